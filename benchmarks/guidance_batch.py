@@ -0,0 +1,111 @@
+"""
+Benchmark of the UNet batch with and without classifier-free guidance.
+
+Runs StableDiffusionHandler.txt_to_img on a tiny pipeline and records the batch size of
+every UNet call and the number of text encoder calls. Requests whose guidance scale
+disables classifier-free guidance (e.g. sdxl-turbo with guidance_scale 0.0) run half the
+UNet batch and never encode the negative prompt.
+"""
+
+import argparse
+import json
+import time
+from typing import List
+
+from rich import print
+
+from benchmarks.tiny_pipeline import TINY_MODEL_PATH, tiny_handler
+from image_generation.api.models import Prompt, TextToImage
+from image_generation.core.stable_diffusion import StableDiffusionHandler
+
+
+def measure(handler: StableDiffusionHandler, text_to_image: TextToImage) -> dict:
+    """
+    Run one request and record the UNet batches and text encoder calls.
+
+    Args:
+        handler (StableDiffusionHandler): Handler serving a diffusers pipeline.
+        text_to_image (TextToImage): The request.
+
+    Returns:
+        dict: The guidance scale, UNet batch sizes, text encoder calls and wall time.
+    """
+    unet_batches: List[int] = []
+    text_encoder_calls = []
+    unet_hook = handler.pipe.unet.register_forward_pre_hook(
+        lambda module, args: unet_batches.append(args[0].shape[0])
+    )
+    text_encoder_hook = handler.pipe.text_encoder.register_forward_pre_hook(
+        lambda module, args: text_encoder_calls.append(1)
+    )
+    try:
+        # Start from an empty embedding cache so encoder calls are comparable
+        handler.prompt_embeddings.clear()
+        start_time = time.perf_counter()
+        handler.txt_to_img(text_to_image)
+        seconds = time.perf_counter() - start_time
+    finally:
+        unet_hook.remove()
+        text_encoder_hook.remove()
+    return {
+        "guidance_scale": text_to_image.prompt.guidance_scale,
+        "unet_batch_sizes": sorted(set(unet_batches)),
+        "unet_samples": sum(unet_batches),
+        "text_encoder_calls": len(text_encoder_calls),
+        "seconds": round(seconds, 4),
+    }
+
+
+def run_benchmark(
+    guidance_scales: List[float],
+    num_images: int = 4,
+    num_inference_steps: int = 2,
+    height: int = 64,
+    width: int = 64,
+) -> List[dict]:
+    """
+    Measure the same request at several guidance scales on a tiny pipeline.
+
+    Returns:
+        List[dict]: One measurement per guidance scale.
+    """
+    results = []
+    with tiny_handler() as handler:
+        for guidance_scale in guidance_scales:
+            text_to_image = TextToImage(
+                model_path=TINY_MODEL_PATH,
+                prompt=Prompt(
+                    positive="a castle on a hill, close-up, 8k, high quality",
+                    negative="bad quality, malformed",
+                    guidance_scale=guidance_scale,
+                ),
+                height=height,
+                width=width,
+                num_inference_steps=num_inference_steps,
+                num_images=num_images,
+                seed=1234,
+            )
+            results.append(measure(handler, text_to_image))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--guidance_scales", type=float, nargs="+", default=[0.0, 7.5])
+    parser.add_argument("--num_images", type=int, default=4)
+    parser.add_argument("--num_inference_steps", type=int, default=2)
+    parser.add_argument("--height", type=int, default=64)
+    parser.add_argument("--width", type=int, default=64)
+    args = parser.parse_args()
+    print(
+        json.dumps(
+            run_benchmark(
+                args.guidance_scales,
+                num_images=args.num_images,
+                num_inference_steps=args.num_inference_steps,
+                height=args.height,
+                width=args.width,
+            ),
+            indent=2,
+        )
+    )
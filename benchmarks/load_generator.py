@@ -0,0 +1,360 @@
+"""
+End-to-end load test of the API and of the message handler.
+
+The API mode sends requests to the API at a target rate, open-loop: requests are due at
+fixed times whether or not the previous ones have finished, and their latency is measured
+from the time they were due, so the requests queued behind a saturated API count.
+
+The handler mode publishes `{"message": ...}` messages at a target rate to an in-memory
+Service Bus, or a SQLite one with --service_bus_path, and runs one or more
+ImageGenerationMessageHandler consumers against it and an in-memory blob storage, or a
+local one with --blob_storage_dir, so the whole consume, generate, upload and publish
+path runs without Azure. The consumers still call the API at --host.
+
+Payloads come from a JSONL file of `{"text_to_style": {...}}` or `{"text_to_image": {...}}`
+objects, or are synthetic TextToStyle requests. Both modes report the throughput, the
+latency percentiles, the error rate and the queue build-up as JSON.
+"""
+
+import argparse
+import json
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import List, Optional
+
+import numpy as np
+
+from cloud_manager.interfaces.blob_storage import BlobStorageInterface
+from cloud_manager.local_blob_storage import LocalBlobStorage
+from cloud_manager.memory_blob_storage import InMemoryBlobStorage
+from cloud_manager.memory_service_bus import InMemoryServiceBus
+from cloud_manager.peek_lock_service_bus import PeekLockServiceBus
+from cloud_manager.sqlite_service_bus import SqliteServiceBus
+from image_generation.utils import call_image_generation_api
+from services import config
+from services.image_generation_message_handler import ImageGenerationMessageHandler
+
+ENDPOINTS = {"text_to_style": "/text_to_style", "text_to_image": "/text_to_image"}
+
+
+def load_payloads(path: str) -> List[dict]:
+    """
+    Read request payloads from a JSONL file.
+
+    Raises:
+        ValueError: If a line is not a text_to_style or text_to_image payload.
+    """
+    payloads = []
+    with open(path) as payloads_file:
+        for line_number, line in enumerate(payloads_file, start=1):
+            if not line.strip():
+                continue
+            payload = json.loads(line)
+            if not isinstance(payload, dict) or not any(
+                key in payload for key in ENDPOINTS
+            ):
+                raise ValueError(
+                    f"Line {line_number} of {path} is not a text_to_style or "
+                    f"text_to_image payload"
+                )
+            payloads.append(payload)
+    if not payloads:
+        raise ValueError(f"No payloads in {path}")
+    return payloads
+
+
+def synthetic_payloads(style: str = "general", num_images: int = 1) -> List[dict]:
+    """
+    A TextToStyle payload, the request the cron sends.
+    """
+    return [{"text_to_style": {"style": style, "num_images": num_images}}]
+
+
+def latency_summary(latencies: List[float]) -> dict:
+    if not latencies:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "mean": round(float(np.mean(latencies)), 4),
+        "max": round(float(np.max(latencies)), 4),
+    }
+
+
+class _LoadRecorder:
+    """
+    Latencies, errors and queue depths of a load test, recorded from several threads.
+    """
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors: List[str] = []
+        self.images = 0
+        self.queue_depths: List[int] = []
+        self._lock = threading.Lock()
+
+    def success(self, latency: float, images: int) -> None:
+        with self._lock:
+            self.latencies.append(latency)
+            self.images += images
+
+    def error(self, error: Exception) -> None:
+        with self._lock:
+            self.errors.append(str(error))
+
+    def queue_depth(self, depth: int) -> None:
+        with self._lock:
+            self.queue_depths.append(depth)
+
+    @property
+    def finished(self) -> int:
+        with self._lock:
+            return len(self.latencies) + len(self.errors)
+
+    def report(self, mode: str, rate: float, sent: int, seconds: float) -> dict:
+        with self._lock:
+            completed = len(self.latencies)
+            return {
+                "mode": mode,
+                "target_rate": rate,
+                "sent": sent,
+                "completed": completed,
+                "errors": len(self.errors),
+                "error_rate": round(len(self.errors) / sent, 4) if sent else 0.0,
+                "first_errors": self.errors[:5],
+                "seconds": round(seconds, 3),
+                "throughput_per_second": round(completed / seconds, 4),
+                "images": self.images,
+                "images_per_second": round(self.images / seconds, 4),
+                "latency_seconds": latency_summary(self.latencies),
+                "queue": {
+                    "max_depth": max(self.queue_depths, default=0),
+                    "mean_depth": round(float(np.mean(self.queue_depths)), 2)
+                    if self.queue_depths
+                    else 0.0,
+                },
+            }
+
+
+def _wait_until(due_time: float) -> None:
+    delay = due_time - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def run_api_load(
+    host: str,
+    payloads: List[dict],
+    rate: float,
+    num_requests: int,
+    concurrency: int = 4,
+) -> dict:
+    """
+    Send requests to the API at a target rate.
+
+    Args:
+        host (str): URL of the API.
+        payloads (List[dict]): Payloads, sent in a loop.
+        rate (float): Requests per second.
+        num_requests (int): Requests to send.
+        concurrency (int): Requests in flight at most, the rest wait in the client queue.
+
+    Returns:
+        dict: The load test report. The queue depth is the number of requests due and
+            waiting for a free connection.
+    """
+    recorder = _LoadRecorder()
+    outstanding = [0]
+    outstanding_lock = threading.Lock()
+
+    def send(payload: dict, due_time: float) -> None:
+        key = next(key for key in ENDPOINTS if key in payload)
+        try:
+            response = call_image_generation_api(host, ENDPOINTS[key], payload[key])
+            with zipfile.ZipFile(BytesIO(response.content)) as zip_file:
+                images = len(zip_file.namelist())
+            recorder.success(time.perf_counter() - due_time, images)
+        except Exception as e:
+            recorder.error(e)
+        finally:
+            with outstanding_lock:
+                outstanding[0] -= 1
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index in range(num_requests):
+            due_time = start_time + index / rate
+            _wait_until(due_time)
+            with outstanding_lock:
+                outstanding[0] += 1
+                recorder.queue_depth(max(outstanding[0] - concurrency, 0))
+            executor.submit(send, payloads[index % len(payloads)], due_time)
+    return recorder.report("api", rate, num_requests, time.perf_counter() - start_time)
+
+
+def run_handler_load(
+    payloads: List[dict],
+    rate: float,
+    num_messages: int,
+    consumers: int = 1,
+    batch_size: int = 50,
+    host: Optional[str] = None,
+    blob_storage: Optional[BlobStorageInterface] = None,
+    service_bus: Optional[PeekLockServiceBus] = None,
+) -> dict:
+    """
+    Publish messages at a target rate and consume them with message handlers.
+
+    Args:
+        payloads (List[dict]): Message payloads, published in a loop.
+        rate (float): Messages per second.
+        num_messages (int): Messages to publish.
+        consumers (int): Message handlers consuming the queue, like handler replicas.
+        batch_size (int): Batch size of the handlers.
+        host (Optional[str]): URL of the API. Defaults to IMAGE_GENERATION_API.
+        blob_storage (Optional[BlobStorageInterface]): Storage the images are uploaded
+            to. Defaults to an in-memory one.
+        service_bus (Optional[PeekLockServiceBus]): Service Bus the messages go through.
+            Defaults to an in-memory one that does not redeliver failed messages.
+
+    Returns:
+        dict: The load test report. Latencies go from publishing a message to completing
+            it, the images are the ImageGenerated messages published, and the queue
+            depth is the number of messages waiting for a consumer.
+    """
+    service_bus = service_bus or InMemoryServiceBus(max_delivery_count=1)
+    blob_storage = blob_storage or InMemoryBlobStorage()
+    queue = config.AZURE_SERVICE_BUS_QUEUE_NAME
+    published_at = {}
+    recorder = _LoadRecorder()
+
+    def timed(handler: ImageGenerationMessageHandler):
+        def callback(message: str) -> None:
+            message_id = json.loads(message)["load_test_id"]
+            try:
+                handler(message)
+            except Exception as e:
+                recorder.error(e)
+                raise
+            recorder.success(time.perf_counter() - published_at[message_id], 0)
+
+        return callback
+
+    original_api = config.IMAGE_GENERATION_API
+    if host is not None:
+        config.IMAGE_GENERATION_API = host
+    threads = [
+        threading.Thread(
+            target=service_bus.consume_indefinitely,
+            args=(
+                queue,
+                timed(
+                    ImageGenerationMessageHandler(
+                        batch_size=batch_size,
+                        blob_storage=blob_storage,
+                        service_bus=service_bus,
+                    )
+                ),
+            ),
+            name=f"load-consumer-{index}",
+        )
+        for index in range(consumers)
+    ]
+    start_time = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.start()
+        for index in range(num_messages):
+            _wait_until(start_time + index / rate)
+            published_at[index] = time.perf_counter()
+            service_bus.publish(
+                queue,
+                [
+                    json.dumps(
+                        {
+                            "message": payloads[index % len(payloads)],
+                            "load_test_id": index,
+                        }
+                    )
+                ],
+            )
+            recorder.queue_depth(service_bus.queue_length(queue))
+        while recorder.finished < num_messages:
+            recorder.queue_depth(service_bus.queue_length(queue))
+            time.sleep(0.05)
+    finally:
+        service_bus.close()
+        for thread in threads:
+            thread.join()
+        config.IMAGE_GENERATION_API = original_api
+    seconds = time.perf_counter() - start_time
+    recorder.images = service_bus.queue_length(config.AZURE_SERVICE_BUS_TOPIC_NAME)
+    report = recorder.report("handler", rate, num_messages, seconds)
+    report["consumers"] = consumers
+    report["blobs"] = len(
+        blob_storage.list_objects(config.AZURE_STORAGE_CONTAINER_NAME)
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("mode", choices=["api", "handler"])
+    parser.add_argument("--host", default=config.IMAGE_GENERATION_API)
+    parser.add_argument("--payloads", help="JSONL file of request payloads.")
+    parser.add_argument("--style", default="general")
+    parser.add_argument("--num_images", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=0.5, help="Requests per second.")
+    parser.add_argument("--num_requests", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--consumers", type=int, default=1)
+    parser.add_argument("--batch_size", type=int, default=50)
+    parser.add_argument(
+        "--blob_storage_dir",
+        help="Upload the handler's images to files in this directory instead of memory.",
+    )
+    parser.add_argument(
+        "--service_bus_path",
+        help="Send the handler's messages through a SQLite Service Bus at this path "
+        "instead of memory.",
+    )
+    parser.add_argument("--output", help="File to write the JSON report to.")
+    args = parser.parse_args()
+
+    payloads = (
+        load_payloads(args.payloads)
+        if args.payloads
+        else synthetic_payloads(args.style, args.num_images)
+    )
+    if args.mode == "api":
+        report = run_api_load(
+            args.host, payloads, args.rate, args.num_requests, args.concurrency
+        )
+    else:
+        report = run_handler_load(
+            payloads,
+            args.rate,
+            args.num_requests,
+            consumers=args.consumers,
+            batch_size=args.batch_size,
+            host=args.host,
+            blob_storage=(
+                LocalBlobStorage(args.blob_storage_dir)
+                if args.blob_storage_dir
+                else None
+            ),
+            service_bus=(
+                SqliteServiceBus(args.service_bus_path, max_delivery_count=1)
+                if args.service_bus_path
+                else None
+            ),
+        )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    print(json.dumps(report, indent=2))
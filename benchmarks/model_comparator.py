@@ -10,7 +10,7 @@ from rich import print
 from image_generation.api.models import TextToImage
 from image_generation.core.prompt_crafter import PromptCrafter
 from image_generation.core.stable_diffusion import StableDiffusionHandler
-from image_generation.core.styles import STYLES
+from image_generation.core.style_registry import STYLES
 
 
 class ModelComparisonExperiment:
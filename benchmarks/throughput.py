@@ -0,0 +1,328 @@
+"""
+Throughput and latency benchmark of the generation stack.
+
+Sweeps batch size, resolution, denoising steps, scheduler and output format, runs every
+combination several times through StableDiffusionHandler.txt_to_img and the API's image
+encoding, and reports p50/p95/p99 latency, images per second and peak memory as JSON.
+
+By default the sweep runs on the tiny randomly initialized pipeline, on CPU and without
+downloading anything, so it can run in CI. Pass --model_path to benchmark a real model.
+Pass --baseline with the JSON of a previous run to flag the cases that got slower.
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from enum import Enum
+from typing import List, Optional
+
+import diffusers
+import numpy as np
+import torch
+
+from benchmarks.tiny_pipeline import TINY_MODEL_PATH, tiny_handler
+from image_generation.api.models import Prompt, TextToImage
+from image_generation.api.utils import image_to_base64, zip_images
+from image_generation.core.performance_profiles import (
+    device_type,
+    peak_device_memory,
+)
+from image_generation.core.stable_diffusion import StableDiffusionHandler
+
+# Metrics compared against the baseline, and whether higher values are better
+COMPARED_METRICS = [
+    ("p50_seconds", False),
+    ("p95_seconds", False),
+    ("images_per_second", True),
+]
+
+
+class OutputFormatEnum(Enum):
+    PIL = "pil"
+    ZIP = "zip"
+    BASE64 = "base64"
+
+
+def encode_images(images: list, output_format: str):
+    """
+    Encode images the way the API returns them.
+
+    Args:
+        images (list): The PIL images.
+        output_format (str): "pil" to skip encoding, "zip" for the zip of PNGs of the
+            /text_to_image endpoints or "base64" for the PNGs of the streaming endpoints.
+    """
+    if output_format == OutputFormatEnum.ZIP.value:
+        return zip_images(
+            [(f"image_{index}", image, {}) for index, image in enumerate(images)]
+        )
+    if output_format == OutputFormatEnum.BASE64.value:
+        return [image_to_base64(image) for image in images]
+    if output_format == OutputFormatEnum.PIL.value:
+        return images
+    raise ValueError(
+        f"{output_format} is not a valid output format. Valid options are: "
+        f"{', '.join(output_format.value for output_format in OutputFormatEnum)}"
+    )
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident set size of this process.
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def case_name(case: dict) -> str:
+    return (
+        f"batch{case['batch_size']}-{case['height']}x{case['width']}-"
+        f"steps{case['num_inference_steps']}-{case['scheduler']}-{case['output_format']}"
+    )
+
+
+def build_cases(
+    batch_sizes: List[int],
+    resolutions: List[str],
+    steps: List[int],
+    schedulers: List[str],
+    output_formats: List[str],
+) -> List[dict]:
+    """
+    Every combination of the swept parameters.
+
+    Args:
+        batch_sizes (List[int]): Images per request.
+        resolutions (List[str]): Resolutions written as "HEIGHTxWIDTH".
+        steps (List[int]): Denoising steps.
+        schedulers (List[str]): Scheduler names.
+        output_formats (List[str]): Output formats, see `encode_images`.
+
+    Returns:
+        List[dict]: The cases.
+    """
+    cases = []
+    for (
+        batch_size,
+        resolution,
+        num_steps,
+        scheduler,
+        output_format,
+    ) in itertools.product(batch_sizes, resolutions, steps, schedulers, output_formats):
+        height, width = (int(size) for size in resolution.lower().split("x"))
+        case = {
+            "batch_size": batch_size,
+            "height": height,
+            "width": width,
+            "num_inference_steps": num_steps,
+            "scheduler": scheduler,
+            "output_format": output_format,
+        }
+        cases.append({"case": case_name(case), **case})
+    return cases
+
+
+def run_case(
+    handler: StableDiffusionHandler, case: dict, repetitions: int, warmup: int
+) -> dict:
+    """
+    Run one case of the sweep.
+
+    Args:
+        handler (StableDiffusionHandler): Handler serving the benchmarked pipeline.
+        case (dict): The case, from `build_cases`.
+        repetitions (int): Measured runs.
+        warmup (int): Runs before the measured ones, to exclude one-off costs.
+
+    Returns:
+        dict: The case with its latency percentiles, throughput and peak memory.
+    """
+    text_to_image = TextToImage(
+        model_path=handler.model_path,
+        model_scheduler=case["scheduler"],
+        prompt=Prompt(
+            positive="a castle on a hill, close-up, 8k, high quality",
+            negative="bad quality, malformed",
+            guidance_scale=7.5,
+        ),
+        height=case["height"],
+        width=case["width"],
+        num_inference_steps=case["num_inference_steps"],
+        num_images=case["batch_size"],
+        seed=1234,
+    )
+    if device_type(handler.device) == "cuda":
+        torch.cuda.reset_peak_memory_stats(handler.device)
+    latencies = []
+    encode_seconds = []
+    for repetition in range(warmup + repetitions):
+        start_time = time.perf_counter()
+        images = handler.txt_to_img(text_to_image)
+        encode_start_time = time.perf_counter()
+        encode_images(images, case["output_format"])
+        end_time = time.perf_counter()
+        if repetition >= warmup:
+            latencies.append(end_time - start_time)
+            encode_seconds.append(end_time - encode_start_time)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        **case,
+        "repetitions": repetitions,
+        "p50_seconds": round(float(p50), 6),
+        "p95_seconds": round(float(p95), 6),
+        "p99_seconds": round(float(p99), 6),
+        "mean_seconds": round(float(np.mean(latencies)), 6),
+        "mean_encode_seconds": round(float(np.mean(encode_seconds)), 6),
+        "images_per_second": round(
+            case["batch_size"] * repetitions / sum(latencies), 6
+        ),
+        "peak_rss_bytes": peak_rss_bytes(),
+        "peak_device_memory_bytes": peak_device_memory(handler.device),
+    }
+
+
+@contextmanager
+def benchmark_handler(model_path: Optional[str] = None, device: str = "cpu"):
+    """
+    Handler for the benchmark, on the tiny pipeline unless a model is given.
+
+    The result cache is disabled, so every run generates its images.
+    """
+    if model_path is None:
+        with tiny_handler(device=device) as handler:
+            handler.result_cache = None
+            yield handler
+    else:
+        handler = StableDiffusionHandler(model_path, device=device)
+        handler.result_cache = None
+        yield handler
+
+
+def run_benchmark(
+    batch_sizes: List[int] = (1, 4),
+    resolutions: List[str] = ("64x64",),
+    steps: List[int] = (2,),
+    schedulers: List[str] = ("euler_a",),
+    output_formats: List[str] = (OutputFormatEnum.ZIP.value,),
+    repetitions: int = 5,
+    warmup: int = 1,
+    model_path: Optional[str] = None,
+    device: str = "cpu",
+) -> dict:
+    """
+    Run the sweep.
+
+    Returns:
+        dict: The environment of the run and one result per case.
+    """
+    cases = build_cases(batch_sizes, resolutions, steps, schedulers, output_formats)
+    with benchmark_handler(model_path, device) as handler:
+        results = [run_case(handler, case, repetitions, warmup) for case in cases]
+        environment = {
+            "model_path": handler.model_path,
+            "device": str(handler.device),
+            "torch": torch.__version__,
+            "diffusers": diffusers.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "torch_threads": torch.get_num_threads(),
+        }
+    return {"environment": environment, "results": results}
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float = 0.1) -> dict:
+    """
+    Compare a run with a previous one.
+
+    Args:
+        report (dict): The run, from `run_benchmark`.
+        baseline (dict): The previous run.
+        tolerance (float): Relative change allowed before a metric counts as a regression.
+
+    Returns:
+        dict: The regressions, with the metric, baseline and current values and relative
+            change, and the cases missing from either run.
+    """
+    baseline_results = {result["case"]: result for result in baseline["results"]}
+    results = {result["case"]: result for result in report["results"]}
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline_results:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            previous = baseline_results[name][metric]
+            current = result[metric]
+            if not previous:
+                continue
+            change = (current - previous) / previous
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(
+                    {
+                        "case": name,
+                        "metric": metric,
+                        "baseline": previous,
+                        "current": current,
+                        "change": round(change, 4),
+                    }
+                )
+    return {
+        "tolerance": tolerance,
+        "regressions": regressions,
+        "new_cases": sorted(set(results) - set(baseline_results)),
+        "missing_cases": sorted(set(baseline_results) - set(results)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--resolutions", nargs="+", default=["64x64"])
+    parser.add_argument("--steps", type=int, nargs="+", default=[2])
+    parser.add_argument("--schedulers", nargs="+", default=["euler_a"])
+    parser.add_argument(
+        "--output_formats",
+        nargs="+",
+        default=[OutputFormatEnum.ZIP.value],
+        choices=[output_format.value for output_format in OutputFormatEnum],
+    )
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument(
+        "--model_path",
+        default=None,
+        help=f"Model to benchmark. Defaults to the tiny pipeline ({TINY_MODEL_PATH}).",
+    )
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--output", help="File to write the JSON report to.")
+    parser.add_argument("--baseline", help="JSON report of a previous run.")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        batch_sizes=args.batch_sizes,
+        resolutions=args.resolutions,
+        steps=args.steps,
+        schedulers=args.schedulers,
+        output_formats=args.output_formats,
+        repetitions=args.repetitions,
+        warmup=args.warmup,
+        model_path=args.model_path,
+        device=args.device,
+    )
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report["comparison"] = compare_to_baseline(
+                report, json.load(baseline_file), args.tolerance
+            )
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    print(json.dumps(report, indent=2))
+    if report.get("comparison", {}).get("regressions"):
+        sys.exit(1)
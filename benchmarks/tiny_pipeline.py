@@ -0,0 +1,169 @@
+"""
+Tiny randomly initialized Stable Diffusion pipeline for offline benchmarks and tests.
+
+The pipeline has the same structure as a real one (CLIP text encoder and tokenizer,
+conditional UNet, VAE and scheduler) but only a few thousand parameters, so it runs on
+CPU in milliseconds without downloading anything.
+"""
+
+import json
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch
+
+import torch
+from diffusers import (
+    AutoencoderKL,
+    AutoencoderTiny,
+    EulerAncestralDiscreteScheduler,
+    StableDiffusionPipeline,
+    UNet2DConditionModel,
+)
+from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+from image_generation.core.stable_diffusion import (
+    AutoPipelineForText2Image,
+    StableDiffusionHandler,
+)
+
+TINY_MODEL_PATH = "tiny/stable-diffusion"
+
+
+def _bytes_to_unicode() -> dict:
+    # Byte to printable character mapping used by CLIP's byte-level BPE
+    printable = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    characters = printable[:]
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            characters.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, [chr(c) for c in characters]))
+
+
+def build_tiny_tokenizer() -> CLIPTokenizer:
+    """
+    Build a character-level CLIP tokenizer without merges.
+    """
+    characters = list(_bytes_to_unicode().values())
+    vocab = {}
+    for token in characters + [c + "</w>" for c in characters]:
+        vocab[token] = len(vocab)
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+    with tempfile.TemporaryDirectory() as directory:
+        vocab_file = Path(directory) / "vocab.json"
+        merges_file = Path(directory) / "merges.txt"
+        vocab_file.write_text(json.dumps(vocab))
+        merges_file.write_text("#version: 0.2\n")
+        return CLIPTokenizer(
+            vocab=str(vocab_file), merges=str(merges_file), model_max_length=77
+        )
+
+
+def build_tiny_pipeline(seed: int = 0) -> StableDiffusionPipeline:
+    """
+    Build a tiny randomly initialized Stable Diffusion pipeline.
+
+    Args:
+        seed (int): Seed of the random weights.
+
+    Returns:
+        StableDiffusionPipeline: The pipeline, on CPU in float32.
+    """
+    torch.manual_seed(seed)
+    tokenizer = build_tiny_tokenizer()
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            vocab_size=len(tokenizer.get_vocab()),
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            max_position_embeddings=77,
+            bos_token_id=tokenizer.bos_token_id,
+            eos_token_id=tokenizer.eos_token_id,
+            pad_token_id=1,
+        )
+    )
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+        norm_num_groups=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 2,
+        up_block_types=["UpDecoderBlock2D"] * 2,
+        latent_channels=4,
+        norm_num_groups=32,
+    )
+    scheduler = EulerAncestralDiscreteScheduler(steps_offset=1)
+    pipeline = StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipeline.set_progress_bar_config(disable=True)
+    return pipeline
+
+
+def build_tiny_decoder(seed: int = 0) -> AutoencoderTiny:
+    """
+    Build a tiny randomly initialized TAESD-style decoder for the tiny pipeline's latents.
+
+    Args:
+        seed (int): Seed of the random weights.
+
+    Returns:
+        AutoencoderTiny: The decoder, upsampling by 2 like the tiny pipeline's VAE.
+    """
+    torch.manual_seed(seed)
+    return AutoencoderTiny(
+        encoder_block_out_channels=(32, 32),
+        decoder_block_out_channels=(32, 32),
+        num_encoder_blocks=(1, 1),
+        num_decoder_blocks=(1, 1),
+        latent_channels=4,
+    )
+
+
+@contextmanager
+def tiny_handler(pipeline: StableDiffusionPipeline = None, device: str = "cpu"):
+    """
+    Create a StableDiffusionHandler serving a tiny pipeline.
+
+    Args:
+        pipeline (StableDiffusionPipeline, optional): The pipeline to serve. Defaults to a new tiny pipeline.
+        device (str): Device of the handler.
+
+    Yields:
+        StableDiffusionHandler: The handler, with TINY_MODEL_PATH as its model path. The
+            pipeline is converted to the dtype the handler loads models in.
+    """
+    pipeline = pipeline or build_tiny_pipeline()
+
+    def from_pretrained(model_path, torch_dtype=None, **kwargs):
+        return pipeline.to(dtype=torch_dtype)
+
+    with patch.object(AutoPipelineForText2Image, "from_pretrained", from_pretrained):
+        yield StableDiffusionHandler(TINY_MODEL_PATH, device=device)
@@ -0,0 +1,330 @@
+"""
+This class implements the ServiceBusInterface on asyncio queues, for generators and publishers running in one process.
+"""
+
+import asyncio
+import inspect
+import itertools
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from cloud_manager.custom_logging import set_logger
+from cloud_manager.peek_lock_service_bus import (
+    MessageLockLostError,
+    PeekLockServiceBus,
+    ReceivedMessage,
+)
+
+logger = set_logger("Asyncio Service Bus")
+
+
+class AsyncioServiceBus(PeekLockServiceBus):
+    """
+    Queues and topics are asyncio queues of the same name.
+
+    The queues live on one event loop: the loop of the first coroutine that uses them, or
+    a background loop started by the first call from a thread. Coroutines on that loop
+    publish and receive without leaving it; calls from other threads and loops are handed
+    over to it. If that loop stops, the queues move to the next one and the messages that
+    were locked on it are released.
+
+    Messages are consumed in peek-lock mode (see PeekLockServiceBus), and `join` waits
+    until every message published to a queue is completed or dead-lettered.
+    """
+
+    def __init__(self, max_delivery_count: int = 10) -> None:
+        self.max_delivery_count = max_delivery_count
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._locked: Dict[str, Dict[int, ReceivedMessage]] = {}
+        self._dead_letters: Dict[str, List[ReceivedMessage]] = {}
+        self._message_ids = itertools.count()
+        self._closed = False
+        self._closing: Optional[asyncio.Future] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._bind_lock = threading.Lock()
+
+    def publish(self, topic: str, messages: List[str]) -> None:
+        if isinstance(messages, str):
+            messages = [messages]
+        self._call(self._put, topic, messages)
+        logger.info(f"Published {len(messages)} messages to '{topic}'")
+
+    async def publish_async(self, topic: str, messages: List[str]) -> None:
+        if isinstance(messages, str):
+            messages = [messages]
+        await self._call_async(self._put, topic, messages)
+        logger.info(f"Published {len(messages)} messages to '{topic}'")
+
+    def receive(
+        self, queue: str, max_wait_time: Optional[float] = None
+    ) -> Optional[ReceivedMessage]:
+        if self._closed:
+            return None
+        return self._call(self._receive, queue, max_wait_time)
+
+    async def receive_async(
+        self, queue: str, max_wait_time: Optional[float] = None
+    ) -> Optional[ReceivedMessage]:
+        """
+        Lock the next message of a queue. See `receive`.
+        """
+        if self._closed:
+            return None
+        return await self._call_async(self._receive, queue, max_wait_time)
+
+    def complete(self, queue: str, message: ReceivedMessage) -> None:
+        self._call(self._settle, queue, message, False)
+
+    def abandon(self, queue: str, message: ReceivedMessage) -> None:
+        self._call(self._settle, queue, message, True)
+
+    async def consume_async(
+        self, queue: str, callback: Callable[[str], Union[None, Awaitable[None]]]
+    ) -> None:
+        """
+        Process the messages available in a queue, stopping at the first callback error.
+
+        The callback can be a function or a coroutine function. Functions run on the event
+        loop, so blocking ones are better consumed from threads with `consume`.
+        """
+        while True:
+            message = await self.receive_async(queue, max_wait_time=0)
+            if message is None:
+                return
+            if not await self._process_async(queue, message, callback):
+                return
+
+    async def consume_indefinitely_async(
+        self,
+        queue: str,
+        callback: Callable[[str], Union[None, Awaitable[None]]],
+        max_number_messages: Optional[int] = None,
+        max_wait_time: Optional[float] = None,
+    ) -> None:
+        """
+        Process the messages of a queue as they arrive. See `consume_indefinitely` and
+        `consume_async`.
+        """
+        processed_messages = 0
+        while max_number_messages is None or processed_messages < max_number_messages:
+            message = await self.receive_async(queue, max_wait_time=max_wait_time)
+            if message is None:
+                return
+            if await self._process_async(queue, message, callback):
+                processed_messages += 1
+
+    async def join(self, queue: str) -> None:
+        """
+        Wait until every message published to a queue is completed or dead-lettered.
+        """
+        await self._call_async(self._join, queue)
+
+    def queue_length(self, queue: str) -> int:
+        """
+        Number of messages of a queue waiting to be received.
+        """
+        messages = self._queues.get(queue)
+        return messages.qsize() if messages is not None else 0
+
+    def in_flight(self, queue: str) -> int:
+        """
+        Number of messages of a queue received and not completed or abandoned yet.
+        """
+        return len(self._locked.get(queue, ()))
+
+    def dead_letters(self, queue: str) -> List[str]:
+        return [message.body for message in self._dead_letters.get(queue, ())]
+
+    def close(self) -> None:
+        """
+        Wake up and stop every consumer, and the background loop if one was started.
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            self._closed = True
+            return
+        self._call(self._close)
+        if self._loop_thread is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join()
+            self._loop_thread = None
+
+    async def _process_async(
+        self,
+        queue: str,
+        message: ReceivedMessage,
+        callback: Callable[[str], Union[None, Awaitable[None]]],
+    ) -> bool:
+        try:
+            try:
+                result = callback(str(message))
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Error while processing message: {e}")
+                await self._call_async(self._settle, queue, message, True)
+                return False
+            await self._call_async(self._settle, queue, message, False)
+        except MessageLockLostError as e:
+            logger.error(f"Lost the lock of a message of '{queue}': {e}")
+            return False
+        logger.debug(f"Consumed message from '{queue}': {message}")
+        return True
+
+    # The methods below run on the event loop of the queues
+
+    def _queue(self, name: str) -> asyncio.Queue:
+        messages = self._queues.get(name)
+        if messages is None:
+            messages = self._queues[name] = asyncio.Queue()
+        return messages
+
+    def _put(self, name: str, bodies: List[str]) -> None:
+        messages = self._queue(name)
+        for body in bodies:
+            messages.put_nowait(ReceivedMessage(next(self._message_ids), body))
+
+    async def _receive(
+        self, name: str, max_wait_time: Optional[float]
+    ) -> Optional[ReceivedMessage]:
+        messages = self._queue(name)
+        if self._closed:
+            return None
+        if messages.empty():
+            if max_wait_time is not None and max_wait_time <= 0:
+                return None
+            if self._closing is None:
+                self._closing = asyncio.get_running_loop().create_future()
+            getter = asyncio.ensure_future(messages.get())
+            done, _ = await asyncio.wait(
+                {getter, self._closing},
+                timeout=max_wait_time,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if getter not in done:
+                # Cancelling a get never loses a message: it stays in the queue
+                getter.cancel()
+                await asyncio.wait({getter})
+                return None
+            message = getter.result()
+        else:
+            message = messages.get_nowait()
+        message.delivery_count += 1
+        self._locked.setdefault(name, {})[message.message_id] = message
+        return message
+
+    def _settle(self, name: str, message: ReceivedMessage, abandon: bool) -> None:
+        if self._locked.get(name, {}).pop(message.message_id, None) is None:
+            raise MessageLockLostError(
+                f"Message {message.message_id} of '{name}' is not locked"
+            )
+        messages = self._queue(name)
+        if abandon:
+            if message.delivery_count >= self.max_delivery_count:
+                logger.error(
+                    f"Dead-lettering message {message.message_id} of '{name}' after "
+                    f"{message.delivery_count} deliveries"
+                )
+                self._dead_letters.setdefault(name, []).append(message)
+            else:
+                messages.put_nowait(message)
+        messages.task_done()
+
+    async def _join(self, name: str) -> None:
+        await self._queue(name).join()
+
+    def _close(self) -> None:
+        self._closed = True
+        if self._closing is not None and not self._closing.done():
+            self._closing.set_result(None)
+
+    # Handing calls over to the event loop of the queues
+
+    def _call(self, function: Callable, *args) -> Any:
+        """
+        Run a function or a coroutine function on the loop of the queues and wait for it.
+        """
+        loop = self._bind()
+        if _running_loop() is loop:
+            if inspect.iscoroutinefunction(function):
+                raise RuntimeError(
+                    "Waiting for the Service Bus would block its event loop, use the "
+                    "async methods on it"
+                )
+            return function(*args)
+        return asyncio.run_coroutine_threadsafe(
+            _as_coroutine(function, *args), loop
+        ).result()
+
+    async def _call_async(self, function: Callable, *args) -> Any:
+        running_loop = asyncio.get_running_loop()
+        loop = self._bind(running_loop)
+        if running_loop is loop:
+            return await _as_coroutine(function, *args)
+        return await asyncio.wrap_future(
+            asyncio.run_coroutine_threadsafe(_as_coroutine(function, *args), loop)
+        )
+
+    def _bind(
+        self, running_loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> asyncio.AbstractEventLoop:
+        """
+        The loop of the queues: the current one, the running loop, or a background loop.
+        """
+        with self._bind_lock:
+            if self._loop is not None and self._loop.is_running():
+                return self._loop
+            if running_loop is None:
+                running_loop = self._start_loop()
+            if self._loop is not None:
+                self._move_queues()
+            self._loop = running_loop
+            return running_loop
+
+    def _move_queues(self) -> None:
+        """
+        Move the queues off a stopped loop. The messages locked on it are released.
+        """
+        for name, old_messages in self._queues.items():
+            messages = asyncio.Queue()
+            for message in self._locked.pop(name, {}).values():
+                messages.put_nowait(message)
+            while not old_messages.empty():
+                messages.put_nowait(old_messages.get_nowait())
+            self._queues[name] = messages
+        self._closing = None
+
+    def _start_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            asyncio.set_event_loop(loop)
+            loop.call_soon(started.set)
+            loop.run_forever()
+            # Let the woken consumers return before closing the loop
+            pending = asyncio.all_tasks(loop)
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+        self._loop_thread = threading.Thread(
+            target=run, name="asyncio-service-bus", daemon=True
+        )
+        self._loop_thread.start()
+        started.wait()
+        return loop
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+async def _as_coroutine(function: Callable, *args) -> Any:
+    result = function(*args)
+    if inspect.isawaitable(result):
+        return await result
+    return result
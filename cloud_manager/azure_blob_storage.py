@@ -3,9 +3,10 @@ This class implements the CloudInterface for Azure Cloud.
 """
 
 import asyncio
-from typing import List
+from typing import BinaryIO, Iterable, List, Optional, Union
 
 import aiofiles
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
 from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
 
@@ -55,6 +56,58 @@ class AzureBlobStorage(BlobStorageInterface):
                 logger.error(f"Error uploading object '{obj['name']}': {e}")
         return blob_urls
 
+    def get_object(self, container_name: str, name: str) -> Optional[bytes]:
+        blob_client = self.blob_service_client.get_blob_client(container_name, name)
+        try:
+            return blob_client.download_blob().readall()
+        except ResourceNotFoundError:
+            logger.debug(f"Object '{name}' not found in '{container_name}'")
+            return None
+
+    def exists(self, container_name: str, name: str) -> bool:
+        return self.blob_service_client.get_blob_client(container_name, name).exists()
+
+    def get_url(self, container_name: str, name: str) -> str:
+        return self.blob_service_client.get_blob_client(container_name, name).url
+
+    def upload_stream(
+        self,
+        container_name: str,
+        name: str,
+        data: Union[BinaryIO, Iterable[bytes]],
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+    ) -> str:
+        blob_client = self.blob_service_client.get_blob_client(container_name, name)
+        try:
+            blob_client.upload_blob(data, overwrite=overwrite, metadata=metadata or {})
+        except ResourceExistsError:
+            raise FileExistsError(
+                f"Object '{name}' already exists in '{container_name}'"
+            )
+        return blob_client.url
+
+    async def upload_stream_async(
+        self,
+        container_name: str,
+        name: str,
+        data: Union[BinaryIO, Iterable[bytes]],
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+    ) -> str:
+        async with await self.get_client_async() as client:
+            blob_client = client.get_blob_client(container_name, name)
+            async with blob_client:
+                try:
+                    await blob_client.upload_blob(
+                        data, overwrite=overwrite, metadata=metadata or {}
+                    )
+                except ResourceExistsError:
+                    raise FileExistsError(
+                        f"Object '{name}' already exists in '{container_name}'"
+                    )
+                return blob_client.url
+
     async def push_objects_async(
         self, container_name: str, objects: List[dict], overwrite: bool = False
     ) -> List[str]:
@@ -53,8 +53,10 @@ class AzureServiceBus(ServiceBusInterface):
             logger.error(
                 f"Service Bus specific error publishing messages to '{topic}': {e}"
             )
+            raise
         except Exception as e:
             logger.error(f"General error publishing messages to '{topic}': {e}")
+            raise
 
     async def publish_async(self, topic: str, messages: List[str]) -> None:
         try:
@@ -78,8 +80,10 @@ class AzureServiceBus(ServiceBusInterface):
             logger.error(
                 f"Service Bus specific error async publishing messages to '{topic}': {e}"
             )
+            raise
         except Exception as e:
             logger.error(f"General error async publishing messages to '{topic}': {e}")
+            raise
 
     def consume(self, queue: str, callback: Callable[[str], None]) -> None:
         try:
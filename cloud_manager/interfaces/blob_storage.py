@@ -2,7 +2,9 @@
 This interface is used to define the methods that each Cloud class needs to implement.
 """
 # Abtrsact methods are forced to be implemented
+import asyncio
 from abc import ABCMeta, abstractmethod
+from typing import BinaryIO, Iterable, List, Optional, Union
 
 
 class BlobStorageInterface(metaclass=ABCMeta):
@@ -11,8 +13,82 @@ class BlobStorageInterface(metaclass=ABCMeta):
     """
 
     @abstractmethod
-    def push_objects(self, objects: list):
+    def push_objects(
+        self, container_name: str, objects: List[dict], overwrite: bool = False
+    ) -> List[str]:
         """
         This method is used to push objects to the cloud.
+
+        :param container_name: The container to push the objects to.
+        :param objects: The objects, as dictionaries with the "name" of the object, the "path" of the file to upload and optionally its "metadata".
+        :param overwrite: Whether to replace existing objects. Existing objects are skipped otherwise.
+        :return: The URLs of the objects pushed. Objects that could not be pushed are logged and left out.
+        """
+        pass
+
+    @abstractmethod
+    async def push_objects_async(
+        self, container_name: str, objects: List[dict], overwrite: bool = False
+    ) -> List[str]:
+        """
+        This method is used to push objects to the cloud asynchronously. See `push_objects`.
+        """
+        pass
+
+    @abstractmethod
+    def get_object(self, container_name: str, name: str) -> Optional[bytes]:
+        """
+        This method is used to download an object from the cloud. Returns None if it does not exist.
+        """
+        pass
+
+    @abstractmethod
+    def exists(self, container_name: str, name: str) -> bool:
+        """
+        This method is used to check whether an object exists.
+        """
+        pass
+
+    @abstractmethod
+    def get_url(self, container_name: str, name: str) -> str:
+        """
+        This method is used to get the URL of an object, whether it exists or not.
         """
         pass
+
+    @abstractmethod
+    def upload_stream(
+        self,
+        container_name: str,
+        name: str,
+        data: Union[BinaryIO, Iterable[bytes]],
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+    ) -> str:
+        """
+        This method is used to upload an object from a file-like object or an iterable of chunks, without a file on disk.
+
+        :param container_name: The container to upload the object to.
+        :param name: The name of the object.
+        :param data: The content of the object.
+        :param metadata: The metadata of the object.
+        :param overwrite: Whether to replace an existing object.
+        :return: The URL of the object.
+        :raises FileExistsError: If the object exists and overwrite is False.
+        """
+        pass
+
+    async def upload_stream_async(
+        self,
+        container_name: str,
+        name: str,
+        data: Union[BinaryIO, Iterable[bytes]],
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+    ) -> str:
+        """
+        This method is used to upload an object asynchronously. See `upload_stream`.
+        """
+        return await asyncio.to_thread(
+            self.upload_stream, container_name, name, data, metadata, overwrite
+        )
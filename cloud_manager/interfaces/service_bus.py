@@ -3,6 +3,7 @@ This interface is used to define the methods that each Service Bus class needs t
 """
 # Abtrsact methods are forced to be implemented
 from abc import ABCMeta, abstractmethod
+from typing import Callable, List, Optional
 
 
 class ServiceBusInterface(metaclass=ABCMeta):
@@ -11,17 +12,25 @@ class ServiceBusInterface(metaclass=ABCMeta):
     """
 
     @abstractmethod
-    def publish(self, topic: str, message: str) -> None:
+    def publish(self, topic: str, messages: List[str]) -> None:
         """
-        Publishes a message to the specified queue or topic.
+        Publishes messages to the specified queue or topic.
 
-        :param topic: The name of the topic to publish the message to.
-        :param message: The message to be published.
+        :param topic: The name of the topic to publish the messages to.
+        :param messages: The messages to be published.
+        :raises Exception: If the messages could not be published.
         """
         pass
 
     @abstractmethod
-    def consume(self, queue: str, callback: callable) -> None:
+    async def publish_async(self, topic: str, messages: List[str]) -> None:
+        """
+        Publishes messages to the specified queue or topic asynchronously. See `publish`.
+        """
+        pass
+
+    @abstractmethod
+    def consume(self, queue: str, callback: Callable[[str], None]) -> None:
         """
         Consumes messages from the specified queue or topic and processes them using the provided callback function.
 
@@ -29,3 +38,19 @@ class ServiceBusInterface(metaclass=ABCMeta):
         :param callback: A callable that will be invoked for each message received. It should take one argument, which is the message.
         """
         pass
+
+    @abstractmethod
+    def consume_indefinitely(
+        self,
+        queue: str,
+        callback: Callable[[str], None],
+        max_number_messages: Optional[int] = None,
+    ) -> None:
+        """
+        Consumes messages from the specified queue as they arrive. A message is completed once the callback returns.
+
+        :param queue: The name of the queue to consume messages from.
+        :param callback: A callable that will be invoked for each message received.
+        :param max_number_messages: The number of messages to process before returning, None to run until stopped.
+        """
+        pass
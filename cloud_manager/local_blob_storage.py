@@ -0,0 +1,278 @@
+"""
+This class implements the BlobStorageInterface on the local filesystem, for offline runs and benchmarks of the upload stage.
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import secrets
+import shutil
+import threading
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Iterable, List, Optional, Union
+
+from cloud_manager.custom_logging import set_logger
+from cloud_manager.interfaces.blob_storage import BlobStorageInterface
+
+logger = set_logger("Local Blob Storage")
+
+METADATA_DIR = ".metadata"
+CHUNK_SIZE = 1024 * 1024
+
+
+class LocalBlobStorage(BlobStorageInterface):
+    """
+    Stores objects as files under a root directory, one directory per container.
+
+    Pushed files are hard-linked into the store when they are on the same filesystem, so an
+    upload costs no copy. Otherwise they are copied in the kernel with `os.sendfile`. Objects
+    are written to a temporary file and renamed, so readers never see a partial object,
+    and are read through memory maps. Metadata is kept as JSON in a `.metadata` directory.
+    """
+
+    def __init__(
+        self, root_dir: str, link_files: bool = True, max_concurrency: int = 8
+    ) -> None:
+        """
+        Initialize the LocalBlobStorage.
+
+        Args:
+            root_dir (str): Directory of the containers.
+            link_files (bool): Whether to hard-link pushed files instead of copying them.
+                The handler's files are temporary, so the link is the only copy left.
+            max_concurrency (int): Objects pushed at the same time by `push_objects_async`.
+        """
+        logger.info(f"Initializing Local Blob Storage in {root_dir}")
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self.link_files = link_files
+        self.max_concurrency = max_concurrency
+        self._metadata_lock = threading.Lock()
+
+    def push_objects(
+        self, container_name: str, objects: List[dict], overwrite: bool = False
+    ) -> List[str]:
+        if not objects:
+            logger.warning("No objects provided for upload")
+            return []
+
+        logger.info(f"Pushing {len(objects)} objects to '{container_name}'")
+        blob_urls = []
+        for obj in objects:
+            blob_url = self._push_object_logged(container_name, obj, overwrite)
+            if blob_url is not None:
+                blob_urls.append(blob_url)
+        return blob_urls
+
+    async def push_objects_async(
+        self, container_name: str, objects: List[dict], overwrite: bool = False
+    ) -> List[str]:
+        if not objects:
+            logger.warning("No objects provided for upload")
+            return []
+
+        logger.info(f"Pushing {len(objects)} objects to '{container_name}'")
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def push(obj: dict) -> Optional[str]:
+            async with semaphore:
+                return await asyncio.to_thread(
+                    self._push_object_logged, container_name, obj, overwrite
+                )
+
+        blob_urls = await asyncio.gather(*(push(obj) for obj in objects))
+        return [blob_url for blob_url in blob_urls if blob_url is not None]
+
+    def upload_stream(
+        self,
+        container_name: str,
+        name: str,
+        data: Union[BinaryIO, Iterable[bytes]],
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+    ) -> str:
+        path = self._path(container_name, name)
+        if path.exists() and not overwrite:
+            raise FileExistsError(
+                f"Object '{name}' already exists in '{container_name}'"
+            )
+        temporary_path = self._temporary_path(path)
+        try:
+            with open(temporary_path, "wb") as destination:
+                if hasattr(data, "read"):
+                    self._copy_stream(data, destination)
+                else:
+                    for chunk in data:
+                        destination.write(chunk)
+            self._commit(temporary_path, path, overwrite)
+        finally:
+            temporary_path.unlink(missing_ok=True)
+        self._write_metadata(container_name, name, metadata)
+        return self.get_url(container_name, name)
+
+    def exists(self, container_name: str, name: str) -> bool:
+        return self._path(container_name, name).is_file()
+
+    def get_url(self, container_name: str, name: str) -> str:
+        return self._path(container_name, name).resolve().as_uri()
+
+    @contextmanager
+    def open_object(self, container_name: str, name: str):
+        """
+        Map an object into memory, read-only.
+
+        Yields:
+            memoryview: The content of the object, valid until the block exits.
+
+        Raises:
+            FileNotFoundError: If the object does not exist.
+        """
+        with open(self._path(container_name, name), "rb") as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def get_object(self, container_name: str, name: str) -> Optional[bytes]:
+        try:
+            with self.open_object(container_name, name) as content:
+                return bytes(content)
+        except FileNotFoundError:
+            logger.debug(f"Object '{name}' not found in '{container_name}'")
+            return None
+
+    def get_metadata(self, container_name: str, name: str) -> Optional[dict]:
+        if not self.exists(container_name, name):
+            return None
+        metadata_path = self._metadata_path(container_name, name)
+        with self._metadata_lock:
+            if not metadata_path.exists():
+                return {}
+            return json.loads(metadata_path.read_text())
+
+    def list_objects(self, container_name: str) -> List[str]:
+        container_path = self._path(container_name)
+        if not container_path.is_dir():
+            return []
+        return sorted(
+            path.relative_to(container_path).as_posix()
+            for path in container_path.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+
+    def _push_object_logged(
+        self, container_name: str, obj: dict, overwrite: bool
+    ) -> Optional[str]:
+        try:
+            return self._push_object(container_name, obj, overwrite)
+        except FileNotFoundError:
+            logger.error(f"File not found: {obj['path']}")
+        except Exception as e:
+            logger.error(f"Error uploading object '{obj['name']}': {e}")
+        return None
+
+    def _push_object(self, container_name: str, obj: dict, overwrite: bool) -> str:
+        source_path = Path(obj["path"])
+        path = self._path(container_name, obj["name"])
+        if path.exists() and not overwrite:
+            raise FileExistsError(
+                f"Object '{obj['name']}' already exists in '{container_name}'"
+            )
+        temporary_path = self._temporary_path(path)
+        try:
+            linked = False
+            if self.link_files:
+                try:
+                    os.link(source_path, temporary_path)
+                    linked = True
+                except FileNotFoundError:
+                    raise
+                except OSError as e:
+                    # Other filesystem, or one without hard links
+                    logger.debug(f"Copying {source_path} instead of linking it: {e}")
+            if not linked:
+                with open(source_path, "rb") as source, open(
+                    temporary_path, "wb"
+                ) as destination:
+                    self._copy_stream(source, destination)
+            self._commit(temporary_path, path, overwrite)
+        finally:
+            temporary_path.unlink(missing_ok=True)
+        self._write_metadata(container_name, obj["name"], obj.get("metadata"))
+        return self.get_url(container_name, obj["name"])
+
+    def _copy_stream(self, source: BinaryIO, destination: BinaryIO) -> None:
+        """
+        Copy a file-like object into a file, in the kernel when both are regular files.
+        """
+        try:
+            source_fd = source.fileno()
+            destination_fd = destination.fileno()
+            size = os.fstat(source_fd).st_size - source.tell()
+        except (AttributeError, OSError, ValueError):
+            shutil.copyfileobj(source, destination, CHUNK_SIZE)
+            return
+        destination.flush()
+        offset = source.tell()
+        try:
+            while size > 0:
+                sent = os.sendfile(destination_fd, source_fd, offset, size)
+                if sent == 0:
+                    break
+                offset += sent
+                size -= sent
+        except (AttributeError, OSError):
+            # No sendfile between these files on this platform: finish in user space
+            source.seek(offset)
+            shutil.copyfileobj(source, destination, CHUNK_SIZE)
+
+    def _commit(self, temporary_path: Path, path: Path, overwrite: bool) -> None:
+        if overwrite:
+            os.replace(temporary_path, path)
+        else:
+            # Linking fails if the object appeared since the existence check
+            os.link(temporary_path, path)
+
+    def _write_metadata(
+        self, container_name: str, name: str, metadata: Optional[dict]
+    ) -> None:
+        metadata_path = self._metadata_path(container_name, name)
+        with self._metadata_lock:
+            if metadata:
+                metadata_path.parent.mkdir(parents=True, exist_ok=True)
+                metadata_path.write_text(json.dumps(metadata, default=str))
+            else:
+                metadata_path.unlink(missing_ok=True)
+
+    def _temporary_path(self, path: Path) -> Path:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path.with_name(f".{path.name}.{secrets.token_hex(4)}.tmp")
+
+    def _metadata_path(self, container_name: str, name: str) -> Path:
+        self._validate_name(name)
+        return self.root_dir / METADATA_DIR / container_name / f"{name}.json"
+
+    def _path(self, container_name: str, name: Optional[str] = None) -> Path:
+        self._validate_name(container_name)
+        if name is None:
+            return self.root_dir / container_name
+        self._validate_name(name)
+        return self.root_dir / container_name / name
+
+    @staticmethod
+    def _validate_name(name: str) -> None:
+        parts = PurePosixPath(name).parts
+        if (
+            not name
+            or name.startswith("/")
+            or "\\" in name
+            or any(part in ("..", ".") or part.startswith(".") for part in parts)
+        ):
+            raise ValueError(f"Invalid object or container name '{name}'")
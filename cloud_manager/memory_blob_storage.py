@@ -0,0 +1,110 @@
+"""
+This class implements the BlobStorageInterface in memory, for tests, load tests and offline runs.
+"""
+
+import threading
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+from cloud_manager.custom_logging import set_logger
+from cloud_manager.interfaces.blob_storage import BlobStorageInterface
+
+logger = set_logger("In-Memory Blob Storage")
+
+
+class InMemoryBlobStorage(BlobStorageInterface):
+    """
+    Keeps the pushed objects in a dictionary. Their URLs use the memory:// scheme.
+    """
+
+    def __init__(self) -> None:
+        self._objects: Dict[Tuple[str, str], Tuple[bytes, dict]] = {}
+        self._lock = threading.Lock()
+
+    def get_url(self, container_name: str, name: str) -> str:
+        return f"memory://{container_name}/{name}"
+
+    def push_objects(
+        self, container_name: str, objects: List[dict], overwrite: bool = False
+    ) -> List[str]:
+        if not objects:
+            logger.warning("No objects provided for upload")
+            return []
+
+        logger.info(f"Pushing {len(objects)} objects to '{container_name}'")
+        blob_urls = []
+        for obj in objects:
+            try:
+                with open(obj["path"], "rb") as data:
+                    content = data.read()
+            except FileNotFoundError:
+                logger.error(f"File not found: {obj['path']}")
+                continue
+            try:
+                blob_urls.append(
+                    self._store(
+                        container_name,
+                        obj["name"],
+                        content,
+                        obj.get("metadata"),
+                        overwrite,
+                    )
+                )
+            except FileExistsError as e:
+                logger.error(f"Error uploading object '{obj['name']}': {e}")
+        return blob_urls
+
+    async def push_objects_async(
+        self, container_name: str, objects: List[dict], overwrite: bool = False
+    ) -> List[str]:
+        return self.push_objects(container_name, objects, overwrite)
+
+    def upload_stream(
+        self,
+        container_name: str,
+        name: str,
+        data: Union[BinaryIO, Iterable[bytes]],
+        metadata: Optional[dict] = None,
+        overwrite: bool = False,
+    ) -> str:
+        if hasattr(data, "read"):
+            content = data.read()
+        else:
+            content = b"".join(data)
+        return self._store(container_name, name, content, metadata, overwrite)
+
+    def exists(self, container_name: str, name: str) -> bool:
+        with self._lock:
+            return (container_name, name) in self._objects
+
+    def get_object(self, container_name: str, name: str) -> Optional[bytes]:
+        with self._lock:
+            stored = self._objects.get((container_name, name))
+        return stored[0] if stored is not None else None
+
+    def get_metadata(self, container_name: str, name: str) -> Optional[dict]:
+        with self._lock:
+            stored = self._objects.get((container_name, name))
+        return dict(stored[1]) if stored is not None else None
+
+    def list_objects(self, container_name: str) -> List[str]:
+        with self._lock:
+            return sorted(
+                name for container, name in self._objects if container == container_name
+            )
+
+    def _store(
+        self,
+        container_name: str,
+        name: str,
+        content: bytes,
+        metadata: Optional[dict],
+        overwrite: bool,
+    ) -> str:
+        key = (container_name, name)
+        with self._lock:
+            if key in self._objects and not overwrite:
+                raise FileExistsError(
+                    f"Object '{name}' already exists in '{container_name}'"
+                )
+            self._objects[key] = (bytes(content), dict(metadata or {}))
+        return self.get_url(container_name, name)
@@ -0,0 +1,125 @@
+"""
+This class implements the ServiceBusInterface in memory, for tests, load tests and offline runs.
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from cloud_manager.custom_logging import set_logger
+from cloud_manager.peek_lock_service_bus import PeekLockServiceBus, ReceivedMessage
+
+logger = set_logger("In-Memory Service Bus")
+
+
+class InMemoryServiceBus(PeekLockServiceBus):
+    """
+    Queues and topics are in-process queues of the same name.
+
+    Messages are consumed in peek-lock mode (see PeekLockServiceBus) and abandoned ones go
+    back to the front of their queue.
+    """
+
+    def __init__(self, max_delivery_count: int = 10) -> None:
+        self.max_delivery_count = max_delivery_count
+        self._queues: Dict[str, Deque[ReceivedMessage]] = {}
+        self._dead_letters: Dict[str, List[ReceivedMessage]] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._message_ids = itertools.count()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def publish(self, topic: str, messages: List[str]) -> None:
+        if isinstance(messages, str):
+            messages = [messages]
+        with self._condition:
+            queue = self._queues.setdefault(topic, deque())
+            for message in messages:
+                queue.append(ReceivedMessage(next(self._message_ids), message))
+            self._condition.notify_all()
+        logger.info(f"Published {len(messages)} messages to '{topic}'")
+
+    async def publish_async(self, topic: str, messages: List[str]) -> None:
+        self.publish(topic, messages)
+
+    def receive(
+        self, queue: str, max_wait_time: Optional[float] = None
+    ) -> Optional[ReceivedMessage]:
+        """
+        Lock the next message of a queue. It must then be completed or abandoned.
+
+        Args:
+            queue (str): Name of the queue.
+            max_wait_time (Optional[float]): Seconds to wait for a message, None to wait
+                until the Service Bus is closed.
+
+        Returns:
+            Optional[ReceivedMessage]: The message, None if there was none in time.
+        """
+        deadline = None if max_wait_time is None else time.monotonic() + max_wait_time
+        with self._condition:
+            messages = self._queues.setdefault(queue, deque())
+            while not messages and not self._closed:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    return None
+                self._condition.wait(timeout)
+            if not messages:
+                return None
+            message = messages.popleft()
+            message.delivery_count += 1
+            self._in_flight[queue] = self._in_flight.get(queue, 0) + 1
+            return message
+
+    def complete(self, queue: str, message: ReceivedMessage) -> None:
+        with self._condition:
+            self._in_flight[queue] -= 1
+            self._condition.notify_all()
+
+    def abandon(self, queue: str, message: ReceivedMessage) -> None:
+        """
+        Release a message so it is delivered again, or dead-letter it.
+        """
+        with self._condition:
+            self._in_flight[queue] -= 1
+            if message.delivery_count >= self.max_delivery_count:
+                logger.error(
+                    f"Dead-lettering message {message.message_id} of '{queue}' after "
+                    f"{message.delivery_count} deliveries"
+                )
+                self._dead_letters.setdefault(queue, []).append(message)
+            else:
+                self._queues[queue].appendleft(message)
+            self._condition.notify_all()
+
+    def queue_length(self, queue: str) -> int:
+        """
+        Number of messages of a queue waiting to be received.
+        """
+        with self._condition:
+            return len(self._queues.get(queue, ()))
+
+    def in_flight(self, queue: str) -> int:
+        """
+        Number of messages of a queue received and not completed or abandoned yet.
+        """
+        with self._condition:
+            return self._in_flight.get(queue, 0)
+
+    def peek_messages(self, queue: str) -> List[str]:
+        with self._condition:
+            return [message.body for message in self._queues.get(queue, ())]
+
+    def dead_letters(self, queue: str) -> List[str]:
+        with self._condition:
+            return [message.body for message in self._dead_letters.get(queue, ())]
+
+    def close(self) -> None:
+        """
+        Wake up and stop every consumer.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
@@ -0,0 +1,139 @@
+"""
+This class implements consuming for the local Service Buses, on top of their receive, complete and abandon methods.
+"""
+
+import time
+from abc import abstractmethod
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Optional
+
+from cloud_manager.custom_logging import set_logger
+from cloud_manager.interfaces.service_bus import ServiceBusInterface
+
+logger = set_logger("Peek-Lock Service Bus")
+
+
+class MessageLockLostError(Exception):
+    """
+    The message is not locked by its receiver anymore: it was settled, or its lock expired.
+    """
+
+
+class ReceivedMessage:
+    """
+    A message and its delivery state.
+    """
+
+    def __init__(
+        self,
+        message_id: int,
+        body: str,
+        delivery_count: int = 0,
+        lock_token: Optional[str] = None,
+    ) -> None:
+        self.message_id = message_id
+        self.body = body
+        self.delivery_count = delivery_count
+        self.lock_token = lock_token
+        self.enqueued_at = time.monotonic()
+
+    def __str__(self) -> str:
+        return self.body
+
+
+class PeekLockServiceBus(ServiceBusInterface):
+    """
+    A Service Bus that locks received messages until they are completed or abandoned, like
+    Azure Service Bus in peek-lock mode.
+
+    A consumed message is completed once its callback returns. A callback error abandons
+    it, so it is delivered again, until it is dead-lettered after `max_delivery_count`
+    deliveries.
+    """
+
+    @abstractmethod
+    def receive(
+        self, queue: str, max_wait_time: Optional[float] = None
+    ) -> Optional[ReceivedMessage]:
+        """
+        Lock the next message of a queue. It must then be completed or abandoned.
+
+        :param queue: The name of the queue.
+        :param max_wait_time: Seconds to wait for a message, None to wait until the Service Bus is closed.
+        :return: The message, None if there was none in time.
+        """
+        pass
+
+    @abstractmethod
+    def complete(self, queue: str, message: ReceivedMessage) -> None:
+        """
+        Remove a received message from its queue.
+
+        :raises MessageLockLostError: If the message is not locked anymore.
+        """
+        pass
+
+    @abstractmethod
+    def abandon(self, queue: str, message: ReceivedMessage) -> None:
+        """
+        Release a received message so it is delivered again, or dead-letter it.
+
+        :raises MessageLockLostError: If the message is not locked anymore.
+        """
+        pass
+
+    def consume(self, queue: str, callback: Callable[[str], None]) -> None:
+        """
+        Process the messages available in a queue, stopping at the first callback error.
+        """
+        while True:
+            message = self.receive(queue, max_wait_time=0)
+            if message is None:
+                return
+            if not self._process(queue, message, callback):
+                return
+
+    def consume_indefinitely(
+        self,
+        queue: str,
+        callback: Callable[[str], None],
+        max_number_messages: Optional[int] = None,
+        max_wait_time: Optional[float] = None,
+    ) -> None:
+        """
+        Process the messages of a queue as they arrive.
+
+        Returns once `max_number_messages` messages are completed, no message arrived for
+        `max_wait_time` seconds, or the Service Bus is closed.
+        """
+        processed_messages = 0
+        while max_number_messages is None or processed_messages < max_number_messages:
+            message = self.receive(queue, max_wait_time=max_wait_time)
+            if message is None:
+                return
+            if self._process(queue, message, callback):
+                processed_messages += 1
+
+    def _lock_renewal(self, queue: str, message: ReceivedMessage) -> ContextManager:
+        """
+        Keep the lock of a message while its callback runs. Locks do not expire by default.
+        """
+        return nullcontext()
+
+    def _process(
+        self, queue: str, message: ReceivedMessage, callback: Callable[[str], None]
+    ) -> bool:
+        try:
+            with self._lock_renewal(queue, message):
+                try:
+                    callback(str(message))
+                except Exception as e:
+                    logger.error(f"Error while processing message: {e}")
+                    self.abandon(queue, message)
+                    return False
+            self.complete(queue, message)
+        except MessageLockLostError as e:
+            logger.error(f"Lost the lock of a message of '{queue}': {e}")
+            return False
+        logger.info(f"Consumed message from '{queue}': {message}")
+        return True
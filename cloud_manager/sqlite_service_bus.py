@@ -0,0 +1,350 @@
+"""
+This class implements the ServiceBusInterface on a SQLite database in WAL mode, for durable local pipelines and traffic replays.
+"""
+
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+from cloud_manager.custom_logging import set_logger
+from cloud_manager.peek_lock_service_bus import (
+    MessageLockLostError,
+    PeekLockServiceBus,
+    ReceivedMessage,
+)
+
+logger = set_logger("SQLite Service Bus")
+
+ACTIVE = "active"
+COMPLETED = "completed"
+DEAD_LETTERED = "dead_lettered"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    body TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'active',
+    delivery_count INTEGER NOT NULL DEFAULT 0,
+    locked_until REAL NOT NULL DEFAULT 0,
+    lock_token TEXT,
+    enqueued_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_by_queue ON messages (queue, state, id);
+"""
+
+
+class SqliteServiceBus(PeekLockServiceBus):
+    """
+    Queues and topics are rows of a SQLite database, shared by every process that opens it.
+
+    Messages survive restarts: a received message is locked for `lock_duration` seconds,
+    renewed while its callback runs, and is delivered again if its consumer dies before
+    completing it. Messages are consumed in peek-lock mode (see PeekLockServiceBus) and are
+    dead-lettered after `max_delivery_count` deliveries.
+
+    With `retain_completed`, completed messages are kept so they can be replayed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lock_duration: float = 300,
+        max_delivery_count: int = 10,
+        retain_completed: bool = False,
+        poll_interval: float = 0.1,
+    ) -> None:
+        """
+        Initialize the SqliteServiceBus.
+
+        Args:
+            path (str): Path of the database, created if it does not exist.
+            lock_duration (float): Seconds a received message stays locked.
+            max_delivery_count (int): Deliveries before a message is dead-lettered.
+            retain_completed (bool): Whether to keep completed messages for `replay`.
+            poll_interval (float): Seconds between checks for messages published by other
+                processes. Messages published by this process wake consumers right away.
+        """
+        logger.info(f"Initializing SQLite Service Bus in {path}")
+        self.path = path
+        self.lock_duration = lock_duration
+        self.max_delivery_count = max_delivery_count
+        self.retain_completed = retain_completed
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._renewing = {}
+        self._renewing_lock = threading.Lock()
+        self._renewer: Optional[threading.Thread] = None
+        self._stop_renewing = threading.Event()
+        self._connection().executescript(SCHEMA)
+
+    def publish(self, topic: str, messages: List[str]) -> None:
+        if isinstance(messages, str):
+            messages = [messages]
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO messages (queue, body, enqueued_at) VALUES (?, ?, ?)",
+                [(topic, message, now) for message in messages],
+            )
+        with self._condition:
+            self._condition.notify_all()
+        logger.info(f"Published {len(messages)} messages to '{topic}'")
+
+    async def publish_async(self, topic: str, messages: List[str]) -> None:
+        self.publish(topic, messages)
+
+    def receive(
+        self, queue: str, max_wait_time: Optional[float] = None
+    ) -> Optional[ReceivedMessage]:
+        deadline = None if max_wait_time is None else time.monotonic() + max_wait_time
+        while not self._closed:
+            message = self._lock_next(queue)
+            if message is not None:
+                return message
+            timeout = self.poll_interval
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    return None
+            with self._condition:
+                if not self._closed:
+                    self._condition.wait(timeout)
+        return None
+
+    def complete(self, queue: str, message: ReceivedMessage) -> None:
+        if self.retain_completed:
+            self._update_locked(
+                queue,
+                message,
+                "UPDATE messages SET state = ?, lock_token = NULL "
+                "WHERE id = ? AND lock_token = ? AND locked_until > ?",
+                prefix=(COMPLETED,),
+                suffix=(time.time(),),
+            )
+        else:
+            self._update_locked(
+                queue,
+                message,
+                "DELETE FROM messages WHERE id = ? AND lock_token = ? AND locked_until > ?",
+                suffix=(time.time(),),
+            )
+
+    def abandon(self, queue: str, message: ReceivedMessage) -> None:
+        if message.delivery_count >= self.max_delivery_count:
+            logger.error(
+                f"Dead-lettering message {message.message_id} of '{queue}' after "
+                f"{message.delivery_count} deliveries"
+            )
+            state = DEAD_LETTERED
+        else:
+            state = ACTIVE
+        self._update_locked(
+            queue,
+            message,
+            "UPDATE messages SET state = ?, locked_until = 0, lock_token = NULL "
+            "WHERE id = ? AND lock_token = ?",
+            prefix=(state,),
+        )
+        with self._condition:
+            self._condition.notify_all()
+
+    def renew_lock(self, queue: str, message: ReceivedMessage) -> None:
+        """
+        Lock a received message for another `lock_duration` seconds.
+
+        Raises:
+            MessageLockLostError: If the message is not locked by this receiver anymore.
+        """
+        self._update_locked(
+            queue,
+            message,
+            "UPDATE messages SET locked_until = ? WHERE id = ? AND lock_token = ?",
+            prefix=(time.time() + self.lock_duration,),
+        )
+
+    def replay(self, queue: str, target: Optional[str] = None) -> int:
+        """
+        Publish the retained completed messages of a queue again, in their original order.
+
+        Args:
+            queue (str): Queue the messages were completed in.
+            target (Optional[str]): Queue to publish them to. Defaults to `queue`.
+
+        Returns:
+            int: The number of messages published.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT INTO messages (queue, body, enqueued_at) "
+                "SELECT ?, body, ? FROM messages WHERE queue = ? AND state = ? "
+                "ORDER BY id",
+                (target or queue, time.time(), queue, COMPLETED),
+            )
+        with self._condition:
+            self._condition.notify_all()
+        logger.info(f"Replayed {cursor.rowcount} messages of '{queue}'")
+        return cursor.rowcount
+
+    def queue_length(self, queue: str) -> int:
+        """
+        Number of messages of a queue waiting to be received.
+        """
+        return self._count(queue, ACTIVE, "locked_until <= ?")
+
+    def in_flight(self, queue: str) -> int:
+        """
+        Number of messages of a queue received and not completed or abandoned yet.
+        """
+        return self._count(queue, ACTIVE, "locked_until > ?")
+
+    def peek_messages(self, queue: str) -> List[str]:
+        """
+        Messages of a queue not completed or dead-lettered yet, locked ones included.
+        """
+        return self._bodies(queue, ACTIVE)
+
+    def dead_letters(self, queue: str) -> List[str]:
+        return self._bodies(queue, DEAD_LETTERED)
+
+    def close(self) -> None:
+        """
+        Wake up and stop every consumer and close the connections. The queues can still be
+        inspected afterwards.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._stop_renewing.set()
+        if self._renewer is not None:
+            self._renewer.join()
+        with self._condition:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+
+    def _lock_next(self, queue: str) -> Optional[ReceivedMessage]:
+        now = time.time()
+        lock_token = secrets.token_hex(8)
+        connection = self._connection()
+        while True:
+            rows = connection.execute(
+                "UPDATE messages "
+                "SET delivery_count = delivery_count + 1, locked_until = ?, lock_token = ? "
+                "WHERE id = ("
+                "  SELECT id FROM messages "
+                "  WHERE queue = ? AND state = ? AND locked_until <= ? "
+                "  ORDER BY id LIMIT 1"
+                ") RETURNING id, body, delivery_count",
+                (now + self.lock_duration, lock_token, queue, ACTIVE, now),
+            ).fetchall()
+            if not rows:
+                return None
+            message_id, body, delivery_count = rows[0]
+            if delivery_count <= self.max_delivery_count:
+                return ReceivedMessage(message_id, body, delivery_count, lock_token)
+            # The lock of its last delivery expired without a completion
+            logger.error(
+                f"Dead-lettering message {message_id} of '{queue}' after "
+                f"{delivery_count - 1} deliveries"
+            )
+            connection.execute(
+                "UPDATE messages SET state = ?, lock_token = NULL WHERE id = ?",
+                (DEAD_LETTERED, message_id),
+            )
+
+    def _update_locked(
+        self,
+        queue: str,
+        message: ReceivedMessage,
+        statement: str,
+        suffix: tuple = (),
+        prefix: tuple = (),
+    ) -> None:
+        cursor = self._connection().execute(
+            statement, prefix + (message.message_id, message.lock_token) + suffix
+        )
+        if cursor.rowcount == 0:
+            raise MessageLockLostError(
+                f"Message {message.message_id} of '{queue}' is not locked anymore"
+            )
+
+    @contextmanager
+    def _lock_renewal(self, queue: str, message: ReceivedMessage):
+        with self._renewing_lock:
+            self._renewing[message.message_id] = (queue, message)
+            if self._renewer is None:
+                self._renewer = threading.Thread(
+                    target=self._renew_locks, name="sqlite-lock-renewer", daemon=True
+                )
+                self._renewer.start()
+        try:
+            yield
+        finally:
+            with self._renewing_lock:
+                self._renewing.pop(message.message_id, None)
+
+    def _renew_locks(self) -> None:
+        """
+        Renew the locks of the messages being processed, a few times per lock duration.
+        """
+        while not self._stop_renewing.wait(self.lock_duration / 3):
+            with self._renewing_lock:
+                renewing = list(self._renewing.values())
+            for queue, message in renewing:
+                try:
+                    self.renew_lock(queue, message)
+                except MessageLockLostError as e:
+                    logger.warning(f"Could not renew a lock: {e}")
+
+    def _count(self, queue: str, state: str, condition: str) -> int:
+        return (
+            self._connection()
+            .execute(
+                f"SELECT COUNT(*) FROM messages WHERE queue = ? AND state = ? AND {condition}",
+                (queue, state, time.time()),
+            )
+            .fetchone()[0]
+        )
+
+    def _bodies(self, queue: str, state: str) -> List[str]:
+        rows = self._connection().execute(
+            "SELECT body FROM messages WHERE queue = ? AND state = ? ORDER BY id",
+            (queue, state),
+        )
+        return [body for (body,) in rows]
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        The connection of the current thread. Statements outside `_transaction` commit
+        on their own.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or connection not in self._connections:
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            # Commits survive a crash of the process, not of the machine
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._condition:
+                self._connections.append(connection)
+        return connection
@@ -2,8 +2,11 @@ from typing import Optional
 
 from pydantic import BaseModel, Field, root_validator, validator
 
+from image_generation.core.decoders import validate_decoder
+from image_generation.core.performance_profiles import validate_performance_profile
 from image_generation.core.prompt_crafter import PromptCrafter
-from image_generation.core.styles import STYLES
+from image_generation.core.resolution_buckets import validate_size
+from image_generation.core.style_registry import STYLES
 from image_generation.custom_logging import set_logger
 
 logger = set_logger("API Models")
@@ -24,6 +27,8 @@ class TextToImage(BaseModel):
     seed: int = -1
     num_inference_steps: int = Field(..., gt=0)
     num_images: int = Field(..., gt=0)
+    performance_profile: Optional[str]
+    decoder: Optional[str]
 
     class Config:
         schema_extra = {
@@ -51,6 +56,20 @@ class TextToImage(BaseModel):
         logger.debug(f"Valid seed value: {seed}")
         return seed
 
+    @validator("height", "width")
+    def validate_sizes(cls, size):
+        return validate_size(size)
+
+    @validator("performance_profile")
+    def validate_profile(cls, performance_profile):
+        if performance_profile is None:
+            return performance_profile
+        return validate_performance_profile(performance_profile)
+
+    @validator("decoder")
+    def validate_decoder_name(cls, decoder):
+        return validate_decoder(decoder) if decoder is not None else decoder
+
 
 class TextToStyle(BaseModel):
     """
@@ -64,8 +83,24 @@ class TextToStyle(BaseModel):
     seed: Optional[int]
     num_inference_steps: Optional[int]
     num_images: Optional[int]
+    performance_profile: Optional[str]
+    decoder: Optional[str]
     style: str
 
+    @validator("height", "width")
+    def validate_sizes(cls, size):
+        return validate_size(size) if size is not None else size
+
+    @validator("performance_profile")
+    def validate_profile(cls, performance_profile):
+        if performance_profile is None:
+            return performance_profile
+        return validate_performance_profile(performance_profile)
+
+    @validator("decoder")
+    def validate_decoder_name(cls, decoder):
+        return validate_decoder(decoder) if decoder is not None else decoder
+
     @root_validator
     def update_text_to_image_objects(cls, values):
         try:
@@ -97,6 +132,12 @@ class TextToStyle(BaseModel):
                     updated_text_to_image.model_path = values["model_path"]
                 if values.get("model_scheduler"):
                     updated_text_to_image.model_scheduler = values["model_scheduler"]
+                if values.get("performance_profile"):
+                    updated_text_to_image.performance_profile = values[
+                        "performance_profile"
+                    ]
+                if values.get("decoder"):
+                    updated_text_to_image.decoder = values["decoder"]
                 if values.get("height") is not None:
                     updated_text_to_image.height = values["height"]
                 if values.get("width") is not None:
@@ -120,3 +161,28 @@ class TextToStyle(BaseModel):
             raise
         logger.info("Validation successful.")
         return values
+
+
+class JobRequest(BaseModel):
+    """
+    Job: a TextToImage or a TextToStyle request generated in the background.
+    """
+
+    text_to_image: Optional[TextToImage]
+    text_to_style: Optional[TextToStyle]
+
+    @root_validator(skip_on_failure=True)
+    def validate_single_request(cls, values):
+        if (values.get("text_to_image") is None) == (
+            values.get("text_to_style") is None
+        ):
+            raise ValueError(
+                "A job needs exactly one of text_to_image or text_to_style"
+            )
+        return values
+
+    @property
+    def text_to_images(self) -> list:
+        if self.text_to_image is not None:
+            return [self.text_to_image]
+        return self.text_to_style.text_to_images
@@ -1,10 +1,37 @@
-import os
+import asyncio
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, BinaryIO, Callable, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
-from image_generation.api.models import TextToImage, TextToStyle
-from image_generation.api.utils import construct_filename, zip_images
+from image_generation import config, metrics, tracing
+from image_generation.api.models import JobRequest, TextToImage, TextToStyle
+from image_generation.api.utils import (
+    construct_filename,
+    image_to_base64,
+    zip_images,
+)
+from image_generation.core.device_pool import DevicePool, available_devices
+from image_generation.core.handler_registry import HandlerRegistry
+from image_generation.core.job_store import (
+    Job,
+    JobStatusEnum,
+    JobStore,
+    JobStoreFullError,
+)
+from image_generation.core.request_scheduler import (
+    PriorityClassEnum,
+    RequestScheduler,
+    parse_client_weights,
+    validate_priority_class,
+)
 from image_generation.core.stable_diffusion import StableDiffusionHandler
 from image_generation.custom_logging import set_logger
 
@@ -12,15 +39,396 @@ logger = set_logger("Image Generation API")
 logger.info("--- Image Generation API ---")
 
 app = FastAPI()
-_model = None
-_model_init_path = os.environ.get("DEFAULT_MODEL_NAME", "stabilityai/sdxl-turbo")
+
+# Probes and scrapes are not traced
+_UNTRACED_PATHS = {"/healthcheck", "/ready", "/metrics"}
+_handlers = HandlerRegistry()
+_device_pool = None
+_device_pool_lock = threading.Lock()
+_job_store = None
+_job_store_lock = threading.Lock()
+_scheduler = None
+_scheduler_lock = threading.Lock()
+_model_init_path = config.DEFAULT_MODEL_NAME
+
+
+# Model loading state reported by /ready: "idle", "loading", "ready" or "failed"
+_load_state = {"status": "idle", "loaded_models": [], "error": None}
 
 
 def get_model(model_init_path: str = _model_init_path) -> StableDiffusionHandler:
-    global _model
-    if _model is None:
-        _model = StableDiffusionHandler(model_init_path)
-    return _model
+    return _handlers.get(model_init_path)
+
+
+def get_device_pool() -> Optional[DevicePool]:
+    """
+    Get the device pool, creating it on first use. None when DEVICE_POOL_SIZE <= 1.
+
+    The pool holds one replica per GPU, or one CPU worker process per replica when
+    there is no GPU.
+    """
+    global _device_pool
+    if config.DEVICE_POOL_SIZE <= 1:
+        return None
+    with _device_pool_lock:
+        if _device_pool is None:
+            _device_pool = DevicePool(
+                _model_init_path,
+                devices=available_devices(config.DEVICE_POOL_SIZE),
+                num_cpu_workers=config.DEVICE_POOL_SIZE,
+            )
+    return _device_pool
+
+
+def get_job_store() -> JobStore:
+    """
+    Get the store of background jobs, creating it on first use.
+    """
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            _job_store = JobStore(
+                max_jobs=config.JOB_STORE_MAX_JOBS,
+                ttl_seconds=config.JOB_TTL_SECONDS,
+                spill_dir=config.JOB_SPILL_DIR or None,
+                max_memory_bytes=config.JOB_STORE_MAX_MEMORY_BYTES,
+                num_workers=config.JOB_WORKERS,
+            )
+    return _job_store
+
+
+def get_scheduler() -> RequestScheduler:
+    """
+    Get the request scheduler, creating it on first use with one slot per device.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            device_pool = get_device_pool()
+            _scheduler = RequestScheduler(
+                capacity=device_pool.size if device_pool is not None else 1,
+                client_weights=parse_client_weights(config.SCHEDULER_CLIENT_WEIGHTS),
+            )
+    return _scheduler
+
+
+def request_priority(request: Request, default_priority_class: str) -> Tuple[str, str]:
+    """
+    Read the priority class and client of a request from its X-Priority and
+    X-Client-Id headers. The client defaults to the caller's address.
+
+    Raises:
+        HTTPException: If the priority class does not exist.
+    """
+    priority_class = request.headers.get("X-Priority", default_priority_class)
+    try:
+        validate_priority_class(priority_class)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    client_id = request.headers.get("X-Client-Id") or (
+        request.client.host if request.client else "anonymous"
+    )
+    return priority_class, client_id
+
+
+def generate_request_images(
+    text_to_image: TextToImage,
+    priority_class: str,
+    client_id: str,
+    on_images: Optional[Callable[[list], None]] = None,
+    on_step: Optional[Callable[[int, int], None]] = None,
+) -> list:
+    """
+    Generate the images of one request once the scheduler gives it a turn.
+
+    On the device pool, `on_images` is called once with all the images and `on_step`
+    is not called.
+    """
+    device_pool = get_device_pool()
+    queued_at = time.perf_counter()
+
+    def work():
+        current_span = tracing.current_span()
+        if current_span is not None:
+            current_span.set_attribute(
+                "scheduler.wait_seconds", round(time.perf_counter() - queued_at, 6)
+            )
+        if device_pool is None:
+            model = get_model(text_to_image.model_path)
+            return model.txt_to_img(text_to_image, on_images=on_images, on_step=on_step)
+        images = device_pool.submit(text_to_image).result()
+        if on_images is not None:
+            on_images(images)
+        return images
+
+    with tracing.start_span(
+        "generate_request",
+        {
+            "model": text_to_image.model_path,
+            "num_images": text_to_image.num_images,
+            "priority_class": priority_class,
+            "client_id": client_id,
+        },
+    ):
+        return get_scheduler().run(
+            work,
+            priority_class,
+            client_id,
+            cost=text_to_image.num_images * text_to_image.num_inference_steps,
+        )
+
+
+def generate_all_images(
+    text_to_images: List[TextToImage],
+    priority_class: str,
+    client_id: str,
+    on_images: Optional[Callable[[int, list], None]] = None,
+    on_step: Optional[Callable[[int, int, int], None]] = None,
+) -> List[list]:
+    """
+    Generate the images of each request, as one scheduled work item per request.
+
+    The items run one after the other, or concurrently on the device pool when enabled.
+    Between two items, work of a higher priority class or of a client with a smaller
+    share takes the turn.
+
+    Args:
+        text_to_images (List[TextToImage]): The requests.
+        priority_class (str): Priority class of the requests.
+        client_id (str): Client the requests belong to.
+        on_images (Optional[Callable[[int, list], None]]): Called with the index of the
+            request and its images as soon as they are ready.
+        on_step (Optional[Callable[[int, int, int], None]]): Called with the index of the
+            request, the step and the number of steps after each denoising step.
+
+    Returns:
+        List[list]: The images of each request, in the order of the requests.
+    """
+
+    def generate(index: int) -> list:
+        logger.debug(f"Processing prompt {index + 1}: {text_to_images[index]}")
+        return generate_request_images(
+            text_to_images[index],
+            priority_class,
+            client_id,
+            on_images=partial(on_images, index) if on_images is not None else None,
+            on_step=partial(on_step, index) if on_step is not None else None,
+        )
+
+    device_pool = get_device_pool()
+    if device_pool is None:
+        return [generate(index) for index in range(len(text_to_images))]
+    with ThreadPoolExecutor(max_workers=device_pool.size) as executor:
+        # Each item runs in a copy of this context, to stay in the request's trace
+        futures = [
+            executor.submit(contextvars.copy_context().run, generate, index)
+            for index in range(len(text_to_images))
+        ]
+        return [future.result() for future in futures]
+
+
+def run_job(job: Job, priority_class: str, client_id: str) -> BinaryIO:
+    """
+    Generate the images of a job, reporting its progress, and zip them.
+
+    Returns:
+        BinaryIO: The zip archive, like the ones of /text_to_image and /text_to_style.
+    """
+    images_per_request = generate_all_images(
+        job.text_to_images,
+        priority_class,
+        client_id,
+        on_images=lambda index, images: job.record_images(images),
+        on_step=lambda index, step, num_steps: job.record_step(step, num_steps),
+    )
+    images = []
+    for text_to_image, request_images in zip(job.text_to_images, images_per_request):
+        metadata = text_to_image.dict()
+        images.extend(
+            (
+                construct_filename(text_to_image.prompt.positive, text_to_image.seed),
+                image,
+                metadata,
+            )
+            for image in request_images
+        )
+    return zip_images(images)
+
+
+async def generate_images(
+    text_to_images: List[TextToImage], priority_class: str, client_id: str
+) -> List[list]:
+    """
+    Generate the images of each request, on the device pool when enabled.
+
+    Returns:
+        List[list]: The images of each request, in the order of the requests.
+    """
+    return await run_in_threadpool(
+        generate_all_images, text_to_images, priority_class, client_id
+    )
+
+
+async def stream_images(
+    text_to_images: List[TextToImage],
+    priority_class: str,
+    client_id: str,
+    progress: bool = False,
+) -> AsyncIterator[str]:
+    """
+    Generate the images of each request and stream them as NDJSON events as they are ready.
+
+    Events are JSON objects, one per line, with an "event" field:
+        - "progress": "request_index", "step" and "num_steps", after each denoising step
+          when `progress` is set and the device pool is disabled.
+        - "image": "request_index", "filename", "metadata" and "image", a base64 PNG
+          with the metadata embedded like in the zip responses.
+        - "error": "detail", ends the stream when generation fails.
+        - "done": "num_images", ends the stream when every image was sent.
+
+    Args:
+        text_to_images (List[TextToImage]): The requests.
+        priority_class (str): Priority class of the requests.
+        client_id (str): Client the requests belong to.
+        progress (bool): Whether to emit step progress events.
+
+    Yields:
+        str: The events, one JSON line each.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(event: Optional[dict]):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def emit_images(request_index: int, images: list):
+        for image in images:
+            emit({"event": "image", "request_index": request_index, "image": image})
+
+    def emit_step(request_index: int, step: int, num_steps: int):
+        emit(
+            {
+                "event": "progress",
+                "request_index": request_index,
+                "step": step,
+                "num_steps": num_steps,
+            }
+        )
+
+    def generate():
+        try:
+            generate_all_images(
+                text_to_images,
+                priority_class,
+                client_id,
+                on_images=emit_images,
+                on_step=emit_step if progress else None,
+            )
+        except Exception as e:
+            logger.error(f"Error while streaming images: {e}")
+            emit({"event": "error", "detail": "An error occurred during generation."})
+        finally:
+            emit(None)
+
+    producer = asyncio.ensure_future(run_in_threadpool(generate))
+    num_images = 0
+    failed = False
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        if event["event"] == "image":
+            text_to_image = text_to_images[event["request_index"]]
+            metadata = text_to_image.dict()
+            event.update(
+                filename=construct_filename(
+                    text_to_image.prompt.positive, text_to_image.seed
+                )
+                + ".png",
+                metadata=metadata,
+                image=await run_in_threadpool(
+                    image_to_base64, event["image"], metadata
+                ),
+            )
+            num_images += 1
+        failed = failed or event["event"] == "error"
+        yield json.dumps(event) + "\n"
+    await producer
+    if not failed:
+        yield json.dumps({"event": "done", "num_images": num_images}) + "\n"
+
+
+def preload_models(
+    default_model: str = _model_init_path, extra_models: list = None
+) -> None:
+    """
+    Load the extra models and then the default model, so the default one stays active.
+
+    Loading the extra models populates the pipeline snapshot cache and the warm-up
+    cache, making later switches to them cheaper. With a device pool, every replica
+    loads them and the service is only ready once all of them have.
+    """
+    extra_models = [m for m in (extra_models or []) if m != default_model]
+    _load_state.update(status="loading", loaded_models=[], error=None)
+    try:
+        device_pool = get_device_pool()
+        if device_pool is not None:
+            _load_state["loaded_models"].extend(
+                device_pool.preload(extra_models + [default_model])
+            )
+            _load_state["status"] = "ready"
+            logger.info("Device pool ready")
+            return
+        for model_path in extra_models + [default_model]:
+            logger.info(f"Preloading model {model_path}")
+            model = get_model(model_path)
+            model.load_model(model_path)
+            _load_state["loaded_models"].append(model.startup_report)
+        _load_state["status"] = "ready"
+        logger.info("Models preloaded")
+    except Exception as e:
+        logger.error(f"Error preloading models: {e}")
+        _load_state.update(status="failed", error=str(e))
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Run each request in a span, joining the caller's trace when it sends a traceparent
+    header, and return the correlation id in the X-Correlation-Id header.
+    """
+    if request.url.path in _UNTRACED_PATHS:
+        return await call_next(request)
+    with tracing.start_span(
+        f"{request.method} {request.url.path}",
+        {"http.method": request.method, "http.target": request.url.path},
+        traceparent=request.headers.get(tracing.TRACEPARENT_HEADER),
+    ) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+    response.headers[tracing.CORRELATION_ID_HEADER] = span.trace_id
+    response.headers[tracing.TRACEPARENT_HEADER] = span.traceparent
+    return response
+
+
+@app.on_event("shutdown")
+def close_job_store():
+    if _job_store is not None:
+        _job_store.close()
+
+
+@app.on_event("startup")
+def start_preloading_models():
+    if not config.PRELOAD_ON_STARTUP:
+        logger.info("Model preloading disabled, models will load on first use")
+        _load_state["status"] = "ready"
+        return
+    threading.Thread(
+        target=preload_models,
+        kwargs={"extra_models": config.PRELOAD_MODELS},
+        name="model-preloader",
+        daemon=True,
+    ).start()
 
 
 # health check
@@ -30,14 +438,39 @@ async def healthcheck():
     return {"status": "healthy"}
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    if _scheduler is not None:
+        for priority_class, stats in _scheduler.stats().items():
+            metrics.SCHEDULER_QUEUE_DEPTH.set(
+                stats["queued"], priority_class=priority_class
+            )
+            metrics.SCHEDULER_RUNNING.set(
+                stats["running"], priority_class=priority_class
+            )
+            metrics.SCHEDULER_MEAN_WAIT_SECONDS.set(
+                stats["mean_wait_seconds"], priority_class=priority_class
+            )
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# readiness check
+@app.get("/ready")
+async def ready():
+    status_code = 200 if _load_state["status"] == "ready" else 503
+    return JSONResponse(status_code=status_code, content=_load_state)
+
+
 # text to image
 @app.post("/text_to_image", response_model=None)
-async def text_to_image(text_to_image: TextToImage):
+async def text_to_image(text_to_image: TextToImage, request: Request):
+    priority_class, client_id = request_priority(
+        request, PriorityClassEnum.INTERACTIVE.value
+    )
     try:
         logger.debug(f"Text to image request: {text_to_image}")
-        model = get_model(text_to_image.model_path)
         logger.info("Generating images")
-        images = model.txt_to_img(text_to_image)
+        images = (await generate_images([text_to_image], priority_class, client_id))[0]
 
         logger.info("Zipping images")
         filenames = [
@@ -65,15 +498,18 @@ async def text_to_image(text_to_image: TextToImage):
 
 
 @app.post("/text_to_style", response_model=None)
-async def text_to_style(text_to_style: TextToStyle):
+async def text_to_style(text_to_style: TextToStyle, request: Request):
+    priority_class, client_id = request_priority(request, PriorityClassEnum.BATCH.value)
     try:
         logger.debug(f"Text to style request: {text_to_style}")
         all_images = []
         logger.info("Generating images")
-        for index, text_to_image in enumerate(text_to_style.text_to_images):
-            logger.debug(f"Processing prompt {index + 1}: {text_to_image}")
-            model = get_model(text_to_image.model_path)
-            images = model.txt_to_img(text_to_image)
+        images_per_request = await generate_images(
+            text_to_style.text_to_images, priority_class, client_id
+        )
+        for text_to_image, images in zip(
+            text_to_style.text_to_images, images_per_request
+        ):
             metadata = text_to_image.dict()
             filename = construct_filename(
                 text_to_image.prompt.positive, text_to_image.seed
@@ -96,3 +532,77 @@ async def text_to_style(text_to_style: TextToStyle):
             status_code=500,
             detail="An error occurred during text_to_image_with_style processing.",
         )
+
+
+@app.post("/text_to_image/stream", response_model=None)
+async def text_to_image_stream(
+    text_to_image: TextToImage, request: Request, progress: bool = False
+):
+    logger.debug(f"Text to image stream request: {text_to_image}")
+    priority_class, client_id = request_priority(
+        request, PriorityClassEnum.INTERACTIVE.value
+    )
+    return StreamingResponse(
+        stream_images([text_to_image], priority_class, client_id, progress),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/text_to_style/stream", response_model=None)
+async def text_to_style_stream(
+    text_to_style: TextToStyle, request: Request, progress: bool = False
+):
+    logger.debug(f"Text to style stream request: {text_to_style}")
+    priority_class, client_id = request_priority(request, PriorityClassEnum.BATCH.value)
+    return StreamingResponse(
+        stream_images(
+            text_to_style.text_to_images, priority_class, client_id, progress
+        ),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(job_request: JobRequest, request: Request):
+    priority_class, client_id = request_priority(request, PriorityClassEnum.BATCH.value)
+    try:
+        job = get_job_store().submit(
+            job_request.text_to_images,
+            partial(run_job, priority_class=priority_class, client_id=client_id),
+        )
+    except JobStoreFullError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail=str(e))
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/result", response_model=None)
+async def get_job_result(job_id: str):
+    job_store = get_job_store()
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    result = job_store.result(job_id)
+    if result is None:
+        detail = (
+            f"Job {job_id} failed: {job.error}"
+            if job.status == JobStatusEnum.FAILED
+            else f"Job {job_id} is {job.status.value}"
+        )
+        raise HTTPException(status_code=409, detail=detail)
+    response = StreamingResponse(result, media_type="application/x-zip-compressed")
+    response.headers["Content-Disposition"] = "attachment; filename=images.zip"
+    return response
+
+
+@app.get("/queue")
+async def queue():
+    return get_scheduler().stats()
@@ -1,5 +1,6 @@
 """Image Generation API Utils"""
 
+import base64
 import io
 import json
 import uuid
@@ -8,6 +9,8 @@ from typing import BinaryIO, List, Tuple
 
 from PIL import Image, PngImagePlugin
 
+from image_generation import metrics, tracing
+
 
 def image_to_bytes(image: Image.Image, metadata: dict = None) -> BinaryIO:
     """
@@ -20,6 +23,11 @@ def image_to_bytes(image: Image.Image, metadata: dict = None) -> BinaryIO:
     Returns:
         BinaryIO: A bytes object containing the image data.
     """
+    with metrics.ENCODE_SECONDS.time():
+        return _image_to_bytes(image, metadata)
+
+
+def _image_to_bytes(image: Image.Image, metadata: dict = None) -> BinaryIO:
     img_byte_arr = io.BytesIO()
 
     if metadata:
@@ -43,6 +51,20 @@ def image_to_bytes(image: Image.Image, metadata: dict = None) -> BinaryIO:
     return img_byte_arr
 
 
+def image_to_base64(image: Image.Image, metadata: dict = None) -> str:
+    """
+    Encode a PIL Image as a base64 PNG, the format of the images of the streaming endpoints.
+
+    Args:
+        image (Image.Image): A PIL Image object.
+        metadata (dict): A dictionary containing metadata to add to the image.
+
+    Returns:
+        str: The base64-encoded PNG.
+    """
+    return base64.b64encode(image_to_bytes(image, metadata).read()).decode("ascii")
+
+
 def get_zip_buffer(images_data: List[Tuple[str, BinaryIO]]) -> BinaryIO:
     """
     Create a zip file in memory containing images from a list of image bytes objects.
@@ -55,7 +77,9 @@ def get_zip_buffer(images_data: List[Tuple[str, BinaryIO]]) -> BinaryIO:
     """
     zip_buffer = io.BytesIO()
 
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
+    with metrics.ZIP_SECONDS.time(), zipfile.ZipFile(
+        zip_buffer, "a", zipfile.ZIP_DEFLATED, False
+    ) as zip_file:
         for filename, data in images_data:  # Unpack the filename and data
             data.seek(0)
             zip_file.writestr(f"{filename}.png", data.read())  # Use the filename here
@@ -74,12 +98,13 @@ def zip_images(images: List[Tuple[str, Image.Image, dict]]) -> BinaryIO:
     Returns:
         BinaryIO: A bytes object containing the zip file data.
     """
-    zip_buffer = get_zip_buffer(
-        [
-            (filename, image_to_bytes(image, metadata))
-            for filename, image, metadata in images
-        ]
-    )
+    with tracing.start_span("zip_images", {"images": len(images)}):
+        zip_buffer = get_zip_buffer(
+            [
+                (filename, image_to_bytes(image, metadata))
+                for filename, image, metadata in images
+            ]
+        )
     return zip_buffer
 
 
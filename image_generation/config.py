@@ -0,0 +1,60 @@
+import os
+
+DEFAULT_MODEL_NAME = os.environ.get("DEFAULT_MODEL_NAME", "stabilityai/sdxl-turbo")
+PRELOAD_ON_STARTUP = os.environ.get("PRELOAD_ON_STARTUP", "true").lower() in (
+    "true",
+    "yes",
+    "1",
+)
+PRELOAD_MODELS = [
+    model.strip()
+    for model in os.environ.get("PRELOAD_MODELS", "").split(",")
+    if model.strip()
+]
+DEVICE_POOL_SIZE = int(os.environ.get("DEVICE_POOL_SIZE", 1))
+PIPELINE_SNAPSHOT_DIR = os.environ.get("PIPELINE_SNAPSHOT_DIR", "").strip()
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() in (
+    "true",
+    "yes",
+    "1",
+)
+WARMUP_HEIGHT = int(os.environ.get("WARMUP_HEIGHT", 688))
+WARMUP_WIDTH = int(os.environ.get("WARMUP_WIDTH", 512))
+WARMUP_GUIDANCE_SCALE = float(os.environ.get("WARMUP_GUIDANCE_SCALE", 0.0))
+STARTUP_BUDGET_SECONDS = float(os.environ.get("STARTUP_BUDGET_SECONDS", 600))
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "").strip()
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 2 * 1024**3))
+RESULT_CACHE_BLOB_CONTAINER = os.environ.get("RESULT_CACHE_BLOB_CONTAINER", "").strip()
+AZURE_STORAGE_CONNECTION_STRING = os.environ.get("AZURE_STORAGE_CONNECTION_STRING", "")
+PROMPT_EMBEDDING_CACHE_SIZE = int(os.environ.get("PROMPT_EMBEDDING_CACHE_SIZE", 256))
+PERFORMANCE_PROFILE = os.environ.get("PERFORMANCE_PROFILE", "auto").strip().lower()
+MAX_THROUGHPUT_HEADROOM_GB = float(os.environ.get("MAX_THROUGHPUT_HEADROOM_GB", 8.0))
+BALANCED_HEADROOM_GB = float(os.environ.get("BALANCED_HEADROOM_GB", 3.0))
+CAPACITY_MEMORY_FRACTION = float(os.environ.get("CAPACITY_MEMORY_FRACTION", 0.9))
+CPU_DTYPE = os.environ.get("CPU_DTYPE", "auto").strip().lower()
+CPU_THREADS = int(os.environ.get("CPU_THREADS", 0))
+CPU_COMPILE = os.environ.get("CPU_COMPILE", "false").lower() in ("true", "yes", "1")
+DEFAULT_DECODER = os.environ.get("DEFAULT_DECODER", "vae").strip().lower()
+TINY_VAE_MODEL = os.environ.get("TINY_VAE_MODEL", "madebyollin/taesd")
+TINY_VAE_XL_MODEL = os.environ.get("TINY_VAE_XL_MODEL", "madebyollin/taesdxl")
+RESOLUTION_BUCKETS = [
+    bucket.strip()
+    for bucket in os.environ.get("RESOLUTION_BUCKETS", "").split(",")
+    if bucket.strip()
+]
+COMPILE_CACHE_DIR = os.environ.get("COMPILE_CACHE_DIR", "").strip()
+JOB_STORE_MAX_JOBS = int(os.environ.get("JOB_STORE_MAX_JOBS", 100))
+JOB_TTL_SECONDS = float(os.environ.get("JOB_TTL_SECONDS", 3600))
+JOB_SPILL_DIR = os.environ.get("JOB_SPILL_DIR", "").strip()
+JOB_STORE_MAX_MEMORY_BYTES = int(
+    os.environ.get("JOB_STORE_MAX_MEMORY_BYTES", 512 * 1024**2)
+)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 1))
+SCHEDULER_CLIENT_WEIGHTS = [
+    weight.strip()
+    for weight in os.environ.get("SCHEDULER_CLIENT_WEIGHTS", "").split(",")
+    if weight.strip()
+]
+TRACE_EXPORT_PATH = os.environ.get("TRACE_EXPORT_PATH", "").strip()
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "").strip()
+PROFILE_TORCH_REQUEST = int(os.environ.get("PROFILE_TORCH_REQUEST", 0))
@@ -0,0 +1,174 @@
+import threading
+from typing import Optional
+
+import torch
+
+from image_generation import config
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("SD Capacity Planner")
+
+
+def is_out_of_memory_error(error: Exception) -> bool:
+    """
+    Whether an exception is a device out of memory error (CUDA, MPS or CPU allocator).
+    """
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
+
+class CapacityPlanner:
+    """
+    Chooses how many images of a request a device can generate at once.
+
+    The peak memory of a micro-batch is estimated from the resolution, the UNet batch size
+    and the VAE settings, and compared against the free device memory. For request shapes
+    that ran out of memory anyway, later requests start from the largest batch size that
+    worked.
+    """
+
+    # Activation bytes per latent pixel and UNet sample, for 2-byte weights
+    UNET_BYTES_PER_LATENT_PIXEL = 112 * 1024
+    # Activation bytes per output pixel and decoded image, for 2-byte weights
+    VAE_BYTES_PER_PIXEL = 5 * 1024
+    # Largest area the VAE decodes at once when tiling
+    VAE_TILE_PIXELS = 512 * 512
+
+    def __init__(self) -> None:
+        # Per request shape, the largest batch size that worked and the smallest that did not
+        self._largest_successes = {}
+        self._smallest_failures = {}
+        self._lock = threading.Lock()
+
+    def _batch_limit(self, shape: tuple) -> Optional[int]:
+        failure = self._smallest_failures.get(shape)
+        if failure is None:
+            return None
+        success = self._largest_successes.get(shape)
+        return success if success is not None else max(1, failure // 2)
+
+    def estimate_peak_bytes(
+        self,
+        height: int,
+        width: int,
+        num_images: int,
+        unet_batch_size: int,
+        bytes_per_element: int = 2,
+        vae_slicing: bool = True,
+        vae_tiling: bool = False,
+    ) -> int:
+        """
+        Estimate the activation memory of generating a micro-batch.
+
+        Args:
+            height (int): Height of the images.
+            width (int): Width of the images.
+            num_images (int): Number of images generated together.
+            unet_batch_size (int): Number of UNet samples per denoising step.
+            bytes_per_element (int): Size of the pipeline's dtype.
+            vae_slicing (bool): Whether the VAE decodes one image at a time.
+            vae_tiling (bool): Whether the VAE decodes in tiles.
+
+        Returns:
+            int: The estimated peak in bytes, on top of the weights.
+        """
+        scale = bytes_per_element / 2
+        latent_pixels = (height // 8) * (width // 8)
+        unet_peak = unet_batch_size * latent_pixels * self.UNET_BYTES_PER_LATENT_PIXEL
+        decoded_pixels = height * width
+        if vae_tiling:
+            decoded_pixels = min(decoded_pixels, self.VAE_TILE_PIXELS)
+        decoded_images = 1 if vae_slicing else num_images
+        vae_peak = decoded_images * decoded_pixels * self.VAE_BYTES_PER_PIXEL
+        return int(max(unet_peak, vae_peak) * scale)
+
+    def max_batch_size(
+        self,
+        shape: tuple,
+        num_images: int,
+        free_memory: Optional[int],
+        unet_batch_size_per_image: int,
+        **estimate_arguments,
+    ) -> int:
+        """
+        Largest number of images of a request shape that can be generated at once.
+
+        Args:
+            shape (tuple): The request shape, as (model_path, height, width, guidance).
+            num_images (int): Number of images still to generate.
+            free_memory (Optional[int]): Free device memory in bytes, None if unknown.
+            unet_batch_size_per_image (int): UNet samples per image, 2 with classifier-free
+                guidance.
+            **estimate_arguments: Other arguments of `estimate_peak_bytes`.
+
+        Returns:
+            int: The batch size, between 1 and `num_images`.
+        """
+        _, height, width, _ = shape
+        with self._lock:
+            limit = self._batch_limit(shape)
+        batch_size = num_images if limit is None else min(num_images, limit)
+        if free_memory is None:
+            return batch_size
+        budget = free_memory * config.CAPACITY_MEMORY_FRACTION
+        while batch_size > 1:
+            peak_bytes = self.estimate_peak_bytes(
+                height,
+                width,
+                batch_size,
+                batch_size * unet_batch_size_per_image,
+                **estimate_arguments,
+            )
+            if peak_bytes <= budget:
+                break
+            batch_size -= 1
+        return batch_size
+
+    def record_out_of_memory(self, shape: tuple, batch_size: int) -> int:
+        """
+        Remember that a batch size ran out of memory for a request shape.
+
+        Args:
+            shape (tuple): The request shape.
+            batch_size (int): The batch size that failed.
+
+        Returns:
+            int: The halved batch size to retry with, 0 when a single image does not fit.
+        """
+        with self._lock:
+            failure = min(batch_size, self._smallest_failures.get(shape, batch_size))
+            self._smallest_failures[shape] = failure
+            if self._largest_successes.get(shape, 0) >= failure:
+                # The device has less memory available than when that size worked
+                del self._largest_successes[shape]
+        new_batch_size = batch_size // 2
+        logger.warning(
+            f"Out of memory generating {batch_size} images of {shape}, "
+            f"retrying with {new_batch_size}"
+        )
+        return new_batch_size
+
+    def record_success(self, shape: tuple, batch_size: int) -> None:
+        """
+        Remember that a batch size worked for a request shape.
+
+        Args:
+            shape (tuple): The request shape.
+            batch_size (int): The batch size that worked.
+        """
+        with self._lock:
+            failure = self._smallest_failures.get(shape)
+            if failure is not None and batch_size >= failure:
+                return
+            if batch_size > self._largest_successes.get(shape, 0):
+                self._largest_successes[shape] = batch_size
+
+    def max_batch_sizes(self) -> dict:
+        """
+        Batch size limits of the request shapes that ran out of memory.
+        """
+        with self._lock:
+            return {
+                shape: self._batch_limit(shape) for shape in self._smallest_failures
+            }
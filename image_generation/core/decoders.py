@@ -0,0 +1,145 @@
+"""
+Decoding of latents into images, separately from the denoising loop.
+
+With the tiny decoder the pipeline returns latents and a TAESD-style tiny autoencoder
+decodes them on a background thread (and a separate CUDA stream on GPUs), so the decode
+of one micro-batch overlaps with the denoising of the next one.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from typing import List, Optional
+
+import torch
+from diffusers import AutoencoderTiny, StableDiffusionXLPipeline
+from PIL import Image
+
+from image_generation import config
+from image_generation.core.performance_profiles import device_type
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("SD Decoders")
+
+
+class DecoderEnum(Enum):
+    VAE = "vae"
+    TINY = "tiny"
+
+
+def validate_decoder(decoder_name: str) -> str:
+    """
+    Check that a decoder exists.
+
+    Raises:
+        ValueError: If it does not.
+    """
+    valid_decoders = [decoder.value for decoder in DecoderEnum]
+    if decoder_name not in valid_decoders:
+        raise ValueError(
+            f"{decoder_name} is not a valid decoder. Valid options are: "
+            f"{', '.join(valid_decoders)}"
+        )
+    return decoder_name
+
+
+def resolve_decoder(decoder_name: Optional[str]) -> str:
+    """
+    Validate a decoder name, defaulting to DEFAULT_DECODER.
+
+    Raises:
+        ValueError: If the decoder name is not valid.
+    """
+    return validate_decoder(decoder_name or config.DEFAULT_DECODER)
+
+
+def load_tiny_decoder(pipe, device: torch.device, dtype: torch.dtype):
+    """
+    Load the tiny autoencoder matching a pipeline's latent space.
+
+    Args:
+        pipe: The diffusers pipeline.
+        device (torch.device): Device to load the decoder on.
+        dtype (torch.dtype): Data type of the decoder.
+
+    Returns:
+        AutoencoderTiny: The decoder.
+    """
+    if isinstance(pipe, StableDiffusionXLPipeline):
+        model_path = config.TINY_VAE_XL_MODEL
+    else:
+        model_path = config.TINY_VAE_MODEL
+    logger.info(f"Loading tiny decoder {model_path}")
+    decoder = AutoencoderTiny.from_pretrained(model_path, torch_dtype=dtype)
+    return decoder.to(device)
+
+
+class LatentDecoder:
+    """
+    Decodes latents into PIL images on a background thread.
+    """
+
+    def __init__(self, decoder, image_processor, device: torch.device) -> None:
+        """
+        Initialize the LatentDecoder.
+
+        Args:
+            decoder: Autoencoder whose `decode` maps scaled latents to images.
+            image_processor: The pipeline's image processor, to post-process the images.
+            device (torch.device): Device the decoder runs on.
+        """
+        self.decoder = decoder
+        self.image_processor = image_processor
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="latent-decoder"
+        )
+        self._stream = (
+            torch.cuda.Stream(device) if device_type(device) == "cuda" else None
+        )
+
+    def decode(self, latents: torch.Tensor) -> List[Image.Image]:
+        """
+        Decode latents into images.
+
+        Args:
+            latents (torch.Tensor): Latents returned by the pipeline with output_type="latent".
+
+        Returns:
+            List[Image.Image]: The images.
+        """
+        with torch.no_grad():
+            latents = (
+                latents.to(self.decoder.dtype) / self.decoder.config.scaling_factor
+            )
+            images = self.decoder.decode(latents, return_dict=False)[0]
+        return self.image_processor.postprocess(images, output_type="pil")
+
+    def submit(self, latents: torch.Tensor) -> Future:
+        """
+        Decode latents in the background.
+
+        Args:
+            latents (torch.Tensor): Latents returned by the pipeline with output_type="latent".
+
+        Returns:
+            Future: Future of the list of images.
+        """
+        if self._stream is None:
+            return self._executor.submit(self.decode, latents)
+        # The decode stream waits for the denoising work queued so far, not for later work
+        latents_ready = torch.cuda.Event()
+        latents_ready.record()
+        return self._executor.submit(self._decode_on_stream, latents, latents_ready)
+
+    def close(self) -> None:
+        """
+        Cancel the decodes not started yet and stop the background thread.
+        """
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _decode_on_stream(
+        self, latents: torch.Tensor, latents_ready: torch.cuda.Event
+    ) -> List[Image.Image]:
+        with torch.cuda.stream(self._stream):
+            self._stream.wait_event(latents_ready)
+            latents.record_stream(self._stream)
+            return self.decode(latents)
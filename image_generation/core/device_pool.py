@@ -0,0 +1,221 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional
+
+import torch
+from PIL import Image
+
+from image_generation.api.models import TextToImage
+from image_generation.core.stable_diffusion import StableDiffusionHandler
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Device Pool")
+
+# Handler of the current CPU worker process, created by _init_cpu_worker
+_worker_handler = None
+# Barrier of the CPU worker processes, so each of them takes one preload task
+_worker_barrier = None
+
+
+def available_devices(max_devices: Optional[int] = None) -> List[str]:
+    """
+    List the accelerator devices available for generation.
+
+    Args:
+        max_devices (Optional[int]): Maximum number of devices to return.
+
+    Returns:
+        List[str]: The CUDA devices, or an empty list when there is no GPU.
+    """
+    if not torch.cuda.is_available():
+        return []
+    devices = [f"cuda:{index}" for index in range(torch.cuda.device_count())]
+    return devices[:max_devices] if max_devices is not None else devices
+
+
+def _init_cpu_worker(
+    handler_factory: Callable[..., StableDiffusionHandler],
+    model_path: str,
+    num_threads: int,
+    barrier,
+) -> None:
+    global _worker_handler, _worker_barrier
+    torch.set_num_threads(num_threads)
+    _worker_barrier = barrier
+    _worker_handler = handler_factory(model_path, device="cpu")
+
+
+def _cpu_worker_txt_to_img(text_to_image: TextToImage) -> List[Image.Image]:
+    return _worker_handler.txt_to_img(text_to_image)
+
+
+def _load_models(handler: StableDiffusionHandler, model_paths: List[str]) -> List[dict]:
+    reports = []
+    for model_path in model_paths:
+        handler.load_model(model_path)
+        reports.append(dict(handler.startup_report))
+    return reports
+
+
+def _cpu_worker_load_models(model_paths: List[str]) -> List[dict]:
+    try:
+        reports = _load_models(_worker_handler, model_paths)
+    except Exception:
+        # Release the workers waiting for this one, their preload fails too
+        _worker_barrier.abort()
+        raise
+    # Hold this worker until every other one has taken a preload task too
+    _worker_barrier.wait()
+    return reports
+
+
+class DevicePool:
+    """
+    Pool of StableDiffusionHandler replicas, one per GPU or per CPU worker process.
+
+    Prompts are dispatched to whichever replica is free and the results are returned
+    in the order of the prompts.
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        devices: Optional[List[str]] = None,
+        num_cpu_workers: int = 1,
+        handler_factory: Callable[..., StableDiffusionHandler] = None,
+    ) -> None:
+        """
+        Initialize the DevicePool.
+
+        Args:
+            model_path (str): Model each replica starts with.
+            devices (Optional[List[str]]): Devices to create one replica on each. When empty,
+                `num_cpu_workers` CPU worker processes are used instead.
+            num_cpu_workers (int): Number of CPU worker processes when there are no devices.
+            handler_factory (Callable[..., StableDiffusionHandler], optional): Callable taking a
+                model path and a device and returning a handler. It must be picklable for CPU
+                workers. Defaults to StableDiffusionHandler.
+        """
+        handler_factory = handler_factory or StableDiffusionHandler
+        self.devices = list(devices or [])
+        if self.devices:
+            logger.info(f"Creating handler replicas on {self.devices}")
+            self._handlers = [
+                handler_factory(model_path, device=device) for device in self.devices
+            ]
+            self._replicas = queue.Queue()
+            for handler in self._handlers:
+                self._replicas.put(handler)
+            self.size = len(self.devices)
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.size, thread_name_prefix="device-pool"
+            )
+        else:
+            if num_cpu_workers < 1:
+                raise ValueError("Number of CPU workers must be greater than 0.")
+            logger.info(f"Creating {num_cpu_workers} CPU worker processes")
+            self.size = num_cpu_workers
+            num_threads = max(1, (os.cpu_count() or 1) // num_cpu_workers)
+            context = multiprocessing.get_context("spawn")
+            self._worker_barrier = context.Barrier(num_cpu_workers)
+            self._executor = ProcessPoolExecutor(
+                max_workers=num_cpu_workers,
+                mp_context=context,
+                initializer=_init_cpu_worker,
+                initargs=(
+                    handler_factory,
+                    model_path,
+                    num_threads,
+                    self._worker_barrier,
+                ),
+            )
+        self._preload_lock = threading.Lock()
+
+    def _device_txt_to_img(self, text_to_image: TextToImage) -> List[Image.Image]:
+        handler = self._replicas.get()
+        try:
+            return handler.txt_to_img(text_to_image)
+        finally:
+            self._replicas.put(handler)
+
+    def map(self, text_to_images: List[TextToImage]) -> List[List[Image.Image]]:
+        """
+        Generate images for several prompts across the replicas.
+
+        Args:
+            text_to_images (List[TextToImage]): The prompts to generate.
+
+        Returns:
+            List[List[Image.Image]]: The images of each prompt, in the order of the prompts.
+        """
+        logger.info(
+            f"Dispatching {len(text_to_images)} prompts to {self.size} replicas"
+        )
+        futures = [self.submit(text_to_image) for text_to_image in text_to_images]
+        return [future.result() for future in futures]
+
+    def preload(self, model_paths: List[str]) -> List[dict]:
+        """
+        Load models on every replica, in order, so the last one stays active.
+
+        CPU worker processes are started and load their model on their first task, so
+        this is what makes them ready to serve.
+
+        Args:
+            model_paths (List[str]): The models to load.
+
+        Returns:
+            List[dict]: The startup report of each model on each replica, by replica.
+
+        Raises:
+            Exception: The error of a replica that failed to load a model.
+        """
+        logger.info(f"Loading {model_paths} on {self.size} replicas")
+        with self._preload_lock:
+            if self.devices:
+                futures = [
+                    self._executor.submit(_load_models, handler, model_paths)
+                    for handler in self._handlers
+                ]
+            else:
+                # Left broken by a failed preload
+                self._worker_barrier.reset()
+                futures = [
+                    self._executor.submit(_cpu_worker_load_models, model_paths)
+                    for _ in range(self.size)
+                ]
+            wait(futures)
+            errors = [future.exception() for future in futures if future.exception()]
+            if errors:
+                # Raise why a replica failed rather than why the others were released
+                raise next(
+                    (
+                        error
+                        for error in errors
+                        if not isinstance(error, threading.BrokenBarrierError)
+                    ),
+                    errors[0],
+                )
+            return [report for future in futures for report in future.result()]
+
+    def submit(self, text_to_image: TextToImage) -> Future:
+        """
+        Dispatch a prompt to the next free replica.
+
+        Args:
+            text_to_image (TextToImage): The prompt to generate.
+
+        Returns:
+            Future: Resolves to the images of the prompt.
+        """
+        function = self._device_txt_to_img if self.devices else _cpu_worker_txt_to_img
+        return self._executor.submit(function, text_to_image)
+
+    def close(self) -> None:
+        """
+        Shut down the worker threads or processes.
+        """
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,85 @@
+import threading
+from typing import Callable, Dict, Optional
+
+import torch
+
+from image_generation.core.stable_diffusion import (
+    StableDiffusionHandler,
+    device_key,
+    select_device,
+)
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Handler Registry")
+
+
+class HandlerRegistry:
+    """
+    Thread-safe registry of StableDiffusionHandler instances, one per device.
+
+    Handlers are created under a lock, so concurrent first requests for the same device
+    wait for a single model load instead of each building their own handler. Devices are
+    registered by their canonical name (see `device_key`), so None, "cuda" and "cuda:0"
+    get the same handler when they are the same device.
+    """
+
+    def __init__(
+        self, handler_factory: Callable[..., StableDiffusionHandler] = None
+    ) -> None:
+        """
+        Initialize the HandlerRegistry.
+
+        Args:
+            handler_factory (Callable[..., StableDiffusionHandler], optional): Callable taking
+                a model path and a device and returning a handler. Defaults to StableDiffusionHandler.
+        """
+        self.handler_factory = handler_factory or StableDiffusionHandler
+        self._handlers: Dict[str, StableDiffusionHandler] = {}
+        # Devices chosen for the devices requested, None being the best available one
+        self._devices: Dict[Optional[str], torch.device] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, model_path: str, device: Optional[str] = None
+    ) -> StableDiffusionHandler:
+        """
+        Get the handler for a device, creating it with the given model if needed.
+
+        Args:
+            model_path (str): Model to load when the handler does not exist yet.
+            device (Optional[str]): Device of the handler. None lets the handler choose the best one.
+
+        Returns:
+            StableDiffusionHandler: The handler for the device.
+        """
+        selected_device = self._devices.get(device)
+        if selected_device is not None:
+            handler = self._handlers.get(device_key(selected_device))
+            if handler is not None:
+                return handler
+        with self._lock:
+            if device not in self._devices:
+                self._devices[device] = select_device(device)
+            selected_device = self._devices[device]
+            key = device_key(selected_device)
+            if key not in self._handlers:
+                logger.info(f"Creating handler for device {key}")
+                self._handlers[key] = self.handler_factory(
+                    model_path, device=selected_device
+                )
+            return self._handlers[key]
+
+    def handlers(self) -> Dict[str, StableDiffusionHandler]:
+        """
+        Returns a snapshot of the registered handlers by device.
+        """
+        with self._lock:
+            return dict(self._handlers)
+
+    def clear(self) -> None:
+        """
+        Remove all the registered handlers.
+        """
+        with self._lock:
+            self._handlers.clear()
+            self._devices.clear()
@@ -0,0 +1,282 @@
+"""
+In-process store of asynchronous generation jobs.
+
+Jobs are run by a small pool of worker threads and their results, zip archives, are
+retained until a time to live after they finish. The store holds a bounded number of
+jobs: finished jobs are evicted oldest first to make room, and results beyond a memory
+budget can spill to disk.
+"""
+
+import contextvars
+import io
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO, Callable, List, Optional
+
+from image_generation.api.models import TextToImage
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Job Store")
+
+
+class JobStatusEnum(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class JobStoreFullError(Exception):
+    """
+    Raised when a job is submitted while the store is full of unfinished jobs.
+    """
+
+
+class Job:
+    """
+    A generation job and its progress.
+    """
+
+    def __init__(self, text_to_images: List[TextToImage]) -> None:
+        self.id = uuid.uuid4().hex
+        self.text_to_images = text_to_images
+        self.status = JobStatusEnum.QUEUED
+        self.num_images = sum(
+            text_to_image.num_images for text_to_image in text_to_images
+        )
+        self.completed_images = 0
+        self.step = 0
+        self.num_steps = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._result: Optional[bytes] = None
+        self._result_path: Optional[Path] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatusEnum.SUCCEEDED, JobStatusEnum.FAILED)
+
+    def record_images(self, images: list) -> None:
+        """
+        Count images as generated, usable as a `txt_to_img` `on_images` callback.
+        """
+        self.completed_images += len(images)
+
+    def record_step(self, step: int, num_steps: int) -> None:
+        """
+        Record the denoising step of the running micro-batch, usable as a `txt_to_img`
+        `on_step` callback.
+        """
+        self.step, self.num_steps = step, num_steps
+
+    def progress(self) -> float:
+        """
+        Fraction of the job done, counting the running micro-batch's steps as a share of
+        one image.
+        """
+        if self.status == JobStatusEnum.SUCCEEDED:
+            return 1.0
+        if self.num_images == 0:
+            return 0.0
+        completed = self.completed_images
+        if self.num_steps and self.completed_images < self.num_images:
+            completed += self.step / self.num_steps
+        return min(completed / self.num_images, 1.0)
+
+    def eta_seconds(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Estimated seconds until the job finishes, from its progress so far.
+
+        Returns:
+            Optional[float]: 0 for finished jobs, None until the running job has progressed.
+        """
+        if self.finished:
+            return 0.0
+        progress = self.progress()
+        if self.started_at is None or progress == 0:
+            return None
+        elapsed = (now or time.time()) - self.started_at
+        return elapsed * (1 - progress) / progress
+
+    def to_dict(self) -> dict:
+        """
+        Status of the job, as reported by the API.
+        """
+        eta_seconds = self.eta_seconds()
+        return {
+            "id": self.id,
+            "status": self.status.value,
+            "num_images": self.num_images,
+            "completed_images": self.completed_images,
+            "progress": round(self.progress(), 4),
+            "eta_seconds": round(eta_seconds, 1) if eta_seconds is not None else None,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+
+
+class JobStore:
+    """
+    Bounded store of jobs, running them on worker threads and retaining their results.
+    """
+
+    def __init__(
+        self,
+        max_jobs: int,
+        ttl_seconds: float,
+        spill_dir: Optional[str] = None,
+        max_memory_bytes: int = 0,
+        num_workers: int = 1,
+    ) -> None:
+        """
+        Initialize the JobStore.
+
+        Args:
+            max_jobs (int): Maximum number of jobs held, finished or not.
+            ttl_seconds (float): Seconds finished jobs and their results are kept.
+            spill_dir (Optional[str]): Directory for results beyond `max_memory_bytes`.
+                Results are all kept in memory when it is not set.
+            max_memory_bytes (int): Memory budget for results when spilling to disk.
+            num_workers (int): Number of jobs running at the same time.
+        """
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.max_memory_bytes = max_memory_bytes
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=num_workers, thread_name_prefix="job-worker"
+        )
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    def submit(
+        self,
+        text_to_images: List[TextToImage],
+        run: Callable[[Job], BinaryIO],
+    ) -> Job:
+        """
+        Create a job and queue it.
+
+        Args:
+            text_to_images (List[TextToImage]): The requests of the job.
+            run (Callable[[Job], BinaryIO]): Generates the job's images, reporting progress
+                on the job, and returns them as a zip archive.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            JobStoreFullError: If the store is full of unfinished jobs.
+        """
+        job = Job(text_to_images)
+        with self._lock:
+            self._evict_expired(time.time())
+            self._make_room()
+            if len(self._jobs) >= self.max_jobs:
+                raise JobStoreFullError(
+                    f"The job store is full with {len(self._jobs)} unfinished jobs"
+                )
+            self._jobs[job.id] = job
+        logger.info(f"Queued job {job.id} with {job.num_images} images")
+        # Run the job in the submitter's context, so its spans join the submitter's trace
+        self._executor.submit(contextvars.copy_context().run, self._run, job, run)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Get a job, None if it does not exist or was evicted.
+        """
+        with self._lock:
+            self._evict_expired(time.time())
+            return self._jobs.get(job_id)
+
+    def result(self, job_id: str) -> Optional[BinaryIO]:
+        """
+        Open the result of a succeeded job, None if it has no result.
+        """
+        with self._lock:
+            self._evict_expired(time.time())
+            job = self._jobs.get(job_id)
+            if job is None or job.status != JobStatusEnum.SUCCEEDED:
+                return None
+            if job._result_path is not None:
+                return open(job._result_path, "rb")
+            return io.BytesIO(job._result)
+
+    def close(self) -> None:
+        """
+        Stop the workers, cancelling the queued jobs.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Job, run: Callable[[Job], BinaryIO]) -> None:
+        job.status = JobStatusEnum.RUNNING
+        job.started_at = time.time()
+        logger.info(f"Running job {job.id}")
+        try:
+            result = run(job).read()
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.finished_at = time.time()
+            job.status = JobStatusEnum.FAILED
+        else:
+            self._store_result(job, result)
+            job.finished_at = time.time()
+            job.status = JobStatusEnum.SUCCEEDED
+            logger.info(f"Job {job.id} succeeded")
+
+    def _store_result(self, job: Job, result: bytes) -> None:
+        with self._lock:
+            spill = (
+                self.spill_dir is not None
+                and self._memory_bytes + len(result) > self.max_memory_bytes
+            )
+            if not spill:
+                job._result = result
+                self._memory_bytes += len(result)
+                return
+        job._result_path = self.spill_dir / f"{job.id}.zip"
+        job._result_path.write_bytes(result)
+
+    def _remove(self, job: Job) -> None:
+        # Must be called with the lock held
+        del self._jobs[job.id]
+        if job._result is not None:
+            self._memory_bytes -= len(job._result)
+            job._result = None
+        if job._result_path is not None:
+            try:
+                os.remove(job._result_path)
+            except OSError as e:
+                logger.warning(f"Could not remove the result of job {job.id}: {e}")
+
+    def _evict_expired(self, now: float) -> None:
+        # Must be called with the lock held
+        finished_jobs = [job for job in self._jobs.values() if job.finished]
+        for job in finished_jobs:
+            if now - job.finished_at > self.ttl_seconds:
+                logger.debug(f"Evicting expired job {job.id}")
+                self._remove(job)
+
+    def _make_room(self) -> None:
+        # Must be called with the lock held. Drops the oldest finished jobs first
+        finished_jobs = [job for job in self._jobs.values() if job.finished]
+        finished_jobs.sort(key=lambda job: job.finished_at)
+        while len(self._jobs) >= self.max_jobs and finished_jobs:
+            job = finished_jobs.pop(0)
+            logger.debug(f"Evicting job {job.id} to make room")
+            self._remove(job)
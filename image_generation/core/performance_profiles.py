@@ -0,0 +1,295 @@
+from enum import Enum
+from typing import Optional
+
+import torch
+from diffusers.models.attention_processor import AttnProcessor2_0
+
+from image_generation import config
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("SD Performance Profiles")
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+GB = 1024**3
+
+
+class PerformanceProfileEnum(Enum):
+    AUTO = "auto"
+    MAX_THROUGHPUT = "max_throughput"
+    BALANCED = "balanced"
+    LOW_MEMORY = "low_memory"
+
+
+class OffloadEnum(Enum):
+    NONE = "none"
+    MODEL = "model"
+    SEQUENTIAL = "sequential"
+
+
+def validate_performance_profile(profile_name: str) -> str:
+    """
+    Check that a performance profile exists.
+
+    Raises:
+        ValueError: If it does not.
+    """
+    valid_profiles = [profile.value for profile in PerformanceProfileEnum]
+    if profile_name not in valid_profiles:
+        raise ValueError(
+            f"{profile_name} is not a valid performance profile. Valid options are: "
+            f"{', '.join(valid_profiles)}"
+        )
+    return profile_name
+
+
+def device_type(device) -> str:
+    """
+    Type of a device ("cpu", "cuda", "mps"...), for torch devices and device names.
+    """
+    return str(device).split(":")[0]
+
+
+def free_device_memory(device: torch.device) -> Optional[int]:
+    """
+    Measure the free memory of an accelerator device.
+
+    Args:
+        device (torch.device): The device.
+
+    Returns:
+        Optional[int]: The free memory in bytes (available RAM for the CPU), or None when it
+            cannot be measured.
+    """
+    try:
+        if device_type(device) == "cpu" and psutil is not None:
+            return psutil.virtual_memory().available
+        if device_type(device) == "cuda":
+            free_memory = torch.cuda.mem_get_info(device)[0]
+            # Memory cached by the allocator is free for this process too
+            cached_memory = torch.cuda.memory_reserved(
+                device
+            ) - torch.cuda.memory_allocated(device)
+            return free_memory + cached_memory
+        if device_type(device) == "mps":
+            return (
+                torch.mps.recommended_max_memory() - torch.mps.driver_allocated_memory()
+            )
+    except Exception as e:
+        logger.debug(f"Could not measure the free memory of {device}: {e}")
+    return None
+
+
+def peak_device_memory(device: torch.device) -> Optional[int]:
+    """
+    Peak memory allocated on an accelerator device by this process.
+
+    Args:
+        device (torch.device): The device.
+
+    Returns:
+        Optional[int]: The peak in bytes on CUDA, the current driver allocation on MPS,
+            None for other devices.
+    """
+    try:
+        if device_type(device) == "cuda":
+            return torch.cuda.max_memory_allocated(device)
+        if device_type(device) == "mps":
+            return torch.mps.driver_allocated_memory()
+    except Exception as e:
+        logger.debug(f"Could not measure the peak memory of {device}: {e}")
+    return None
+
+
+def module_bytes(module) -> int:
+    """
+    Size of the parameters and buffers of a module, 0 for anything that is not one.
+    """
+    if not isinstance(module, torch.nn.Module):
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+def pipeline_weights_bytes(pipe) -> dict:
+    """
+    Size of the weights of each model of a pipeline.
+
+    Args:
+        pipe: The diffusers pipeline.
+
+    Returns:
+        dict: Bytes per component name, only for components that are torch modules.
+    """
+    components = getattr(pipe, "components", None)
+    if not isinstance(components, dict):
+        return {}
+    sizes = {name: module_bytes(module) for name, module in components.items()}
+    return {name: size for name, size in sizes.items() if size > 0}
+
+
+class PerformanceProfileHandler:
+    """
+    Named trade-offs between speed and memory, resolved into pipeline settings.
+    """
+
+    profiles = {
+        PerformanceProfileEnum.MAX_THROUGHPUT.value: {
+            "attention_slicing": False,
+            "sdpa": True,
+            "vae_slicing": False,
+            "vae_tiling": False,
+            "channels_last": True,
+            "offload": OffloadEnum.NONE.value,
+        },
+        PerformanceProfileEnum.BALANCED.value: {
+            "attention_slicing": False,
+            "sdpa": True,
+            "vae_slicing": True,
+            "vae_tiling": False,
+            "channels_last": True,
+            "offload": OffloadEnum.NONE.value,
+        },
+        PerformanceProfileEnum.LOW_MEMORY.value: {
+            "attention_slicing": True,
+            "sdpa": False,
+            "vae_slicing": True,
+            "vae_tiling": False,
+            "channels_last": False,
+            "offload": OffloadEnum.NONE.value,
+        },
+    }
+
+    @classmethod
+    def select_profile(
+        cls, free_memory: Optional[int], weights_bytes: int
+    ) -> PerformanceProfileEnum:
+        """
+        Pick the fastest profile that fits in the memory left once the weights are loaded.
+
+        Args:
+            free_memory (Optional[int]): Free device memory in bytes, None if unknown.
+            weights_bytes (int): Size of the pipeline's weights.
+
+        Returns:
+            PerformanceProfileEnum: The profile, low_memory when the memory is unknown.
+        """
+        if free_memory is None:
+            return PerformanceProfileEnum.LOW_MEMORY
+        headroom = free_memory - weights_bytes
+        if headroom >= config.MAX_THROUGHPUT_HEADROOM_GB * GB:
+            return PerformanceProfileEnum.MAX_THROUGHPUT
+        if headroom >= config.BALANCED_HEADROOM_GB * GB:
+            return PerformanceProfileEnum.BALANCED
+        return PerformanceProfileEnum.LOW_MEMORY
+
+    @classmethod
+    def resolve(
+        cls,
+        profile_name: Optional[str],
+        device: torch.device,
+        free_memory: Optional[int],
+        component_bytes: dict,
+    ) -> dict:
+        """
+        Resolve a profile into the settings to apply to a pipeline.
+
+        Args:
+            profile_name (Optional[str]): Name of the profile, None or "auto" to choose by memory.
+            device (torch.device): Device the pipeline runs on.
+            free_memory (Optional[int]): Free device memory in bytes, None if unknown.
+            component_bytes (dict): Size of the weights of each model of the pipeline.
+
+        Returns:
+            dict: The requested and resolved profile, the measured memory and the settings.
+
+        Raises:
+            ValueError: If the profile name is not valid.
+        """
+        profile_name = validate_performance_profile(
+            profile_name or PerformanceProfileEnum.AUTO.value
+        )
+        weights_bytes = sum(component_bytes.values())
+        if profile_name == PerformanceProfileEnum.AUTO.value:
+            profile = cls.select_profile(free_memory, weights_bytes).value
+        else:
+            profile = profile_name
+        settings = dict(cls.profiles[profile])
+
+        if device_type(device) == "cpu":
+            # Weights stay resident in RAM: offloading only saves accelerator memory
+            settings.update(offload=OffloadEnum.NONE.value, channels_last=True)
+        elif free_memory is not None and free_memory < weights_bytes:
+            # The whole pipeline does not fit: keep only the running model on the device,
+            # or only the running layer when even the largest model does not fit
+            largest_model_bytes = max(component_bytes.values(), default=0)
+            settings["offload"] = (
+                OffloadEnum.MODEL.value
+                if free_memory >= largest_model_bytes
+                else OffloadEnum.SEQUENTIAL.value
+            )
+            settings.update(vae_slicing=True, vae_tiling=True)
+
+        return {
+            "requested_profile": profile_name,
+            "profile": profile,
+            "free_memory_bytes": free_memory,
+            "weights_bytes": weights_bytes,
+            **settings,
+        }
+
+    @classmethod
+    def apply(cls, pipe, device: torch.device, settings: dict, previous: dict = None):
+        """
+        Apply resolved settings to a pipeline.
+
+        Args:
+            pipe: The diffusers pipeline, freshly loaded when `previous` is None.
+            device (torch.device): Device the pipeline runs on.
+            settings (dict): Settings returned by `resolve`.
+            previous (dict, optional): Settings currently applied to the pipeline. They must
+                have the same offload mode, changing it requires reloading the pipeline.
+        """
+        previous = previous or {}
+        if not previous:
+            offload = settings["offload"]
+            if offload == OffloadEnum.SEQUENTIAL.value:
+                pipe.enable_sequential_cpu_offload(device=device)
+            elif offload == OffloadEnum.MODEL.value:
+                pipe.enable_model_cpu_offload(device=device)
+            else:
+                pipe.to(device)
+
+        unet = getattr(pipe, "unet", None)
+        if settings["attention_slicing"]:
+            pipe.enable_attention_slicing(1)
+        elif unet is not None:
+            # Setting the processor also replaces any sliced attention
+            if settings["sdpa"]:
+                unet.set_attn_processor(AttnProcessor2_0())
+            else:
+                unet.set_default_attn_processor()
+
+        vae = getattr(pipe, "vae", None)
+        if vae is not None:
+            if settings["vae_slicing"]:
+                vae.enable_slicing()
+            elif previous.get("vae_slicing"):
+                vae.disable_slicing()
+            if settings["vae_tiling"]:
+                vae.enable_tiling()
+            elif previous.get("vae_tiling"):
+                vae.disable_tiling()
+
+        if unet is not None and settings["channels_last"] != previous.get(
+            "channels_last", False
+        ):
+            memory_format = (
+                torch.channels_last
+                if settings["channels_last"]
+                else torch.contiguous_format
+            )
+            unet.to(memory_format=memory_format)
@@ -4,20 +4,11 @@ import random
 import re
 from collections import Counter
 from fractions import Fraction
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 
-from image_generation.core.styles import (
-    actions,
-    adjectives,
-    characters,
-    contexts,
-    creatures,
-    objects,
-    settings,
-    themes,
-)
+from image_generation.core.style_registry import STYLES, StyleRegistry, parse_template
 from image_generation.custom_logging import set_logger
 
 logger = set_logger("Prompt Crafter")
@@ -39,16 +30,7 @@ class PromptCrafter:
         logger.info("Initializing PromptCrafter...")
         self.styles = styles
         if variables is None:
-            self.original_variables = {
-                "characters": characters,
-                "settings": settings,
-                "objects": objects,
-                "creatures": creatures,
-                "contexts": contexts,
-                "adjectives": adjectives,
-                "themes": themes,
-                "actions": actions,
-            }
+            self.original_variables = STYLES.variables
         else:
             self.original_variables = variables
         self.variables = {
@@ -188,6 +170,48 @@ class PromptCrafter:
         logger.debug(f"Filled prompt: {prompt}")
         return prompt
 
+    def fill_template(self, pairs: List[Tuple[str, Optional[str]]]) -> str:
+        """
+        Fill the placeholders of a parsed prompt template with random values from the variable pools.
+
+        Values are drawn as `fill_placeholder` does, so a seeded crafter fills the same prompts.
+
+        Args:
+            pairs (List[Tuple[str, Optional[str]]]): The template, parsed by `parse_template`.
+
+        Returns:
+            str: The filled prompt string.
+        """
+        placeholders = {placeholder for _, placeholder in pairs}
+        values = {}
+        for var in self.variables.keys():
+            singular = var[:-1]
+            if singular in placeholders:
+                if len(self.variables[var]) == 0:
+                    self.refill_and_shuffle(var)
+                values[singular] = self.variables[var].pop()
+            if var in placeholders:
+                choices = []
+                sample_size = min(
+                    len(self.original_variables[var]), random.randint(2, 4)
+                )
+                for _ in range(sample_size):
+                    if len(self.variables[var]) == 0:
+                        self.refill_and_shuffle(var)
+                    choices.append(self.variables[var].pop())
+                values[var] = ", ".join(choices)
+        filled_prompt = "".join(
+            literal
+            + (
+                values.get(placeholder, "{" + placeholder + "}")
+                if placeholder is not None
+                else ""
+            )
+            for literal, placeholder in pairs
+        )
+        logger.debug(f"Filled prompt: {filled_prompt}")
+        return filled_prompt
+
     def calculate_unique_combinations(self, prompt: str) -> int:
         """
         Calculate the number of unique combinations based on a given prompt string.
@@ -275,6 +299,10 @@ class PromptCrafter:
             raise ValueError(f"'{style_key}' is not a valid style key.")
 
         style_templates = self.styles[style_key]
+        if isinstance(self.styles, StyleRegistry):
+            template_pairs = self.styles.template_pairs(style_key)
+        else:
+            template_pairs = {}
 
         prompts = self.evenly_random_sample(style_templates, num_images)
 
@@ -298,16 +326,15 @@ class PromptCrafter:
                 logger.warning(
                     f"Warning: Not enough unique combinations for template '{positive_prompt}': {unique_combinations}. Duplicates will be allowed."
                 )
+            pairs = template_pairs.get(positive_prompt) or parse_template(
+                positive_prompt
+            )
             for prompt in prompts:
                 new_prompt = copy.deepcopy(prompt)
                 iterations = 0
                 filled_prompt = copy.deepcopy(new_prompt["prompt"]["positive"])
                 while iterations < unique_combinations:
-                    filled_prompt = copy.deepcopy(new_prompt["prompt"]["positive"])
-                    for var in self.variables.keys():
-                        filled_prompt = self.fill_placeholder(
-                            filled_prompt, var, f"{{{var[:-1]}}}", f"{{{var}}}"
-                        )
+                    filled_prompt = self.fill_template(pairs)
                     iterations += 1
                     if (
                         filled_prompt not in unique_prompts[positive_prompt]
@@ -327,8 +354,6 @@ class PromptCrafter:
 if __name__ == "__main__":
     from rich import print
 
-    from image_generation.core.styles import STYLES
-
     prompt_crafter = PromptCrafter(STYLES)
     prompt_crafter.set_seed(42)
 
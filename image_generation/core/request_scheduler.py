@@ -0,0 +1,211 @@
+"""
+Priority and fair-share scheduling of generation work.
+
+Every request is split into prompt-level work items, and each item waits for a turn on
+the devices before running. Turns go to the highest priority class first and, within a
+class, to the client that has received the least work relative to its weight (weighted
+fair queuing on a virtual time). A long text_to_style batch therefore yields to an
+interactive request at its next prompt boundary.
+"""
+
+import itertools
+import threading
+import time
+from enum import Enum
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Request Scheduler")
+
+T = TypeVar("T")
+
+
+class PriorityClassEnum(Enum):
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+
+# Classes in the order they are served
+PRIORITY_ORDER = [PriorityClassEnum.INTERACTIVE.value, PriorityClassEnum.BATCH.value]
+
+
+def validate_priority_class(priority_class: str) -> str:
+    """
+    Check that a priority class exists.
+
+    Raises:
+        ValueError: If it does not.
+    """
+    if priority_class not in PRIORITY_ORDER:
+        raise ValueError(
+            f"{priority_class} is not a valid priority class. Valid options are: "
+            f"{', '.join(PRIORITY_ORDER)}"
+        )
+    return priority_class
+
+
+def parse_client_weights(weights: List[str]) -> Dict[str, float]:
+    """
+    Parse client weights written as "client=weight".
+
+    Raises:
+        ValueError: If a weight is malformed or not positive.
+    """
+    client_weights = {}
+    for entry in weights:
+        client_id, _, weight = entry.partition("=")
+        try:
+            weight = float(weight)
+        except ValueError:
+            weight = 0.0
+        if not client_id.strip() or weight <= 0:
+            raise ValueError(
+                f"Invalid client weight {entry}, expected client=weight with a positive weight"
+            )
+        client_weights[client_id.strip()] = weight
+    return client_weights
+
+
+class _Ticket:
+    def __init__(self, sequence: int, priority_class: str, client_id: str, cost: float):
+        self.sequence = sequence
+        self.priority_class = priority_class
+        self.client_id = client_id
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+
+
+class RequestScheduler:
+    """
+    Gives work items turns on a fixed number of execution slots.
+    """
+
+    def __init__(
+        self, capacity: int = 1, client_weights: Optional[Dict[str, float]] = None
+    ) -> None:
+        """
+        Initialize the RequestScheduler.
+
+        Args:
+            capacity (int): Number of work items running at the same time, one per device.
+            client_weights (Optional[Dict[str, float]]): Share of each client within a
+                priority class. Clients not listed weigh 1.
+        """
+        self.capacity = capacity
+        self.client_weights = client_weights or {}
+        self._waiting: List[_Ticket] = []
+        self._running = 0
+        self._running_per_class = {name: 0 for name in PRIORITY_ORDER}
+        # Work received by each client, divided by its weight
+        self._virtual_times: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+        self._wait_stats = {
+            name: {"dispatched": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for name in PRIORITY_ORDER
+        }
+        self._condition = threading.Condition()
+
+    def run(
+        self,
+        work: Callable[[], T],
+        priority_class: str = PriorityClassEnum.INTERACTIVE.value,
+        client_id: str = "default",
+        cost: float = 1.0,
+    ) -> T:
+        """
+        Wait for a turn and run a work item.
+
+        Args:
+            work (Callable[[], T]): The work item.
+            priority_class (str): Priority class of the item.
+            client_id (str): Client the item belongs to.
+            cost (float): Amount of work of the item, e.g. images times steps.
+
+        Returns:
+            T: The result of the work item.
+
+        Raises:
+            ValueError: If the priority class does not exist.
+        """
+        ticket = self._enqueue(validate_priority_class(priority_class), client_id, cost)
+        self._wait_for_turn(ticket)
+        try:
+            return work()
+        finally:
+            with self._condition:
+                self._running -= 1
+                self._running_per_class[ticket.priority_class] -= 1
+                self._condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Queue length, running items and wait times of each priority class.
+        """
+        with self._condition:
+            stats = {}
+            for name in PRIORITY_ORDER:
+                wait_stats = self._wait_stats[name]
+                dispatched = wait_stats["dispatched"]
+                stats[name] = {
+                    "queued": sum(
+                        1 for ticket in self._waiting if ticket.priority_class == name
+                    ),
+                    "running": self._running_per_class[name],
+                    "dispatched": dispatched,
+                    "mean_wait_seconds": (
+                        wait_stats["total_wait_seconds"] / dispatched
+                        if dispatched
+                        else 0.0
+                    ),
+                    "max_wait_seconds": wait_stats["max_wait_seconds"],
+                }
+            return stats
+
+    def _enqueue(self, priority_class: str, client_id: str, cost: float) -> _Ticket:
+        with self._condition:
+            if not any(ticket.client_id == client_id for ticket in self._waiting):
+                # A client becoming active starts at the current virtual time, so idle
+                # periods do not build up credit over the active clients
+                self._virtual_times[client_id] = max(
+                    self._virtual_times.get(client_id, 0.0), self._virtual_time
+                )
+            ticket = _Ticket(next(self._sequence), priority_class, client_id, cost)
+            self._waiting.append(ticket)
+            return ticket
+
+    def _next_ticket(self) -> _Ticket:
+        return min(
+            self._waiting,
+            key=lambda ticket: (
+                PRIORITY_ORDER.index(ticket.priority_class),
+                self._virtual_times[ticket.client_id],
+                ticket.sequence,
+            ),
+        )
+
+    def _wait_for_turn(self, ticket: _Ticket) -> None:
+        with self._condition:
+            while self._running >= self.capacity or self._next_ticket() is not ticket:
+                self._condition.wait()
+            self._waiting.remove(ticket)
+            self._running += 1
+            self._running_per_class[ticket.priority_class] += 1
+            self._virtual_time = self._virtual_times[ticket.client_id]
+            self._virtual_times[
+                ticket.client_id
+            ] += ticket.cost / self.client_weights.get(ticket.client_id, 1.0)
+            wait_seconds = time.monotonic() - ticket.enqueued_at
+            wait_stats = self._wait_stats[ticket.priority_class]
+            wait_stats["dispatched"] += 1
+            wait_stats["total_wait_seconds"] += wait_seconds
+            wait_stats["max_wait_seconds"] = max(
+                wait_stats["max_wait_seconds"], wait_seconds
+            )
+            # Other waiters may be next now
+            self._condition.notify_all()
+        logger.debug(
+            f"Dispatched {ticket.priority_class} work of {ticket.client_id} after "
+            f"{wait_seconds:.3f}s"
+        )
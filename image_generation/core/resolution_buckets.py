@@ -0,0 +1,112 @@
+"""
+Resolution buckets for shape-stable execution.
+
+Compiled graphs are specialized to the shapes they were traced with, so every new
+resolution recompiles. When buckets are configured, requests are generated at the
+closest bucket that covers them and the images are cropped back to the requested size.
+"""
+
+from typing import List, Tuple
+
+from PIL import Image
+
+# Latents are 8 times smaller than the images
+SIZE_MULTIPLE = 8
+
+
+def validate_size(size: int) -> int:
+    """
+    Validate an image height or width.
+
+    Raises:
+        ValueError: If the size is not a positive multiple of 8.
+    """
+    if size <= 0 or size % SIZE_MULTIPLE != 0:
+        raise ValueError(
+            f"Image sizes must be multiples of {SIZE_MULTIPLE}, not {size}"
+        )
+    return size
+
+
+def parse_buckets(buckets: List[str]) -> List[Tuple[int, int]]:
+    """
+    Parse resolution buckets written as "HEIGHTxWIDTH".
+
+    Args:
+        buckets (List[str]): The buckets, e.g. ["688x512", "1024x1024"].
+
+    Returns:
+        List[Tuple[int, int]]: The (height, width) of each bucket.
+
+    Raises:
+        ValueError: If a bucket is malformed or its sizes are not multiples of 8.
+    """
+    parsed_buckets = []
+    for bucket in buckets:
+        try:
+            height, width = (int(size) for size in bucket.lower().split("x"))
+        except ValueError:
+            raise ValueError(
+                f"Invalid resolution bucket {bucket}, expected HEIGHTxWIDTH"
+            )
+        parsed_buckets.append((validate_size(height), validate_size(width)))
+    return parsed_buckets
+
+
+def snap_to_bucket(
+    height: int, width: int, buckets: List[Tuple[int, int]]
+) -> Tuple[int, int]:
+    """
+    Choose the resolution to generate a requested size at.
+
+    The smallest bucket covering the request is used, preferring the closest aspect ratio
+    among buckets of the same area. When no bucket covers it, the largest bucket with the
+    closest aspect ratio is used.
+
+    Args:
+        height (int): Requested height.
+        width (int): Requested width.
+        buckets (List[Tuple[int, int]]): The (height, width) buckets, may be empty.
+
+    Returns:
+        Tuple[int, int]: The (height, width) to generate at, the request itself without buckets.
+    """
+    if not buckets or (height, width) in buckets:
+        return height, width
+    aspect_ratio = height / width
+
+    def aspect_ratio_distance(bucket):
+        return abs(bucket[0] / bucket[1] - aspect_ratio)
+
+    covering = [b for b in buckets if b[0] >= height and b[1] >= width]
+    if covering:
+        return min(covering, key=lambda b: (b[0] * b[1], aspect_ratio_distance(b)))
+    return min(buckets, key=lambda b: (aspect_ratio_distance(b), -b[0] * b[1]))
+
+
+def fit_to_size(image: Image.Image, height: int, width: int) -> Image.Image:
+    """
+    Fit an image generated at a bucket resolution to the requested size.
+
+    The image is scaled to cover the requested size, keeping its aspect ratio, and the
+    excess is cropped evenly from both sides.
+
+    Args:
+        image (Image.Image): The generated image.
+        height (int): Requested height.
+        width (int): Requested width.
+
+    Returns:
+        Image.Image: The image at the requested size.
+    """
+    if image.size == (width, height):
+        return image
+    scale = max(width / image.width, height / image.height)
+    if scale != 1:
+        image = image.resize(
+            (round(image.width * scale), round(image.height * scale)),
+            Image.LANCZOS,
+        )
+    left = (image.width - width) // 2
+    top = (image.height - height) // 2
+    return image.crop((left, top, left + width, top + height))
@@ -0,0 +1,309 @@
+"""
+Content-addressed cache of generated images.
+
+Requests with a fixed seed are deterministic: the same model, scheduler, prompt, size,
+steps and guidance always produce the same images on the same kind of device, dtype and
+resolution buckets. Their images are stored under the hash of the canonical request and
+of that environment, in a size-bounded local disk tier with least recently used
+eviction, and optionally in a blob storage tier shared between workers.
+"""
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional
+
+from diffusers.utils.hub_utils import extract_commit_hash
+from huggingface_hub import try_to_load_from_cache
+from PIL import Image
+
+from image_generation import config
+from image_generation.api.models import TextToImage
+from image_generation.core.resolution_buckets import parse_buckets
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Result Cache")
+
+CACHE_FORMAT_VERSION = 3
+
+
+def model_revision(model_path: str) -> Optional[str]:
+    """
+    The commit of the Hugging Face cache snapshot of a model.
+
+    Args:
+        model_path (str): The model.
+
+    Returns:
+        Optional[str]: The commit hash, or None for models not in the Hugging Face cache.
+    """
+    try:
+        resolved_file = try_to_load_from_cache(model_path, "model_index.json")
+    except Exception:
+        # Local paths are not valid repository ids
+        return None
+    return (
+        extract_commit_hash(resolved_file) if isinstance(resolved_file, str) else None
+    )
+
+
+def request_cache_key(
+    text_to_image: TextToImage, environment: Optional[dict] = None
+) -> str:
+    """
+    Compute the content address of a request.
+
+    The performance profile only changes how the images are computed, not which ones,
+    so it is not part of the address. The decoder changes the images, so it is, with the
+    configured default for requests that do not set one, and so are the resolution
+    buckets and the revision of the model.
+
+    Args:
+        text_to_image (TextToImage): The request.
+        environment (Optional[dict]): What else changes the images of the handler
+            generating them, like its device type and dtype.
+
+    Returns:
+        str: The SHA-256 hex digest of the canonical request.
+    """
+    request = text_to_image.dict(exclude={"performance_profile"})
+    request["decoder"] = text_to_image.decoder or config.DEFAULT_DECODER
+    canonical = json.dumps(
+        {
+            "version": CACHE_FORMAT_VERSION,
+            **request,
+            "resolution_buckets": sorted(parse_buckets(config.RESOLUTION_BUCKETS)),
+            "model_revision": model_revision(text_to_image.model_path),
+            "environment": environment or {},
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(text_to_image: TextToImage) -> bool:
+    """
+    Whether a request is deterministic and can be cached.
+    """
+    return text_to_image.seed is not None and text_to_image.seed != -1
+
+
+def encode_images(images: List[Image.Image]) -> bytes:
+    """
+    Encode images as PNGs stored in an uncompressed zip archive.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zip_file:
+        for index, image in enumerate(images):
+            image_buffer = io.BytesIO()
+            image.save(image_buffer, format="PNG")
+            zip_file.writestr(f"{index}.png", image_buffer.getvalue())
+    return buffer.getvalue()
+
+
+def decode_images(data: bytes) -> List[Image.Image]:
+    """
+    Decode images encoded with `encode_images`.
+    """
+    images = []
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        for name in sorted(zip_file.namelist(), key=lambda n: int(n.split(".")[0])):
+            image = Image.open(io.BytesIO(zip_file.read(name)))
+            image.load()
+            images.append(image)
+    return images
+
+
+class ResultCache:
+    """
+    Two-tier cache mapping request hashes to encoded images.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        blob_storage=None,
+        blob_container: str = "",
+    ) -> None:
+        """
+        Initialize the ResultCache.
+
+        Args:
+            directory (str): Directory of the local disk tier.
+            max_bytes (int): Maximum size of the local disk tier. Least recently used
+                entries are evicted beyond it.
+            blob_storage (BlobStorageInterface, optional): Blob storage of the shared tier.
+            blob_container (str): Container of the shared tier.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.blob_storage = blob_storage
+        self.blob_container = blob_container
+        self._lock = threading.Lock()
+        # Entries in least recently used order, restored from modification times
+        entries = sorted(
+            (path.stat().st_mtime_ns, path.stem, path.stat().st_size)
+            for path in self.directory.glob("*.zip")
+        )
+        self._sizes = OrderedDict((key, size) for _, key, size in entries)
+        logger.info(
+            f"Result cache at {self.directory}: {len(self._sizes)} entries, "
+            f"{sum(self._sizes.values())} bytes"
+        )
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.zip"
+
+    def _blob_name(self, key: str) -> str:
+        return f"result-cache/{key}.zip"
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Get the encoded images of a request hash, from disk or from blob storage.
+
+        Args:
+            key (str): The request hash.
+
+        Returns:
+            Optional[bytes]: The encoded images, or None on a miss.
+        """
+        path = self._path(key)
+        with self._lock:
+            if key in self._sizes:
+                try:
+                    data = path.read_bytes()
+                    os.utime(path)  # Keep the order across restarts
+                    self._sizes.move_to_end(key)
+                    logger.debug(f"Disk cache hit for {key}")
+                    return data
+                except FileNotFoundError:
+                    self._sizes.pop(key, None)
+
+        if self.blob_storage is None:
+            return None
+        try:
+            data = self.blob_storage.get_object(
+                self.blob_container, self._blob_name(key)
+            )
+        except Exception as e:
+            logger.warning(f"Error reading {key} from blob storage: {e}")
+            return None
+        if data is not None:
+            logger.debug(f"Blob cache hit for {key}")
+            self._write(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        Store the encoded images of a request hash on disk and in blob storage.
+
+        Args:
+            key (str): The request hash.
+            data (bytes): The encoded images.
+        """
+        path = self._write(key, data)
+        if self.blob_storage is None or path is None:
+            return
+        try:
+            self.blob_storage.push_objects(
+                self.blob_container,
+                [{"name": self._blob_name(key), "path": str(path)}],
+                overwrite=True,
+            )
+        except Exception as e:
+            logger.warning(f"Error writing {key} to blob storage: {e}")
+
+    def get_images(
+        self, text_to_image: TextToImage, environment: Optional[dict] = None
+    ) -> Optional[List[Image.Image]]:
+        """
+        Get the cached images of a request.
+
+        Args:
+            text_to_image (TextToImage): The request.
+            environment (Optional[dict]): See `request_cache_key`.
+
+        Returns:
+            Optional[List[Image.Image]]: The images, or None on a miss or for non-deterministic requests.
+        """
+        if not is_cacheable(text_to_image):
+            return None
+        data = self.get(request_cache_key(text_to_image, environment))
+        return decode_images(data) if data is not None else None
+
+    def put_images(
+        self,
+        text_to_image: TextToImage,
+        images: List[Image.Image],
+        environment: Optional[dict] = None,
+    ) -> None:
+        """
+        Cache the images of a deterministic request.
+
+        Args:
+            text_to_image (TextToImage): The request.
+            images (List[Image.Image]): The generated images.
+            environment (Optional[dict]): See `request_cache_key`.
+        """
+        if is_cacheable(text_to_image):
+            self.put(
+                request_cache_key(text_to_image, environment), encode_images(images)
+            )
+
+    def _write(self, key: str, data: bytes) -> Optional[Path]:
+        if len(data) > self.max_bytes:
+            logger.debug(f"Not caching {key}: {len(data)} bytes over the cache size")
+            return None
+        path = self._path(key)
+        with self._lock:
+            # Write atomically so concurrent readers never see a partial entry
+            with tempfile.NamedTemporaryFile(
+                dir=self.directory, suffix=".tmp", delete=False
+            ) as f:
+                f.write(data)
+            os.replace(f.name, path)
+            self._sizes[key] = len(data)
+            self._sizes.move_to_end(key)
+            self._evict()
+        return path
+
+    def _evict(self) -> None:
+        total_bytes = sum(self._sizes.values())
+        while total_bytes > self.max_bytes and self._sizes:
+            key, size = self._sizes.popitem(last=False)
+            self._path(key).unlink(missing_ok=True)
+            total_bytes -= size
+            logger.debug(f"Evicted {key} from the result cache")
+
+
+@lru_cache(maxsize=None)
+def default_result_cache() -> Optional[ResultCache]:
+    """
+    The result cache configured through the environment, shared by all handlers.
+
+    Returns:
+        Optional[ResultCache]: The cache, or None when RESULT_CACHE_DIR is not set.
+    """
+    if not config.RESULT_CACHE_DIR:
+        return None
+    blob_storage = None
+    if config.RESULT_CACHE_BLOB_CONTAINER:
+        from cloud_manager.azure_blob_storage import AzureBlobStorage
+
+        blob_storage = AzureBlobStorage(config.AZURE_STORAGE_CONNECTION_STRING)
+    return ResultCache(
+        config.RESULT_CACHE_DIR,
+        config.RESULT_CACHE_MAX_BYTES,
+        blob_storage=blob_storage,
+        blob_container=config.RESULT_CACHE_BLOB_CONTAINER,
+    )
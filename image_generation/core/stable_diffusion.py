@@ -1,70 +1,450 @@
-from typing import Optional
+import gc
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import wait
+from pathlib import Path
+from typing import Callable, List, Optional
 
 import numpy as np
 import torch
-from diffusers import AutoPipelineForText2Image
+from diffusers import (
+    AutoPipelineForText2Image,
+    StableDiffusionPipeline,
+    StableDiffusionXLPipeline,
+)
 
+from image_generation import config, metrics, tracing
 from image_generation.api.models import TextToImage
+from image_generation.core.capacity_planner import (
+    CapacityPlanner,
+    is_out_of_memory_error,
+)
+from image_generation.core.cpu_runtime import (
+    configure_cpu_threads,
+    cpu_dtype,
+    optimize_for_cpu,
+)
+from image_generation.core.decoders import (
+    DecoderEnum,
+    LatentDecoder,
+    load_tiny_decoder,
+    resolve_decoder,
+)
+from image_generation.core.performance_profiles import (
+    OffloadEnum,
+    PerformanceProfileHandler,
+    device_type,
+    free_device_memory,
+    peak_device_memory,
+    pipeline_weights_bytes,
+)
+from image_generation.core.resolution_buckets import (
+    fit_to_size,
+    parse_buckets,
+    snap_to_bucket,
+)
+from image_generation.core.result_cache import ResultCache, default_result_cache
 from image_generation.core.schedulers import SchedulerEnum, SchedulerHandler
+from image_generation.core.step_profiler import StepProfiler
 from image_generation.custom_logging import set_logger
 from image_generation.utils import enough_gpu_memory
 
 logger = set_logger("Stable Diffusion Handler")
 
 
+def select_device(device=None) -> torch.device:
+    """
+    Returns the device to use
+
+    :param device: Device to use (None will choose the best available)
+    :return: The device
+    """
+    if device is not None:
+        return torch.device(device)
+    if torch.backends.mps.is_available():
+        logger.info("Using MPS device")
+        return torch.device("mps")
+    if torch.cuda.is_available() and enough_gpu_memory():
+        logger.info("Using CUDA device")
+        return torch.device("cuda")
+    logger.info("Using CPU device")
+    return torch.device("cpu")
+
+
+def device_key(device) -> str:
+    """
+    Returns the canonical name of a device, with its index, so "cuda" and "cuda:0"
+    are the same device when the current CUDA device is the first one
+
+    :param device: Device, or device name
+    :return: The device type and index, or "cpu"
+    """
+    type_name, _, index = str(device).partition(":")
+    if type_name == "cpu":
+        return type_name
+    if not index:
+        # The current CUDA device is the first one until CUDA is initialized
+        use_current_device = type_name == "cuda" and torch.cuda.is_initialized()
+        index = torch.cuda.current_device() if use_current_device else 0
+    return f"{type_name}:{index}"
+
+
 class StableDiffusionHandler:
-    def __init__(self, model_path: str, device: str = None):
+    # Models already warmed up in this process, as (model_path, device, profile, decoder)
+    _warmed_up = set()
+    # One execution slot per device, shared by every handler using that device
+    _execution_slots = {}
+    _execution_slots_lock = threading.Lock()
+
+    def __init__(
+        self,
+        model_path: str,
+        device: str = None,
+        result_cache: Optional[ResultCache] = None,
+        performance_profile: Optional[str] = None,
+    ):
         """
         Initializes the StableDiffusionHandler
 
         :param model_path: Path to the model
         :param device: Device to use for computations (None will choose the best available)
+        :param result_cache: Cache of deterministic results (None will use the configured one)
+        :param performance_profile: Memory/speed profile (None will use the configured one)
         """
-        if device is None:
-            if torch.backends.mps.is_available():
-                device = torch.device("mps")
-                logger.info("Using MPS device")
-            elif torch.cuda.is_available() and enough_gpu_memory():
-                device = torch.device("cuda")
-                logger.info("Using CUDA device")
-            else:
-                device = torch.device("cpu")
-                logger.info("Using CPU device")
-        else:
-            device = torch.device(device)
+        device = select_device(device)
         self.device = device
-        self._init_model(model_path=model_path)
+        self.result_cache = (
+            result_cache if result_cache is not None else default_result_cache()
+        )
+        self.black_image_retries = 0
+        self.prompt_embeddings = OrderedDict()
+        self.slot = self.execution_slot(device)
+        self.capacity_planner = CapacityPlanner()
         self.scheduler_name = None
+        # Profile of requests that do not ask for one
+        self.default_performance_profile = (
+            performance_profile or config.PERFORMANCE_PROFILE
+        )
+        self.performance_profile = self.default_performance_profile
+        self.last_profile_path = None
+        self.latent_decoder = None
+        with self.slot:
+            self._init_model(model_path=model_path)
+
+    @classmethod
+    def execution_slot(cls, device) -> threading.RLock:
+        """
+        Returns the execution slot of a device.
+
+        Model loading, scheduler changes and inference only happen while holding the
+        slot of the handler's device, so concurrent requests never mutate the pipeline
+        under each other.
+
+        :param device: Device of the slot
+        :return: The lock guarding the device
+        """
+        with cls._execution_slots_lock:
+            return cls._execution_slots.setdefault(
+                device_key(device), threading.RLock()
+            )
+
+    @property
+    def result_cache_environment(self) -> dict:
+        """
+        What changes the images of the handler besides the request, for the result cache
+        """
+        return {
+            "device": device_type(self.device),
+            "dtype": str(self.torch_dtype).replace("torch.", ""),
+        }
+
+    def load_model(self, model_path: str):
+        """
+        Loads a model inside the device's execution slot
+
+        :param model_path: Path to the model
+        """
+        with self.slot:
+            if model_path != self.model_path:
+                self._init_model(model_path=model_path)
 
     def _init_model(self, model_path: str):
         """
         Initializes the model
 
         :param model_path: Path to the model
-        :param scheduler_name: Name of the scheduler to use
         """
         logger.info(f"Loading model from {model_path}")
         self.model_path = model_path
-        torch_dtype = (
-            torch.float16 if self.device != torch.device("mps") else torch.float32
+        self.prompt_embeddings.clear()
+        if self.latent_decoder is not None:
+            # The tiny decoder matches the latent space of the previous model
+            self.latent_decoder.close()
+            self.latent_decoder = None
+        if device_type(self.device) == "cpu":
+            self.torch_dtype = cpu_dtype()
+        elif self.device == torch.device("mps"):
+            self.torch_dtype = torch.float32
+        else:
+            self.torch_dtype = torch.float16
+        start_time = time.perf_counter()
+        self.pipe, snapshot_status = self._load_pipeline(model_path, self.torch_dtype)
+        self._configure_pipeline()
+        load_seconds = time.perf_counter() - start_time
+        metrics.MODEL_LOAD_SECONDS.observe(load_seconds, model=model_path)
+
+        start_time = time.perf_counter()
+        warmed_up = self._warm_up()
+        warmup_seconds = time.perf_counter() - start_time
+        if warmed_up:
+            metrics.WARMUP_SECONDS.observe(warmup_seconds, model=model_path)
+
+        self.startup_report = {
+            "model_path": model_path,
+            "device": str(self.device),
+            "snapshot": snapshot_status,
+            "load_seconds": round(load_seconds, 3),
+            "warmed_up": warmed_up,
+            "warmup_seconds": round(warmup_seconds, 3),
+            "performance": self.performance_settings,
+        }
+        if self.cpu_runtime is not None:
+            self.startup_report["cpu_runtime"] = self.cpu_runtime
+        logger.info(f"Model ready: {self.startup_report}")
+        if load_seconds + warmup_seconds > config.STARTUP_BUDGET_SECONDS:
+            logger.warning(
+                f"Loading {model_path} took {load_seconds + warmup_seconds:.1f}s, "
+                f"over the startup budget of {config.STARTUP_BUDGET_SECONDS}s"
+            )
+
+    def _configure_pipeline(self):
+        """
+        Applies the handler's performance profile to a freshly loaded pipeline.
+
+        The profile is resolved against the free device memory, measured once the previous
+        pipeline has been released.
+        """
+        self._release_device_memory()
+        self.performance_settings = PerformanceProfileHandler.resolve(
+            self.performance_profile,
+            self.device,
+            free_device_memory(self.device),
+            pipeline_weights_bytes(self.pipe),
+        )
+        PerformanceProfileHandler.apply(
+            self.pipe, self.device, self.performance_settings
+        )
+        logger.info(f"Performance settings: {self.performance_settings}")
+        self.cpu_runtime = None
+        if device_type(self.device) == "cpu":
+            self.cpu_runtime = {
+                "dtype": str(self.torch_dtype).replace("torch.", ""),
+                "threads": configure_cpu_threads(),
+                "graph_optimization": optimize_for_cpu(self.pipe, self.torch_dtype),
+            }
+            logger.info(f"CPU runtime: {self.cpu_runtime}")
+
+    def _set_performance_profile(self, performance_profile: str):
+        """
+        Switches the performance profile of the loaded pipeline.
+
+        Slicing, tiling, attention and memory format are changed in place. A different
+        offload mode needs the weights back on the CPU, so the model is reloaded.
+
+        :param performance_profile: Name of the profile
+        """
+        component_bytes = pipeline_weights_bytes(self.pipe)
+        free_memory = free_device_memory(self.device)
+        if (
+            free_memory is not None
+            and self.performance_settings["offload"] == OffloadEnum.NONE.value
+        ):
+            # The weights already on the device are available to the new settings
+            free_memory += sum(component_bytes.values())
+        settings = PerformanceProfileHandler.resolve(
+            performance_profile, self.device, free_memory, component_bytes
+        )
+        self.performance_profile = performance_profile
+        if settings["offload"] != self.performance_settings["offload"]:
+            logger.info(f"Reloading {self.model_path} to change the offload mode")
+            self._init_model(model_path=self.model_path)
+            return
+        PerformanceProfileHandler.apply(
+            self.pipe, self.device, settings, previous=self.performance_settings
+        )
+        self.performance_settings = settings
+        self.startup_report["performance"] = settings
+        logger.info(f"Performance settings: {settings}")
+
+    def _batch_size(self, shape: tuple, num_images: int, guidance_scale: float) -> int:
+        """
+        Returns how many of the remaining images to generate in the next pipeline call
+
+        :param shape: Request shape, as (model_path, height, width, guidance)
+        :param num_images: Number of images still to generate
+        :param guidance_scale: Guidance scale of the request
+        :return: The micro-batch size
+        """
+        dtype = getattr(self.pipe, "dtype", None)
+        return self.capacity_planner.max_batch_size(
+            shape,
+            num_images,
+            free_device_memory(self.device),
+            self.unet_batch_size(1, guidance_scale),
+            bytes_per_element=dtype.itemsize if isinstance(dtype, torch.dtype) else 2,
+            vae_slicing=self.performance_settings["vae_slicing"],
+            vae_tiling=self.performance_settings["vae_tiling"],
         )
-        self.pipe = AutoPipelineForText2Image.from_pretrained(
+
+    def _latent_decoder(self, decoder_name: Optional[str]) -> Optional[LatentDecoder]:
+        """
+        Returns the decoder of the latents for a request's decoder mode
+
+        :param decoder_name: Decoder of the request (None will use the configured one)
+        :return: The latent decoder, or None when the pipeline decodes the images itself
+        """
+        if resolve_decoder(decoder_name) == DecoderEnum.VAE.value:
+            return None
+        if not isinstance(
+            self.pipe, (StableDiffusionPipeline, StableDiffusionXLPipeline)
+        ):
+            logger.warning(f"No tiny decoder for {self.model_path}, using its VAE")
+            return None
+        if self.latent_decoder is None:
+            self.latent_decoder = LatentDecoder(
+                load_tiny_decoder(self.pipe, self.device, self.torch_dtype),
+                self.pipe.image_processor,
+                self.device,
+            )
+        return self.latent_decoder
+
+    def _release_device_memory(self):
+        """
+        Returns the memory cached by the allocator to the device
+        """
+        gc.collect()
+        if device_type(self.device) == "cuda":
+            torch.cuda.empty_cache()
+
+    def _snapshot_path(self, model_path: str, torch_dtype: torch.dtype) -> Path:
+        """
+        Returns the local snapshot directory for a model and dtype
+
+        :param model_path: Path to the model
+        :param torch_dtype: Data type the weights are stored in
+        :return: The snapshot directory
+        """
+        dtype_name = str(torch_dtype).replace("torch.", "")
+        snapshot_name = f"{model_path.strip('/').replace('/', '--')}--{dtype_name}"
+        return Path(config.PIPELINE_SNAPSHOT_DIR) / snapshot_name
+
+    def _load_pipeline(self, model_path: str, torch_dtype: torch.dtype):
+        """
+        Loads the pipeline, from the local snapshot cache when available.
+
+        Weights are safetensors, memory-mapped and loaded straight to the target dtype.
+        When the snapshot cache is enabled and the model is not cached yet, the loaded
+        pipeline is saved to it so the next start does not resolve or convert anything.
+
+        :param model_path: Path to the model
+        :param torch_dtype: Data type to load the weights in
+        :return: The pipeline and the snapshot status ("disabled", "hit" or "miss")
+        """
+        if not config.PIPELINE_SNAPSHOT_DIR:
+            pipe = AutoPipelineForText2Image.from_pretrained(
+                model_path,
+                torch_dtype=torch_dtype,
+                variant="fp16",
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            )
+            return pipe, "disabled"
+
+        snapshot_path = self._snapshot_path(model_path, torch_dtype)
+        if (snapshot_path / "model_index.json").exists():
+            logger.info(f"Loading pipeline snapshot from {snapshot_path}")
+            pipe = AutoPipelineForText2Image.from_pretrained(
+                snapshot_path,
+                torch_dtype=torch_dtype,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+                local_files_only=True,
+            )
+            return pipe, "hit"
+
+        pipe = AutoPipelineForText2Image.from_pretrained(
             model_path,
             torch_dtype=torch_dtype,
             variant="fp16",
             use_safetensors=True,
+            low_cpu_mem_usage=True,
         )
-        # Recommended if computer has < 16 GB of RAM
-        if self.device == torch.device("cpu"):
-            self.pipe.enable_sequential_cpu_offload()
-            self.pipe.enable_attention_slicing(1)
-        else:
-            self.pipe.to(self.device)
-            self.pipe.enable_attention_slicing(1)
-            self.pipe.enable_vae_slicing()
-        # Warm up the model
-        logger.info("Warming up model")
-        self.pipe("", num_inference_steps=1)
+        # Save to a temporary directory of this loader first, so neither a crash nor
+        # another loader saving the same model ever leaves a partial snapshot
+        temporary_path = None
+        try:
+            snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = Path(
+                tempfile.mkdtemp(
+                    prefix=f".{snapshot_path.name}.", dir=snapshot_path.parent
+                )
+            )
+            pipe.save_pretrained(temporary_path, safe_serialization=True)
+            try:
+                temporary_path.rename(snapshot_path)
+                logger.info(f"Saved pipeline snapshot to {snapshot_path}")
+            except OSError:
+                if not (snapshot_path / "model_index.json").exists():
+                    raise
+                # Another loader saved the snapshot first
+                shutil.rmtree(temporary_path, ignore_errors=True)
+        except Exception as e:
+            if temporary_path is not None:
+                shutil.rmtree(temporary_path, ignore_errors=True)
+            logger.warning(f"Could not save pipeline snapshot to {snapshot_path}: {e}")
+        return pipe, "miss"
+
+    def _warm_up(self) -> bool:
+        """
+        Warms up the model at the production resolution, through the components real
+        requests use: the configured performance profile, already applied to the
+        pipeline, and the configured decoder.
+
+        Each combination is only warmed up once per device and process, so switching back
+        to a model that has already been used does not pay for the warm-up again.
+
+        :return: Whether a warm-up was run
+        """
+        decoder_name = resolve_decoder(None)
+        warmup_key = (
+            self.model_path,
+            str(self.device),
+            self.performance_profile,
+            decoder_name,
+        )
+        if not config.WARMUP_ENABLED or warmup_key in self._warmed_up:
+            return False
+        logger.info(
+            f"Warming up model with the {self.performance_profile} profile and the "
+            f"{decoder_name} decoder"
+        )
+        latent_decoder = self._latent_decoder(decoder_name)
+        arguments = {"output_type": "latent"} if latent_decoder is not None else {}
+        output = self.pipe(
+            "",
+            height=config.WARMUP_HEIGHT,
+            width=config.WARMUP_WIDTH,
+            guidance_scale=config.WARMUP_GUIDANCE_SCALE,
+            num_inference_steps=1,
+            **arguments,
+        )
+        if latent_decoder is not None:
+            latent_decoder.submit(output.images).result()
+        self._warmed_up.add(warmup_key)
+        return True
 
     def _set_scheduler(self, scheduler_name: SchedulerEnum):
         self.pipe.scheduler = SchedulerHandler.set_scheduler(
@@ -85,6 +465,152 @@ class StableDiffusionHandler:
         generator = generator.manual_seed(seed)
         return generator
 
+    def _image_generators(
+        self, seed: Optional[int], first_image: int, num_images: int
+    ) -> Optional[List[torch.Generator]]:
+        """
+        Returns one generator per image of a micro-batch, seeded with the request seed
+        plus the index of the image in the request, so a seeded request gives the same
+        images however it is split into micro-batches
+
+        :param seed: Seed of the request
+        :param first_image: Index in the request of the first image of the micro-batch
+        :param num_images: Number of images of the micro-batch
+        :return: The generators, or None for unseeded requests
+        """
+        if seed == -1 or seed is None:
+            return None
+        return [
+            self._set_seed(seed + index)
+            for index in range(first_image, first_image + num_images)
+        ]
+
+    def _encode_text(self, text: str) -> tuple:
+        """
+        Encodes a text with the pipeline's text encoders, caching the result
+
+        :param text: Text to encode
+        :return: The text embeddings and, for SDXL, the pooled text embeddings (None otherwise)
+        """
+        key = (self.model_path, text)
+        if key in self.prompt_embeddings:
+            self.prompt_embeddings.move_to_end(key)
+            return self.prompt_embeddings[key]
+        with torch.no_grad():
+            if isinstance(self.pipe, StableDiffusionXLPipeline):
+                embeds, _, pooled_embeds, _ = self.pipe.encode_prompt(
+                    prompt=text,
+                    device=self.pipe._execution_device,
+                    num_images_per_prompt=1,
+                    do_classifier_free_guidance=False,
+                )
+            else:
+                embeds, _ = self.pipe.encode_prompt(
+                    prompt=text,
+                    device=self.pipe._execution_device,
+                    num_images_per_prompt=1,
+                    do_classifier_free_guidance=False,
+                )
+                pooled_embeds = None
+        self.prompt_embeddings[key] = (embeds, pooled_embeds)
+        while len(self.prompt_embeddings) > config.PROMPT_EMBEDDING_CACHE_SIZE:
+            self.prompt_embeddings.popitem(last=False)
+        return embeds, pooled_embeds
+
+    def uses_classifier_free_guidance(self, guidance_scale: float) -> bool:
+        """
+        Whether the pipeline runs the unconditional branch for a guidance scale.
+
+        Like diffusers, guidance only applies above 1 and not for guidance-distilled
+        UNets (those conditioned on the guidance scale through time_cond_proj_dim).
+
+        :param guidance_scale: Guidance scale of the request
+        :return: Whether the negative prompt has any effect
+        """
+        if guidance_scale <= 1:
+            return False
+        unet_config = getattr(getattr(self.pipe, "unet", None), "config", None)
+        time_cond_proj_dim = getattr(unet_config, "time_cond_proj_dim", None)
+        return not isinstance(time_cond_proj_dim, int)
+
+    def unet_batch_size(self, num_images: int, guidance_scale: float) -> int:
+        """
+        Number of UNet samples per denoising step for a micro-batch
+
+        :param num_images: Number of images generated together
+        :param guidance_scale: Guidance scale of the request
+        :return: The UNet batch size, doubled when the unconditional branch runs
+        """
+        if self.uses_classifier_free_guidance(guidance_scale):
+            return 2 * num_images
+        return num_images
+
+    def _prompt_arguments(
+        self, positive_prompt: str, negative_prompt: str, guidance_scale: float
+    ) -> dict:
+        """
+        Returns the prompt arguments of a pipeline call.
+
+        Pipelines whose text encoding is known get cached embeddings instead of the texts,
+        so repeated prompts and negative prompts are only encoded once. The negative prompt
+        is neither encoded nor forwarded when classifier-free guidance has no effect.
+
+        :param positive_prompt: Positive prompt
+        :param negative_prompt: Negative prompt
+        :param guidance_scale: Guidance scale of the request
+        :return: Keyword arguments for the pipeline
+        """
+        use_negative_prompt = self.uses_classifier_free_guidance(guidance_scale)
+        if config.PROMPT_EMBEDDING_CACHE_SIZE < 1 or not isinstance(
+            self.pipe, (StableDiffusionPipeline, StableDiffusionXLPipeline)
+        ):
+            arguments = {"prompt": positive_prompt}
+            if use_negative_prompt:
+                arguments["negative_prompt"] = negative_prompt
+            return arguments
+
+        prompt_embeds, pooled_prompt_embeds = self._encode_text(positive_prompt)
+        arguments = {"prompt_embeds": prompt_embeds}
+        if pooled_prompt_embeds is not None:
+            arguments["pooled_prompt_embeds"] = pooled_prompt_embeds
+        if use_negative_prompt:
+            negative_prompt_embeds, negative_pooled_prompt_embeds = self._encode_text(
+                negative_prompt
+            )
+            arguments["negative_prompt_embeds"] = negative_prompt_embeds
+            if negative_pooled_prompt_embeds is not None:
+                arguments[
+                    "negative_pooled_prompt_embeds"
+                ] = negative_pooled_prompt_embeds
+        return arguments
+
+    def _record_pipeline_metrics(
+        self, seconds: float, num_inference_steps: int, height: int, width: int
+    ):
+        """
+        Records the latency of a pipeline call and the device memory high-water mark.
+        """
+        metrics.PIPELINE_SECONDS.observe(
+            seconds, steps=num_inference_steps, resolution=f"{height}x{width}"
+        )
+        peak_memory = peak_device_memory(self.device)
+        if peak_memory is not None:
+            metrics.DEVICE_MEMORY_HIGH_WATER_BYTES.set_max(
+                peak_memory, device=str(self.device)
+            )
+
+    @staticmethod
+    def _step_callback(on_step: Callable[[int, int], None], num_inference_steps: int):
+        """
+        Wrap a progress callback as a diffusers `callback_on_step_end`.
+        """
+
+        def callback_on_step_end(pipe, step, timestep, callback_kwargs):
+            on_step(step + 1, num_inference_steps)
+            return callback_kwargs
+
+        return callback_on_step_end
+
     def _is_black_image(self, image):
         """
         Checks if an image is entirely black.
@@ -92,19 +618,110 @@ class StableDiffusionHandler:
         image_array = np.array(image)
         return np.all(image_array == 0)
 
-    def txt_to_img(self, input_data: TextToImage) -> list:
+    def txt_to_img(
+        self,
+        input_data: TextToImage,
+        on_images: Optional[Callable[[list], None]] = None,
+        on_step: Optional[Callable[[int, int], None]] = None,
+    ) -> list:
         """
         Converts input text to images
 
         :param input_data: Input data for generating images
+        :param on_images: Called with the images of each micro-batch as soon as they are ready
+        :param on_step: Called with the step and the number of steps after each denoising step
         :return: Generated images
         """
+        if self.result_cache is not None:
+            images = self.result_cache.get_images(
+                input_data, self.result_cache_environment
+            )
+            if images is not None:
+                logger.info(f"Returning {len(images)} cached images")
+                if on_images is not None:
+                    on_images(images)
+                return images
+        with self.slot, tracing.start_span(
+            "txt_to_img",
+            {
+                "model": input_data.model_path,
+                "num_images": input_data.num_images,
+                "num_inference_steps": input_data.num_inference_steps,
+            },
+        ):
+            start_time = time.perf_counter()
+            images = self._txt_to_img(input_data, on_images, on_step)
+            seconds = time.perf_counter() - start_time
+            metrics.IMAGES_GENERATED.inc(len(images), model=self.model_path)
+            if seconds > 0:
+                metrics.IMAGES_PER_SECOND.set(
+                    len(images) / seconds, model=self.model_path
+                )
+            # Retries after black images use a random seed, so the result is not reproducible
+            reproducible = self.black_image_retries == 0
+        if (
+            self.result_cache is not None
+            and reproducible
+            and len(images) == input_data.num_images
+        ):
+            self.result_cache.put_images(
+                input_data, images, self.result_cache_environment
+            )
+        return images
+
+    def _txt_to_img(
+        self,
+        input_data: TextToImage,
+        on_images: Optional[Callable[[list], None]] = None,
+        on_step: Optional[Callable[[int, int], None]] = None,
+    ) -> list:
         if input_data.model_path != self.model_path:
             self._init_model(
                 model_path=input_data.model_path,
             )
         if input_data.model_scheduler != self.scheduler_name:
             self._set_scheduler(input_data.model_scheduler)
+        # A request without a profile goes back to the default one, not the last request's
+        performance_profile = (
+            input_data.performance_profile or self.default_performance_profile
+        )
+        if performance_profile != self.performance_profile:
+            self._set_performance_profile(performance_profile)
+        if not config.PROFILE_DIR:
+            return self._generate(input_data, on_images, on_step)
+        latent_decoder = self._latent_decoder(input_data.decoder)
+        with StepProfiler(
+            self.pipe,
+            self.device,
+            decoders=[latent_decoder.decoder] if latent_decoder is not None else None,
+            attributes={
+                "model": self.model_path,
+                "num_images": input_data.num_images,
+                "num_inference_steps": input_data.num_inference_steps,
+                "resolution": f"{input_data.height}x{input_data.width}",
+                "guidance_scale": input_data.prompt.guidance_scale,
+            },
+        ) as profiler:
+            images = self._generate(
+                input_data, on_images, profiler.step_callback(on_step)
+            )
+        self.last_profile_path = profiler.path
+        return images
+
+    def _generate(
+        self,
+        input_data: TextToImage,
+        on_images: Optional[Callable[[list], None]] = None,
+        on_step: Optional[Callable[[int, int], None]] = None,
+    ) -> list:
+        """
+        Runs the micro-batches of a request on the loaded pipeline
+
+        :param input_data: Input data for generating images
+        :param on_images: Called with the images of each micro-batch as soon as they are ready
+        :param on_step: Called with the step and the number of steps after each denoising step
+        :return: Generated images
+        """
         positive_prompt = input_data.prompt.positive
         negative_prompt = input_data.prompt.negative
         guidance_scale = input_data.prompt.guidance_scale
@@ -112,51 +729,152 @@ class StableDiffusionHandler:
         width = input_data.width
         num_inference_steps = input_data.num_inference_steps
         num_images = input_data.num_images
-        generator = self._set_seed(input_data.seed)
+        seed = input_data.seed
         logger.info(f"Running inference on {num_images} images")
+        self.black_image_retries = 0
+        prompt_arguments = self._prompt_arguments(
+            positive_prompt, negative_prompt, guidance_scale
+        )
+        # Generate at the resolution bucket of the request, if any
+        generation_height, generation_width = snap_to_bucket(
+            height, width, parse_buckets(config.RESOLUTION_BUCKETS)
+        )
+        shape = (
+            self.model_path,
+            generation_height,
+            generation_width,
+            self.uses_classifier_free_guidance(guidance_scale),
+        )
+        latent_decoder = self._latent_decoder(input_data.decoder)
+        pipeline_arguments = dict(prompt_arguments)
+        if latent_decoder is not None:
+            pipeline_arguments["output_type"] = "latent"
+        if on_step is not None:
+            pipeline_arguments["callback_on_step_end"] = self._step_callback(
+                on_step, num_inference_steps
+            )
         images = []
+        # Micro-batches being decoded in the background, with their sizes
+        pending_batches = deque()
+        num_pending_images = 0
         max_attempts = 10
-        while len(images) < num_images and max_attempts > 0:
-            # Generate the remaining images
-            num_images_to_generate = num_images - len(images)
-            logger.debug(f"Num images to generate: {num_images_to_generate}")
-            candidate_images = self.pipe(
-                prompt=positive_prompt,
-                negative_prompt=negative_prompt,
-                guidance_scale=guidance_scale,
-                height=height,
-                width=width,
-                num_inference_steps=num_inference_steps,
-                num_images_per_prompt=num_images_to_generate,
-                generator=generator,
-            ).images
-
-            max_attempts -= 1
-
-            for img in candidate_images:
-                if not self._is_black_image(img):
-                    images.append(img)  # Keep this image if it is not black
+        try:
+            while max_attempts > 0 and (pending_batches or len(images) < num_images):
+                num_images_missing = num_images - len(images) - num_pending_images
+                if num_images_missing <= 0:
+                    # Everything missing is being decoded: wait for the oldest micro-batch
+                    decoded_images, batch_size = pending_batches.popleft()
+                    num_pending_images -= batch_size
+                    candidate_images = decoded_images.result()
                 else:
-                    logger.info(
-                        f"Black image detected. Retrying with {max_attempts} remaining attempts"
+                    # Generate as many of the remaining images as fit in the device at once
+                    num_images_to_generate = self._batch_size(
+                        shape, num_images_missing, guidance_scale
                     )
                     logger.debug(
-                        f"""Parameters:
-                        prompt: {positive_prompt}
-                        negative_prompt: {negative_prompt}
-                        guidance_scale: {guidance_scale}
-                        height: {height}
-                        width: {width}
-                        num_inference_steps: {num_inference_steps}
-                        num_images_per_prompt: {num_images_to_generate}
-                        seed: {input_data.seed}
-                        """
+                        f"Num images to generate: {num_images_to_generate}, UNet batch size: "
+                        f"{self.unet_batch_size(num_images_to_generate, guidance_scale)}"
+                    )
+                    start_time = time.perf_counter()
+                    try:
+                        with tracing.start_span(
+                            "pipeline",
+                            {
+                                "batch_size": num_images_to_generate,
+                                "resolution": f"{generation_height}x{generation_width}",
+                                "num_inference_steps": num_inference_steps,
+                            },
+                        ):
+                            candidate_images = self.pipe(
+                                **pipeline_arguments,
+                                guidance_scale=guidance_scale,
+                                height=generation_height,
+                                width=generation_width,
+                                num_inference_steps=num_inference_steps,
+                                num_images_per_prompt=num_images_to_generate,
+                                generator=self._image_generators(
+                                    seed,
+                                    len(images) + num_pending_images,
+                                    num_images_to_generate,
+                                ),
+                            ).images
+                    except Exception as e:
+                        if not is_out_of_memory_error(e) or num_images_to_generate == 1:
+                            raise
+                        self.capacity_planner.record_out_of_memory(
+                            shape, num_images_to_generate
+                        )
+                        candidate_images = None
+                    if candidate_images is None:
+                        # Outside the except block, so the failed call's tensors can be freed
+                        self._release_device_memory()
+                        continue
+                    self.capacity_planner.record_success(shape, num_images_to_generate)
+                    self._record_pipeline_metrics(
+                        time.perf_counter() - start_time,
+                        num_inference_steps,
+                        generation_height,
+                        generation_width,
                     )
-                    # Set seed to -1 to generate vary the image generated to avoid black images
-                    generator = self._set_seed(-1)
+                    if latent_decoder is not None:
+                        # Decode in the background while the next micro-batch denoises
+                        pending_batches.append(
+                            (
+                                latent_decoder.submit(candidate_images),
+                                num_images_to_generate,
+                            )
+                        )
+                        num_pending_images += num_images_to_generate
+                        continue
 
-            logger.debug(
-                f"Generated {len(images)} non-black images out of {num_images} so far."
-            )
+                if (generation_height, generation_width) != (height, width):
+                    candidate_images = [
+                        fit_to_size(img, height, width) for img in candidate_images
+                    ]
+                is_black = [self._is_black_image(img) for img in candidate_images]
+                if any(is_black):
+                    # Only batches with black images use up the retry attempts
+                    max_attempts -= 1
+
+                if on_images is not None and not all(is_black):
+                    on_images(
+                        [
+                            img
+                            for img, black in zip(candidate_images, is_black)
+                            if not black
+                        ]
+                    )
+                for img, black in zip(candidate_images, is_black):
+                    if not black:
+                        images.append(img)  # Keep this image if it is not black
+                    else:
+                        logger.info(
+                            f"Black image detected. Retrying with {max_attempts} remaining attempts"
+                        )
+                        logger.debug(
+                            f"""Parameters:
+                            prompt: {positive_prompt}
+                            negative_prompt: {negative_prompt}
+                            guidance_scale: {guidance_scale}
+                            height: {height}
+                            width: {width}
+                            num_inference_steps: {num_inference_steps}
+                            num_images_per_prompt: {len(candidate_images)}
+                            seed: {input_data.seed}
+                            """
+                        )
+                        # Set seed to -1 to generate vary the image generated to avoid black images
+                        seed = -1
+                        self.black_image_retries += 1
+                        metrics.BLACK_IMAGE_RETRIES.inc(model=self.model_path)
+
+                logger.debug(
+                    f"Generated {len(images)} non-black images out of {num_images} so far."
+                )
+        finally:
+            # Micro-batches left when the retries run out or a pipeline call fails
+            for decoded_images, _ in pending_batches:
+                if not decoded_images.cancel():
+                    wait([decoded_images])
 
         return images
@@ -0,0 +1,282 @@
+"""
+Opt-in profiling of the denoising loop.
+
+While a request runs, the profiler times every call of the pipeline's stages: text
+encoding, the UNet, the scheduler step, the VAE (or tiny decoder) decode and the
+post-processing that moves the images to the host and converts them to PIL. Denoising
+step boundaries come from the diffusers step callback, so the UNet and scheduler time
+is also broken down per step.
+
+Each request is written to PROFILE_DIR as a Chrome trace (open it in chrome://tracing or
+Perfetto) whose `otherData` holds the per-stage and per-step totals. Set
+PROFILE_TORCH_REQUEST to N to also capture the N-th profiled request of the process with
+`torch.profiler`, next to it.
+"""
+
+import itertools
+import json
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+from image_generation import config, tracing
+from image_generation.core.performance_profiles import device_type
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Step Profiler")
+
+TEXT_ENCODING = "text_encoding"
+UNET = "unet"
+SCHEDULER = "scheduler"
+VAE_DECODE = "vae_decode"
+TRANSFER = "transfer"
+STAGES = [TEXT_ENCODING, UNET, SCHEDULER, VAE_DECODE, TRANSFER]
+
+
+class StepProfiler:
+    """
+    Times the stages of a pipeline while it generates one request.
+    """
+
+    # Number of profiled requests in this process, to pick the one torch.profiler captures
+    _requests = itertools.count(1)
+
+    def __init__(
+        self,
+        pipe,
+        device: torch.device,
+        decoders: Optional[list] = None,
+        attributes: Optional[dict] = None,
+        output_dir: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize the StepProfiler.
+
+        Args:
+            pipe: The diffusers pipeline to profile.
+            device (torch.device): Device the pipeline runs on.
+            decoders (Optional[list]): Other autoencoders whose `decode` to time, like the
+                tiny decoder.
+            attributes (Optional[dict]): Description of the request, added to the trace.
+            output_dir (Optional[str]): Directory of the traces. Defaults to PROFILE_DIR.
+        """
+        self.pipe = pipe
+        self.device = device
+        self.decoders = decoders or []
+        self.attributes = dict(attributes or {})
+        self.output_dir = Path(output_dir or config.PROFILE_DIR)
+        self.path: Optional[Path] = None
+        self.torch_profile_path: Optional[Path] = None
+        self.events: List[dict] = []
+        self.step_seconds: Dict[int, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._patches = []
+        self._current_step = 0
+        self._step_start_ns: Optional[int] = None
+        self._start_ns = 0
+        self._torch_profiler = None
+
+    def __enter__(self) -> "StepProfiler":
+        self.request_number = next(self._requests)
+        name = tracing.correlation_id() or secrets.token_hex(8)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.output_dir / f"{self.request_number:05d}-{name}.json"
+
+        text_encoders = [
+            getattr(self.pipe, name, None)
+            for name in ("text_encoder", "text_encoder_2")
+        ]
+        for text_encoder in text_encoders:
+            if text_encoder is not None:
+                self._patch(text_encoder, "forward", TEXT_ENCODING)
+        denoiser = getattr(self.pipe, "unet", None) or getattr(
+            self.pipe, "transformer", None
+        )
+        if denoiser is not None:
+            self._patch(denoiser, "forward", UNET)
+        self._patch(self.pipe.scheduler, "step", SCHEDULER)
+        for decoder in [getattr(self.pipe, "vae", None)] + self.decoders:
+            if decoder is not None:
+                self._patch(decoder, "decode", VAE_DECODE)
+        image_processor = getattr(self.pipe, "image_processor", None)
+        if image_processor is not None:
+            self._patch(image_processor, "postprocess", TRANSFER)
+
+        if config.PROFILE_TORCH_REQUEST == self.request_number:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if device_type(self.device) == "cuda":
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_profiler = torch.profiler.profile(
+                activities=activities, record_shapes=True
+            )
+            self._torch_profiler.__enter__()
+        self._start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        total_seconds = (time.perf_counter_ns() - self._start_ns) / 1e9
+        for obj, attribute, original in reversed(self._patches):
+            if original is None:
+                delattr(obj, attribute)
+            else:
+                setattr(obj, attribute, original)
+        self._patches.clear()
+        if self._torch_profiler is not None:
+            self._torch_profiler.__exit__(exc_type, exc, traceback)
+            self.torch_profile_path = self.path.with_suffix(".torch.json")
+            self._torch_profiler.export_chrome_trace(str(self.torch_profile_path))
+            self._torch_profiler = None
+
+        summary = self.summary(total_seconds)
+        if exc is not None:
+            summary["error"] = str(exc)
+        try:
+            self.path.write_text(
+                json.dumps(
+                    {
+                        "traceEvents": self._thread_names() + self.events,
+                        "displayTimeUnit": "ms",
+                        "otherData": summary,
+                    }
+                )
+            )
+            logger.info(f"Wrote step profile to {self.path}: {summary['seconds']}")
+        except OSError as e:
+            logger.warning(f"Could not write step profile to {self.path}: {e}")
+
+    def step_callback(
+        self, on_step: Optional[Callable[[int, int], None]] = None
+    ) -> Callable[[int, int], None]:
+        """
+        Wrap a progress callback to also mark the denoising step boundaries.
+
+        Args:
+            on_step (Optional[Callable[[int, int], None]]): Progress callback to call after
+                each step, if any.
+
+        Returns:
+            Callable[[int, int], None]: Callback taking the step and the number of steps.
+        """
+
+        def callback(step: int, num_steps: int) -> None:
+            end_ns = self._now_ns()
+            with self._lock:
+                if self._step_start_ns is not None:
+                    self._add_event(
+                        f"step {step}", "step", self._step_start_ns, end_ns, step
+                    )
+                    self.step_seconds.setdefault(step, {})
+                    self.step_seconds[step]["seconds"] = (
+                        self.step_seconds[step].get("seconds", 0.0)
+                        + (end_ns - self._step_start_ns) / 1e9
+                    )
+                self._step_start_ns = None
+                # The next micro-batch starts again from the first step
+                self._current_step = step % num_steps
+            if on_step is not None:
+                on_step(step, num_steps)
+
+        return callback
+
+    def summary(self, total_seconds: float) -> dict:
+        """
+        Totals of the recorded stages, overall and per denoising step.
+        """
+        with self._lock:
+            seconds = {stage: 0.0 for stage in STAGES}
+            for event in self.events:
+                if event["cat"] in seconds:
+                    seconds[event["cat"]] += event["dur"] / 1e6
+            steps = [
+                {"step": step, **{k: round(v, 6) for k, v in stage_seconds.items()}}
+                for step, stage_seconds in sorted(self.step_seconds.items())
+            ]
+        return {
+            **self.attributes,
+            "request_number": self.request_number,
+            "device": str(self.device),
+            "total_seconds": round(total_seconds, 6),
+            "seconds": {stage: round(value, 6) for stage, value in seconds.items()},
+            "steps": steps,
+            "torch_profile": (
+                str(self.torch_profile_path) if self.torch_profile_path else None
+            ),
+        }
+
+    def _patch(self, obj, attribute: str, stage: str) -> None:
+        """
+        Replace a method of an object with a timed version, until the profiler exits.
+        """
+        original = obj.__dict__.get(attribute)
+        method = getattr(obj, attribute)
+
+        def timed(*args, **kwargs):
+            self._synchronize()
+            start_ns = self._now_ns()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._synchronize()
+                self._record(stage, type(obj).__name__, start_ns, self._now_ns())
+
+        self._patches.append((obj, attribute, original))
+        setattr(obj, attribute, timed)
+
+    def _record(self, stage: str, name: str, start_ns: int, end_ns: int) -> None:
+        with self._lock:
+            step = None
+            if stage in (UNET, SCHEDULER):
+                step = self._current_step + 1
+                if self._step_start_ns is None:
+                    self._step_start_ns = start_ns
+                stage_seconds = self.step_seconds.setdefault(step, {})
+                key = f"{stage}_seconds"
+                stage_seconds[key] = (
+                    stage_seconds.get(key, 0.0) + (end_ns - start_ns) / 1e9
+                )
+            self._add_event(name, stage, start_ns, end_ns, step)
+
+    def _add_event(
+        self, name: str, category: str, start_ns: int, end_ns: int, step: Optional[int]
+    ) -> None:
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start_ns / 1e3,
+            "dur": (end_ns - start_ns) / 1e3,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if step is not None:
+            event["args"] = {"step": step}
+        self.events.append(event)
+
+    def _thread_names(self) -> List[dict]:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        return [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": names.get(tid, str(tid))},
+            }
+            for tid in sorted({event["tid"] for event in self.events})
+        ]
+
+    def _now_ns(self) -> int:
+        return time.perf_counter_ns() - self._start_ns
+
+    def _synchronize(self) -> None:
+        # Kernels run asynchronously on accelerators: wait for them so each stage is
+        # charged its own time
+        if device_type(self.device) == "cuda":
+            torch.cuda.synchronize(self.device)
+        elif device_type(self.device) == "mps":
+            torch.mps.synchronize()
@@ -0,0 +1,383 @@
+"""
+Compiled style registry.
+
+The styles and variable pools in `image_generation.core.styles` are compiled into
+a compact JSON document (`styles.json`) in which:
+
+- every string is interned once in a shared string pool,
+- variable pools are stored as lists of indices into that pool,
+- template parameter sets (model, scheduler, size, ...) are deduplicated,
+- positive prompt templates are pre-parsed into slot lists, where an integer slot
+  is a literal string from the pool and a string slot is a placeholder name.
+
+Styles are only materialized into template dictionaries the first time they are
+requested, so adding new styles does not slow down startup. Their slot lists are kept
+alongside, so prompts are filled without parsing the templates again.
+"""
+
+import copy
+import hashlib
+import importlib
+import json
+import re
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Style Registry")
+
+FORMAT_VERSION = 1
+STYLES_MODULE = "image_generation.core.styles"
+STYLES_SOURCE_PATH = Path(__file__).with_name("styles.py")
+COMPILED_STYLES_PATH = Path(__file__).with_name("styles.json")
+VARIABLE_NAMES = (
+    "characters",
+    "settings",
+    "objects",
+    "creatures",
+    "contexts",
+    "adjectives",
+    "themes",
+    "actions",
+)
+
+PLACEHOLDER_PATTERN = re.compile(r"\{(\w+)\}")
+
+
+def source_hash(source_path: Path = STYLES_SOURCE_PATH) -> str:
+    """
+    Compute the hash of the styles source file without importing it.
+
+    Args:
+        source_path (Path): Path to the styles source file.
+
+    Returns:
+        str: The SHA-256 hex digest of the file contents.
+    """
+    return hashlib.sha256(Path(source_path).read_bytes()).hexdigest()
+
+
+def parse_template(template: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    Parse a prompt template into (literal, placeholder) pairs.
+
+    Args:
+        template (str): The prompt template, e.g. "{theme} {character} on {setting}".
+
+    Returns:
+        List[Tuple[str, Optional[str]]]: The literal text preceding each placeholder and the
+        placeholder name. The last pair holds the trailing text and a None placeholder.
+    """
+    pairs = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(template):
+        pairs.append((template[position : match.start()], match.group(1)))
+        position = match.end()
+    pairs.append((template[position:], None))
+    return pairs
+
+
+def template_pairs(slots: list, strings: List[str]) -> List[Tuple[str, Optional[str]]]:
+    """
+    Turn a compiled slot list into the (literal, placeholder) pairs of `parse_template`.
+
+    Args:
+        slots (list): A compiled slot list. Integers are indices into the string pool,
+            strings are placeholder names.
+        strings (List[str]): The interned string pool.
+
+    Returns:
+        List[Tuple[str, Optional[str]]]: The literal text preceding each placeholder and the
+        placeholder name. The last pair holds the trailing text and a None placeholder.
+    """
+    pairs = []
+    literal = ""
+    for slot in slots:
+        if isinstance(slot, int):
+            literal += strings[slot]
+        else:
+            pairs.append((literal, slot))
+            literal = ""
+    pairs.append((literal, None))
+    return pairs
+
+
+def render_template(slots: list, strings: List[str]) -> str:
+    """
+    Render a compiled slot list back into a prompt template.
+
+    Args:
+        slots (list): A compiled slot list. Integers are indices into the string pool,
+            strings are placeholder names.
+        strings (List[str]): The interned string pool.
+
+    Returns:
+        str: The prompt template.
+    """
+    return "".join(
+        strings[slot] if isinstance(slot, int) else "{" + slot + "}" for slot in slots
+    )
+
+
+def compile_styles(
+    styles: Dict[str, List[dict]], variables: Dict[str, List[str]], source_sha256=""
+) -> dict:
+    """
+    Compile styles and variable pools into the compact registry format.
+
+    Args:
+        styles (Dict[str, List[dict]]): Style names mapped to lists of templates.
+        variables (Dict[str, List[str]]): Variable names mapped to lists of values.
+        source_sha256 (str): Hash of the source the styles were compiled from.
+
+    Returns:
+        dict: The compiled registry, ready to be serialized as JSON.
+    """
+    strings: List[str] = []
+    string_index: Dict[str, int] = {}
+
+    def intern(value: str) -> int:
+        if value not in string_index:
+            string_index[value] = len(strings)
+            strings.append(value)
+        return string_index[value]
+
+    parameters: List[dict] = []
+    parameter_index: Dict[str, int] = {}
+
+    def intern_parameters(template: dict) -> int:
+        template_parameters = copy.deepcopy(template)
+        template_parameters.get("prompt", {}).pop("positive", None)
+        key = json.dumps(template_parameters, sort_keys=True)
+        if key not in parameter_index:
+            parameter_index[key] = len(parameters)
+            parameters.append(template_parameters)
+        return parameter_index[key]
+
+    compiled_variables = {
+        name: [intern(value) for value in values] for name, values in variables.items()
+    }
+
+    compiled_styles = {}
+    for style_name, templates in styles.items():
+        compiled_templates = []
+        for template in templates:
+            slots = []
+            for literal, placeholder in parse_template(template["prompt"]["positive"]):
+                if literal:
+                    slots.append(intern(literal))
+                if placeholder is not None:
+                    slots.append(placeholder)
+            compiled_templates.append([intern_parameters(template), slots])
+        compiled_styles[style_name] = compiled_templates
+
+    return {
+        "format_version": FORMAT_VERSION,
+        "source_sha256": source_sha256,
+        "strings": strings,
+        "variables": compiled_variables,
+        "parameters": parameters,
+        "styles": compiled_styles,
+    }
+
+
+def compile_styles_module(module_name: str = STYLES_MODULE) -> dict:
+    """
+    Import the styles module and compile it.
+
+    Args:
+        module_name (str): The module containing `STYLES` and the variable pools.
+
+    Returns:
+        dict: The compiled registry.
+    """
+    logger.info(f"Compiling styles from {module_name}")
+    module = importlib.import_module(module_name)
+    variables = {name: getattr(module, name) for name in VARIABLE_NAMES}
+    sha256 = source_hash(Path(module.__file__))
+    return compile_styles(module.STYLES, variables, source_sha256=sha256)
+
+
+def write_compiled_styles(
+    compiled: dict, output_path: Path = COMPILED_STYLES_PATH
+) -> None:
+    """
+    Serialize a compiled registry to disk.
+
+    Args:
+        compiled (dict): The compiled registry.
+        output_path (Path): Where to write the JSON document.
+    """
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(compiled, f, separators=(",", ":"), ensure_ascii=False)
+        f.write("\n")
+    logger.info(f"Compiled styles written to {output_path}")
+
+
+class StyleRegistry(MutableMapping):
+    """
+    Lazy, dictionary-like view over the compiled styles.
+
+    The compiled document is read on first access and each style is only turned into
+    template dictionaries the first time it is requested. Styles can be added or removed
+    at runtime as with a regular dictionary; those changes are kept in memory only.
+    """
+
+    def __init__(
+        self,
+        compiled_path: Path = COMPILED_STYLES_PATH,
+        source_path: Optional[Path] = STYLES_SOURCE_PATH,
+        module_name: str = STYLES_MODULE,
+    ) -> None:
+        """
+        Initialize the StyleRegistry.
+
+        Args:
+            compiled_path (Path): Path to the compiled JSON document.
+            source_path (Optional[Path]): Path to the styles source used to detect a stale
+                compiled document. None disables the check.
+            module_name (str): Module to compile from when the compiled document is missing or stale.
+        """
+        self.compiled_path = Path(compiled_path)
+        self.source_path = Path(source_path) if source_path is not None else None
+        self.module_name = module_name
+        self._compiled: Optional[dict] = None
+        self._materialized: Dict[str, List[dict]] = {}
+        self._pairs: Dict[str, Dict[str, List[Tuple[str, Optional[str]]]]] = {}
+        self._variables: Optional[Dict[str, List[str]]] = None
+        self._deleted: set = set()
+
+    @property
+    def compiled(self) -> dict:
+        """
+        The compiled registry document, loaded on first access.
+        """
+        if self._compiled is None:
+            self._compiled = self._load()
+        return self._compiled
+
+    def _load(self) -> dict:
+        expected_hash = None
+        if self.source_path is not None and self.source_path.exists():
+            expected_hash = source_hash(self.source_path)
+
+        if self.compiled_path.exists():
+            with open(self.compiled_path, encoding="utf-8") as f:
+                compiled = json.load(f)
+            if compiled.get("format_version") != FORMAT_VERSION:
+                logger.warning(
+                    f"Compiled styles at {self.compiled_path} have an unsupported format. Recompiling."
+                )
+            elif (
+                expected_hash is not None and compiled["source_sha256"] != expected_hash
+            ):
+                logger.warning(
+                    f"Compiled styles at {self.compiled_path} are out of date. Recompiling."
+                )
+            else:
+                logger.debug(f"Loaded compiled styles from {self.compiled_path}")
+                return compiled
+        else:
+            logger.warning(f"Compiled styles not found at {self.compiled_path}")
+        return compile_styles_module(self.module_name)
+
+    @property
+    def variables(self) -> Dict[str, List[str]]:
+        """
+        The variable pools, resolved from the interned string pool.
+        """
+        if self._variables is None:
+            strings = self.compiled["strings"]
+            self._variables = {
+                name: [strings[index] for index in indices]
+                for name, indices in self.compiled["variables"].items()
+            }
+        return self._variables
+
+    def template_pairs(
+        self, style_name: str
+    ) -> Dict[str, List[Tuple[str, Optional[str]]]]:
+        """
+        The parsed positive prompt templates of a style, see `parse_template`.
+
+        Compiled styles reuse their slot lists, styles added at runtime are parsed once.
+
+        Args:
+            style_name (str): Name of the style.
+
+        Returns:
+            Dict[str, List[Tuple[str, Optional[str]]]]: The (literal, placeholder) pairs of
+            each positive prompt template, by template.
+
+        Raises:
+            KeyError: If the style does not exist.
+        """
+        templates = self[style_name]
+        if style_name not in self._pairs:
+            self._pairs[style_name] = {
+                template["prompt"]["positive"]: parse_template(
+                    template["prompt"]["positive"]
+                )
+                for template in templates
+            }
+        return self._pairs[style_name]
+
+    def _materialize(self, style_name: str) -> List[dict]:
+        strings = self.compiled["strings"]
+        parameters = self.compiled["parameters"]
+        templates = []
+        pairs = {}
+        for parameter_index, slots in self.compiled["styles"][style_name]:
+            template = copy.deepcopy(parameters[parameter_index])
+            positive = render_template(slots, strings)
+            template.setdefault("prompt", {})["positive"] = positive
+            templates.append(template)
+            pairs[positive] = template_pairs(slots, strings)
+        self._pairs[style_name] = pairs
+        logger.debug(f"Materialized style '{style_name}' ({len(templates)} templates)")
+        return templates
+
+    def __getitem__(self, style_name: str) -> List[dict]:
+        if style_name in self._materialized:
+            return self._materialized[style_name]
+        if style_name in self._deleted or style_name not in self.compiled["styles"]:
+            raise KeyError(style_name)
+        templates = self._materialize(style_name)
+        self._materialized[style_name] = templates
+        return templates
+
+    def __setitem__(self, style_name: str, templates: List[dict]) -> None:
+        self._deleted.discard(style_name)
+        self._materialized[style_name] = templates
+        self._pairs.pop(style_name, None)
+
+    def __delitem__(self, style_name: str) -> None:
+        if style_name not in self:
+            raise KeyError(style_name)
+        self._materialized.pop(style_name, None)
+        self._pairs.pop(style_name, None)
+        self._deleted.add(style_name)
+
+    def __contains__(self, style_name: object) -> bool:
+        if style_name in self._materialized:
+            return True
+        return style_name not in self._deleted and style_name in self.compiled["styles"]
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        for style_name in list(self.compiled["styles"]) + list(self._materialized):
+            if style_name not in seen and style_name in self:
+                seen.add(style_name)
+                yield style_name
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+STYLES = StyleRegistry()
+
+
+if __name__ == "__main__":
+    write_compiled_styles(compile_styles_module())
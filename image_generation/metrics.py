@@ -0,0 +1,355 @@
+"""
+Prometheus metrics of the generation path.
+
+A small in-process implementation of counters, gauges and histograms rendered in the
+Prometheus text exposition format. Updates are a dictionary lookup and an addition under
+a lock, cheap enough to leave on in production. The API serves the metrics on /metrics;
+other processes, like the message handler, can serve them with `start_metrics_server`.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a fast encode to a 50-step batch on CPU
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def samples(self) -> List[Tuple[str, Tuple[str, ...], Tuple[str, ...], float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for name, label_names, label_values, value in self.samples():
+            lines.append(
+                f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up.
+    """
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be incremented")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            (f"{self.name}_total", self.label_names, key, value) for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down.
+    """
+
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_max(self, value: float, **labels) -> None:
+        """
+        Set the gauge if the value is higher, for high-water marks.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = max(self._values.get(key, value), value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> Optional[float]:
+        return self._values.get(self._key(labels))
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, self.label_names, key, value) for key, value in items]
+
+
+class Histogram(_Metric):
+    """
+    Observations counted in cumulative buckets, with their count and sum.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts, then the sum and the count of the observations
+            observations = self._values.setdefault(
+                key, [[0] * len(self.buckets), 0.0, 0]
+            )
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    observations[0][index] += 1
+                    break
+            observations[1] += value
+            observations[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of a block of code.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def count(self, **labels) -> int:
+        return self._values.get(self._key(labels), [None, 0.0, 0])[2]
+
+    def sum(self, **labels) -> float:
+        return self._values.get(self._key(labels), [None, 0.0, 0])[1]
+
+    def samples(self):
+        with self._lock:
+            items = sorted(
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            )
+        samples = []
+        label_names = self.label_names + ("le",)
+        for key, counts, total, count in items:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(
+                    (
+                        f"{self.name}_bucket",
+                        label_names,
+                        key + (_format_value(upper_bound),),
+                        cumulative,
+                    )
+                )
+            samples.append((f"{self.name}_bucket", label_names, key + ("+Inf",), count))
+            samples.append((f"{self.name}_sum", self.label_names, key, total))
+            samples.append((f"{self.name}_count", self.label_names, key, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(
+        self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+    def clear(self) -> None:
+        """
+        Reset every metric, e.g. between tests.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+# StableDiffusionHandler
+MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    "sd_model_load_seconds", "Time to load and configure a pipeline.", ["model"]
+)
+WARMUP_SECONDS = REGISTRY.histogram(
+    "sd_warmup_seconds", "Time to warm up a pipeline.", ["model"]
+)
+PIPELINE_SECONDS = REGISTRY.histogram(
+    "sd_pipeline_seconds",
+    "Latency of one pipeline call (a micro-batch).",
+    ["steps", "resolution"],
+)
+IMAGES_GENERATED = REGISTRY.counter(
+    "sd_images_generated", "Images generated, black images excluded.", ["model"]
+)
+IMAGES_PER_SECOND = REGISTRY.gauge(
+    "sd_images_per_second", "Throughput of the last txt_to_img call.", ["model"]
+)
+BLACK_IMAGE_RETRIES = REGISTRY.counter(
+    "sd_black_image_retries", "Black images detected and generated again.", ["model"]
+)
+DEVICE_MEMORY_HIGH_WATER_BYTES = REGISTRY.gauge(
+    "sd_device_memory_high_water_bytes",
+    "Peak device memory allocated by the pipeline.",
+    ["device"],
+)
+
+# API
+ENCODE_SECONDS = REGISTRY.histogram(
+    "api_image_encode_seconds", "Time to encode an image as PNG."
+)
+ZIP_SECONDS = REGISTRY.histogram("api_zip_seconds", "Time to zip a response's images.")
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    "api_scheduler_queued", "Work items waiting for a turn.", ["priority_class"]
+)
+SCHEDULER_RUNNING = REGISTRY.gauge(
+    "api_scheduler_running", "Work items running.", ["priority_class"]
+)
+SCHEDULER_MEAN_WAIT_SECONDS = REGISTRY.gauge(
+    "api_scheduler_mean_wait_seconds",
+    "Mean time work items waited for a turn.",
+    ["priority_class"],
+)
+
+# ImageGenerationMessageHandler
+BATCH_STAGE_SECONDS = REGISTRY.histogram(
+    "handler_batch_stage_seconds",
+    "Duration of each stage of a message batch.",
+    ["stage"],
+)
+PENDING_BATCHES = REGISTRY.gauge(
+    "handler_pending_batches", "Batches of the current message left to process."
+)
+PENDING_UPLOADS = REGISTRY.gauge(
+    "handler_pending_uploads", "Images extracted and waiting to be uploaded."
+)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serve /metrics from a background thread, for processes without an API.
+
+    Args:
+        port (int): Port to listen on, 0 for any free port.
+        host (str): Address to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The server, stopped with `shutdown()`.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    logger.info(f"Serving metrics on port {server.server_address[1]}")
+    return server
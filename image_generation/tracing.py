@@ -0,0 +1,243 @@
+"""
+Span-based tracing of the generation path.
+
+Spans follow the OpenTelemetry model: a trace id shared by every span of a trace, which
+doubles as the correlation id, a span id, the parent span id, start and end times,
+attributes and a status. The current span lives in a context variable, so spans nest
+across function calls, `run_in_threadpool` and asyncio tasks. Traces cross process
+boundaries in the W3C `traceparent` header.
+
+Finished spans are handed to the registered exporters. Set TRACE_EXPORT_PATH to append
+them as JSON lines, with OTLP field names, to a local file. Tests use
+`InMemorySpanExporter`.
+"""
+
+import contextvars
+import json
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from image_generation import config
+from image_generation.custom_logging import set_logger
+
+logger = set_logger("Tracing")
+
+TRACEPARENT_HEADER = "traceparent"
+CORRELATION_ID_HEADER = "X-Correlation-Id"
+
+_TRACEPARENT_PATTERN = re.compile(
+    r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$"
+)
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    """
+    A timed operation of a trace.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_span_id: Optional[str] = None,
+        attributes: Optional[dict] = None,
+    ) -> None:
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.attributes = dict(attributes or {})
+        self.status = "UNSET"
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+
+    @property
+    def traceparent(self) -> str:
+        """
+        The W3C trace context of the span, to propagate it to other services.
+        """
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    @property
+    def duration_seconds(self) -> Optional[float]:
+        if self.end_time_ns is None:
+            return None
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        """
+        The span with OTLP JSON field names.
+        """
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_time_ns,
+            "endTimeUnixNano": self.end_time_ns,
+            "attributes": self.attributes,
+            "status": {"code": self.status},
+        }
+
+
+class InMemorySpanExporter:
+    """
+    Keeps finished spans in memory, for tests.
+    """
+
+    def __init__(self) -> None:
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def find(self, name: str) -> List[Span]:
+        with self._lock:
+            return [span for span in self.spans if span.name == name]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+
+
+class JsonLinesSpanExporter:
+    """
+    Appends finished spans to a file, one JSON object per line.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock, open(self.path, "a") as file:
+            file.write(line)
+
+
+_exporters = []
+_exporters_lock = threading.Lock()
+_file_exporters: Dict[str, JsonLinesSpanExporter] = {}
+
+
+def add_exporter(exporter) -> None:
+    """
+    Register an exporter, an object with an `export(span)` method.
+    """
+    with _exporters_lock:
+        _exporters.append(exporter)
+
+
+def remove_exporter(exporter) -> None:
+    with _exporters_lock:
+        _exporters.remove(exporter)
+
+
+def _export(span: Span) -> None:
+    with _exporters_lock:
+        exporters = list(_exporters)
+        if config.TRACE_EXPORT_PATH:
+            if config.TRACE_EXPORT_PATH not in _file_exporters:
+                _file_exporters[config.TRACE_EXPORT_PATH] = JsonLinesSpanExporter(
+                    config.TRACE_EXPORT_PATH
+                )
+            exporters.append(_file_exporters[config.TRACE_EXPORT_PATH])
+    for exporter in exporters:
+        try:
+            exporter.export(span)
+        except Exception as e:
+            logger.warning(f"Could not export span {span.name}: {e}")
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Parse a W3C traceparent header.
+
+    Returns:
+        Optional[Tuple[str, str]]: The trace id and the parent span id, None if the
+            header is missing or malformed.
+    """
+    if not traceparent:
+        return None
+    match = _TRACEPARENT_PATTERN.match(traceparent.strip().lower())
+    if match is None or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+        return None
+    return match.group(1), match.group(2)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def correlation_id() -> Optional[str]:
+    """
+    The trace id of the current span, None outside of a trace.
+    """
+    span = current_span()
+    return span.trace_id if span is not None else None
+
+
+def propagation_headers() -> dict:
+    """
+    Headers carrying the current trace to another service, empty outside of a trace.
+    """
+    span = current_span()
+    return {TRACEPARENT_HEADER: span.traceparent} if span is not None else {}
+
+
+@contextmanager
+def start_span(
+    name: str, attributes: Optional[dict] = None, traceparent: Optional[str] = None
+):
+    """
+    Run a block of code in a new span, child of the current span.
+
+    Args:
+        name (str): Name of the span.
+        attributes (Optional[dict]): Attributes of the span.
+        traceparent (Optional[str]): W3C trace context of a remote parent, used when
+            there is no current span. A new trace is started when neither exists.
+
+    Yields:
+        Span: The span, ended and exported when the block exits. Exceptions set its
+            status to ERROR and are re-raised.
+    """
+    parent = current_span()
+    if parent is not None:
+        trace_id, parent_span_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_span_id = parse_traceparent(traceparent) or (
+            secrets.token_hex(16),
+            None,
+        )
+    span = Span(name, trace_id, parent_span_id, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "ERROR"
+        span.set_attribute("exception.type", type(e).__name__)
+        span.set_attribute("exception.message", str(e))
+        raise
+    else:
+        if span.status == "UNSET":
+            span.status = "OK"
+    finally:
+        span.end_time_ns = time.time_ns()
+        _current_span.reset(token)
+        _export(span)
@@ -1,4 +1,6 @@
+import base64
 import io
+import json
 import os
 import time
 import zipfile
@@ -8,6 +10,7 @@ import requests
 import torch
 from PIL import Image
 
+from image_generation import tracing
 from image_generation.custom_logging import set_logger
 
 logger = set_logger("Image Generation Utils")
@@ -21,7 +24,9 @@ def call_image_generation_api(host, endpoint, request_object: dict):
     url = f"{host}{endpoint}"
     logger.info(f"Calling {url}")
     logger.info(f"Request object: {request_object}")
-    response = requests.post(url, json=request_object)
+    response = requests.post(
+        url, json=request_object, headers=tracing.propagation_headers()
+    )
 
     if response.status_code != 200:
         raise Exception(
@@ -31,6 +36,39 @@ def call_image_generation_api(host, endpoint, request_object: dict):
     return response
 
 
+def stream_image_generation_api(host, endpoint, request_object: dict, progress=False):
+    """
+    Call a streaming endpoint of the API and yield its events as they arrive.
+
+    Image events are yielded with their "image" decoded into a PIL Image.
+    """
+    url = f"{host}{endpoint}"
+    logger.info(f"Streaming {url}")
+    logger.info(f"Request object: {request_object}")
+    with requests.post(
+        url,
+        json=request_object,
+        params={"progress": progress},
+        headers=tracing.propagation_headers(),
+        stream=True,
+    ) as response:
+        if response.status_code != 200:
+            raise Exception(
+                f"Request to {url} failed with status code {response.status_code}"
+            )
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["event"] == "image":
+                event["image"] = Image.open(
+                    io.BytesIO(base64.b64decode(event["image"]))
+                )
+            elif event["event"] == "error":
+                raise Exception(f"Streaming {url} failed: {event['detail']}")
+            yield event
+
+
 def wait_for_service(host, endpoint="/healthcheck", timeout=TIMEOUT):
     url = f"{host}{endpoint}"
     logger.info(f"Waiting for the service at {url} to become available")
@@ -77,14 +115,9 @@ def store_zip_images_temporarily(response):
 
 
 def enough_gpu_memory(minimum_gb=MINIMUM_MEMORY_GB):
-    def convert_bytes_to(bytes, to, bsize=1024):
-        a = {"k": 1, "m": 2, "g": 3, "t": 4, "p": 5, "e": 6}
-        r = float(bytes)
-        for i in range(a[to]):
-            r = r / bsize
-        return r
-
-    total_memory = torch.cuda.mem_get_info()[1]
-    total_memory_gb = convert_bytes_to(total_memory, "g")
-    logger.info(f"Total GPU memory: {total_memory_gb} GB")
-    return total_memory_gb >= minimum_gb
+    free_memory, total_memory = torch.cuda.mem_get_info()
+    free_memory_gb = free_memory / 1024**3
+    logger.info(
+        f"Free GPU memory: {free_memory_gb:.2f} GB of {total_memory / 1024**3:.2f} GB"
+    )
+    return free_memory_gb >= minimum_gb
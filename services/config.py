@@ -17,3 +17,20 @@ AZURE_STORAGE_CONTAINER_NAME = os.environ.get(
 AZURE_SERVICE_BUS_MAX_LOCK_RENEWAL_DURATION = int(
     os.environ.get("AZURE_SERVICE_BUS_MAX_LOCK_RENEWAL_DURATION", 300)
 )
+IMAGE_GENERATION_API_STARTUP_TIMEOUT = int(
+    os.environ.get("IMAGE_GENERATION_API_STARTUP_TIMEOUT", 2260)
+)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+BLOB_STORAGE_BACKEND = os.environ.get("BLOB_STORAGE_BACKEND", "azure").strip().lower()
+LOCAL_BLOB_STORAGE_DIR = os.environ.get(
+    "LOCAL_BLOB_STORAGE_DIR", "blob_storage"
+).strip()
+SERVICE_BUS_BACKEND = os.environ.get("SERVICE_BUS_BACKEND", "azure").strip().lower()
+LOCAL_SERVICE_BUS_PATH = os.environ.get(
+    "LOCAL_SERVICE_BUS_PATH", "service_bus.sqlite3"
+).strip()
+IMAGE_GENERATION_APIS = [
+    host.strip()
+    for host in os.environ.get("IMAGE_GENERATION_APIS", IMAGE_GENERATION_API).split(",")
+    if host.strip()
+]
@@ -1,8 +1,13 @@
 import asyncio
+import contextvars
 import json
+import queue
+import threading
+from contextlib import contextmanager
+from enum import Enum
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from rich.progress import (
     BarColumn,
@@ -12,19 +17,113 @@ from rich.progress import (
     TimeRemainingColumn,
 )
 
+from cloud_manager.asyncio_service_bus import AsyncioServiceBus
 from cloud_manager.azure_blob_storage import AzureBlobStorage
 from cloud_manager.azure_service_bus import AzureServiceBus
 from cloud_manager.interfaces.blob_storage import BlobStorageInterface
 from cloud_manager.interfaces.service_bus import ServiceBusInterface
+from cloud_manager.local_blob_storage import LocalBlobStorage
+from cloud_manager.memory_blob_storage import InMemoryBlobStorage
+from cloud_manager.memory_service_bus import InMemoryServiceBus
+from cloud_manager.sqlite_service_bus import SqliteServiceBus
+from image_generation import metrics, tracing
 from image_generation.custom_logging import set_logger
+from image_generation.metrics import start_metrics_server
 from image_generation.utils import store_zip_images_temporarily, wait_for_service
 from services import config
+from services.manifest import (
+    ManifestBatch,
+    ManifestCheckpoint,
+    load_manifest,
+    manifest_digest,
+)
 from services.message_handlers import MessageFactory, MessageTypeInterface
 from services.message_service_bus import MessageServiceBusClass
 
 logger = set_logger("Image Generation Message Handler")
 
 
+class BlobStorageBackendEnum(Enum):
+    AZURE = "azure"
+    LOCAL = "local"
+    MEMORY = "memory"
+
+
+def create_blob_storage(backend: Optional[str] = None) -> BlobStorageInterface:
+    """
+    Create the blob storage the images are uploaded to.
+
+    Args:
+        backend (Optional[str]): "azure", "local" (files under LOCAL_BLOB_STORAGE_DIR) or
+            "memory". Defaults to BLOB_STORAGE_BACKEND.
+
+    Raises:
+        ValueError: If the backend does not exist.
+    """
+    backend = backend or config.BLOB_STORAGE_BACKEND
+    if backend == BlobStorageBackendEnum.AZURE.value:
+        return AzureBlobStorage(config.AZURE_STORAGE_CONNECTION_STRING)
+    if backend == BlobStorageBackendEnum.LOCAL.value:
+        return LocalBlobStorage(config.LOCAL_BLOB_STORAGE_DIR)
+    if backend == BlobStorageBackendEnum.MEMORY.value:
+        return InMemoryBlobStorage()
+    raise ValueError(
+        f"{backend} is not a valid blob storage backend. Valid options are: "
+        f"{', '.join(backend.value for backend in BlobStorageBackendEnum)}"
+    )
+
+
+class ServiceBusBackendEnum(Enum):
+    AZURE = "azure"
+    SQLITE = "sqlite"
+    ASYNCIO = "asyncio"
+    MEMORY = "memory"
+
+
+def create_service_bus(backend: Optional[str] = None) -> ServiceBusInterface:
+    """
+    Create the Service Bus the messages are consumed from and published to.
+
+    Args:
+        backend (Optional[str]): "azure", "sqlite" (a database at LOCAL_SERVICE_BUS_PATH
+            shared with the local publishers), "asyncio" or "memory". Defaults to
+            SERVICE_BUS_BACKEND.
+
+    Raises:
+        ValueError: If the backend does not exist.
+    """
+    backend = backend or config.SERVICE_BUS_BACKEND
+    if backend == ServiceBusBackendEnum.AZURE.value:
+        logger.info(
+            f"Using Azure Service Bus Max Lock Renewal Duration: {config.AZURE_SERVICE_BUS_MAX_LOCK_RENEWAL_DURATION}"
+        )
+        return AzureServiceBus(
+            config.AZURE_SERVICE_BUS_CONNECTION_STRING,
+            config.AZURE_SERVICE_BUS_MAX_LOCK_RENEWAL_DURATION,
+        )
+    if backend == ServiceBusBackendEnum.SQLITE.value:
+        return SqliteServiceBus(config.LOCAL_SERVICE_BUS_PATH)
+    if backend == ServiceBusBackendEnum.ASYNCIO.value:
+        return AsyncioServiceBus()
+    if backend == ServiceBusBackendEnum.MEMORY.value:
+        return InMemoryServiceBus()
+    raise ValueError(
+        f"{backend} is not a valid Service Bus backend. Valid options are: "
+        f"{', '.join(backend.value for backend in ServiceBusBackendEnum)}"
+    )
+
+
+@contextmanager
+def batch_stage(stage: str, **attributes):
+    """
+    Time a stage of a message batch, in the stage metrics and in a span.
+    """
+    with metrics.BATCH_STAGE_SECONDS.time(stage=stage), tracing.start_span(
+        stage, attributes
+    ) as span:
+        yield span
+
+
 class ImageGenerationMessageHandler:
     """
     A message handler that processes incoming messages to generate images
@@ -32,13 +131,21 @@ class ImageGenerationMessageHandler:
     generated image URLs to an Azure Service Bus topic.
     """
 
-    def __init__(self, tags_to_add: dict = None, batch_size: int = 50) -> None:
+    def __init__(
+        self,
+        tags_to_add: dict = None,
+        batch_size: int = 50,
+        blob_storage: Optional[BlobStorageInterface] = None,
+        service_bus: Optional[ServiceBusInterface] = None,
+    ) -> None:
         """
         Initialize the ImageGenerationMessageHandler instance.
 
         Args:
             tags_to_add (dict, optional): A dictionary of tags to add to the Azure Service Bus message. Defaults to None.
             batch_size (int, optional): Number of images to process in each batch Defaults to 50.
+            blob_storage (BlobStorageInterface, optional): Storage to upload the images to. Defaults to the BLOB_STORAGE_BACKEND one.
+            service_bus (ServiceBusInterface, optional): Service Bus to consume and publish messages with. Defaults to the SERVICE_BUS_BACKEND one.
         """
         if batch_size < 1:
             error_message = "Batch size must be greater than 0."
@@ -46,17 +153,13 @@ class ImageGenerationMessageHandler:
             raise ValueError(error_message)
         logger.info(f"Using batch size: {batch_size}")
         self.batch_size = batch_size
-        self.azure_cloud: BlobStorageInterface = AzureBlobStorage(
-            config.AZURE_STORAGE_CONNECTION_STRING
-        )
+        if blob_storage is None:
+            blob_storage = create_blob_storage()
+        self.azure_cloud: BlobStorageInterface = blob_storage
 
-        logger.info(
-            f"Using Azure Service Bus Max Lock Renewal Duration: {config.AZURE_SERVICE_BUS_MAX_LOCK_RENEWAL_DURATION}"
-        )
-        self.service_bus: ServiceBusInterface = AzureServiceBus(
-            config.AZURE_SERVICE_BUS_CONNECTION_STRING,
-            config.AZURE_SERVICE_BUS_MAX_LOCK_RENEWAL_DURATION,
-        )
+        if service_bus is None:
+            service_bus = create_service_bus()
+        self.service_bus: ServiceBusInterface = service_bus
         metadata_fields_to_keep = [
             "model_path",
             "style",
@@ -74,12 +177,18 @@ class ImageGenerationMessageHandler:
             message (str): The message to be processed.
         """
         logger.info(f"Received message: {message}")
-        try:
-            message_json = json.loads(message)["message"]
-            self.handle_message(message_json)
-        except json.JSONDecodeError as e:
-            logger.error(f"Error decoding JSON: {e}")
-            raise
+        # Root span of the message's trace, its id is the correlation id in the logs
+        with tracing.start_span(
+            "service_bus.receive",
+            {"messaging.destination": config.AZURE_SERVICE_BUS_QUEUE_NAME},
+        ) as span:
+            logger.info(f"Correlation id: {span.trace_id}")
+            try:
+                message_json = json.loads(message)["message"]
+                self.handle_message(message_json)
+            except json.JSONDecodeError as e:
+                logger.error(f"Error decoding JSON: {e}")
+                raise
 
     def get_num_images_from_message(self, message_json: dict) -> int:
         """
@@ -153,12 +262,14 @@ class ImageGenerationMessageHandler:
                 )
 
                 for i in range(0, num_images, self.batch_size):
+                    metrics.PENDING_BATCHES.set(num_batches - i // self.batch_size)
                     message_json = self.set_num_images_in_message(
                         message_json, min(self.batch_size, num_images - i)
                     )
-                    processed_message, message = self.process_incoming_message(
-                        message_json
-                    )
+                    with batch_stage("generate"):
+                        processed_message, message = self.process_incoming_message(
+                            message_json
+                        )
                     (
                         files_blob_urls,
                         metadata_list,
@@ -167,22 +278,13 @@ class ImageGenerationMessageHandler:
                         processed_message, message
                     )
 
-                    messages_to_send = []
-                    for file_blob_url, metadata in zip(files_blob_urls, metadata_list):
-                        metadata.update(message.message_json)
-                        message_to_send = (
-                            self.message_service_bus.create_message_to_send(
-                                file_blob_url, metadata
-                            )
-                        )
-                        messages_to_send.append(message_to_send)
-
-                        logger.info(
-                            f"Sending message ImageGenerated: {message_to_send}"
-                        )
-                    await self.service_bus.publish_async(
-                        config.AZURE_SERVICE_BUS_TOPIC_NAME, messages_to_send
+                    messages_to_send = self.create_messages_to_send(
+                        files_blob_urls, metadata_list, message
                     )
+                    with batch_stage("publish", messages=len(messages_to_send)):
+                        await self.service_bus.publish_async(
+                            config.AZURE_SERVICE_BUS_TOPIC_NAME, messages_to_send
+                        )
 
                     progress.update(
                         task,
@@ -193,6 +295,7 @@ class ImageGenerationMessageHandler:
                     )
 
                     temp_dir.cleanup()
+                metrics.PENDING_BATCHES.set(0)
 
         except Exception as e:
             logger.error(f"Error handling message: {e}")
@@ -231,34 +334,27 @@ class ImageGenerationMessageHandler:
                 )
 
                 for i in range(0, num_images, self.batch_size):
+                    metrics.PENDING_BATCHES.set(num_batches - i // self.batch_size)
                     message_json = self.set_num_images_in_message(
                         message_json, min(self.batch_size, num_images - i)
                     )
-                    processed_message, message = self.process_incoming_message(
-                        message_json
-                    )
+                    with batch_stage("generate"):
+                        processed_message, message = self.process_incoming_message(
+                            message_json
+                        )
                     (
                         files_blob_urls,
                         metadata_list,
                         temp_dir,
                     ) = self.upload_images_to_blob_storage(processed_message, message)
 
-                    messages_to_send = []
-                    for file_blob_url, metadata in zip(files_blob_urls, metadata_list):
-                        metadata.update(message.message_json)
-                        message_to_send = (
-                            self.message_service_bus.create_message_to_send(
-                                file_blob_url, metadata
-                            )
-                        )
-                        messages_to_send.append(message_to_send)
-
-                        logger.info(
-                            f"Sending message ImageGenerated: {message_to_send}"
-                        )
-                    self.service_bus.publish(
-                        config.AZURE_SERVICE_BUS_TOPIC_NAME, messages_to_send
+                    messages_to_send = self.create_messages_to_send(
+                        files_blob_urls, metadata_list, message
                     )
+                    with batch_stage("publish", messages=len(messages_to_send)):
+                        self.service_bus.publish(
+                            config.AZURE_SERVICE_BUS_TOPIC_NAME, messages_to_send
+                        )
 
                     progress.update(
                         task,
@@ -269,13 +365,42 @@ class ImageGenerationMessageHandler:
                     )
 
                     temp_dir.cleanup()
+                metrics.PENDING_BATCHES.set(0)
 
         except Exception as e:
             logger.error(f"Error handling message: {e}")
             raise
 
+    def create_messages_to_send(
+        self,
+        files_blob_urls: List[str],
+        metadata_list: List[dict],
+        message: MessageTypeInterface,
+    ) -> List[str]:
+        """
+        Create the ImageGenerated messages of uploaded images.
+
+        Args:
+            files_blob_urls (List[str]): The URLs of the images.
+            metadata_list (List[dict]): The metadata of the images.
+            message (MessageInterface): The processed message the images were generated for.
+
+        Returns:
+            List[str]: The messages to publish, one per image.
+        """
+        messages_to_send = []
+        for file_blob_url, metadata in zip(files_blob_urls, metadata_list):
+            metadata.update(message.message_json)
+            message_to_send = self.message_service_bus.create_message_to_send(
+                file_blob_url, metadata
+            )
+            messages_to_send.append(message_to_send)
+
+            logger.info(f"Sending message ImageGenerated: {message_to_send}")
+        return messages_to_send
+
     def process_incoming_message(
-        self, message_json: Dict[str, Any]
+        self, message_json: Dict[str, Any], host: Optional[str] = None
     ) -> Tuple[Dict[str, Any], MessageTypeInterface]:
         """
         Process the incoming message JSON to determine the appropriate endpoint
@@ -283,13 +408,14 @@ class ImageGenerationMessageHandler:
 
         Args:
             message_json (Dict[str, Any]): The incoming message JSON.
+            host (Optional[str]): URL of the image generation API. Defaults to IMAGE_GENERATION_API.
 
         Returns:
             Tuple[Dict[str, Any], MessageInterface]: The response from the image generation API and the processed message.
         """
         try:
             message = MessageFactory.create_message(message_json)
-            response = message.process()
+            response = message.process(host)
             logger.info(f"Response: {response}")
             return response, message
         except Exception as e:
@@ -314,7 +440,10 @@ class ImageGenerationMessageHandler:
         """
         logger.info("Getting file objects...")
         try:
-            file_paths, metadata_list, temp_dir = store_zip_images_temporarily(response)
+            with batch_stage("extract"):
+                file_paths, metadata_list, temp_dir = store_zip_images_temporarily(
+                    response
+                )
             logger.debug(f"File paths: {file_paths}")
             file_objects = [
                 {
@@ -328,9 +457,13 @@ class ImageGenerationMessageHandler:
             logger.info(
                 f"Uploading files to blob storage '{config.AZURE_STORAGE_CONTAINER_NAME}'"
             )
-            files_blob_urls = await self.azure_cloud.push_objects_async(
-                config.AZURE_STORAGE_CONTAINER_NAME, file_objects, overwrite=True
-            )
+            metrics.PENDING_UPLOADS.set(len(file_objects))
+            with batch_stage("upload", images=len(file_objects)) as span:
+                files_blob_urls = await self.azure_cloud.push_objects_async(
+                    config.AZURE_STORAGE_CONTAINER_NAME, file_objects, overwrite=True
+                )
+                span.set_attribute("blob.urls", files_blob_urls)
+            metrics.PENDING_UPLOADS.set(0)
             logger.info(f"Uploaded files to blob storage: {files_blob_urls}")
             return files_blob_urls, metadata_list, temp_dir
         except Exception as e:
@@ -355,7 +488,10 @@ class ImageGenerationMessageHandler:
         """
         logger.info("Getting file objects...")
         try:
-            file_paths, metadata_list, temp_dir = store_zip_images_temporarily(response)
+            with batch_stage("extract"):
+                file_paths, metadata_list, temp_dir = store_zip_images_temporarily(
+                    response
+                )
             logger.debug(f"File paths: {file_paths}")
             file_objects = [
                 {
@@ -369,9 +505,13 @@ class ImageGenerationMessageHandler:
             logger.info(
                 f"Uploading files to blob storage '{config.AZURE_STORAGE_CONTAINER_NAME}'"
             )
-            files_blob_urls = self.azure_cloud.push_objects(
-                config.AZURE_STORAGE_CONTAINER_NAME, file_objects, overwrite=True
-            )
+            metrics.PENDING_UPLOADS.set(len(file_objects))
+            with batch_stage("upload", images=len(file_objects)) as span:
+                files_blob_urls = self.azure_cloud.push_objects(
+                    config.AZURE_STORAGE_CONTAINER_NAME, file_objects, overwrite=True
+                )
+                span.set_attribute("blob.urls", files_blob_urls)
+            metrics.PENDING_UPLOADS.set(0)
             logger.info(f"Uploaded files to blob storage: {files_blob_urls}")
             return files_blob_urls, metadata_list, temp_dir
         except Exception as e:
@@ -397,7 +537,11 @@ class ImageGenerationMessageHandler:
             message_json = {
                 "text_to_style": {"style": "general", "num_images": total_images}
             }
-            asyncio.run(self.handle_message_async(message_json))
+            with tracing.start_span(
+                "generate_on_command", {"num_images": total_images}
+            ) as span:
+                logger.info(f"Correlation id: {span.trace_id}")
+                asyncio.run(self.handle_message_async(message_json))
         else:
             # Default to standard message handling
             self.service_bus.consume_indefinitely(
@@ -405,13 +549,174 @@ class ImageGenerationMessageHandler:
                 self,
             )
 
+    def run_manifest(
+        self,
+        manifest_path: str,
+        checkpoint_path: Optional[str] = None,
+        concurrency: int = 1,
+        hosts: Optional[List[str]] = None,
+    ) -> Dict[str, int]:
+        """
+        Generate, upload and publish the images of a manifest of jobs.
+
+        The jobs are split into batches of `batch_size` images, which workers take in
+        turn: `concurrency` per API, so faster APIs take more batches. Progress is
+        checkpointed (see ManifestCheckpoint), and running a manifest again resumes it:
+        published batches are skipped and the failed ones are retried.
+
+        Args:
+            manifest_path (str): JSONL file of text_to_style and text_to_image jobs.
+            checkpoint_path (Optional[str]): Checkpoint of the run. Defaults to
+                `<manifest_path>.checkpoint.jsonl`.
+            concurrency (int): Batches generated at the same time by each API.
+            hosts (Optional[List[str]]): URLs of the APIs. Defaults to IMAGE_GENERATION_APIS.
+
+        Returns:
+            Dict[str, int]: Number of batches in the manifest, skipped because they were
+                already published, completed by this run and failed.
+
+        Raises:
+            ValueError: If the manifest is invalid, the concurrency is not positive, or the
+                checkpoint belongs to another manifest.
+        """
+        if concurrency <= 0:
+            raise ValueError("Concurrency must be greater than 0")
+        hosts = hosts or config.IMAGE_GENERATION_APIS
+        batches = load_manifest(manifest_path, self.batch_size)
+        checkpoint = ManifestCheckpoint(
+            checkpoint_path or f"{manifest_path}.checkpoint.jsonl",
+            manifest_digest(manifest_path, self.batch_size),
+        )
+        pending = queue.Queue()
+        for batch in batches:
+            if not checkpoint.is_published(batch.batch_id):
+                pending.put(batch)
+        summary = {
+            "batches": len(batches),
+            "skipped": len(batches) - pending.qsize(),
+            "completed": 0,
+            "failed": 0,
+        }
+        summary_lock = threading.Lock()
+        logger.info(
+            f"Running {pending.qsize()} of {len(batches)} batches of {manifest_path} "
+            f"on {len(hosts)} APIs"
+        )
 
-def main(tags_to_add=None, generate_on_command=False, total_images=0, batch_size=50):
-    wait_for_service(config.IMAGE_GENERATION_API, timeout=2260)
+        def work(host: str) -> None:
+            while True:
+                try:
+                    batch = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self.run_manifest_batch(batch, checkpoint, host)
+                    outcome = "completed"
+                except Exception as e:
+                    logger.error(f"Batch {batch.batch_id} failed on {host}: {e}")
+                    outcome = "failed"
+                with summary_lock:
+                    summary[outcome] += 1
+                    metrics.PENDING_BATCHES.set(pending.qsize())
+
+        with tracing.start_span(
+            "manifest", {"manifest": manifest_path, "batches": len(batches)}
+        ) as span:
+            logger.info(f"Correlation id: {span.trace_id}")
+            workers = [
+                threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(work, host),
+                    name=f"manifest-{index}-{worker}",
+                )
+                for index, host in enumerate(hosts)
+                for worker in range(concurrency)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            span.set_attribute("manifest.summary", summary)
+        logger.info(f"Manifest {manifest_path} done: {summary}")
+        return summary
+
+    def run_manifest_batch(
+        self, batch: ManifestBatch, checkpoint: ManifestCheckpoint, host: str
+    ) -> None:
+        """
+        Generate, upload and publish the images of a manifest batch, resuming from its
+        checkpointed stage.
+
+        Args:
+            batch (ManifestBatch): The batch.
+            checkpoint (ManifestCheckpoint): The checkpoint of the manifest run.
+            host (str): URL of the image generation API.
+        """
+        messages_to_send = checkpoint.uploaded_messages(batch.batch_id)
+        if messages_to_send is None:
+            with batch_stage("generate", batch=batch.batch_id, host=host):
+                processed_message, message = self.process_incoming_message(
+                    batch.message_json, host
+                )
+            (
+                files_blob_urls,
+                metadata_list,
+                temp_dir,
+            ) = self.upload_images_to_blob_storage(processed_message, message)
+            try:
+                if len(files_blob_urls) != len(metadata_list):
+                    # Left un-uploaded, so a resumed run generates the batch again
+                    raise RuntimeError(
+                        f"Uploaded {len(files_blob_urls)} of {len(metadata_list)} "
+                        f"images of batch {batch.batch_id}"
+                    )
+                messages_to_send = self.create_messages_to_send(
+                    files_blob_urls, metadata_list, message
+                )
+            finally:
+                temp_dir.cleanup()
+            checkpoint.record_uploaded(batch.batch_id, messages_to_send)
+        else:
+            logger.info(f"Batch {batch.batch_id} is already uploaded, publishing it")
+        with batch_stage("publish", messages=len(messages_to_send)):
+            self.service_bus.publish(
+                config.AZURE_SERVICE_BUS_TOPIC_NAME, messages_to_send
+            )
+        checkpoint.record_published(batch.batch_id)
+
+
+def main(
+    tags_to_add=None,
+    generate_on_command=False,
+    total_images=0,
+    batch_size=50,
+    manifest=None,
+    checkpoint=None,
+    concurrency=1,
+):
+    if config.METRICS_PORT:
+        start_metrics_server(config.METRICS_PORT)
+    hosts = config.IMAGE_GENERATION_APIS if manifest else [config.IMAGE_GENERATION_API]
+    for host in hosts:
+        wait_for_service(
+            host,
+            endpoint="/ready",
+            timeout=config.IMAGE_GENERATION_API_STARTUP_TIMEOUT,
+        )
     handler = ImageGenerationMessageHandler(
         tags_to_add=tags_to_add, batch_size=batch_size
     )
-    handler.run(generate_on_command=generate_on_command, total_images=total_images)
+    if manifest:
+        summary = handler.run_manifest(
+            manifest, checkpoint_path=checkpoint, concurrency=concurrency
+        )
+        if summary["failed"]:
+            raise RuntimeError(
+                f"{summary['failed']} batches of {manifest} failed, run it again to "
+                f"retry them"
+            )
+    else:
+        handler.run(generate_on_command=generate_on_command, total_images=total_images)
 
 
 if __name__ == "__main__":
@@ -423,12 +728,34 @@ if __name__ == "__main__":
     parser.add_argument("--generate_on_command", action="store_true", default=False)
     parser.add_argument("--total_images", type=int, default=0)
     parser.add_argument("--batch_size", type=int, default=50)
+    parser.add_argument(
+        "--manifest",
+        default=None,
+        help="JSONL file of text_to_style/text_to_image jobs to generate, sharded "
+        "across IMAGE_GENERATION_APIS",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        default=None,
+        help="Checkpoint of the manifest run, resumed if it exists. Defaults to "
+        "<manifest>.checkpoint.jsonl",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Batches generated at the same time by each API in manifest mode",
+    )
     args = parser.parse_args()
     main(
         tags_to_add=args.tags_to_add,
         generate_on_command=args.generate_on_command,
         total_images=args.total_images,
         batch_size=args.batch_size,
+        manifest=args.manifest,
+        checkpoint=args.checkpoint,
+        concurrency=args.concurrency,
     )
     # Example usage:
     # python services/image_generation_message_handler.py --tags_to_add '{"test":"test"}' --generate_on_command --total_images 10
+    # python services/image_generation_message_handler.py --manifest jobs.jsonl --concurrency 2
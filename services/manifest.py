@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from image_generation.custom_logging import set_logger
+from services.message_handlers import MessageFactory
+
+logger = set_logger("Manifest")
+
+
+class ManifestBatch:
+    """
+    A batch of images of a manifest job, generated with one API call.
+    """
+
+    def __init__(self, job_number: int, batch_index: int, job: dict, num_images: int):
+        """
+        Initialize a ManifestBatch instance.
+
+        Args:
+            job_number (int): Line of the job in the manifest.
+            batch_index (int): Index of the batch in the job.
+            job (dict): The job, a text_to_style or text_to_image message.
+            num_images (int): Number of images of the batch.
+        """
+        self.batch_id = f"{job_number}:{batch_index}"
+        self.job = job
+        self.num_images = num_images
+
+    @property
+    def message_json(self) -> dict:
+        """
+        The job message, with the number of images of the batch.
+        """
+        key = next(key for key in MessageFactory.message_classes if key in self.job)
+        return {key: {**self.job[key], "num_images": self.num_images}}
+
+
+def load_manifest(path: str, batch_size: int) -> List[ManifestBatch]:
+    """
+    Read a JSONL manifest of text_to_style and text_to_image jobs and split them into
+    batches.
+
+    Args:
+        path (str): Path of the manifest.
+        batch_size (int): Maximum number of images of a batch.
+
+    Returns:
+        List[ManifestBatch]: The batches, identified by job line and batch index.
+
+    Raises:
+        ValueError: If a line is not a job with a positive num_images.
+    """
+    batches = []
+    with open(path) as manifest_file:
+        for line_number, line in enumerate(manifest_file, start=1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            keys = [key for key in MessageFactory.message_classes if key in job]
+            if len(keys) != 1 or not isinstance(job[keys[0]], dict):
+                raise ValueError(
+                    f"Line {line_number} of {path} is not a text_to_style or "
+                    f"text_to_image job"
+                )
+            num_images = job[keys[0]].get("num_images")
+            if not isinstance(num_images, int) or num_images <= 0:
+                raise ValueError(
+                    f"Line {line_number} of {path} needs a positive num_images"
+                )
+            for batch_index, start in enumerate(range(0, num_images, batch_size)):
+                batches.append(
+                    ManifestBatch(
+                        line_number,
+                        batch_index,
+                        job,
+                        min(batch_size, num_images - start),
+                    )
+                )
+    return batches
+
+
+def manifest_digest(path: str, batch_size: int) -> str:
+    """
+    Fingerprint of a manifest and of its split into batches.
+    """
+    digest = hashlib.sha256(f"{batch_size}\n".encode())
+    with open(path, "rb") as manifest_file:
+        for chunk in iter(lambda: manifest_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ManifestCheckpoint:
+    """
+    Progress of a manifest run, appended to a JSONL file as batches advance.
+
+    A batch is checkpointed twice: once its images are uploaded, with the ImageGenerated
+    messages to publish, and once those are published. A resumed run skips published
+    batches and only publishes the messages of uploaded ones, so completed work is
+    neither generated nor uploaded again. Each record is synced to disk before the run
+    moves on, and a record cut short by a crash is ignored.
+    """
+
+    def __init__(self, path: str, digest: str) -> None:
+        """
+        Initialize a ManifestCheckpoint instance, resuming the checkpoint at path if it
+        exists.
+
+        Args:
+            path (str): Path of the checkpoint.
+            digest (str): The `manifest_digest` of the manifest.
+
+        Raises:
+            ValueError: If the checkpoint belongs to another manifest or batch size.
+        """
+        self.path = Path(path)
+        self._uploaded: Dict[str, List[str]] = {}
+        self._published = set()
+        self._lock = threading.Lock()
+        if self.path.exists() and self.path.stat().st_size:
+            self._load(digest)
+            logger.info(
+                f"Resuming from {path}: {len(self._published)} batches published, "
+                f"{len(self._uploaded)} uploaded"
+            )
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._append({"manifest": digest})
+
+    def is_published(self, batch_id: str) -> bool:
+        with self._lock:
+            return batch_id in self._published
+
+    def uploaded_messages(self, batch_id: str) -> Optional[List[str]]:
+        """
+        The messages of a batch uploaded and not published yet, None if it was not.
+        """
+        with self._lock:
+            return self._uploaded.get(batch_id)
+
+    def record_uploaded(self, batch_id: str, messages: List[str]) -> None:
+        self._append({"batch": batch_id, "uploaded": messages})
+        with self._lock:
+            self._uploaded[batch_id] = messages
+
+    def record_published(self, batch_id: str) -> None:
+        self._append({"batch": batch_id, "published": True})
+        with self._lock:
+            self._uploaded.pop(batch_id, None)
+            self._published.add(batch_id)
+
+    def _load(self, digest: str) -> None:
+        with open(self.path) as checkpoint_file:
+            lines = checkpoint_file.readlines()
+        header = json.loads(lines[0])
+        if header.get("manifest") != digest:
+            raise ValueError(
+                f"Checkpoint {self.path} belongs to another manifest or batch size. "
+                f"Remove it to start over."
+            )
+        for line_number, line in enumerate(lines[1:], start=2):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring incomplete line {line_number} of {self.path}")
+                continue
+            if record.get("published"):
+                self._uploaded.pop(record["batch"], None)
+                self._published.add(record["batch"])
+            elif record["batch"] not in self._published:
+                self._uploaded[record["batch"]] = record["uploaded"]
+        if lines[-1] and not lines[-1].endswith("\n"):
+            # Start the next record on its own line
+            with open(self.path, "a") as checkpoint_file:
+                checkpoint_file.write("\n")
+
+    def _append(self, record: dict) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a") as checkpoint_file:
+                checkpoint_file.write(line)
+                checkpoint_file.flush()
+                os.fsync(checkpoint_file.fileno())
@@ -1,6 +1,6 @@
 import uuid
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from image_generation.utils import call_image_generation_api
 from services import config
@@ -28,9 +28,12 @@ class MessageTypeInterface(ABC):
             raise ValueError(f"Key {key} not found in message_json")
 
     @abstractmethod
-    def process(self) -> Any:
+    def process(self, host: Optional[str] = None) -> Any:
         """
         Process the message. This method should be overridden in subclasses.
+
+        Args:
+            host (Optional[str]): URL of the image generation API. Defaults to IMAGE_GENERATION_API.
         """
         pass
 
@@ -61,15 +64,18 @@ class TextToStyleMessage(MessageTypeInterface):
         """
         super().__init__(message_json, "text_to_style")
 
-    def process(self) -> Any:
+    def process(self, host: Optional[str] = None) -> Any:
         """
         Process the message by calling the image generation API.
 
+        Args:
+            host (Optional[str]): URL of the image generation API. Defaults to IMAGE_GENERATION_API.
+
         Returns:
             Any: The response from the image generation API.
         """
         return call_image_generation_api(
-            config.IMAGE_GENERATION_API, "/text_to_style", self.message_json
+            host or config.IMAGE_GENERATION_API, "/text_to_style", self.message_json
         )
 
     def get_file_name(self, file_path: str) -> str:
@@ -99,15 +105,18 @@ class TextToImageMessage(MessageTypeInterface):
         """
         super().__init__(message_json, "text_to_image")
 
-    def process(self) -> Any:
+    def process(self, host: Optional[str] = None) -> Any:
         """
         Process the message by calling the image generation API.
 
+        Args:
+            host (Optional[str]): URL of the image generation API. Defaults to IMAGE_GENERATION_API.
+
         Returns:
             Any: The response from the image generation API.
         """
         return call_image_generation_api(
-            config.IMAGE_GENERATION_API, "/text_to_image", self.message_json
+            host or config.IMAGE_GENERATION_API, "/text_to_image", self.message_json
         )
 
     def get_file_name(self, file_path: str) -> str:
@@ -41,5 +41,10 @@ fi
 CMD+=" --total_images ${TOTAL_IMAGES:-0}"
 CMD+=" --batch_size ${BATCH_SIZE:-50}"
 
+# Run a manifest of jobs instead if MANIFEST is set
+if [ ! -z "$MANIFEST" ]; then
+    CMD+=" --manifest $MANIFEST --concurrency ${CONCURRENCY:-1}"
+fi
+
 # Execute the command
 eval $CMD
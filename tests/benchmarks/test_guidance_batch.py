@@ -0,0 +1,26 @@
+import unittest
+from unittest.mock import patch
+
+from benchmarks.guidance_batch import run_benchmark
+from image_generation import config
+from image_generation.core.stable_diffusion import StableDiffusionHandler
+
+
+class TestGuidanceBatch(unittest.TestCase):
+    def setUp(self):
+        StableDiffusionHandler._warmed_up.clear()
+
+    @patch.object(config, "WARMUP_ENABLED", False)
+    def test_no_guidance_halves_unet_batch(self):
+        without_guidance, with_guidance = run_benchmark(
+            [0.0, 7.5], num_images=2, num_inference_steps=1, height=32, width=32
+        )
+
+        self.assertEqual(without_guidance["unet_batch_sizes"], [2])
+        self.assertEqual(with_guidance["unet_batch_sizes"], [4])
+        self.assertEqual(without_guidance["text_encoder_calls"], 1)
+        self.assertEqual(with_guidance["text_encoder_calls"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
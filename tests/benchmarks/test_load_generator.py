@@ -0,0 +1,128 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+from benchmarks.load_generator import (
+    load_payloads,
+    run_api_load,
+    run_handler_load,
+    synthetic_payloads,
+)
+from cloud_manager.local_blob_storage import LocalBlobStorage
+from cloud_manager.sqlite_service_bus import SqliteServiceBus
+from image_generation.api.utils import zip_images
+from services import config
+
+
+def zip_response(num_images=2):
+    response = MagicMock(status_code=200)
+    response.content = zip_images(
+        [
+            (
+                f"image_{index}",
+                Image.new("RGB", (8, 8), color="red"),
+                {"model_path": "tiny", "style": "general"},
+            )
+            for index in range(num_images)
+        ]
+    ).read()
+    return response
+
+
+class TestLoadGenerator(unittest.TestCase):
+    def test_load_payloads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "payloads.jsonl"
+            path.write_text(
+                json.dumps({"text_to_style": {"style": "general", "num_images": 1}})
+                + "\n\n"
+                + json.dumps({"text_to_image": {"num_images": 2}})
+                + "\n"
+            )
+            self.assertEqual(len(load_payloads(str(path))), 2)
+
+            path.write_text(json.dumps({"request_id": "1"}) + "\n")
+            with self.assertRaises(ValueError):
+                load_payloads(str(path))
+
+    @patch("benchmarks.load_generator.call_image_generation_api")
+    def test_run_api_load(self, mock_call_api):
+        mock_call_api.side_effect = [zip_response(), Exception("Some error")] * 2
+
+        report = run_api_load(
+            "http://api",
+            synthetic_payloads(num_images=2),
+            rate=100,
+            num_requests=4,
+            concurrency=1,
+        )
+
+        mock_call_api.assert_called_with(
+            "http://api", "/text_to_style", {"style": "general", "num_images": 2}
+        )
+        self.assertEqual(report["sent"], 4)
+        self.assertEqual(report["completed"], 2)
+        self.assertEqual(report["errors"], 2)
+        self.assertEqual(report["error_rate"], 0.5)
+        self.assertEqual(report["images"], 4)
+        self.assertIsNotNone(report["latency_seconds"]["p95"])
+
+    @patch("services.message_handlers.call_image_generation_api")
+    def test_run_handler_load(self, mock_call_api):
+        mock_call_api.side_effect = lambda host, endpoint, request: zip_response(
+            request["num_images"]
+        )
+
+        report = run_handler_load(
+            synthetic_payloads(num_images=2),
+            rate=100,
+            num_messages=3,
+            consumers=2,
+            host="http://api",
+        )
+
+        self.assertEqual(mock_call_api.call_args.args[0], "http://api")
+        self.assertEqual(config.IMAGE_GENERATION_API, "http://127.0.0.1:5000")
+        self.assertEqual(report["completed"], 3)
+        self.assertEqual(report["errors"], 0)
+        # One ImageGenerated message per image
+        self.assertEqual(report["images"], 6)
+        self.assertGreater(report["blobs"], 0)
+        self.assertEqual(report["consumers"], 2)
+
+    @patch("services.message_handlers.call_image_generation_api")
+    def test_run_handler_load_with_local_backends(self, mock_call_api):
+        mock_call_api.side_effect = lambda host, endpoint, request: zip_response(
+            request["num_images"]
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            blob_storage = LocalBlobStorage(str(Path(directory) / "blobs"))
+            report = run_handler_load(
+                synthetic_payloads(num_images=2),
+                rate=100,
+                num_messages=2,
+                host="http://api",
+                blob_storage=blob_storage,
+                service_bus=SqliteServiceBus(
+                    str(Path(directory) / "service_bus.sqlite3"),
+                    max_delivery_count=1,
+                    poll_interval=0.01,
+                ),
+            )
+
+            self.assertEqual(report["completed"], 2)
+            self.assertEqual(report["images"], 4)
+            self.assertEqual(
+                report["blobs"],
+                len(blob_storage.list_objects(config.AZURE_STORAGE_CONTAINER_NAME)),
+            )
+            self.assertGreater(report["blobs"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import zipfile
+from unittest.mock import patch
+
+from PIL import Image
+
+from benchmarks.throughput import (
+    build_cases,
+    compare_to_baseline,
+    encode_images,
+    run_benchmark,
+)
+from image_generation import config
+from image_generation.core.stable_diffusion import StableDiffusionHandler
+
+
+class TestThroughputBenchmark(unittest.TestCase):
+    def setUp(self):
+        StableDiffusionHandler._warmed_up.clear()
+
+    def test_build_cases(self):
+        cases = build_cases([1, 2], ["32x32", "64x32"], [2], ["euler_a"], ["zip"])
+        self.assertEqual(len(cases), 4)
+        self.assertEqual(cases[0]["case"], "batch1-32x32-steps2-euler_a-zip")
+        self.assertEqual((cases[1]["height"], cases[1]["width"]), (64, 32))
+
+    def test_encode_images(self):
+        images = [Image.new("RGB", (8, 8))] * 2
+        self.assertIs(encode_images(images, "pil"), images)
+        self.assertEqual(len(encode_images(images, "base64")), 2)
+        with zipfile.ZipFile(encode_images(images, "zip")) as zip_file:
+            self.assertEqual(len(zip_file.namelist()), 2)
+        with self.assertRaises(ValueError):
+            encode_images(images, "jpeg")
+
+    @patch.object(config, "WARMUP_ENABLED", False)
+    def test_run_benchmark_on_tiny_pipeline(self):
+        report = run_benchmark(
+            batch_sizes=[1, 2],
+            resolutions=["32x32"],
+            steps=[1],
+            schedulers=["euler_a", "ddims"],
+            output_formats=["zip"],
+            repetitions=3,
+            warmup=0,
+        )
+
+        self.assertEqual(report["environment"]["device"], "cpu")
+        self.assertEqual(len(report["results"]), 4)
+        for result in report["results"]:
+            self.assertEqual(result["repetitions"], 3)
+            self.assertLessEqual(result["p50_seconds"], result["p95_seconds"])
+            self.assertLessEqual(result["p95_seconds"], result["p99_seconds"])
+            self.assertGreater(result["images_per_second"], 0)
+            self.assertGreater(result["mean_encode_seconds"], 0)
+            self.assertGreater(result["peak_rss_bytes"], 0)
+            self.assertIsNone(result["peak_device_memory_bytes"])
+
+    def test_compare_to_baseline(self):
+        baseline = {
+            "results": [
+                {
+                    "case": "a",
+                    "p50_seconds": 1.0,
+                    "p95_seconds": 1.0,
+                    "images_per_second": 4.0,
+                },
+                {
+                    "case": "b",
+                    "p50_seconds": 1.0,
+                    "p95_seconds": 1.0,
+                    "images_per_second": 4.0,
+                },
+            ]
+        }
+        report = {
+            "results": [
+                {
+                    "case": "a",
+                    "p50_seconds": 1.05,
+                    "p95_seconds": 1.5,
+                    "images_per_second": 3.0,
+                },
+                {
+                    "case": "c",
+                    "p50_seconds": 1.0,
+                    "p95_seconds": 1.0,
+                    "images_per_second": 4.0,
+                },
+            ]
+        }
+
+        comparison = compare_to_baseline(report, baseline, tolerance=0.1)
+
+        self.assertEqual(
+            [(r["case"], r["metric"]) for r in comparison["regressions"]],
+            [("a", "p95_seconds"), ("a", "images_per_second")],
+        )
+        self.assertEqual(comparison["regressions"][0]["change"], 0.5)
+        self.assertEqual(comparison["new_cases"], ["c"])
+        self.assertEqual(comparison["missing_cases"], ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import unittest
+
+from cloud_manager.asyncio_service_bus import AsyncioServiceBus
+from cloud_manager.peek_lock_service_bus import MessageLockLostError
+
+
+class TestAsyncioServiceBus(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.service_bus = AsyncioServiceBus(max_delivery_count=2)
+
+    async def test_publish_and_consume(self):
+        received = []
+
+        async def callback(message):
+            received.append(message)
+
+        await self.service_bus.publish_async("queue", ["first", "second"])
+        await self.service_bus.consume_async("queue", callback)
+        await self.service_bus.join("queue")
+
+        self.assertEqual(received, ["first", "second"])
+        self.assertEqual(self.service_bus.queue_length("queue"), 0)
+        self.assertEqual(self.service_bus.in_flight("queue"), 0)
+
+    async def test_failed_messages_are_redelivered_then_dead_lettered(self):
+        deliveries = []
+
+        def fail(message):
+            deliveries.append(message)
+            raise RuntimeError("Some error")
+
+        await self.service_bus.publish_async("queue", ["poison"])
+        await self.service_bus.consume_async("queue", fail)
+        self.assertEqual(self.service_bus.queue_length("queue"), 1)
+        await self.service_bus.consume_async("queue", fail)
+        await self.service_bus.join("queue")
+
+        self.assertEqual(deliveries, ["poison", "poison"])
+        self.assertEqual(self.service_bus.queue_length("queue"), 0)
+        self.assertEqual(self.service_bus.dead_letters("queue"), ["poison"])
+
+    async def test_locks(self):
+        await self.service_bus.publish_async("queue", ["first"])
+        message = await self.service_bus.receive_async("queue")
+
+        self.assertEqual(message.delivery_count, 1)
+        self.assertEqual(self.service_bus.in_flight("queue"), 1)
+        self.service_bus.complete("queue", message)
+        with self.assertRaises(MessageLockLostError):
+            self.service_bus.abandon("queue", message)
+
+    async def test_consume_indefinitely_async(self):
+        received = []
+        consumer = asyncio.create_task(
+            self.service_bus.consume_indefinitely_async(
+                "queue", received.append, max_number_messages=2
+            )
+        )
+        await asyncio.sleep(0)
+        await self.service_bus.publish_async("queue", ["first"])
+        await self.service_bus.publish_async("queue", ["second", "third"])
+        await asyncio.wait_for(consumer, 5)
+
+        self.assertEqual(received, ["first", "second"])
+        self.assertEqual(self.service_bus.queue_length("queue"), 1)
+
+    async def test_threads_publish_to_the_loop(self):
+        received = []
+        consumer = asyncio.create_task(
+            self.service_bus.consume_indefinitely_async(
+                "queue", received.append, max_number_messages=3
+            )
+        )
+        await asyncio.sleep(0)
+        await asyncio.to_thread(self.service_bus.publish, "queue", ["a", "b", "c"])
+        await asyncio.wait_for(consumer, 5)
+
+        self.assertEqual(received, ["a", "b", "c"])
+
+    async def test_max_wait_time_and_close(self):
+        self.assertIsNone(await self.service_bus.receive_async("queue", 0.01))
+        consumer = asyncio.create_task(
+            self.service_bus.consume_indefinitely_async("queue", print)
+        )
+        await asyncio.sleep(0.01)
+        self.service_bus.close()
+        await asyncio.wait_for(consumer, 5)
+
+        self.assertIsNone(await self.service_bus.receive_async("queue"))
+
+    def test_sync_methods_block_the_loop(self):
+        async def receive():
+            await self.service_bus.publish_async("queue", ["first"])
+            self.service_bus.receive("queue")
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(receive())
+
+
+class TestAsyncioServiceBusFromThreads(unittest.TestCase):
+    def setUp(self):
+        self.service_bus = AsyncioServiceBus(max_delivery_count=2)
+        self.addCleanup(self.service_bus.close)
+
+    def test_publish_and_consume(self):
+        received = []
+        self.service_bus.publish("queue", ["first", "second"])
+        asyncio.run(self.service_bus.publish_async("queue", ["third"]))
+
+        self.service_bus.consume("queue", received.append)
+
+        self.assertEqual(received, ["first", "second", "third"])
+        self.assertEqual(self.service_bus.in_flight("queue"), 0)
+
+    def test_consume_indefinitely_and_close(self):
+        received = []
+        consumer = threading.Thread(
+            target=self.service_bus.consume_indefinitely,
+            args=("queue", received.append),
+        )
+        consumer.start()
+        self.service_bus.publish("queue", ["first", "second"])
+        for _ in range(500):
+            if len(received) == 2:
+                break
+            threading.Event().wait(0.01)
+        self.service_bus.close()
+        consumer.join(5)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(received, ["first", "second"])
+
+    def test_locked_messages_are_released_when_their_loop_stops(self):
+        async def receive():
+            await self.service_bus.publish_async("queue", ["first"])
+            return await self.service_bus.receive_async("queue")
+
+        asyncio.run(receive())
+
+        self.assertEqual(self.service_bus.receive("queue", 0).body, "first")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,8 @@
 import unittest
 from unittest.mock import AsyncMock, MagicMock, patch
 
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
 from cloud_manager.azure_blob_storage import AzureBlobStorage
 
 
@@ -143,6 +145,53 @@ class TestAzureBlobStorage(unittest.TestCase):
 
         self.assertEqual(blob_urls, [])
 
+    def test_get_object(self):
+        blob_client = self.azure_cloud.blob_service_client.get_blob_client.return_value
+        blob_client.download_blob.return_value.readall.return_value = b"data"
+
+        self.assertEqual(self.azure_cloud.get_object("test", "name.zip"), b"data")
+        self.azure_cloud.blob_service_client.get_blob_client.assert_called_once_with(
+            "test", "name.zip"
+        )
+
+    def test_get_object_not_found(self):
+        blob_client = self.azure_cloud.blob_service_client.get_blob_client.return_value
+        blob_client.download_blob.side_effect = ResourceNotFoundError("Not found")
+
+        self.assertIsNone(self.azure_cloud.get_object("test", "name.zip"))
+
+    def test_exists_and_get_url(self):
+        blob_client = self.azure_cloud.blob_service_client.get_blob_client.return_value
+        blob_client.exists.return_value = True
+        blob_client.url = "https://example.com/test/name.zip"
+
+        self.assertTrue(self.azure_cloud.exists("test", "name.zip"))
+        self.assertEqual(
+            self.azure_cloud.get_url("test", "name.zip"),
+            "https://example.com/test/name.zip",
+        )
+
+    def test_upload_stream(self):
+        blob_client = self.azure_cloud.blob_service_client.get_blob_client.return_value
+        blob_client.url = "https://example.com/test/name.zip"
+        chunks = [b"a", b"b"]
+
+        url = self.azure_cloud.upload_stream(
+            "test", "name.zip", chunks, metadata={"style": "x"}
+        )
+
+        self.assertEqual(url, "https://example.com/test/name.zip")
+        blob_client.upload_blob.assert_called_once_with(
+            chunks, overwrite=False, metadata={"style": "x"}
+        )
+
+    def test_upload_stream_existing_object(self):
+        blob_client = self.azure_cloud.blob_service_client.get_blob_client.return_value
+        blob_client.upload_blob.side_effect = ResourceExistsError("Exists")
+
+        with self.assertRaises(FileExistsError):
+            self.azure_cloud.upload_stream("test", "name.zip", [b"data"])
+
     @patch("azure.storage.blob.BlobServiceClient.from_connection_string")
     def test_invalid_connection_string(self, mock_from_connection_string):
         mock_from_connection_string.side_effect = ValueError(
@@ -1,7 +1,7 @@
 import asyncio
 import time
 import unittest
-from unittest.mock import MagicMock, call, patch
+from unittest.mock import AsyncMock, MagicMock, call, patch
 
 from azure.servicebus import ServiceBusMessage, ServiceBusMessageBatch
 from azure.servicebus._common.auto_lock_renewer import AutoLockRenewer
@@ -47,7 +47,7 @@ class TestAzureServiceBusAsync(unittest.IsolatedAsyncioTestCase):
         mock_batch.__len__.return_value = len(messages)
         mock_sender.create_message_batch = MagicMock(return_value=asyncio.Future())
         mock_sender.create_message_batch.return_value.set_result(mock_batch)
-        mock_sender.send_messages = MagicMock()
+        mock_sender.send_messages = AsyncMock()
 
         self.mock_async_service_bus_client.get_queue_sender.return_value.__aenter__.return_value = (
             mock_sender
@@ -77,7 +77,8 @@ class TestAzureServiceBusAsync(unittest.IsolatedAsyncioTestCase):
             mock_sender
         )
 
-        await self.service_bus.publish_async(topic, messages)
+        with self.assertRaises(ServiceBusError):
+            await self.service_bus.publish_async(topic, messages)
 
         mock_logger.error.assert_called_with(
             f"Service Bus specific error async publishing messages to '{topic}': Async publish test error"
@@ -166,7 +167,8 @@ class TestAzureServiceBus(unittest.TestCase):
             mock_sender
         )
 
-        self.service_bus.publish(topic, messages)
+        with self.assertRaises(ServiceBusError):
+            self.service_bus.publish(topic, messages)
         mock_logger.error.assert_called_once_with(
             f"Service Bus specific error publishing messages to '{topic}': Test error"
         )
@@ -183,7 +185,8 @@ class TestAzureServiceBus(unittest.TestCase):
             mock_sender
         )
 
-        self.service_bus.publish(topic, messages)
+        with self.assertRaisesRegex(Exception, "Test error"):
+            self.service_bus.publish(topic, messages)
         mock_logger.error.assert_called_once_with(
             f"General error publishing messages to '{topic}': Test error"
         )
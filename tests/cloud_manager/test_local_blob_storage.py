@@ -0,0 +1,139 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+from cloud_manager.local_blob_storage import LocalBlobStorage
+
+
+class TestLocalBlobStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = Path(self.directory.name) / "image.png"
+        self.path.write_bytes(b"image")
+        self.root_dir = Path(self.directory.name) / "store"
+        self.blob_storage = LocalBlobStorage(str(self.root_dir))
+
+    def test_push_and_get_objects(self):
+        urls = self.blob_storage.push_objects(
+            "images",
+            [{"name": "a/b.png", "path": str(self.path), "metadata": {"style": "x"}}],
+        )
+
+        stored_path = self.root_dir / "images" / "a" / "b.png"
+        self.assertEqual(urls, [stored_path.resolve().as_uri()])
+        self.assertEqual(self.blob_storage.get_object("images", "a/b.png"), b"image")
+        self.assertEqual(
+            self.blob_storage.get_metadata("images", "a/b.png"), {"style": "x"}
+        )
+        self.assertEqual(self.blob_storage.list_objects("images"), ["a/b.png"])
+        self.assertTrue(self.blob_storage.exists("images", "a/b.png"))
+        self.assertIsNone(self.blob_storage.get_object("images", "c.png"))
+        self.assertIsNone(self.blob_storage.get_metadata("images", "c.png"))
+        self.assertEqual(self.blob_storage.list_objects("videos"), [])
+
+    def test_push_objects_links_files(self):
+        self.blob_storage.push_objects(
+            "images", [{"name": "a.png", "path": str(self.path)}]
+        )
+
+        stored_path = self.root_dir / "images" / "a.png"
+        self.assertEqual(os.stat(stored_path).st_ino, os.stat(self.path).st_ino)
+
+    def test_push_objects_copies_files(self):
+        blob_storage = LocalBlobStorage(str(self.root_dir), link_files=False)
+        blob_storage.push_objects("images", [{"name": "a.png", "path": str(self.path)}])
+
+        stored_path = self.root_dir / "images" / "a.png"
+        self.assertNotEqual(os.stat(stored_path).st_ino, os.stat(self.path).st_ino)
+        self.assertEqual(stored_path.read_bytes(), b"image")
+
+    def test_push_objects_async(self):
+        paths = []
+        for index in range(3):
+            path = Path(self.directory.name) / f"{index}.png"
+            path.write_bytes(str(index).encode())
+            paths.append({"name": f"{index}.png", "path": str(path)})
+
+        urls = asyncio.run(self.blob_storage.push_objects_async("images", paths))
+
+        self.assertEqual(len(urls), 3)
+        self.assertEqual(
+            self.blob_storage.list_objects("images"), ["0.png", "1.png", "2.png"]
+        )
+
+    def test_overwrite_and_missing_files(self):
+        obj = {"name": "a.png", "path": str(self.path)}
+        self.blob_storage.push_objects("images", [obj])
+        other_path = Path(self.directory.name) / "other.png"
+        other_path.write_bytes(b"new image")
+        other = {"name": "a.png", "path": str(other_path)}
+
+        self.assertEqual(self.blob_storage.push_objects("images", [other]), [])
+        self.assertEqual(self.blob_storage.get_object("images", "a.png"), b"image")
+        self.blob_storage.push_objects("images", [other], overwrite=True)
+        self.assertEqual(self.blob_storage.get_object("images", "a.png"), b"new image")
+        self.assertEqual(
+            self.blob_storage.push_objects(
+                "images", [{"name": "b.png", "path": "missing.png"}]
+            ),
+            [],
+        )
+        self.assertEqual(self.blob_storage.push_objects("images", []), [])
+        self.assertEqual(self.blob_storage.list_objects("images"), ["a.png"])
+
+    def test_upload_stream(self):
+        self.blob_storage.upload_stream("images", "bytes.zip", BytesIO(b"bytes"))
+        self.blob_storage.upload_stream("images", "chunks.zip", [b"ch", b"unks"])
+        with open(self.path, "rb") as data:
+            self.blob_storage.upload_stream(
+                "images", "file.png", data, metadata={"style": "x"}
+            )
+
+        self.assertEqual(self.blob_storage.get_object("images", "bytes.zip"), b"bytes")
+        self.assertEqual(
+            self.blob_storage.get_object("images", "chunks.zip"), b"chunks"
+        )
+        self.assertEqual(self.blob_storage.get_object("images", "file.png"), b"image")
+        self.assertEqual(
+            self.blob_storage.get_metadata("images", "file.png"), {"style": "x"}
+        )
+        with self.assertRaises(FileExistsError):
+            self.blob_storage.upload_stream("images", "bytes.zip", [b"other"])
+        self.blob_storage.upload_stream(
+            "images", "bytes.zip", [b"other"], overwrite=True
+        )
+        self.assertEqual(self.blob_storage.get_object("images", "bytes.zip"), b"other")
+        self.assertEqual(
+            asyncio.run(
+                self.blob_storage.upload_stream_async("images", "async.zip", [b"a"])
+            ),
+            self.blob_storage.get_url("images", "async.zip"),
+        )
+
+    def test_open_object(self):
+        self.blob_storage.upload_stream("images", "a.zip", [b"content"])
+        self.blob_storage.upload_stream("images", "empty.zip", [])
+
+        with self.blob_storage.open_object("images", "a.zip") as content:
+            self.assertEqual(content[:4], b"cont")
+        with self.blob_storage.open_object("images", "empty.zip") as content:
+            self.assertEqual(len(content), 0)
+        with self.assertRaises(FileNotFoundError):
+            with self.blob_storage.open_object("images", "missing.zip"):
+                pass
+
+    def test_invalid_names(self):
+        for name in ["", "/a.png", "../a.png", "a/../b.png", ".a.png", "a\\b.png"]:
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    self.blob_storage.upload_stream("images", name, [b"data"])
+        with self.assertRaises(ValueError):
+            self.blob_storage.get_url("..", "a.png")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import asyncio
+import tempfile
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+from cloud_manager.memory_blob_storage import InMemoryBlobStorage
+
+
+class TestInMemoryBlobStorage(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = Path(self.directory.name) / "image.png"
+        self.path.write_bytes(b"image")
+        self.blob_storage = InMemoryBlobStorage()
+
+    def test_push_and_get_objects(self):
+        urls = self.blob_storage.push_objects(
+            "images",
+            [{"name": "a.png", "path": str(self.path), "metadata": {"style": "x"}}],
+        )
+
+        self.assertEqual(urls, ["memory://images/a.png"])
+        self.assertEqual(self.blob_storage.get_object("images", "a.png"), b"image")
+        self.assertEqual(
+            self.blob_storage.get_metadata("images", "a.png"), {"style": "x"}
+        )
+        self.assertEqual(self.blob_storage.list_objects("images"), ["a.png"])
+        self.assertIsNone(self.blob_storage.get_object("images", "b.png"))
+
+    def test_push_objects_async(self):
+        urls = asyncio.run(
+            self.blob_storage.push_objects_async(
+                "images", [{"name": "a.png", "path": str(self.path)}]
+            )
+        )
+        self.assertEqual(urls, ["memory://images/a.png"])
+
+    def test_overwrite_and_missing_files(self):
+        obj = {"name": "a.png", "path": str(self.path)}
+        self.blob_storage.push_objects("images", [obj])
+        self.path.write_bytes(b"new image")
+
+        self.assertEqual(self.blob_storage.push_objects("images", [obj]), [])
+        self.assertEqual(self.blob_storage.get_object("images", "a.png"), b"image")
+        self.blob_storage.push_objects("images", [obj], overwrite=True)
+        self.assertEqual(self.blob_storage.get_object("images", "a.png"), b"new image")
+        self.assertEqual(
+            self.blob_storage.push_objects(
+                "images", [{"name": "b.png", "path": "missing.png"}]
+            ),
+            [],
+        )
+        self.assertEqual(self.blob_storage.push_objects("images", []), [])
+
+    def test_upload_stream_and_exists(self):
+        url = self.blob_storage.upload_stream("images", "a.zip", [b"a", b"b"])
+
+        self.assertEqual(url, "memory://images/a.zip")
+        self.assertTrue(self.blob_storage.exists("images", "a.zip"))
+        self.assertFalse(self.blob_storage.exists("images", "b.zip"))
+        with self.assertRaises(FileExistsError):
+            self.blob_storage.upload_stream("images", "a.zip", BytesIO(b"c"))
+        self.blob_storage.upload_stream(
+            "images", "a.zip", BytesIO(b"c"), overwrite=True
+        )
+        self.assertEqual(self.blob_storage.get_object("images", "a.zip"), b"c")
+
+
+if __name__ == "__main__":
+    unittest.main()
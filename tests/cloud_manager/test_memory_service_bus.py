@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import unittest
+
+from cloud_manager.memory_service_bus import InMemoryServiceBus
+
+
+class TestInMemoryServiceBus(unittest.TestCase):
+    def setUp(self):
+        self.service_bus = InMemoryServiceBus(max_delivery_count=2)
+
+    def test_publish_and_consume(self):
+        received = []
+        self.service_bus.publish("queue", ["first", "second"])
+        asyncio.run(self.service_bus.publish_async("queue", ["third"]))
+
+        self.service_bus.consume("queue", received.append)
+
+        self.assertEqual(received, ["first", "second", "third"])
+        self.assertEqual(self.service_bus.queue_length("queue"), 0)
+        self.assertEqual(self.service_bus.in_flight("queue"), 0)
+
+    def test_failed_messages_are_redelivered_then_dead_lettered(self):
+        deliveries = []
+
+        def fail(message):
+            deliveries.append(message)
+            raise RuntimeError("Some error")
+
+        self.service_bus.publish("queue", ["poison"])
+        self.service_bus.consume("queue", fail)
+        self.assertEqual(self.service_bus.peek_messages("queue"), ["poison"])
+        self.service_bus.consume("queue", fail)
+
+        self.assertEqual(deliveries, ["poison", "poison"])
+        self.assertEqual(self.service_bus.queue_length("queue"), 0)
+        self.assertEqual(self.service_bus.dead_letters("queue"), ["poison"])
+
+    def test_consume_indefinitely(self):
+        received = []
+        consumer = threading.Thread(
+            target=self.service_bus.consume_indefinitely,
+            args=("queue", received.append),
+            kwargs={"max_number_messages": 2},
+        )
+        consumer.start()
+        self.service_bus.publish("queue", ["first"])
+        self.service_bus.publish("queue", ["second", "third"])
+        consumer.join(5)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(received, ["first", "second"])
+        self.assertEqual(self.service_bus.peek_messages("queue"), ["third"])
+
+    def test_close_stops_consumers(self):
+        consumer = threading.Thread(
+            target=self.service_bus.consume_indefinitely, args=("queue", print)
+        )
+        consumer.start()
+        self.service_bus.close()
+        consumer.join(5)
+        self.assertFalse(consumer.is_alive())
+
+    def test_max_wait_time(self):
+        self.assertIsNone(self.service_bus.receive("queue", max_wait_time=0.01))
+        self.service_bus.consume_indefinitely("queue", print, max_wait_time=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from cloud_manager.peek_lock_service_bus import MessageLockLostError
+from cloud_manager.sqlite_service_bus import SqliteServiceBus
+
+
+class TestSqliteServiceBus(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = str(Path(self.directory.name) / "service_bus.sqlite3")
+        self.service_bus = self.open()
+
+    def open(self, **kwargs) -> SqliteServiceBus:
+        kwargs.setdefault("max_delivery_count", 2)
+        service_bus = SqliteServiceBus(self.path, poll_interval=0.01, **kwargs)
+        self.addCleanup(service_bus.close)
+        return service_bus
+
+    def test_publish_and_consume(self):
+        received = []
+        self.service_bus.publish("queue", ["first", "second"])
+        asyncio.run(self.service_bus.publish_async("queue", ["third"]))
+
+        self.service_bus.consume("queue", received.append)
+
+        self.assertEqual(received, ["first", "second", "third"])
+        self.assertEqual(self.service_bus.queue_length("queue"), 0)
+        self.assertEqual(self.service_bus.in_flight("queue"), 0)
+
+    def test_failed_messages_are_redelivered_then_dead_lettered(self):
+        deliveries = []
+
+        def fail(message):
+            deliveries.append(message)
+            raise RuntimeError("Some error")
+
+        self.service_bus.publish("queue", ["poison"])
+        self.service_bus.consume("queue", fail)
+        self.assertEqual(self.service_bus.peek_messages("queue"), ["poison"])
+        self.service_bus.consume("queue", fail)
+
+        self.assertEqual(deliveries, ["poison", "poison"])
+        self.assertEqual(self.service_bus.queue_length("queue"), 0)
+        self.assertEqual(self.service_bus.dead_letters("queue"), ["poison"])
+
+    def test_messages_survive_a_restart(self):
+        self.service_bus.publish("queue", ["first", "second"])
+        self.service_bus.close()
+
+        received = []
+        self.open().consume("queue", received.append)
+
+        self.assertEqual(received, ["first", "second"])
+
+    def test_expired_locks_are_delivered_again(self):
+        service_bus = self.open(lock_duration=0.05)
+        service_bus.publish("queue", ["first"])
+        message = service_bus.receive("queue", 0)
+        self.assertIsNone(service_bus.receive("queue", 0))
+        time.sleep(0.1)
+
+        redelivered = service_bus.receive("queue", 0)
+        self.assertEqual(redelivered.body, "first")
+        self.assertEqual(redelivered.delivery_count, 2)
+        with self.assertRaises(MessageLockLostError):
+            service_bus.complete("queue", message)
+        service_bus.complete("queue", redelivered)
+
+    def test_expired_last_delivery_is_dead_lettered(self):
+        service_bus = self.open(lock_duration=0.01, max_delivery_count=1)
+        service_bus.publish("queue", ["first"])
+        service_bus.receive("queue", 0)
+        time.sleep(0.05)
+
+        self.assertIsNone(service_bus.receive("queue", 0))
+        self.assertEqual(service_bus.dead_letters("queue"), ["first"])
+
+    def test_locks_are_renewed_while_processing(self):
+        service_bus = self.open(lock_duration=0.06)
+        service_bus.publish("queue", ["first"])
+
+        service_bus.consume("queue", lambda message: time.sleep(0.15))
+
+        self.assertEqual(service_bus.peek_messages("queue"), [])
+        self.assertEqual(service_bus.dead_letters("queue"), [])
+
+    def test_replay(self):
+        service_bus = self.open(retain_completed=True)
+        service_bus.publish("queue", ["first", "second"])
+        service_bus.consume("queue", print)
+
+        self.assertEqual(service_bus.replay("queue", "replayed"), 2)
+        self.assertEqual(service_bus.peek_messages("replayed"), ["first", "second"])
+        self.assertEqual(service_bus.peek_messages("queue"), [])
+
+    def test_consume_indefinitely_across_instances(self):
+        received = []
+        consumer = threading.Thread(
+            target=self.service_bus.consume_indefinitely,
+            args=("queue", received.append),
+            kwargs={"max_number_messages": 2},
+        )
+        consumer.start()
+        self.open().publish("queue", ["first", "second", "third"])
+        consumer.join(5)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(received, ["first", "second"])
+        self.assertEqual(self.service_bus.peek_messages("queue"), ["third"])
+
+    def test_close_stops_consumers(self):
+        consumer = threading.Thread(
+            target=self.service_bus.consume_indefinitely, args=("queue", print)
+        )
+        consumer.start()
+        time.sleep(0.02)
+        self.service_bus.close()
+        consumer.join(5)
+        self.assertFalse(consumer.is_alive())
+
+    def test_max_wait_time(self):
+        self.assertIsNone(self.service_bus.receive("queue", max_wait_time=0.01))
+        self.service_bus.consume_indefinitely("queue", print, max_wait_time=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
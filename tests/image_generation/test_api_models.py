@@ -19,6 +19,8 @@ class TestModels(unittest.TestCase):
             "num_inference_steps": 50,
             "num_images": 2,
             "seed": 57857,
+            "performance_profile": "balanced",
+            "decoder": "tiny",
         }
 
         # Test if the model correctly validates and transforms the data
@@ -33,6 +35,18 @@ class TestModels(unittest.TestCase):
         with self.assertRaises(ValueError):
             TextToImage(**{**text_to_image_data, "seed": -2})
 
+        # Sizes must be multiples of 8
+        with self.assertRaises(ValueError):
+            TextToImage(**{**text_to_image_data, "height": 500})
+
+        # Performance profiles must exist
+        with self.assertRaises(ValueError):
+            TextToImage(**{**text_to_image_data, "performance_profile": "fastest"})
+
+        # Decoders must exist
+        with self.assertRaises(ValueError):
+            TextToImage(**{**text_to_image_data, "decoder": "preview"})
+
     def test_text_to_style(self):
         # Assume we have a style called 'test_style' in STYLES
         STYLES["test_style"] = [
@@ -69,6 +83,12 @@ class TestModels(unittest.TestCase):
         # Test if the model throws an error for invalid data (non-existent style)
         with self.assertRaises(ValueError):
             TextToStyle(**{**text_to_style_data, "style": "non_existent_style"})
+        with self.assertRaises(ValueError):
+            TextToStyle(**{**text_to_style_data, "width": 500})
+        with self.assertRaises(ValueError):
+            TextToStyle(**{**text_to_style_data, "performance_profile": "fastest"})
+        with self.assertRaises(ValueError):
+            TextToStyle(**{**text_to_style_data, "decoder": "preview"})
 
         # Edge case: number of images is less than number of TextToImage objects
         STYLES["test_style"].append(
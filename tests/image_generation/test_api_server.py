@@ -1,24 +1,138 @@
+import base64
 import io
+import json
+import threading
 import unittest
 import zipfile
+from concurrent.futures import Future
 from unittest.mock import MagicMock, patch
 
 from fastapi.testclient import TestClient
 from PIL import Image
 
+from image_generation import metrics, tracing
+from image_generation.api import server
 from image_generation.api.models import TextToImage, TextToStyle
 from image_generation.api.server import app
+from image_generation.core.job_store import JobStore
 
 client = TestClient(app)
 
 
+def completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
 class TestServer(unittest.TestCase):
+    def setUp(self):
+        # Each test gets a scheduler sized for its own device pool
+        scheduler_patch = patch.object(server, "_scheduler", None)
+        scheduler_patch.start()
+        self.addCleanup(scheduler_patch.stop)
+
+    def get_style_template(self):
+        return {
+            "model_path": "prompthero/openjourney-v4",
+            "model_scheduler": "euler_a",
+            "prompt": {"positive": "portrait", "guidance_scale": 16.5},
+            "height": 688,
+            "width": 512,
+            "num_inference_steps": 50,
+            "num_images": 1,
+            "seed": -1,
+        }
+
     @patch("image_generation.api.server.get_model")
     def test_healthcheck(self, mock_get_model):
         response = client.get("/healthcheck")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json(), {"status": "healthy"})
 
+    def test_ready_while_loading(self):
+        with patch.dict(server._load_state, {"status": "loading"}):
+            response = client.get("/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "loading")
+
+    @patch("image_generation.api.server.get_model")
+    def test_preload_models(self, mock_get_model):
+        mock_handler = MagicMock()
+        mock_handler.model_path = "extra_model"
+        mock_handler.startup_report = {"load_seconds": 1.0}
+        mock_get_model.return_value = mock_handler
+
+        with patch.dict(server._load_state, {}):
+            server.preload_models("default_model", ["extra_model"])
+            self.assertEqual(
+                [call.args[0] for call in mock_get_model.call_args_list],
+                ["extra_model", "default_model"],
+            )
+            mock_handler.load_model.assert_called_with("default_model")
+            self.assertEqual(len(server._load_state["loaded_models"]), 2)
+
+            response = client.get("/ready")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["status"], "ready")
+
+    @patch("image_generation.api.server.get_device_pool")
+    def test_preload_models_device_pool(self, mock_get_device_pool):
+        replicas_loading = threading.Event()
+        replicas_loaded = threading.Event()
+
+        def preload(model_paths):
+            replicas_loading.set()
+            replicas_loaded.wait(5)
+            return [
+                {"model_path": model_path, "device": device}
+                for device in ["cuda:0", "cuda:1"]
+                for model_path in model_paths
+            ]
+
+        mock_get_device_pool.return_value.preload.side_effect = preload
+
+        with patch.dict(server._load_state, {}):
+            preloader = threading.Thread(
+                target=server.preload_models, args=("default_model", ["extra_model"])
+            )
+            preloader.start()
+            self.assertTrue(replicas_loading.wait(5))
+            response = client.get("/ready")
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response.json()["status"], "loading")
+
+            replicas_loaded.set()
+            preloader.join(5)
+
+            mock_get_device_pool.return_value.preload.assert_called_once_with(
+                ["extra_model", "default_model"]
+            )
+            response = client.get("/ready")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [
+                    (report["device"], report["model_path"])
+                    for report in response.json()["loaded_models"]
+                ],
+                [
+                    ("cuda:0", "extra_model"),
+                    ("cuda:0", "default_model"),
+                    ("cuda:1", "extra_model"),
+                    ("cuda:1", "default_model"),
+                ],
+            )
+
+    @patch("image_generation.api.server.get_model")
+    def test_preload_models_failure(self, mock_get_model):
+        mock_get_model.side_effect = Exception("Some error")
+        with patch.dict(server._load_state, {}):
+            server.preload_models("default_model")
+            response = client.get("/ready")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["status"], "failed")
+        self.assertEqual(response.json()["error"], "Some error")
+
     @patch("image_generation.api.server.get_model")
     def test_text_to_image(self, mock_get_model):
         # Mock the get_model function and the txt_to_img method
@@ -49,6 +163,13 @@ class TestServer(unittest.TestCase):
             seed=-1,
         )
 
+        response = client.post(
+            "/text_to_image",
+            json={**text_to_image_data.dict(), "performance_profile": "fastest"},
+        )
+        self.assertEqual(response.status_code, 422)
+        mock_stable_diffusion_handler_instance.txt_to_img.assert_not_called()
+
         response = client.post("/text_to_image", json=text_to_image_data.dict())
         self.assertEqual(response.status_code, 200)
         self.assertEqual(
@@ -63,6 +184,322 @@ class TestServer(unittest.TestCase):
             file_names = zip_file.namelist()
             self.assertEqual(len(file_names), len(set(file_names)))
 
+    @patch("image_generation.api.server.get_device_pool")
+    @patch("image_generation.api.server.get_model")
+    def test_text_to_style_device_pool(self, mock_get_model, mock_get_device_pool):
+        mock_images = [
+            [Image.new("RGB", (512, 688), color="red")],
+            [Image.new("RGB", (512, 688), color="blue")],
+        ]
+        mock_get_device_pool.return_value.size = 2
+        mock_get_device_pool.return_value.submit.side_effect = [
+            completed_future(images) for images in mock_images
+        ]
+
+        with patch(
+            "image_generation.api.models.STYLES",
+            {"some_style_name": [self.get_style_template()]},
+        ):
+            text_to_style_data = TextToStyle(num_images=2, style="some_style_name")
+            response = client.post("/text_to_style", json=text_to_style_data.dict())
+
+        self.assertEqual(response.status_code, 200)
+        mock_get_model.assert_not_called()
+        self.assertEqual(mock_get_device_pool.return_value.submit.call_count, 2)
+        with zipfile.ZipFile(io.BytesIO(response.content), "r") as zip_file:
+            self.assertEqual(len(zip_file.namelist()), 2)
+
+    def get_stream_events(self, response):
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    @patch("image_generation.api.server.get_model")
+    def test_text_to_image_stream(self, mock_get_model):
+        mock_images = [
+            Image.new("RGB", (512, 688), color="red"),
+            Image.new("RGB", (512, 688), color="blue"),
+        ]
+
+        def txt_to_img(text_to_image, on_images=None, on_step=None):
+            for image in mock_images:
+                on_step(1, 1)
+                on_images([image])
+            return mock_images
+
+        mock_get_model.return_value.txt_to_img.side_effect = txt_to_img
+        text_to_image_data = TextToImage(**self.get_style_template())
+
+        response = client.post(
+            "/text_to_image/stream",
+            json=text_to_image_data.dict(),
+            params={"progress": True},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            response.headers["content-type"].startswith("application/x-ndjson")
+        )
+        events = self.get_stream_events(response)
+        self.assertEqual(
+            [event["event"] for event in events],
+            ["progress", "image", "progress", "image", "done"],
+        )
+        self.assertEqual(
+            events[0],
+            {"event": "progress", "request_index": 0, "step": 1, "num_steps": 1},
+        )
+        self.assertEqual(events[-1]["num_images"], 2)
+        image = Image.open(io.BytesIO(base64.b64decode(events[1]["image"])))
+        self.assertEqual(image.getpixel((0, 0)), (255, 0, 0))
+        self.assertEqual(
+            image.info["prompt"], json.dumps(text_to_image_data.dict()["prompt"])
+        )
+        self.assertEqual(
+            events[1]["metadata"]["model_path"], "prompthero/openjourney-v4"
+        )
+        self.assertTrue(events[1]["filename"].endswith(".png"))
+
+    @patch("image_generation.api.server.get_model")
+    def test_text_to_image_stream_without_progress(self, mock_get_model):
+        mock_get_model.return_value.txt_to_img.return_value = []
+        text_to_image_data = TextToImage(**self.get_style_template())
+
+        response = client.post("/text_to_image/stream", json=text_to_image_data.dict())
+
+        self.assertEqual(
+            self.get_stream_events(response), [{"event": "done", "num_images": 0}]
+        )
+        self.assertIsNone(
+            mock_get_model.return_value.txt_to_img.call_args.kwargs["on_step"]
+        )
+
+    @patch("image_generation.api.server.get_model")
+    def test_text_to_image_stream_exception(self, mock_get_model):
+        def txt_to_img(text_to_image, on_images=None, on_step=None):
+            on_images([Image.new("RGB", (8, 8), color="red")])
+            raise Exception("Some error")
+
+        mock_get_model.return_value.txt_to_img.side_effect = txt_to_img
+        text_to_image_data = TextToImage(**self.get_style_template())
+
+        response = client.post("/text_to_image/stream", json=text_to_image_data.dict())
+
+        self.assertEqual(response.status_code, 200)
+        events = self.get_stream_events(response)
+        self.assertEqual([event["event"] for event in events], ["image", "error"])
+
+    @patch("image_generation.api.server.get_device_pool")
+    @patch("image_generation.api.server.get_model")
+    def test_text_to_style_stream_device_pool(
+        self, mock_get_model, mock_get_device_pool
+    ):
+        mock_get_device_pool.return_value.size = 2
+        mock_get_device_pool.return_value.submit.side_effect = [
+            completed_future([Image.new("RGB", (8, 8), color="red")]),
+            completed_future([Image.new("RGB", (8, 8), color="blue")] * 2),
+        ]
+
+        with patch(
+            "image_generation.api.models.STYLES",
+            {"some_style_name": [self.get_style_template()]},
+        ):
+            text_to_style_data = TextToStyle(num_images=2, style="some_style_name")
+            response = client.post(
+                "/text_to_style/stream", json=text_to_style_data.dict()
+            )
+
+        mock_get_model.assert_not_called()
+        events = self.get_stream_events(response)
+        self.assertEqual(
+            sorted(event["request_index"] for event in events[:-1]), [0, 1, 1]
+        )
+        self.assertEqual(events[-1], {"event": "done", "num_images": 3})
+
+    def wait_for_job(self, job_id):
+        for _ in range(500):
+            job = client.get(f"/jobs/{job_id}").json()
+            if job["status"] in ("succeeded", "failed"):
+                return job
+            threading.Event().wait(0.01)
+        raise TimeoutError(f"Job {job_id} did not finish")
+
+    @patch("image_generation.api.server.get_model")
+    def test_job_text_to_image(self, mock_get_model):
+        release = threading.Event()
+
+        def txt_to_img(text_to_image, on_images=None, on_step=None):
+            release.wait(5)
+            on_step(1, 1)
+            images = [Image.new("RGB", (8, 8), color="red")] * 2
+            on_images(images)
+            return images
+
+        mock_get_model.return_value.txt_to_img.side_effect = txt_to_img
+        text_to_image_data = TextToImage(
+            **{**self.get_style_template(), "num_images": 2}
+        )
+
+        with patch.object(server, "_job_store", JobStore(max_jobs=10, ttl_seconds=60)):
+            response = client.post(
+                "/jobs", json={"text_to_image": text_to_image_data.dict()}
+            )
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()["id"]
+            self.assertEqual(response.json()["num_images"], 2)
+
+            response = client.get(f"/jobs/{job_id}/result")
+            self.assertEqual(response.status_code, 409)
+
+            release.set()
+            job = self.wait_for_job(job_id)
+            self.assertEqual(job["status"], "succeeded")
+            self.assertEqual(job["completed_images"], 2)
+            self.assertEqual(job["progress"], 1.0)
+
+            response = client.get(f"/jobs/{job_id}/result")
+            self.assertEqual(response.status_code, 200)
+            with zipfile.ZipFile(io.BytesIO(response.content), "r") as zip_file:
+                self.assertEqual(len(zip_file.namelist()), 2)
+            server._job_store.close()
+
+    @patch("image_generation.api.server.get_model")
+    def test_job_failure(self, mock_get_model):
+        mock_get_model.return_value.txt_to_img.side_effect = Exception("Some error")
+        text_to_image_data = TextToImage(**self.get_style_template())
+
+        with patch.object(server, "_job_store", JobStore(max_jobs=10, ttl_seconds=60)):
+            job_id = client.post(
+                "/jobs", json={"text_to_image": text_to_image_data.dict()}
+            ).json()["id"]
+            job = self.wait_for_job(job_id)
+            response = client.get(f"/jobs/{job_id}/result")
+            server._job_store.close()
+
+        self.assertEqual(job["status"], "failed")
+        self.assertEqual(job["error"], "Some error")
+        self.assertEqual(response.status_code, 409)
+
+    def test_job_not_found(self):
+        with patch.object(server, "_job_store", JobStore(max_jobs=10, ttl_seconds=60)):
+            self.assertEqual(client.get("/jobs/unknown").status_code, 404)
+            self.assertEqual(client.get("/jobs/unknown/result").status_code, 404)
+
+    def test_job_store_full(self):
+        with patch.object(server, "_job_store", JobStore(max_jobs=0, ttl_seconds=60)):
+            response = client.post(
+                "/jobs",
+                json={"text_to_image": TextToImage(**self.get_style_template()).dict()},
+            )
+        self.assertEqual(response.status_code, 503)
+
+    @patch("image_generation.api.server.get_model")
+    def test_priority_and_client_headers(self, mock_get_model):
+        mock_get_model.return_value.txt_to_img.return_value = [
+            Image.new("RGB", (8, 8), color="red")
+        ]
+        text_to_image_data = TextToImage(**self.get_style_template())
+
+        with patch.object(server.RequestScheduler, "run", autospec=True) as mock_run:
+            mock_run.side_effect = lambda scheduler, work, *args, **kwargs: work()
+            client.post("/text_to_image", json=text_to_image_data.dict())
+            client.post(
+                "/text_to_image",
+                json=text_to_image_data.dict(),
+                headers={"X-Priority": "batch", "X-Client-Id": "cron"},
+            )
+
+        self.assertEqual(
+            [call.args[2:4] for call in mock_run.call_args_list],
+            [("interactive", "testclient"), ("batch", "cron")],
+        )
+        self.assertEqual(mock_run.call_args.kwargs["cost"], 50)
+
+    def test_invalid_priority(self):
+        response = client.post(
+            "/text_to_image",
+            json=TextToImage(**self.get_style_template()).dict(),
+            headers={"X-Priority": "urgent"},
+        )
+        self.assertEqual(response.status_code, 422)
+
+    @patch("image_generation.api.server.get_model")
+    def test_queue_stats(self, mock_get_model):
+        mock_get_model.return_value.txt_to_img.return_value = []
+        with patch(
+            "image_generation.api.models.STYLES",
+            {"some_style_name": [self.get_style_template()]},
+        ):
+            text_to_style_data = TextToStyle(num_images=3, style="some_style_name")
+            client.post("/text_to_style", json=text_to_style_data.dict())
+
+        response = client.get("/queue")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["batch"]["dispatched"], 3)
+        self.assertEqual(response.json()["interactive"]["dispatched"], 0)
+
+    @patch("image_generation.api.server.get_model")
+    def test_metrics(self, mock_get_model):
+        metrics.REGISTRY.clear()
+        mock_get_model.return_value.txt_to_img.return_value = [
+            Image.new("RGB", (8, 8), color="red")
+        ]
+        client.post(
+            "/text_to_image", json=TextToImage(**self.get_style_template()).dict()
+        )
+
+        response = client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertIn("api_image_encode_seconds_count 1", response.text)
+        self.assertIn("api_zip_seconds_count 1", response.text)
+        self.assertIn('api_scheduler_queued{priority_class="batch"} 0', response.text)
+
+    @patch("image_generation.api.server.get_model")
+    def test_request_joins_caller_trace(self, mock_get_model):
+        exporter = tracing.InMemorySpanExporter()
+        tracing.add_exporter(exporter)
+        self.addCleanup(tracing.remove_exporter, exporter)
+        trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+        def txt_to_img(text_to_image, on_images=None, on_step=None):
+            with tracing.start_span("txt_to_img"):
+                return [Image.new("RGB", (8, 8), color="red")]
+
+        mock_get_model.return_value.txt_to_img.side_effect = txt_to_img
+        response = client.post(
+            "/text_to_image",
+            json=TextToImage(**self.get_style_template()).dict(),
+            headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"},
+        )
+
+        self.assertEqual(response.headers["X-Correlation-Id"], trace_id)
+        spans = {span.name: span for span in exporter.spans}
+        self.assertEqual(
+            set(spans),
+            {"POST /text_to_image", "generate_request", "txt_to_img", "zip_images"},
+        )
+        self.assertTrue(all(span.trace_id == trace_id for span in spans.values()))
+        self.assertEqual(
+            spans["txt_to_img"].parent_span_id, spans["generate_request"].span_id
+        )
+        self.assertEqual(
+            spans["generate_request"].parent_span_id,
+            spans["POST /text_to_image"].span_id,
+        )
+        self.assertIn("scheduler.wait_seconds", spans["generate_request"].attributes)
+
+    def test_probes_are_not_traced(self):
+        exporter = tracing.InMemorySpanExporter()
+        tracing.add_exporter(exporter)
+        self.addCleanup(tracing.remove_exporter, exporter)
+        response = client.get("/healthcheck")
+        self.assertNotIn("X-Correlation-Id", response.headers)
+        self.assertEqual(exporter.spans, [])
+
+    def test_job_needs_one_request(self):
+        response = client.post("/jobs", json={})
+        self.assertEqual(response.status_code, 422)
+
     @patch("image_generation.api.server.get_model")
     def test_text_to_image_exception(self, mock_get_model):
         mock_get_model.side_effect = Exception("Some error")
@@ -0,0 +1,87 @@
+import unittest
+from unittest.mock import patch
+
+import torch
+
+from image_generation import config
+from image_generation.core.capacity_planner import (
+    CapacityPlanner,
+    is_out_of_memory_error,
+)
+
+GB = 1024**3
+
+
+class TestCapacityPlanner(unittest.TestCase):
+    def setUp(self):
+        self.planner = CapacityPlanner()
+        self.shape = ("model", 512, 512, True)
+
+    def test_estimate_peak_bytes(self):
+        four_images = self.planner.estimate_peak_bytes(512, 512, 4, 8)
+        self.assertEqual(
+            self.planner.estimate_peak_bytes(512, 512, 8, 16), 2 * four_images
+        )
+        self.assertEqual(
+            self.planner.estimate_peak_bytes(512, 512, 4, 8, bytes_per_element=4),
+            2 * four_images,
+        )
+        self.assertGreater(
+            self.planner.estimate_peak_bytes(1024, 1024, 4, 8), 3 * four_images
+        )
+
+    def test_vae_peak_without_slicing(self):
+        sliced = self.planner.estimate_peak_bytes(1024, 1024, 8, 1, vae_slicing=True)
+        not_sliced = self.planner.estimate_peak_bytes(
+            1024, 1024, 8, 1, vae_slicing=False
+        )
+        tiled = self.planner.estimate_peak_bytes(
+            1024, 1024, 8, 1, vae_slicing=False, vae_tiling=True
+        )
+        self.assertGreater(not_sliced, sliced)
+        self.assertLess(tiled, not_sliced)
+
+    def test_max_batch_size_unknown_memory(self):
+        self.assertEqual(self.planner.max_batch_size(self.shape, 8, None, 2), 8)
+
+    def test_max_batch_size_fits_free_memory(self):
+        three_images = self.planner.estimate_peak_bytes(512, 512, 3, 6)
+        with patch.object(config, "CAPACITY_MEMORY_FRACTION", 1.0):
+            batch_size = self.planner.max_batch_size(self.shape, 8, three_images, 2)
+        self.assertEqual(batch_size, 3)
+        # A single image is always attempted
+        self.assertEqual(self.planner.max_batch_size(self.shape, 8, 0, 2), 1)
+
+    def test_record_out_of_memory(self):
+        self.assertEqual(self.planner.record_out_of_memory(self.shape, 8), 4)
+        self.assertEqual(self.planner.max_batch_size(self.shape, 8, None, 2), 4)
+        self.assertEqual(self.planner.max_batch_size(self.shape, 2, None, 2), 2)
+        self.assertEqual(
+            self.planner.max_batch_size(("model", 256, 256, True), 8, None, 2), 8
+        )
+        self.assertEqual(self.planner.record_out_of_memory(self.shape, 1), 0)
+        self.assertEqual(self.planner.max_batch_sizes(), {self.shape: 1})
+
+    def test_start_from_largest_success(self):
+        self.planner.record_success(self.shape, 8)
+        self.assertEqual(self.planner.max_batch_sizes(), {})
+
+        self.planner.record_out_of_memory(self.shape, 6)
+        # 8 worked before but no longer fits
+        self.assertEqual(self.planner.max_batch_sizes(), {self.shape: 3})
+        self.planner.record_success(self.shape, 5)
+        self.planner.record_success(self.shape, 6)
+        self.planner.record_success(self.shape, 4)
+        self.assertEqual(self.planner.max_batch_size(self.shape, 8, None, 2), 5)
+
+    def test_is_out_of_memory_error(self):
+        self.assertTrue(is_out_of_memory_error(torch.cuda.OutOfMemoryError("oom")))
+        self.assertTrue(
+            is_out_of_memory_error(RuntimeError("MPS backend out of memory"))
+        )
+        self.assertFalse(is_out_of_memory_error(RuntimeError("shape mismatch")))
+        self.assertFalse(is_out_of_memory_error(ValueError("out of memory")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+import torch
+
+from image_generation import config
+from image_generation.core import cpu_runtime
+
+
+class TestCpuRuntime(unittest.TestCase):
+    def test_cpu_dtype(self):
+        with patch.object(config, "CPU_DTYPE", "auto"), patch.object(
+            cpu_runtime, "supports_bfloat16", return_value=True
+        ):
+            self.assertEqual(cpu_runtime.cpu_dtype(), torch.bfloat16)
+        with patch.object(config, "CPU_DTYPE", "auto"), patch.object(
+            cpu_runtime, "supports_bfloat16", return_value=False
+        ):
+            self.assertEqual(cpu_runtime.cpu_dtype(), torch.float32)
+        with patch.object(config, "CPU_DTYPE", "float32"):
+            self.assertEqual(cpu_runtime.cpu_dtype(), torch.float32)
+        with patch.object(config, "CPU_DTYPE", "float16"):
+            with self.assertRaises(ValueError):
+                cpu_runtime.cpu_dtype()
+
+    def test_configure_cpu_threads(self):
+        num_threads = torch.get_num_threads()
+        try:
+            with patch.object(config, "CPU_THREADS", 2):
+                self.assertEqual(cpu_runtime.configure_cpu_threads(), 2)
+            with patch.object(config, "CPU_THREADS", 0):
+                self.assertEqual(cpu_runtime.configure_cpu_threads(), 2)
+        finally:
+            torch.set_num_threads(num_threads)
+            torch.set_flush_denormal(False)
+
+    def test_configure_compile_cache(self):
+        cache_size_limit = torch._dynamo.config.cache_size_limit
+        try:
+            with patch.object(
+                config, "RESOLUTION_BUCKETS", ["688x512", "512x688", "1024x1024"]
+            ), patch.object(
+                config, "COMPILE_CACHE_DIR", "models/compile_cache"
+            ), patch.dict(
+                "os.environ"
+            ):
+                cpu_runtime.configure_compile_cache()
+                self.assertEqual(
+                    os.environ["TORCHINDUCTOR_CACHE_DIR"], "models/compile_cache"
+                )
+            self.assertGreaterEqual(torch._dynamo.config.cache_size_limit, 24)
+        finally:
+            torch._dynamo.config.cache_size_limit = cache_size_limit
+
+    def test_optimize_for_cpu(self):
+        pipe = MagicMock()
+        self.assertEqual(cpu_runtime.optimize_for_cpu(pipe, torch.float32), "none")
+
+        unet = torch.nn.Linear(2, 2)
+        pipe.unet = unet
+        with patch.object(cpu_runtime, "ipex", None), patch.object(
+            config, "CPU_COMPILE", False
+        ):
+            self.assertEqual(cpu_runtime.optimize_for_cpu(pipe, torch.float32), "none")
+            self.assertIs(pipe.unet, unet)
+
+        with patch.object(cpu_runtime, "ipex", None), patch.object(
+            config, "CPU_COMPILE", True
+        ), patch("torch.compile", return_value="compiled") as mock_compile:
+            self.assertEqual(
+                cpu_runtime.optimize_for_cpu(pipe, torch.float32), "torch_compile"
+            )
+            mock_compile.assert_called_once_with(unet, dynamic=False)
+            self.assertEqual(pipe.unet, "compiled")
+
+        pipe.unet = unet
+        mock_ipex = MagicMock()
+        with patch.object(cpu_runtime, "ipex", mock_ipex):
+            self.assertEqual(cpu_runtime.optimize_for_cpu(pipe, torch.bfloat16), "ipex")
+            mock_ipex.optimize.assert_called_once_with(
+                unet, dtype=torch.bfloat16, inplace=True
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import torch
+from diffusers.image_processor import VaeImageProcessor
+
+from benchmarks.tiny_pipeline import build_tiny_decoder
+from image_generation import config
+from image_generation.core.decoders import (
+    AutoencoderTiny,
+    LatentDecoder,
+    StableDiffusionXLPipeline,
+    load_tiny_decoder,
+    resolve_decoder,
+)
+
+
+class TestDecoders(unittest.TestCase):
+    def test_resolve_decoder(self):
+        with patch.object(config, "DEFAULT_DECODER", "tiny"):
+            self.assertEqual(resolve_decoder(None), "tiny")
+            self.assertEqual(resolve_decoder("vae"), "vae")
+        with self.assertRaises(ValueError):
+            resolve_decoder("preview")
+
+    def test_load_tiny_decoder(self):
+        with patch.object(AutoencoderTiny, "from_pretrained") as mock_from_pretrained:
+            load_tiny_decoder(MagicMock(), "cpu", torch.float32)
+            mock_from_pretrained.assert_called_with(
+                config.TINY_VAE_MODEL, torch_dtype=torch.float32
+            )
+            load_tiny_decoder(
+                MagicMock(spec=StableDiffusionXLPipeline), "cpu", torch.float32
+            )
+            mock_from_pretrained.assert_called_with(
+                config.TINY_VAE_XL_MODEL, torch_dtype=torch.float32
+            )
+
+    def test_latent_decoder(self):
+        latent_decoder = LatentDecoder(
+            build_tiny_decoder(), VaeImageProcessor(vae_scale_factor=2), "cpu"
+        )
+        latents = torch.randn(3, 4, 16, 8)
+
+        images = latent_decoder.decode(latents)
+        self.assertEqual(len(images), 3)
+        self.assertEqual(images[0].size, (16, 32))
+
+        future = latent_decoder.submit(latents)
+        self.assertEqual([image.size for image in future.result()], [(16, 32)] * 3)
+
+        latent_decoder.close()
+        with self.assertRaises(RuntimeError):
+            latent_decoder.submit(latents)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from PIL import Image
+
+from image_generation.api.models import Prompt, TextToImage
+from image_generation.core.device_pool import DevicePool, available_devices
+
+
+class FakeHandler:
+    def __init__(self, model_path, device=None):
+        self.model_path = model_path
+        self.device = device
+        self.loaded_models = [model_path]
+
+    @property
+    def startup_report(self):
+        return {
+            "model_path": self.model_path,
+            "device": f"{os.getpid()}:{self.device}",
+            "loaded_models": list(self.loaded_models),
+        }
+
+    def load_model(self, model_path):
+        time.sleep(0.1)
+        self.model_path = model_path
+        self.loaded_models.append(model_path)
+
+    def txt_to_img(self, text_to_image):
+        time.sleep(0.1)
+        image = Image.new("RGB", (text_to_image.width, text_to_image.height))
+        image.info["worker"] = f"{os.getpid()}:{self.device}"
+        return [image] * text_to_image.num_images
+
+
+class FailingOnceHandler(FakeHandler):
+    """
+    Fails to load models named after a missing marker file, creating it, so that only
+    the first of several worker processes fails.
+    """
+
+    def load_model(self, model_path):
+        try:
+            os.close(os.open(model_path, os.O_CREAT | os.O_EXCL))
+        except FileExistsError:
+            return super().load_model(model_path)
+        raise RuntimeError(f"Could not load {model_path}")
+
+
+def get_text_to_images(count):
+    return [
+        TextToImage(
+            prompt=Prompt(positive=f"prompt {index}", guidance_scale=0.0),
+            height=8,
+            width=8 * (index + 1),
+            num_inference_steps=1,
+            num_images=1,
+        )
+        for index in range(count)
+    ]
+
+
+class TestDevicePool(unittest.TestCase):
+    def test_available_devices(self):
+        with patch("torch.cuda.is_available", return_value=False):
+            self.assertEqual(available_devices(), [])
+        with patch("torch.cuda.is_available", return_value=True), patch(
+            "torch.cuda.device_count", return_value=4
+        ):
+            self.assertEqual(available_devices(2), ["cuda:0", "cuda:1"])
+
+    def test_device_replicas(self):
+        pool = DevicePool(
+            "model_path", devices=["fake:0", "fake:1"], handler_factory=FakeHandler
+        )
+        try:
+            results = pool.map(get_text_to_images(6))
+        finally:
+            pool.close()
+
+        self.assertEqual(
+            [images[0].width for images in results], [8, 16, 24, 32, 40, 48]
+        )
+        workers = {images[0].info["worker"].split(":", 1)[1] for images in results}
+        self.assertEqual(workers, {"fake:0", "fake:1"})
+
+    def test_cpu_worker_processes(self):
+        pool = DevicePool("model_path", num_cpu_workers=2, handler_factory=FakeHandler)
+        try:
+            results = pool.map(get_text_to_images(6))
+        finally:
+            pool.close()
+
+        self.assertEqual(
+            [images[0].width for images in results], [8, 16, 24, 32, 40, 48]
+        )
+        pids = {images[0].info["worker"].split(":")[0] for images in results}
+        self.assertEqual(len(pids), 2)
+        self.assertNotIn(str(os.getpid()), pids)
+
+    def test_preload_device_replicas(self):
+        pool = DevicePool(
+            "model_path", devices=["fake:0", "fake:1"], handler_factory=FakeHandler
+        )
+        try:
+            reports = pool.preload(["extra_model", "model_path"])
+        finally:
+            pool.close()
+
+        self.assertEqual(
+            [
+                (report["device"].split(":", 1)[1], report["model_path"])
+                for report in reports
+            ],
+            [
+                ("fake:0", "extra_model"),
+                ("fake:0", "model_path"),
+                ("fake:1", "extra_model"),
+                ("fake:1", "model_path"),
+            ],
+        )
+
+    def test_preload_cpu_worker_processes(self):
+        pool = DevicePool("model_path", num_cpu_workers=2, handler_factory=FakeHandler)
+        try:
+            reports = pool.preload(["extra_model", "model_path"])
+        finally:
+            pool.close()
+
+        # Every worker process loaded both models, the default one last
+        self.assertEqual(len(reports), 4)
+        workers = {report["device"] for report in reports}
+        self.assertEqual(len(workers), 2)
+        for worker in workers:
+            self.assertEqual(
+                [
+                    report["loaded_models"]
+                    for report in reports
+                    if report["device"] == worker
+                ][-1],
+                ["model_path", "extra_model", "model_path"],
+            )
+
+    def test_preload_cpu_worker_failure(self):
+        pool = DevicePool(
+            "model_path", num_cpu_workers=2, handler_factory=FailingOnceHandler
+        )
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                marker = f"{directory}/broken_model"
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    preload = executor.submit(pool.preload, [marker])
+                    # The worker that loaded its model is released, not left waiting
+                    with self.assertRaisesRegex(RuntimeError, "Could not load"):
+                        preload.result(timeout=60)
+
+                # The workers are released for the next preload
+                reports = pool.preload([marker])
+        finally:
+            pool.close()
+
+        self.assertEqual(len(reports), 2)
+
+    def test_invalid_cpu_workers(self):
+        with self.assertRaises(ValueError):
+            DevicePool("model_path", num_cpu_workers=0, handler_factory=FakeHandler)
+
+
+if __name__ == "__main__":
+    unittest.main()
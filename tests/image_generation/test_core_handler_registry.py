@@ -0,0 +1,64 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import torch
+
+from image_generation.core.handler_registry import HandlerRegistry
+from image_generation.core.stable_diffusion import select_device
+
+
+class TestHandlerRegistry(unittest.TestCase):
+    def setUp(self):
+        def slow_factory(model_path, device=None):
+            time.sleep(0.05)
+            return MagicMock(model_path=model_path, device=device)
+
+        self.factory = MagicMock(side_effect=slow_factory)
+        self.registry = HandlerRegistry(handler_factory=self.factory)
+
+    def test_concurrent_get_creates_one_handler(self):
+        handlers = []
+        threads = [
+            threading.Thread(
+                target=lambda: handlers.append(self.registry.get("model_path"))
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The registry chooses the device, so the handler is registered under it
+        self.factory.assert_called_once_with("model_path", device=select_device())
+        self.assertEqual(len(handlers), 8)
+        self.assertTrue(all(handler is handlers[0] for handler in handlers))
+
+    def test_one_handler_per_device(self):
+        cpu_handler = self.registry.get("model_path", device="cpu")
+        cuda_handler = self.registry.get("model_path", device="cuda:0")
+        self.assertIsNot(cpu_handler, cuda_handler)
+        self.assertIs(self.registry.get("other_model", device="cpu"), cpu_handler)
+        self.assertEqual(set(self.registry.handlers()), {"cpu", "cuda:0"})
+
+        self.registry.clear()
+        self.assertEqual(self.registry.handlers(), {})
+
+    def test_same_device_names_share_a_handler(self):
+        with patch(
+            "image_generation.core.handler_registry.select_device",
+            side_effect=lambda device=None: torch.device(device or "cuda"),
+        ):
+            handler = self.registry.get("model_path")
+            self.assertIs(self.registry.get("model_path", device="cuda"), handler)
+            self.assertIs(self.registry.get("model_path", device="cuda:0"), handler)
+            self.assertIsNot(self.registry.get("model_path", device="cuda:1"), handler)
+
+        self.assertEqual(set(self.registry.handlers()), {"cuda:0", "cuda:1"})
+        self.assertEqual(self.factory.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import io
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from image_generation.api.models import Prompt, TextToImage
+from image_generation.core.job_store import (
+    Job,
+    JobStatusEnum,
+    JobStore,
+    JobStoreFullError,
+)
+
+
+def get_text_to_image(num_images=2):
+    return TextToImage(
+        prompt=Prompt(positive="A castle", guidance_scale=5.0),
+        height=512,
+        width=512,
+        num_inference_steps=10,
+        num_images=num_images,
+    )
+
+
+def wait_until_finished(job, timeout=5):
+    for _ in range(int(timeout * 100)):
+        if job.finished:
+            return
+        threading.Event().wait(0.01)
+    raise TimeoutError(f"Job {job.id} did not finish")
+
+
+class TestJob(unittest.TestCase):
+    def test_progress_and_eta(self):
+        job = Job([get_text_to_image(num_images=2), get_text_to_image(num_images=2)])
+        self.assertEqual(job.num_images, 4)
+        self.assertEqual(job.progress(), 0.0)
+        self.assertIsNone(job.eta_seconds())
+
+        job.status = JobStatusEnum.RUNNING
+        job.started_at = 100.0
+        job.record_images([None])
+        job.record_step(5, 10)
+        self.assertAlmostEqual(job.progress(), 1.5 / 4)
+        self.assertAlmostEqual(job.eta_seconds(now=115.0), 25.0)
+
+        job.status = JobStatusEnum.SUCCEEDED
+        self.assertEqual(job.progress(), 1.0)
+        self.assertEqual(job.eta_seconds(), 0.0)
+        self.assertEqual(job.to_dict()["status"], "succeeded")
+
+
+class TestJobStore(unittest.TestCase):
+    def test_submit_runs_job_and_keeps_result(self):
+        job_store = JobStore(max_jobs=10, ttl_seconds=60)
+
+        def run(job):
+            job.record_images([None, None])
+            return io.BytesIO(b"zip")
+
+        job = job_store.submit([get_text_to_image()], run)
+        wait_until_finished(job)
+
+        self.assertIs(job_store.get(job.id), job)
+        self.assertEqual(job.status, JobStatusEnum.SUCCEEDED)
+        self.assertEqual(job.completed_images, 2)
+        self.assertEqual(job_store.result(job.id).read(), b"zip")
+        job_store.close()
+
+    def test_failed_job(self):
+        job_store = JobStore(max_jobs=10, ttl_seconds=60)
+
+        def run(job):
+            raise RuntimeError("Some error")
+
+        job = job_store.submit([get_text_to_image()], run)
+        wait_until_finished(job)
+
+        self.assertEqual(job.status, JobStatusEnum.FAILED)
+        self.assertEqual(job.error, "Some error")
+        self.assertIsNone(job_store.result(job.id))
+        job_store.close()
+
+    def test_full_store_evicts_finished_jobs_and_rejects_unfinished(self):
+        job_store = JobStore(max_jobs=2, ttl_seconds=60)
+        release = threading.Event()
+
+        def blocked_run(job):
+            release.wait(5)
+            return io.BytesIO(b"zip")
+
+        finished_job = job_store.submit(
+            [get_text_to_image()], lambda job: io.BytesIO(b"zip")
+        )
+        wait_until_finished(finished_job)
+        running_job = job_store.submit([get_text_to_image()], blocked_run)
+        queued_job = job_store.submit([get_text_to_image()], blocked_run)
+
+        self.assertIsNone(job_store.get(finished_job.id))
+        with self.assertRaises(JobStoreFullError):
+            job_store.submit([get_text_to_image()], blocked_run)
+        release.set()
+        wait_until_finished(running_job)
+        wait_until_finished(queued_job)
+        job_store.close()
+
+    def test_expired_jobs_are_evicted(self):
+        job_store = JobStore(max_jobs=10, ttl_seconds=60)
+        job = job_store.submit([get_text_to_image()], lambda job: io.BytesIO(b"zip"))
+        wait_until_finished(job)
+
+        with patch("image_generation.core.job_store.time.time") as mock_time:
+            mock_time.return_value = job.finished_at + 61
+            self.assertIsNone(job_store.get(job.id))
+        job_store.close()
+
+    def test_results_spill_to_disk_beyond_memory_budget(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            job_store = JobStore(
+                max_jobs=1, ttl_seconds=60, spill_dir=spill_dir, max_memory_bytes=4
+            )
+            in_memory_job = job_store.submit(
+                [get_text_to_image()], lambda job: io.BytesIO(b"abc")
+            )
+            wait_until_finished(in_memory_job)
+            self.assertEqual(list(Path(spill_dir).iterdir()), [])
+
+            job_store.max_jobs = 2
+            spilled_job = job_store.submit(
+                [get_text_to_image()], lambda job: io.BytesIO(b"defgh")
+            )
+            wait_until_finished(spilled_job)
+            spill_path = Path(spill_dir) / f"{spilled_job.id}.zip"
+            self.assertTrue(spill_path.exists())
+            with job_store.result(spilled_job.id) as result:
+                self.assertEqual(result.read(), b"defgh")
+            self.assertEqual(job_store.result(in_memory_job.id).read(), b"abc")
+
+            # Evicting a spilled job removes its file
+            job_store.max_jobs = 1
+            job_store.submit([get_text_to_image()], lambda job: io.BytesIO(b"i"))
+            job_store.close()
+            self.assertIsNone(job_store.get(in_memory_job.id))
+            self.assertIsNone(job_store.get(spilled_job.id))
+            self.assertFalse(spill_path.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
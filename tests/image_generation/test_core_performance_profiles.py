@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import torch
+
+from image_generation import config
+from image_generation.core.performance_profiles import (
+    GB,
+    PerformanceProfileHandler,
+    free_device_memory,
+    pipeline_weights_bytes,
+)
+
+
+class TestPerformanceProfiles(unittest.TestCase):
+    def setUp(self):
+        self.cuda = torch.device("cuda")
+        self.component_bytes = {"unet": 3 * GB, "text_encoder": GB}
+
+    def resolve(self, profile_name, free_memory, device=None):
+        return PerformanceProfileHandler.resolve(
+            profile_name, device or self.cuda, free_memory, self.component_bytes
+        )
+
+    def test_auto_profile_by_headroom(self):
+        with patch.object(config, "MAX_THROUGHPUT_HEADROOM_GB", 8.0), patch.object(
+            config, "BALANCED_HEADROOM_GB", 3.0
+        ):
+            self.assertEqual(self.resolve("auto", 20 * GB)["profile"], "max_throughput")
+            self.assertEqual(self.resolve(None, 8 * GB)["profile"], "balanced")
+            self.assertEqual(self.resolve("auto", 5 * GB)["profile"], "low_memory")
+            self.assertEqual(self.resolve("auto", None)["profile"], "low_memory")
+
+    def test_explicit_profile(self):
+        settings = self.resolve("max_throughput", 20 * GB)
+        self.assertEqual(settings["requested_profile"], "max_throughput")
+        self.assertEqual(settings["weights_bytes"], 4 * GB)
+        self.assertFalse(settings["attention_slicing"])
+        self.assertTrue(settings["channels_last"])
+        self.assertEqual(settings["offload"], "none")
+
+    def test_offload_when_weights_do_not_fit(self):
+        self.assertEqual(self.resolve("balanced", 3.5 * GB)["offload"], "model")
+        settings = self.resolve("balanced", 2 * GB)
+        self.assertEqual(settings["offload"], "sequential")
+        self.assertTrue(settings["vae_tiling"])
+
+    def test_cpu_keeps_weights_resident(self):
+        cpu = torch.device("cpu")
+        for profile_name in ["low_memory", "balanced", "max_throughput"]:
+            settings = self.resolve(profile_name, GB, device=cpu)
+            self.assertEqual(settings["offload"], "none")
+            self.assertTrue(settings["channels_last"])
+        self.assertEqual(
+            self.resolve("auto", None, device=cpu)["profile"], "low_memory"
+        )
+
+    def test_invalid_profile(self):
+        with self.assertRaises(ValueError):
+            self.resolve("fastest", None)
+
+    def test_apply_fresh_pipeline(self):
+        pipe = MagicMock()
+        PerformanceProfileHandler.apply(
+            pipe, self.cuda, self.resolve("max_throughput", 20 * GB)
+        )
+        pipe.to.assert_called_once_with(self.cuda)
+        pipe.enable_attention_slicing.assert_not_called()
+        pipe.unet.set_attn_processor.assert_called_once()
+        pipe.vae.enable_slicing.assert_not_called()
+        pipe.unet.to.assert_called_once_with(memory_format=torch.channels_last)
+
+        pipe = MagicMock()
+        PerformanceProfileHandler.apply(
+            pipe, self.cuda, self.resolve("balanced", 3.5 * GB)
+        )
+        pipe.enable_model_cpu_offload.assert_called_once_with(device=self.cuda)
+        pipe.to.assert_not_called()
+        pipe.vae.enable_tiling.assert_called_once()
+
+    def test_apply_over_previous_settings(self):
+        pipe = MagicMock()
+        previous = self.resolve("low_memory", 20 * GB)
+        PerformanceProfileHandler.apply(
+            pipe, self.cuda, self.resolve("max_throughput", 20 * GB), previous=previous
+        )
+        pipe.to.assert_not_called()
+        pipe.vae.disable_slicing.assert_called_once()
+        pipe.unet.set_attn_processor.assert_called_once()
+        pipe.unet.to.assert_called_once_with(memory_format=torch.channels_last)
+
+        pipe = MagicMock()
+        PerformanceProfileHandler.apply(
+            pipe, self.cuda, previous, previous=self.resolve("max_throughput", 20 * GB)
+        )
+        pipe.enable_attention_slicing.assert_called_once_with(1)
+        pipe.unet.to.assert_called_once_with(memory_format=torch.contiguous_format)
+
+    def test_free_device_memory(self):
+        with patch("torch.cuda.mem_get_info", return_value=(2 * GB, 8 * GB)):
+            self.assertEqual(free_device_memory(self.cuda), 2 * GB)
+        with patch("torch.cuda.mem_get_info", side_effect=RuntimeError("no GPU")):
+            self.assertIsNone(free_device_memory(self.cuda))
+        with patch("image_generation.core.performance_profiles.psutil") as mock_psutil:
+            mock_psutil.virtual_memory.return_value.available = 16 * GB
+            self.assertEqual(free_device_memory(torch.device("cpu")), 16 * GB)
+        with patch("image_generation.core.performance_profiles.psutil", None):
+            self.assertIsNone(free_device_memory(torch.device("cpu")))
+
+    def test_pipeline_weights_bytes(self):
+        pipe = MagicMock()
+        pipe.components = {
+            "unet": torch.nn.Linear(4, 4, bias=False),
+            "scheduler": object(),
+        }
+        self.assertEqual(pipeline_weights_bytes(pipe), {"unet": 16 * 4})
+        self.assertEqual(pipeline_weights_bytes(MagicMock()), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
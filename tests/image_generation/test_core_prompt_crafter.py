@@ -6,6 +6,7 @@ from unittest.mock import patch
 import numpy as np
 
 from image_generation.core.prompt_crafter import PromptCrafter
+from image_generation.core.style_registry import parse_template
 
 
 class TestPromptCrafter(unittest.TestCase):
@@ -110,6 +111,25 @@ class TestPromptCrafter(unittest.TestCase):
         self.assertNotIn("{character}", filled_prompt)
         self.assertNotIn("{setting}", filled_prompt)
 
+    def test_fill_template_draws_like_fill_placeholder(self):
+        prompt = (
+            "A {character} and a {character} with {objects} in {setting}, {unknown}."
+        )
+        random.seed(7)
+        prompt_crafter = PromptCrafter(self.sample_styles, self.sample_variables)
+        filled_prompt = prompt_crafter.fill_template(parse_template(prompt))
+
+        random.seed(7)
+        prompt_crafter = PromptCrafter(self.sample_styles, self.sample_variables)
+        expected_prompt = prompt
+        for var in prompt_crafter.variables:
+            expected_prompt = prompt_crafter.fill_placeholder(
+                expected_prompt, var, f"{{{var[:-1]}}}", f"{{{var}}}"
+            )
+
+        self.assertEqual(filled_prompt, expected_prompt)
+        self.assertTrue(filled_prompt.endswith(", {unknown}."))
+
     def test_exceed_unique_combinations(self):
         num_images = 1000  # an arbitrary large number
         prompts = self.prompt_crafter.generate_prompts("style1", num_images)
@@ -0,0 +1,138 @@
+import threading
+import time
+import unittest
+
+from image_generation.core.request_scheduler import (
+    RequestScheduler,
+    parse_client_weights,
+    validate_priority_class,
+)
+
+
+class TestRequestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.order = []
+        self.threads = []
+
+    def tearDown(self):
+        for thread in self.threads:
+            thread.join(5)
+
+    def block(self, scheduler):
+        """
+        Occupy the only slot of the scheduler until the returned event is set.
+        """
+        release = threading.Event()
+        started = threading.Event()
+
+        def work():
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=scheduler.run, args=(work,))
+        thread.start()
+        self.threads.append(thread)
+        started.wait(5)
+        return release
+
+    def enqueue(self, scheduler, name, priority_class, client_id, cost=1.0):
+        queued = sum(stats["queued"] for stats in scheduler.stats().values())
+        thread = threading.Thread(
+            target=scheduler.run,
+            args=(lambda: self.order.append(name), priority_class, client_id, cost),
+        )
+        thread.start()
+        self.threads.append(thread)
+        # Wait until the item is queued, so the arrival order is deterministic
+        while sum(stats["queued"] for stats in scheduler.stats().values()) == queued:
+            time.sleep(0.001)
+
+    def run_queued(self, release):
+        release.set()
+        for thread in self.threads:
+            thread.join(5)
+
+    def test_interactive_work_runs_before_queued_batch_work(self):
+        scheduler = RequestScheduler(capacity=1)
+        release = self.block(scheduler)
+        self.enqueue(scheduler, "style prompt 1", "batch", "cron")
+        self.enqueue(scheduler, "style prompt 2", "batch", "cron")
+        self.enqueue(scheduler, "interactive", "interactive", "user")
+
+        self.run_queued(release)
+
+        self.assertEqual(
+            self.order, ["interactive", "style prompt 1", "style prompt 2"]
+        )
+
+    def test_weighted_fair_share_between_clients(self):
+        scheduler = RequestScheduler(capacity=1, client_weights={"heavy": 2.0})
+        release = self.block(scheduler)
+        for index in range(4):
+            self.enqueue(scheduler, f"light {index}", "batch", "light")
+        for index in range(4):
+            self.enqueue(scheduler, f"heavy {index}", "batch", "heavy")
+
+        self.run_queued(release)
+
+        # The heavy client gets two turns for each turn of the light client
+        self.assertEqual(
+            self.order[:6],
+            ["light 0", "heavy 0", "heavy 1", "light 1", "heavy 2", "heavy 3"],
+        )
+
+    def test_capacity_runs_items_concurrently(self):
+        scheduler = RequestScheduler(capacity=2)
+        barrier = threading.Barrier(2, timeout=5)
+        threads = [
+            threading.Thread(target=scheduler.run, args=(barrier.wait,))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertFalse(barrier.broken)
+
+    def test_stats(self):
+        scheduler = RequestScheduler(capacity=1)
+        release = self.block(scheduler)
+        self.enqueue(scheduler, "style prompt", "batch", "cron")
+
+        stats = scheduler.stats()
+        self.assertEqual(stats["interactive"]["running"], 1)
+        self.assertEqual(stats["batch"]["queued"], 1)
+
+        self.run_queued(release)
+        stats = scheduler.stats()
+        self.assertEqual(stats["batch"]["dispatched"], 1)
+        self.assertEqual(stats["batch"]["queued"], 0)
+        self.assertGreater(stats["batch"]["max_wait_seconds"], 0)
+
+    def test_work_errors_release_the_slot(self):
+        scheduler = RequestScheduler(capacity=1)
+
+        def fail():
+            raise RuntimeError("Some error")
+
+        with self.assertRaises(RuntimeError):
+            scheduler.run(fail)
+        self.assertEqual(scheduler.run(lambda: "done"), "done")
+
+    def test_invalid_priority_class(self):
+        with self.assertRaises(ValueError):
+            validate_priority_class("urgent")
+        with self.assertRaises(ValueError):
+            RequestScheduler().run(lambda: None, priority_class="urgent")
+
+    def test_parse_client_weights(self):
+        self.assertEqual(
+            parse_client_weights(["cron=0.5", " web = 2"]), {"cron": 0.5, "web": 2.0}
+        )
+        for invalid in ["cron", "cron=abc", "cron=0", "=2"]:
+            with self.assertRaises(ValueError):
+                parse_client_weights([invalid])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from PIL import Image
+
+from image_generation.core.resolution_buckets import (
+    fit_to_size,
+    parse_buckets,
+    snap_to_bucket,
+    validate_size,
+)
+
+
+class TestResolutionBuckets(unittest.TestCase):
+    def setUp(self):
+        self.buckets = [(512, 512), (688, 512), (512, 688), (1024, 1024)]
+
+    def test_validate_size(self):
+        self.assertEqual(validate_size(688), 688)
+        for size in [0, -8, 500]:
+            with self.assertRaises(ValueError):
+                validate_size(size)
+
+    def test_parse_buckets(self):
+        self.assertEqual(
+            parse_buckets(["688x512", " 1024X1024 "]), [(688, 512), (1024, 1024)]
+        )
+        for bucket in ["688", "688x500", "tall"]:
+            with self.assertRaises(ValueError):
+                parse_buckets([bucket])
+
+    def test_snap_to_bucket(self):
+        self.assertEqual(snap_to_bucket(688, 512, self.buckets), (688, 512))
+        self.assertEqual(snap_to_bucket(640, 480, self.buckets), (688, 512))
+        self.assertEqual(snap_to_bucket(480, 640, self.buckets), (512, 688))
+        self.assertEqual(snap_to_bucket(768, 768, self.buckets), (1024, 1024))
+        # Nothing covers it: the largest bucket with the closest aspect ratio
+        self.assertEqual(snap_to_bucket(1376, 1024, self.buckets), (688, 512))
+        self.assertEqual(snap_to_bucket(400, 304, []), (400, 304))
+
+    def test_fit_to_size(self):
+        image = Image.new("RGB", (512, 688))
+        self.assertIs(fit_to_size(image, 688, 512), image)
+        self.assertEqual(fit_to_size(image, 640, 480).size, (480, 640))
+        self.assertEqual(fit_to_size(image, 512, 512).size, (512, 512))
+        self.assertEqual(fit_to_size(image, 1376, 1024).size, (1024, 1376))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+from PIL import Image
+
+from image_generation import config
+from image_generation.api.models import Prompt, TextToImage
+from image_generation.core.result_cache import (
+    ResultCache,
+    decode_images,
+    encode_images,
+    model_revision,
+    request_cache_key,
+)
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self.temp_dir.name, max_bytes=1024 * 1024)
+        self.images = [
+            Image.new("RGB", (8, 8), color="red"),
+            Image.new("RGB", (8, 8), color="blue"),
+        ]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def get_text_to_image(self, seed=1234, positive="A landscape"):
+        return TextToImage(
+            prompt=Prompt(positive=positive, guidance_scale=0.0),
+            height=8,
+            width=8,
+            num_inference_steps=2,
+            num_images=2,
+            seed=seed,
+        )
+
+    def test_request_cache_key(self):
+        self.assertEqual(
+            request_cache_key(self.get_text_to_image()),
+            request_cache_key(self.get_text_to_image()),
+        )
+        self.assertNotEqual(
+            request_cache_key(self.get_text_to_image()),
+            request_cache_key(self.get_text_to_image(seed=1)),
+        )
+
+    def test_request_cache_key_environment(self):
+        text_to_image = self.get_text_to_image()
+        key = request_cache_key(text_to_image, {"device": "cuda", "dtype": "float16"})
+
+        self.assertNotEqual(
+            key,
+            request_cache_key(text_to_image, {"device": "cpu", "dtype": "bfloat16"}),
+        )
+        with patch.object(config, "RESOLUTION_BUCKETS", ["512x512"]):
+            self.assertNotEqual(
+                key,
+                request_cache_key(
+                    text_to_image, {"device": "cuda", "dtype": "float16"}
+                ),
+            )
+        with patch(
+            "image_generation.core.result_cache.try_to_load_from_cache",
+            return_value=f"/hub/models--a--b/snapshots/{'0' * 40}/model_index.json",
+        ):
+            self.assertEqual(model_revision("a/b"), "0" * 40)
+            self.assertNotEqual(
+                key,
+                request_cache_key(
+                    text_to_image, {"device": "cuda", "dtype": "float16"}
+                ),
+            )
+
+    def test_encode_decode_images(self):
+        decoded = decode_images(encode_images(self.images))
+        self.assertEqual(
+            [image.getpixel((0, 0)) for image in decoded], [(255, 0, 0), (0, 0, 255)]
+        )
+
+    def test_put_and_get_images(self):
+        text_to_image = self.get_text_to_image()
+        self.assertIsNone(self.cache.get_images(text_to_image))
+        self.cache.put_images(text_to_image, self.images)
+
+        images = ResultCache(self.temp_dir.name, 1024 * 1024).get_images(text_to_image)
+        self.assertEqual(len(images), 2)
+
+    def test_random_seed_is_not_cached(self):
+        text_to_image = self.get_text_to_image(seed=-1)
+        self.cache.put_images(text_to_image, self.images)
+        self.assertIsNone(self.cache.get_images(text_to_image))
+        self.assertEqual(self.cache._sizes, {})
+
+    def test_lru_eviction(self):
+        data = b"0" * 400
+        cache = ResultCache(self.temp_dir.name, max_bytes=1000)
+        cache.put("first", data)
+        cache.put("second", data)
+        cache.get("first")  # "second" is now the least recently used
+        cache.put("third", data)
+
+        self.assertIsNotNone(cache.get("first"))
+        self.assertIsNone(cache.get("second"))
+        self.assertIsNotNone(cache.get("third"))
+
+    def test_blob_storage_tier(self):
+        blob_storage = MagicMock()
+        blob_storage.get_object.return_value = b"data"
+        cache = ResultCache(
+            self.temp_dir.name, 1024, blob_storage=blob_storage, blob_container="test"
+        )
+
+        self.assertEqual(cache.get("key"), b"data")
+        blob_storage.get_object.assert_called_once_with("test", "result-cache/key.zip")
+        # Blob hits are written to disk
+        blob_storage.get_object.reset_mock()
+        self.assertEqual(cache.get("key"), b"data")
+        blob_storage.get_object.assert_not_called()
+
+        cache.put("other", b"other")
+        self.assertEqual(
+            blob_storage.push_objects.call_args.args[1][0]["name"],
+            "result-cache/other.zip",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
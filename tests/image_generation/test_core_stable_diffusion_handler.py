@@ -1,15 +1,23 @@
+import tempfile
+import threading
+import time
 import unittest
+from pathlib import Path
 from unittest.mock import ANY, MagicMock, call, patch
 
 import numpy as np
 import torch
 from PIL import Image
 
+from image_generation import config, metrics
 from image_generation.api.models import Prompt, TextToImage
+from image_generation.core.result_cache import ResultCache
 from image_generation.core.schedulers import SchedulerEnum
 from image_generation.core.stable_diffusion import (
     AutoPipelineForText2Image,
     StableDiffusionHandler,
+    StableDiffusionPipeline,
+    StableDiffusionXLPipeline,
 )
 
 
@@ -22,6 +30,7 @@ class TestStableDiffusionHandler(unittest.TestCase):
         )
 
         self.model_path = "test_model_path"
+        StableDiffusionHandler._warmed_up.clear()
 
     def tearDown(self):
         AutoPipelineForText2Image.from_pretrained = self.original_from_pretrained
@@ -122,6 +131,114 @@ class TestStableDiffusionHandler(unittest.TestCase):
         self.assertEqual(handler.model_path, new_model_path)
         self.assertEqual(handler.pipe, new_mocked_pipeline)
 
+    def test_warm_up_once_per_model(self):
+        with patch.object(config, "WARMUP_HEIGHT", 688), patch.object(
+            config, "WARMUP_WIDTH", 512
+        ):
+            handler = StableDiffusionHandler(self.model_path, device="cuda")
+        self.mocked_pipeline.assert_called_once_with(
+            "", height=688, width=512, guidance_scale=0.0, num_inference_steps=1
+        )
+        self.assertTrue(handler.startup_report["warmed_up"])
+
+        handler._init_model(self.model_path)
+        self.mocked_pipeline.assert_called_once()
+        self.assertFalse(handler.startup_report["warmed_up"])
+
+    def test_warm_up_with_configured_decoder_and_profile(self):
+        pipeline = MagicMock(spec=StableDiffusionPipeline)
+        pipeline.image_processor = MagicMock()
+        AutoPipelineForText2Image.from_pretrained.return_value = pipeline
+        with patch.object(config, "DEFAULT_DECODER", "tiny"), patch(
+            "image_generation.core.stable_diffusion.load_tiny_decoder"
+        ), patch(
+            "image_generation.core.stable_diffusion.LatentDecoder"
+        ) as mock_latent_decoder:
+            handler = StableDiffusionHandler(
+                self.model_path, device="cuda", performance_profile="low_memory"
+            )
+
+            self.assertEqual(pipeline.call_args.kwargs["output_type"], "latent")
+            mock_latent_decoder.return_value.submit.assert_called_once_with(
+                pipeline.return_value.images
+            )
+            self.assertTrue(handler.startup_report["warmed_up"])
+
+            # Reloading with another profile warms it up too
+            handler.performance_profile = "max_throughput"
+            handler._init_model(self.model_path)
+            self.assertTrue(handler.startup_report["warmed_up"])
+            self.assertEqual(pipeline.call_count, 2)
+
+    def test_warm_up_disabled(self):
+        with patch.object(config, "WARMUP_ENABLED", False):
+            handler = StableDiffusionHandler(self.model_path, device="cuda")
+        self.mocked_pipeline.assert_not_called()
+        self.assertEqual(handler.startup_report["snapshot"], "disabled")
+
+    def test_pipeline_snapshot_cache(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir, patch.object(
+            config, "PIPELINE_SNAPSHOT_DIR", snapshot_dir
+        ):
+
+            def save_pretrained(path, safe_serialization):
+                Path(path).mkdir(parents=True, exist_ok=True)
+                (Path(path) / "model_index.json").write_text("{}")
+
+            self.mocked_pipeline.save_pretrained.side_effect = save_pretrained
+            handler = StableDiffusionHandler(self.model_path, device="cuda")
+            self.assertEqual(handler.startup_report["snapshot"], "miss")
+            snapshot_path = handler._snapshot_path(self.model_path, torch.float16)
+            self.assertTrue((snapshot_path / "model_index.json").exists())
+
+            handler._init_model(self.model_path)
+            self.assertEqual(handler.startup_report["snapshot"], "hit")
+            AutoPipelineForText2Image.from_pretrained.assert_called_with(
+                snapshot_path,
+                torch_dtype=torch.float16,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+                local_files_only=True,
+            )
+
+    def test_pipeline_snapshot_concurrent_loaders(self):
+        handler = StableDiffusionHandler(self.model_path, device="cuda")
+        saving = threading.Barrier(2)
+
+        def save_pretrained(path, safe_serialization):
+            # Both loaders write their snapshot at the same time
+            saving.wait(timeout=5)
+            (Path(path) / "model_index.json").write_text(str(path))
+            time.sleep(0.05)
+            (Path(path) / "model.safetensors").write_text(str(path))
+
+        self.mocked_pipeline.save_pretrained.side_effect = save_pretrained
+        with tempfile.TemporaryDirectory() as snapshot_dir, patch.object(
+            config, "PIPELINE_SNAPSHOT_DIR", snapshot_dir
+        ):
+            statuses = []
+            loaders = [
+                threading.Thread(
+                    target=lambda: statuses.append(
+                        handler._load_pipeline(self.model_path, torch.float16)[1]
+                    )
+                )
+                for _ in range(2)
+            ]
+            for loader in loaders:
+                loader.start()
+            for loader in loaders:
+                loader.join()
+
+            self.assertEqual(statuses, ["miss", "miss"])
+            snapshot_path = handler._snapshot_path(self.model_path, torch.float16)
+            # The snapshot is one loader's complete save and the other one is removed
+            self.assertEqual(
+                (snapshot_path / "model_index.json").read_text(),
+                (snapshot_path / "model.safetensors").read_text(),
+            )
+            self.assertEqual(list(Path(snapshot_dir).iterdir()), [snapshot_path])
+
     # Testing _set_seed method
     def test_set_seed(self):
         handler = StableDiffusionHandler(self.model_path)
@@ -138,10 +255,16 @@ class TestStableDiffusionHandler(unittest.TestCase):
 
     # Testing conditions inside the _init_model method
     def test_init_model_cpu(self):
-        handler = StableDiffusionHandler(self.model_path, device="cpu")
-        self.assertTrue(handler.pipe.enable_sequential_cpu_offload.called)
-        handler.pipe.enable_sequential_cpu_offload.assert_called_once()
-        handler.pipe.enable_attention_slicing.assert_called_once_with(1)
+        with patch.object(config, "CPU_DTYPE", "float32"):
+            handler = StableDiffusionHandler(self.model_path, device="cpu")
+        # The weights stay resident instead of being offloaded
+        handler.pipe.enable_sequential_cpu_offload.assert_not_called()
+        handler.pipe.to.assert_called_once_with(torch.device("cpu"))
+        self.assertEqual(
+            AutoPipelineForText2Image.from_pretrained.call_args.kwargs["torch_dtype"],
+            torch.float32,
+        )
+        self.assertEqual(handler.startup_report["cpu_runtime"]["dtype"], "float32")
 
     def test_init_model_other(self):
         handler = StableDiffusionHandler(self.model_path, device="cuda")
@@ -182,6 +305,537 @@ class TestStableDiffusionHandler(unittest.TestCase):
             self.assertEqual(handler.pipe.scheduler, mock_scheduler)
             self.assertEqual(handler.scheduler_name, scheduler_name)
 
+    def test_execution_slot_per_device(self):
+        handler = StableDiffusionHandler(self.model_path, device="cuda")
+        other_handler = StableDiffusionHandler(self.model_path, device="cuda")
+        cpu_handler = StableDiffusionHandler(self.model_path, device="cpu")
+        self.assertIs(handler.slot, other_handler.slot)
+        self.assertIsNot(handler.slot, cpu_handler.slot)
+        self.assertIs(StableDiffusionHandler.execution_slot("cuda:0"), handler.slot)
+        self.assertIsNot(StableDiffusionHandler.execution_slot("cuda:1"), handler.slot)
+
+    def test_txt_to_img_serialized_per_device(self):
+        test_text_to_image = self.get_test_text_to_image()
+        handler = StableDiffusionHandler(test_text_to_image.model_path, device="cuda")
+        white_img = Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        running = []
+        overlaps = []
+
+        def mock_pipe(*args, **kwargs):
+            running.append(1)
+            overlaps.append(len(running))
+            time.sleep(0.02)
+            running.pop()
+            return MagicMock(images=[white_img])
+
+        handler.pipe.side_effect = mock_pipe
+        threads = [
+            threading.Thread(target=handler.txt_to_img, args=(test_text_to_image,))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(overlaps), 4)
+        self.assertEqual(max(overlaps), 1)
+
+    def test_load_model(self):
+        handler = StableDiffusionHandler(self.model_path)
+        AutoPipelineForText2Image.from_pretrained.reset_mock()
+        handler.load_model(self.model_path)
+        AutoPipelineForText2Image.from_pretrained.assert_not_called()
+        handler.load_model("new_model_path")
+        self.assertEqual(handler.model_path, "new_model_path")
+
+    def test_txt_to_img_result_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            result_cache = ResultCache(cache_dir, max_bytes=1024 * 1024)
+            handler = StableDiffusionHandler(self.model_path, result_cache=result_cache)
+            white_img = Image.fromarray(np.ones((8, 8, 3), dtype=np.uint8) * 255)
+            handler.pipe.return_value.images = [white_img]
+            test_text_to_image = self.get_test_text_to_image()
+            test_text_to_image.seed = 1234
+
+            handler.txt_to_img(test_text_to_image)
+            handler.pipe.reset_mock()
+            images = handler.txt_to_img(test_text_to_image)
+
+            handler.pipe.assert_not_called()
+            self.assertEqual(len(images), 1)
+            np.testing.assert_array_equal(images[0], white_img)
+
+    def test_result_cache_is_not_shared_across_device_types(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            result_cache = ResultCache(cache_dir, max_bytes=1024 * 1024)
+            white_img = Image.fromarray(np.ones((8, 8, 3), dtype=np.uint8) * 255)
+            self.mocked_pipeline.return_value.images = [white_img]
+            test_text_to_image = self.get_test_text_to_image()
+            test_text_to_image.seed = 1234
+            gpu_handler = StableDiffusionHandler(
+                test_text_to_image.model_path, device="cuda", result_cache=result_cache
+            )
+            # No CUDA generator without a GPU
+            with patch.object(gpu_handler, "_set_seed", return_value=None):
+                gpu_handler.txt_to_img(test_text_to_image)
+
+            cpu_handler = StableDiffusionHandler(
+                test_text_to_image.model_path, device="cpu", result_cache=result_cache
+            )
+            self.mocked_pipeline.reset_mock()
+            cpu_handler.txt_to_img(test_text_to_image)
+
+            self.mocked_pipeline.assert_called_once()
+
+    def test_prompt_embedding_cache_sdxl(self):
+        pipeline = MagicMock(spec=StableDiffusionXLPipeline)
+        pipeline.encode_prompt.side_effect = lambda prompt, **kwargs: (
+            f"embeds:{prompt}",
+            None,
+            f"pooled:{prompt}",
+            None,
+        )
+        AutoPipelineForText2Image.from_pretrained.return_value = pipeline
+        test_text_to_image = self.get_test_text_to_image()
+        handler = StableDiffusionHandler(test_text_to_image.model_path)
+        white_img = Image.fromarray(np.ones((8, 8, 3), dtype=np.uint8) * 255)
+        handler.pipe.return_value.images = [white_img]
+
+        handler.txt_to_img(test_text_to_image)
+        handler.txt_to_img(test_text_to_image)
+
+        # Positive and negative prompts are only encoded once
+        self.assertEqual(pipeline.encode_prompt.call_count, 2)
+        self.assertEqual(
+            pipeline.call_args.kwargs,
+            dict(
+                prompt_embeds="embeds:A beautiful landscape with a clear sky",
+                negative_prompt_embeds="embeds:bad quality, pixelated",
+                pooled_prompt_embeds="pooled:A beautiful landscape with a clear sky",
+                negative_pooled_prompt_embeds="pooled:bad quality, pixelated",
+                guidance_scale=test_text_to_image.prompt.guidance_scale,
+                height=test_text_to_image.height,
+                width=test_text_to_image.width,
+                num_inference_steps=test_text_to_image.num_inference_steps,
+                num_images_per_prompt=test_text_to_image.num_images,
+                generator=None,
+            ),
+        )
+
+    def test_prompt_embedding_cache_eviction(self):
+        pipeline = MagicMock(spec=StableDiffusionPipeline)
+        pipeline.encode_prompt.side_effect = lambda prompt, **kwargs: (
+            f"embeds:{prompt}",
+            None,
+        )
+        AutoPipelineForText2Image.from_pretrained.return_value = pipeline
+        handler = StableDiffusionHandler(self.model_path)
+
+        with patch.object(config, "PROMPT_EMBEDDING_CACHE_SIZE", 2):
+            self.assertEqual(
+                handler._prompt_arguments("first", "negative", 5.0),
+                {
+                    "prompt_embeds": "embeds:first",
+                    "negative_prompt_embeds": "embeds:negative",
+                },
+            )
+            handler._prompt_arguments("second", "negative", 5.0)
+        self.assertEqual(
+            list(handler.prompt_embeddings),
+            [(self.model_path, "second"), (self.model_path, "negative")],
+        )
+
+        handler._init_model("new_model_path")
+        self.assertEqual(len(handler.prompt_embeddings), 0)
+
+    def test_uses_classifier_free_guidance(self):
+        handler = StableDiffusionHandler(self.model_path)
+        handler.pipe.unet.config.time_cond_proj_dim = None
+        self.assertFalse(handler.uses_classifier_free_guidance(0.0))
+        self.assertFalse(handler.uses_classifier_free_guidance(1.0))
+        self.assertTrue(handler.uses_classifier_free_guidance(7.5))
+        self.assertEqual(handler.unet_batch_size(4, 0.0), 4)
+        self.assertEqual(handler.unet_batch_size(4, 7.5), 8)
+
+        # Guidance-distilled UNets embed the guidance scale instead
+        handler.pipe.unet.config.time_cond_proj_dim = 256
+        self.assertFalse(handler.uses_classifier_free_guidance(7.5))
+
+    def test_txt_to_img_without_guidance_skips_negative_prompt(self):
+        test_text_to_image = self.get_test_text_to_image()
+        test_text_to_image.prompt.guidance_scale = 0.0
+        handler = StableDiffusionHandler(test_text_to_image.model_path)
+        white_img = Image.fromarray(np.ones((8, 8, 3), dtype=np.uint8) * 255)
+        handler.pipe.return_value.images = [white_img]
+
+        handler.txt_to_img(test_text_to_image)
+
+        self.assertNotIn("negative_prompt", handler.pipe.call_args.kwargs)
+        self.assertEqual(
+            handler.pipe.call_args.kwargs["prompt"], test_text_to_image.prompt.positive
+        )
+
+    def test_prompt_embeddings_without_guidance(self):
+        pipeline = MagicMock(spec=StableDiffusionXLPipeline)
+        pipeline.encode_prompt.side_effect = lambda prompt, **kwargs: (
+            f"embeds:{prompt}",
+            None,
+            f"pooled:{prompt}",
+            None,
+        )
+        AutoPipelineForText2Image.from_pretrained.return_value = pipeline
+        handler = StableDiffusionHandler(self.model_path)
+
+        self.assertEqual(
+            handler._prompt_arguments("positive", "negative", 0.0),
+            {
+                "prompt_embeds": "embeds:positive",
+                "pooled_prompt_embeds": "pooled:positive",
+            },
+        )
+        self.assertEqual(pipeline.encode_prompt.call_count, 1)
+
+    def test_performance_profile_in_startup_report(self):
+        with patch.object(config, "PERFORMANCE_PROFILE", "auto"):
+            handler = StableDiffusionHandler(self.model_path, device="cuda")
+        # Without measurable memory the most conservative profile is used
+        performance = handler.startup_report["performance"]
+        self.assertEqual(performance["requested_profile"], "auto")
+        self.assertEqual(performance["profile"], "low_memory")
+        self.assertEqual(performance["offload"], "none")
+
+    def test_request_performance_profile(self):
+        text_to_image = self.get_test_text_to_image()
+        handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+        handler.pipe.return_value.images = [
+            Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        ]
+        text_to_image.performance_profile = "max_throughput"
+
+        handler.txt_to_img(text_to_image)
+
+        self.assertEqual(handler.performance_settings["profile"], "max_throughput")
+        handler.pipe.unet.set_attn_processor.assert_called_once()
+        handler.pipe.vae.disable_slicing.assert_called_once()
+        # Same offload mode: the settings change in place
+        AutoPipelineForText2Image.from_pretrained.assert_called_once()
+
+    def test_request_without_performance_profile_uses_the_default(self):
+        text_to_image = self.get_test_text_to_image()
+        with patch.object(config, "PERFORMANCE_PROFILE", "low_memory"):
+            handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+        handler.pipe.return_value.images = [
+            Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        ]
+
+        handler.txt_to_img(
+            text_to_image.copy(update={"performance_profile": "max_throughput"})
+        )
+        self.assertEqual(handler.performance_settings["profile"], "max_throughput")
+
+        handler.txt_to_img(text_to_image)
+
+        self.assertEqual(handler.performance_profile, "low_memory")
+        self.assertEqual(handler.performance_settings["profile"], "low_memory")
+
+    def test_request_performance_profile_changing_offload_reloads(self):
+        text_to_image = self.get_test_text_to_image()
+        text_to_image.performance_profile = "balanced"
+        with patch(
+            "image_generation.core.stable_diffusion.pipeline_weights_bytes",
+            return_value={"unet": 4096, "text_encoder": 512},
+        ), patch(
+            "image_generation.core.stable_diffusion.free_device_memory",
+            side_effect=[1024] + [1024**3] * 3,
+        ):
+            handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+            self.assertEqual(handler.performance_settings["offload"], "sequential")
+            handler.pipe.return_value.images = [
+                Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+            ]
+
+            handler.txt_to_img(text_to_image)
+
+        self.assertEqual(handler.performance_profile, "balanced")
+        self.assertEqual(handler.performance_settings["offload"], "none")
+        self.assertEqual(AutoPipelineForText2Image.from_pretrained.call_count, 2)
+
+    def test_out_of_memory_splits_batch(self):
+        text_to_image = self.get_test_text_to_image(num_images=4)
+        handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+        white_img = Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        handler.pipe.reset_mock()
+
+        def mock_pipe(*args, **kwargs):
+            if kwargs["num_images_per_prompt"] > 2:
+                raise torch.cuda.OutOfMemoryError("CUDA out of memory")
+            return MagicMock(images=[white_img] * kwargs["num_images_per_prompt"])
+
+        handler.pipe.side_effect = mock_pipe
+        images = handler.txt_to_img(text_to_image)
+
+        self.assertEqual(len(images), 4)
+        batch_sizes = [
+            c.kwargs["num_images_per_prompt"] for c in handler.pipe.call_args_list
+        ]
+        self.assertEqual(batch_sizes, [4, 2, 2])
+        shape = (text_to_image.model_path, 512, 512, True)
+        self.assertEqual(handler.capacity_planner.max_batch_sizes(), {shape: 2})
+
+        # The learnt batch size is used directly by the next request of the same shape
+        handler.pipe.reset_mock()
+        handler.txt_to_img(text_to_image)
+        batch_sizes = [
+            c.kwargs["num_images_per_prompt"] for c in handler.pipe.call_args_list
+        ]
+        self.assertEqual(batch_sizes, [2, 2])
+
+    def test_out_of_memory_remembers_largest_working_batch(self):
+        text_to_image = self.get_test_text_to_image(num_images=8)
+        handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+        white_img = Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        handler.pipe.reset_mock()
+
+        def mock_pipe(*args, **kwargs):
+            if kwargs["num_images_per_prompt"] > 5:
+                raise torch.cuda.OutOfMemoryError("CUDA out of memory")
+            return MagicMock(images=[white_img] * kwargs["num_images_per_prompt"])
+
+        handler.pipe.side_effect = mock_pipe
+        self.assertEqual(len(handler.txt_to_img(text_to_image)), 8)
+        text_to_image.num_images = 6
+        self.assertEqual(len(handler.txt_to_img(text_to_image)), 6)
+
+        batch_sizes = [
+            c.kwargs["num_images_per_prompt"] for c in handler.pipe.call_args_list
+        ]
+        # 8 fails, 4 works, then the remaining 4 fit; the next request starts at 4
+        self.assertEqual(batch_sizes, [8, 4, 4, 4, 2])
+
+    def test_seeded_images_do_not_depend_on_batch_size(self):
+        text_to_image = self.get_test_text_to_image(num_images=4)
+        text_to_image.seed = 42
+        handler = StableDiffusionHandler(text_to_image.model_path, device="cpu")
+
+        def mock_pipe(*args, **kwargs):
+            # Each image is noise drawn from its generator, like the initial latents
+            generators = kwargs["generator"]
+            self.assertEqual(len(generators), kwargs["num_images_per_prompt"])
+            return MagicMock(
+                images=[
+                    Image.fromarray(
+                        (torch.rand((8, 8, 3), generator=generator) * 255)
+                        .to(torch.uint8)
+                        .numpy()
+                    )
+                    for generator in generators
+                ]
+            )
+
+        handler.pipe.side_effect = mock_pipe
+        results = []
+        for batch_size in [1, 3, 4]:
+            with patch.object(
+                handler,
+                "_batch_size",
+                side_effect=lambda shape, missing, guidance: min(batch_size, missing),
+            ):
+                results.append(
+                    [np.array(image) for image in handler._generate(text_to_image)]
+                )
+
+        for images in results[1:]:
+            self.assertEqual(len(images), 4)
+            for image, expected_image in zip(images, results[0]):
+                np.testing.assert_array_equal(image, expected_image)
+        self.assertFalse(np.array_equal(results[0][0], results[0][1]))
+
+    def test_out_of_memory_single_image_raises(self):
+        text_to_image = self.get_test_text_to_image(num_images=1)
+        handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+        handler.pipe.side_effect = torch.cuda.OutOfMemoryError("CUDA out of memory")
+
+        with self.assertRaises(torch.cuda.OutOfMemoryError):
+            handler.txt_to_img(text_to_image)
+
+    def test_tiny_decoder_overlaps_decode_with_denoising(self):
+        pipeline = MagicMock(spec=StableDiffusionPipeline)
+        pipeline.image_processor = MagicMock()
+        AutoPipelineForText2Image.from_pretrained.return_value = pipeline
+        text_to_image = self.get_test_text_to_image(num_images=4)
+        text_to_image.decoder = "tiny"
+        with patch.object(config, "WARMUP_ENABLED", False):
+            handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+        handler.capacity_planner.record_out_of_memory(
+            (text_to_image.model_path, 512, 512, True), 4
+        )
+        white_img = Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        events = []
+
+        def mock_pipe(*args, **kwargs):
+            events.append(f"denoise {kwargs['num_images_per_prompt']}")
+            return MagicMock(images=f"latents {len(events)}")
+
+        def submit(latents):
+            events.append(f"submit {latents}")
+            future = MagicMock()
+            future.result.side_effect = lambda: events.append(f"result {latents}") or [
+                white_img,
+                white_img,
+            ]
+            return future
+
+        pipeline.side_effect = mock_pipe
+        with patch.object(config, "PROMPT_EMBEDDING_CACHE_SIZE", 0), patch(
+            "image_generation.core.stable_diffusion.load_tiny_decoder"
+        ) as mock_load_tiny_decoder, patch(
+            "image_generation.core.stable_diffusion.LatentDecoder"
+        ) as mock_latent_decoder:
+            mock_latent_decoder.return_value.submit.side_effect = submit
+            images = handler.txt_to_img(text_to_image)
+
+        self.assertEqual(len(images), 4)
+        mock_load_tiny_decoder.assert_called_once()
+        self.assertEqual(pipeline.call_args.kwargs["output_type"], "latent")
+        # The second micro-batch denoises before the first one is waited for
+        self.assertEqual(
+            events,
+            [
+                "denoise 2",
+                "submit latents 1",
+                "denoise 2",
+                "submit latents 3",
+                "result latents 1",
+                "result latents 3",
+            ],
+        )
+
+    def test_tiny_decoder_pending_batches_are_cancelled_on_failure(self):
+        pipeline = MagicMock(spec=StableDiffusionPipeline)
+        pipeline.image_processor = MagicMock()
+        AutoPipelineForText2Image.from_pretrained.return_value = pipeline
+        text_to_image = self.get_test_text_to_image(num_images=4)
+        text_to_image.decoder = "tiny"
+        with patch.object(config, "WARMUP_ENABLED", False):
+            handler = StableDiffusionHandler(text_to_image.model_path, device="cuda")
+        handler.capacity_planner.record_out_of_memory(
+            (text_to_image.model_path, 512, 512, True), 4
+        )
+        pipeline.side_effect = [MagicMock(images="latents"), RuntimeError("Failed")]
+
+        with patch.object(config, "PROMPT_EMBEDDING_CACHE_SIZE", 0), patch(
+            "image_generation.core.stable_diffusion.load_tiny_decoder"
+        ), patch(
+            "image_generation.core.stable_diffusion.LatentDecoder"
+        ) as mock_latent_decoder:
+            future = mock_latent_decoder.return_value.submit.return_value
+            with self.assertRaises(RuntimeError):
+                handler.txt_to_img(text_to_image)
+
+            future.cancel.assert_called_once()
+
+            # Switching models stops the decoder of the previous one
+            with patch.object(config, "WARMUP_ENABLED", False):
+                handler._init_model("new_model_path")
+            mock_latent_decoder.return_value.close.assert_called_once()
+            self.assertIsNone(handler.latent_decoder)
+
+    def test_vae_decoder_decodes_in_pipeline(self):
+        handler = StableDiffusionHandler(self.model_path)
+        handler.pipe.return_value.images = [
+            Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        ]
+        text_to_image = self.get_test_text_to_image()
+        text_to_image.model_path = self.model_path
+        text_to_image.decoder = "tiny"
+
+        # Pipelines without a known latent space fall back to their own VAE
+        handler.txt_to_img(text_to_image)
+        self.assertNotIn("output_type", handler.pipe.call_args.kwargs)
+
+    def test_txt_to_img_resolution_bucket(self):
+        text_to_image = self.get_test_text_to_image()
+        text_to_image.height, text_to_image.width = 640, 480
+        handler = StableDiffusionHandler(text_to_image.model_path)
+        handler.pipe.return_value.images = [
+            Image.fromarray(np.ones((688, 512, 3), dtype=np.uint8) * 255)
+        ]
+
+        with patch.object(config, "RESOLUTION_BUCKETS", ["512x512", "688x512"]):
+            images = handler.txt_to_img(text_to_image)
+
+        self.assertEqual(handler.pipe.call_args.kwargs["height"], 688)
+        self.assertEqual(handler.pipe.call_args.kwargs["width"], 512)
+        self.assertEqual(images[0].size, (480, 640))
+
+    def test_txt_to_img_streams_images_and_steps(self):
+        text_to_image = self.get_test_text_to_image(num_images=2)
+        text_to_image.num_inference_steps = 2
+        handler = StableDiffusionHandler(text_to_image.model_path)
+        white_img = Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        black_img = Image.fromarray(np.zeros((512, 512, 3), dtype=np.uint8))
+
+        def pipeline(**kwargs):
+            for step in range(kwargs["num_inference_steps"]):
+                kwargs["callback_on_step_end"](handler.pipe, step, 0, {})
+            return MagicMock(
+                images=[white_img, black_img][: kwargs["num_images_per_prompt"]]
+            )
+
+        handler.pipe.reset_mock()
+        handler.pipe.side_effect = pipeline
+        on_images = MagicMock()
+        on_step = MagicMock()
+        images = handler.txt_to_img(text_to_image, on_images=on_images, on_step=on_step)
+
+        self.assertEqual(len(images), 2)
+        # The black image is retried and never streamed
+        self.assertEqual(
+            [len(call.args[0]) for call in on_images.call_args_list], [1, 1]
+        )
+        self.assertEqual(
+            on_step.call_args_list, [call(1, 2), call(2, 2), call(1, 2), call(2, 2)]
+        )
+
+    def test_txt_to_img_without_step_callback(self):
+        handler = StableDiffusionHandler(self.model_path)
+        handler.pipe.return_value.images = [
+            Image.fromarray(np.ones((8, 8, 3), dtype=np.uint8) * 255)
+        ]
+        handler.txt_to_img(self.get_test_text_to_image())
+        self.assertNotIn("callback_on_step_end", handler.pipe.call_args.kwargs)
+
+    def test_txt_to_img_records_metrics(self):
+        metrics.REGISTRY.clear()
+        text_to_image = self.get_test_text_to_image()
+        model_path = text_to_image.model_path
+        handler = StableDiffusionHandler(model_path)
+        white_img = Image.fromarray(np.ones((512, 512, 3), dtype=np.uint8) * 255)
+        black_img = Image.fromarray(np.zeros((512, 512, 3), dtype=np.uint8))
+        handler.pipe.side_effect = [
+            MagicMock(images=[black_img]),
+            MagicMock(images=[white_img]),
+        ]
+
+        with patch(
+            "image_generation.core.stable_diffusion.peak_device_memory",
+            return_value=1024,
+        ):
+            handler.txt_to_img(text_to_image)
+
+        self.assertEqual(
+            metrics.PIPELINE_SECONDS.count(steps=50, resolution="512x512"), 2
+        )
+        self.assertEqual(metrics.IMAGES_GENERATED.value(model=model_path), 1)
+        self.assertEqual(metrics.BLACK_IMAGE_RETRIES.value(model=model_path), 1)
+        self.assertGreater(metrics.IMAGES_PER_SECOND.value(model=model_path), 0)
+        self.assertEqual(
+            metrics.DEVICE_MEMORY_HIGH_WATER_BYTES.value(device=str(handler.device)),
+            1024,
+        )
+        self.assertEqual(metrics.MODEL_LOAD_SECONDS.count(model=model_path), 1)
+
     def test_black_images_success(self):
         handler = StableDiffusionHandler(self.model_path)
 
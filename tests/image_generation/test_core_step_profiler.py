@@ -0,0 +1,135 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from benchmarks.tiny_pipeline import TINY_MODEL_PATH, tiny_handler
+from image_generation import config, tracing
+from image_generation.api.models import Prompt, TextToImage
+from image_generation.core.stable_diffusion import StableDiffusionHandler
+from image_generation.core.step_profiler import STAGES, StepProfiler
+
+
+def get_text_to_image(num_images=2, num_inference_steps=3):
+    return TextToImage(
+        model_path=TINY_MODEL_PATH,
+        prompt=Prompt(positive="A castle", negative="blurry", guidance_scale=7.5),
+        height=32,
+        width=32,
+        num_inference_steps=num_inference_steps,
+        num_images=num_images,
+        seed=1234,
+    )
+
+
+@patch.object(config, "WARMUP_ENABLED", False)
+@patch.object(config, "RESULT_CACHE_DIR", "")
+class TestStepProfiler(unittest.TestCase):
+    def setUp(self):
+        StableDiffusionHandler._warmed_up.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def read_profile(self, path):
+        return json.loads(Path(path).read_text())
+
+    def test_profiling_disabled_by_default(self):
+        with patch.object(config, "PROFILE_DIR", ""), tiny_handler() as handler:
+            handler.txt_to_img(get_text_to_image())
+        self.assertIsNone(handler.last_profile_path)
+
+    def test_handler_writes_chrome_trace_per_request(self):
+        steps = []
+        with patch.object(config, "PROFILE_DIR", self.directory.name), tiny_handler(
+            device="cpu"
+        ) as handler:
+            with tracing.start_span("request") as span:
+                images = handler.txt_to_img(
+                    get_text_to_image(),
+                    on_step=lambda step, num_steps: steps.append(step),
+                )
+            first_profile = handler.last_profile_path
+            handler.txt_to_img(get_text_to_image(num_inference_steps=2))
+
+        self.assertEqual(len(images), 2)
+        # The progress callback still runs
+        self.assertEqual(steps, [1, 2, 3])
+        self.assertTrue(first_profile.name.endswith(f"-{span.trace_id}.json"))
+        self.assertNotEqual(first_profile, handler.last_profile_path)
+
+        profile = self.read_profile(first_profile)
+        summary = profile["otherData"]
+        self.assertEqual(summary["model"], TINY_MODEL_PATH)
+        self.assertEqual(summary["num_inference_steps"], 3)
+        self.assertEqual(set(summary["seconds"]), set(STAGES))
+        for stage in STAGES:
+            self.assertGreater(summary["seconds"][stage], 0, stage)
+        self.assertEqual([step["step"] for step in summary["steps"]], [1, 2, 3])
+        for step in summary["steps"]:
+            self.assertGreater(step["unet_seconds"], 0)
+            self.assertGreater(step["scheduler_seconds"], 0)
+            self.assertGreaterEqual(
+                step["seconds"], step["unet_seconds"] + step["scheduler_seconds"]
+            )
+
+        events = [event for event in profile["traceEvents"] if event["ph"] == "X"]
+        self.assertEqual(
+            [event["name"] for event in events if event["cat"] == "step"],
+            ["step 1", "step 2", "step 3"],
+        )
+        self.assertEqual(
+            [event["args"]["step"] for event in events if event["cat"] == "unet"],
+            [1, 2, 3],
+        )
+        self.assertTrue(
+            any(event["ph"] == "M" for event in profile["traceEvents"]),
+        )
+
+    def test_profiler_restores_pipeline(self):
+        with tiny_handler() as handler:
+            pipe = handler.pipe
+            forward = pipe.unet.forward
+            with StepProfiler(pipe, handler.device, output_dir=self.directory.name):
+                self.assertIsNot(pipe.unet.forward, forward)
+            self.assertNotIn("forward", pipe.unet.__dict__)
+            self.assertNotIn("step", pipe.scheduler.__dict__)
+            self.assertNotIn("decode", pipe.vae.__dict__)
+            self.assertNotIn("postprocess", pipe.image_processor.__dict__)
+
+    def test_failed_request_still_writes_profile(self):
+        with tiny_handler() as handler:
+            profiler = StepProfiler(
+                handler.pipe, handler.device, output_dir=self.directory.name
+            )
+            with self.assertRaises(RuntimeError):
+                with profiler:
+                    raise RuntimeError("Some error")
+        self.assertEqual(
+            self.read_profile(profiler.path)["otherData"]["error"], "Some error"
+        )
+
+    def test_torch_profiler_captures_nth_request(self):
+        with tiny_handler() as handler:
+            first = StepProfiler(
+                handler.pipe, handler.device, output_dir=self.directory.name
+            )
+            with first:
+                pass
+            with patch.object(
+                config, "PROFILE_TORCH_REQUEST", first.request_number + 1
+            ):
+                with StepProfiler(
+                    handler.pipe, handler.device, output_dir=self.directory.name
+                ) as second:
+                    pass
+        self.assertIsNone(first.torch_profile_path)
+        self.assertTrue(second.torch_profile_path.exists())
+        self.assertEqual(
+            self.read_profile(second.path)["otherData"]["torch_profile"],
+            str(second.torch_profile_path),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
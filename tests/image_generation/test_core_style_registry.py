@@ -0,0 +1,140 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from image_generation.core import styles
+from image_generation.core.style_registry import (
+    COMPILED_STYLES_PATH,
+    VARIABLE_NAMES,
+    StyleRegistry,
+    compile_styles,
+    parse_template,
+    render_template,
+    source_hash,
+    write_compiled_styles,
+)
+
+
+class TestStyleRegistry(unittest.TestCase):
+    def setUp(self):
+        self.styles = {
+            "style1": [
+                {
+                    "model_path": "model",
+                    "prompt": {
+                        "positive": "A {character} in a {setting}.",
+                        "guidance_scale": 0.0,
+                    },
+                    "height": 688,
+                },
+                {
+                    "model_path": "model",
+                    "prompt": {
+                        "positive": "{creature} with {objects}",
+                        "guidance_scale": 0.0,
+                    },
+                    "height": 688,
+                },
+            ],
+        }
+        self.variables = {
+            "characters": ["wizard", "knight:2"],
+            "settings": ["castle", "wizard"],
+        }
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.compiled_path = Path(self.temp_dir.name) / "styles.json"
+        write_compiled_styles(
+            compile_styles(self.styles, self.variables), self.compiled_path
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_parse_template(self):
+        self.assertEqual(
+            parse_template("{theme} on {setting}!"),
+            [("", "theme"), (" on ", "setting"), ("!", None)],
+        )
+
+    def test_compile_interns_strings_and_parameters(self):
+        compiled = compile_styles(self.styles, self.variables)
+        self.assertEqual(compiled["strings"].count("wizard"), 1)
+        self.assertEqual(len(compiled["parameters"]), 1)
+        slots = compiled["styles"]["style1"][0][1]
+        self.assertEqual(
+            render_template(slots, compiled["strings"]), "A {character} in a {setting}."
+        )
+
+    def test_registry_round_trip(self):
+        registry = StyleRegistry(self.compiled_path, source_path=None)
+        self.assertEqual(registry["style1"], self.styles["style1"])
+        self.assertEqual(registry.variables, self.variables)
+        self.assertEqual(list(registry), ["style1"])
+        self.assertIsNone(registry.get("missing"))
+
+    def test_registry_is_lazy(self):
+        registry = StyleRegistry(self.compiled_path, source_path=None)
+        self.assertIsNone(registry._compiled)
+        self.assertNotIn("style1", registry._materialized)
+        registry["style1"]
+        self.assertIn("style1", registry._materialized)
+        self.assertIs(registry["style1"], registry["style1"])
+
+    def test_registry_template_pairs(self):
+        registry = StyleRegistry(self.compiled_path, source_path=None)
+        compiled_pairs = registry.template_pairs("style1")
+        self.assertEqual(
+            compiled_pairs,
+            {
+                template["prompt"]["positive"]: parse_template(
+                    template["prompt"]["positive"]
+                )
+                for template in self.styles["style1"]
+            },
+        )
+        self.assertIs(registry.template_pairs("style1"), compiled_pairs)
+
+        registry["style2"] = [{"prompt": {"positive": "{theme} test"}}]
+        self.assertEqual(
+            registry.template_pairs("style2"),
+            {"{theme} test": [("", "theme"), (" test", None)]},
+        )
+        registry["style2"] = [{"prompt": {"positive": "test"}}]
+        self.assertEqual(registry.template_pairs("style2"), {"test": [("test", None)]})
+        with self.assertRaises(KeyError):
+            registry.template_pairs("missing")
+
+    def test_registry_runtime_changes(self):
+        registry = StyleRegistry(self.compiled_path, source_path=None)
+        registry["style2"] = [{"prompt": {"positive": "test"}}]
+        self.assertIn("style2", registry)
+        self.assertEqual(len(registry), 2)
+        del registry["style1"]
+        self.assertNotIn("style1", registry)
+        with self.assertRaises(KeyError):
+            registry["style1"]
+
+    def test_stale_compiled_styles_are_recompiled(self):
+        with open(self.compiled_path) as f:
+            compiled = json.load(f)
+        compiled["source_sha256"] = "stale"
+        write_compiled_styles(compiled, self.compiled_path)
+
+        registry = StyleRegistry(self.compiled_path)
+        self.assertEqual(registry["general"], styles.STYLES["general"])
+
+    def test_compiled_styles_are_up_to_date(self):
+        registry = StyleRegistry()
+        self.assertEqual(registry.compiled["source_sha256"], source_hash())
+        with open(COMPILED_STYLES_PATH) as f:
+            self.assertEqual(json.load(f)["source_sha256"], source_hash())
+        self.assertEqual(dict(registry), styles.STYLES)
+        self.assertEqual(
+            registry.variables,
+            {name: getattr(styles, name) for name in VARIABLE_NAMES},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import urllib.request
+
+from image_generation.metrics import MetricsRegistry, start_metrics_server
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter("images", "Images.", ["model"])
+        counter.inc(model="a")
+        counter.inc(2, model="a")
+        self.assertEqual(counter.value(model="a"), 3)
+        self.assertIn('images_total{model="a"} 3', self.registry.render())
+        with self.assertRaises(ValueError):
+            counter.inc(-1, model="a")
+
+    def test_labels_must_match(self):
+        counter = self.registry.counter("images", "Images.", ["model"])
+        with self.assertRaises(ValueError):
+            counter.inc(device="cpu")
+
+    def test_gauge_high_water_mark(self):
+        gauge = self.registry.gauge("memory", "Memory.")
+        gauge.set_max(10)
+        gauge.set_max(5)
+        self.assertEqual(gauge.value(), 10)
+        gauge.set(3)
+        gauge.dec()
+        self.assertEqual(gauge.value(), 2)
+
+    def test_histogram_render(self):
+        histogram = self.registry.histogram(
+            "latency_seconds", "Latency.", ["steps"], buckets=(0.5, 1)
+        )
+        histogram.observe(0.25, steps=2)
+        histogram.observe(0.75, steps=2)
+        histogram.observe(5, steps=2)
+
+        self.assertEqual(histogram.count(steps=2), 3)
+        self.assertEqual(histogram.sum(steps=2), 6)
+        self.assertEqual(
+            self.registry.render().splitlines(),
+            [
+                "# HELP latency_seconds Latency.",
+                "# TYPE latency_seconds histogram",
+                'latency_seconds_bucket{steps="2",le="0.5"} 1',
+                'latency_seconds_bucket{steps="2",le="1"} 2',
+                'latency_seconds_bucket{steps="2",le="+Inf"} 3',
+                'latency_seconds_sum{steps="2"} 6',
+                'latency_seconds_count{steps="2"} 3',
+            ],
+        )
+
+    def test_histogram_time(self):
+        histogram = self.registry.histogram("stage_seconds", "Stage.", ["stage"])
+        with self.assertRaises(RuntimeError):
+            with histogram.time(stage="upload"):
+                raise RuntimeError("Some error")
+        self.assertEqual(histogram.count(stage="upload"), 1)
+
+    def test_label_values_are_escaped(self):
+        gauge = self.registry.gauge("info", "Info.", ["model"])
+        gauge.set(1, model='a "b"')
+        self.assertIn('info{model="a \\"b\\""} 1', self.registry.render())
+
+    def test_duplicate_names(self):
+        self.registry.counter("images", "Images.")
+        with self.assertRaises(ValueError):
+            self.registry.gauge("images", "Images.")
+
+    def test_metrics_server(self):
+        server = start_metrics_server(0, host="127.0.0.1")
+        try:
+            port = server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn(b"# TYPE sd_pipeline_seconds histogram", response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from image_generation import config, tracing
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.exporter = tracing.InMemorySpanExporter()
+        tracing.add_exporter(self.exporter)
+        self.addCleanup(tracing.remove_exporter, self.exporter)
+
+    def test_spans_nest_in_one_trace(self):
+        with tracing.start_span("parent", {"model": "a"}) as parent:
+            self.assertEqual(tracing.correlation_id(), parent.trace_id)
+            with tracing.start_span("child") as child:
+                self.assertIs(tracing.current_span(), child)
+            self.assertIs(tracing.current_span(), parent)
+        self.assertIsNone(tracing.current_span())
+
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_span_id, parent.span_id)
+        self.assertIsNone(parent.parent_span_id)
+        self.assertEqual(
+            [span.name for span in self.exporter.spans], ["child", "parent"]
+        )
+        self.assertEqual(parent.status, "OK")
+        self.assertGreaterEqual(parent.duration_seconds, child.duration_seconds)
+
+    def test_separate_traces(self):
+        with tracing.start_span("first") as first:
+            pass
+        with tracing.start_span("second") as second:
+            pass
+        self.assertNotEqual(first.trace_id, second.trace_id)
+
+    def test_remote_parent(self):
+        traceparent = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+        with tracing.start_span("server", traceparent=traceparent) as span:
+            self.assertEqual(
+                tracing.propagation_headers(), {"traceparent": span.traceparent}
+            )
+        self.assertEqual(span.trace_id, "4bf92f3577b34da6a3ce929d0e0e4736")
+        self.assertEqual(span.parent_span_id, "00f067aa0ba902b7")
+
+    def test_parse_traceparent(self):
+        self.assertIsNone(tracing.parse_traceparent(None))
+        self.assertIsNone(tracing.parse_traceparent("garbage"))
+        self.assertIsNone(
+            tracing.parse_traceparent(
+                "00-00000000000000000000000000000000-00f067aa0ba902b7-01"
+            )
+        )
+        self.assertEqual(tracing.propagation_headers(), {})
+
+    def test_exception_sets_error_status(self):
+        with self.assertRaises(ValueError):
+            with tracing.start_span("failing"):
+                raise ValueError("Some error")
+        span = self.exporter.find("failing")[0]
+        self.assertEqual(span.status, "ERROR")
+        self.assertEqual(span.attributes["exception.message"], "Some error")
+
+    def test_context_follows_asyncio_tasks(self):
+        async def child():
+            with tracing.start_span("task"):
+                await asyncio.sleep(0)
+
+        async def main():
+            with tracing.start_span("root") as root:
+                await asyncio.gather(child(), child())
+            return root
+
+        root = asyncio.run(main())
+        self.assertEqual(
+            [span.parent_span_id for span in self.exporter.find("task")],
+            [root.span_id, root.span_id],
+        )
+
+    def test_json_lines_export(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = str(Path(directory) / "traces" / "spans.jsonl")
+            with patch.object(config, "TRACE_EXPORT_PATH", path):
+                with tracing.start_span("exported", {"images": 2}) as span:
+                    pass
+            lines = Path(path).read_text().splitlines()
+
+        self.assertEqual(len(lines), 1)
+        exported = json.loads(lines[0])
+        self.assertEqual(exported["traceId"], span.trace_id)
+        self.assertEqual(exported["name"], "exported")
+        self.assertEqual(exported["attributes"], {"images": 2})
+        self.assertEqual(exported["status"], {"code": "OK"})
+
+
+if __name__ == "__main__":
+    unittest.main()
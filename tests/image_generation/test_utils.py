@@ -1,10 +1,13 @@
+import base64
 import io
+import json
 import unittest
 from unittest.mock import MagicMock, patch
 
 import requests
+from PIL import Image
 
-from image_generation import utils
+from image_generation import tracing, utils
 
 
 class TestUtils(unittest.TestCase):
@@ -18,7 +21,22 @@ class TestUtils(unittest.TestCase):
         response = utils.call_image_generation_api(host, endpoint, request_object)
 
         self.assertEqual(response.status_code, 200)
-        mock_post.assert_called_once_with(f"{host}{endpoint}", json=request_object)
+        mock_post.assert_called_once_with(
+            f"{host}{endpoint}", json=request_object, headers={}
+        )
+
+    @patch("image_generation.utils.requests.post")
+    def test_call_image_generation_api_propagates_trace(self, mock_post):
+        mock_post.return_value.status_code = 200
+
+        with tracing.start_span("test") as span:
+            utils.call_image_generation_api(
+                "http://localhost:5000", "/text_to_image", {}
+            )
+
+        self.assertEqual(
+            mock_post.call_args.kwargs["headers"], {"traceparent": span.traceparent}
+        )
 
     @patch("image_generation.utils.requests.post")
     def test_call_image_generation_api_failure(self, mock_post):
@@ -35,6 +53,55 @@ class TestUtils(unittest.TestCase):
             in str(context.exception)
         )
 
+    @patch("image_generation.utils.requests.post")
+    def test_stream_image_generation_api(self, mock_post):
+        image_bytes = io.BytesIO()
+        Image.new("RGB", (8, 8), color="red").save(image_bytes, format="PNG")
+        lines = [
+            json.dumps({"event": "progress", "step": 1, "num_steps": 1}),
+            "",
+            json.dumps(
+                {
+                    "event": "image",
+                    "image": base64.b64encode(image_bytes.getvalue()).decode(),
+                }
+            ),
+            json.dumps({"event": "done", "num_images": 1}),
+        ]
+        response = mock_post.return_value.__enter__.return_value
+        response.status_code = 200
+        response.iter_lines.return_value = [line.encode() for line in lines]
+
+        events = list(
+            utils.stream_image_generation_api(
+                "http://localhost:5000", "/text_to_image/stream", {}, progress=True
+            )
+        )
+
+        self.assertEqual(
+            [event["event"] for event in events], ["progress", "image", "done"]
+        )
+        self.assertEqual(events[1]["image"].getpixel((0, 0)), (255, 0, 0))
+        mock_post.assert_called_once_with(
+            "http://localhost:5000/text_to_image/stream",
+            json={},
+            params={"progress": True},
+            headers={},
+            stream=True,
+        )
+
+    @patch("image_generation.utils.requests.post")
+    def test_stream_image_generation_api_error_event(self, mock_post):
+        response = mock_post.return_value.__enter__.return_value
+        response.status_code = 200
+        response.iter_lines.return_value = [
+            json.dumps({"event": "error", "detail": "Some error"}).encode()
+        ]
+
+        with self.assertRaises(Exception) as context:
+            list(utils.stream_image_generation_api("http://host", "/stream", {}))
+        self.assertIn("Some error", str(context.exception))
+
     @patch("image_generation.utils.requests.get")
     def test_wait_for_service(self, mock_get):
         mock_get.return_value.status_code = 200
@@ -93,10 +160,17 @@ class TestUtils(unittest.TestCase):
 
     @patch("image_generation.utils.torch.cuda.mem_get_info")
     def test_enough_gpu_memory(self, mock_mem_info):
-        mock_mem_info.return_value = [0, 1024 * 1024 * 1024 * 4]  # 4 GB
+        mock_mem_info.return_value = [1024 * 1024 * 1024 * 4, 1024 * 1024 * 1024 * 8]
 
         self.assertTrue(utils.enough_gpu_memory(minimum_gb=3.0))
 
+    @patch("image_generation.utils.torch.cuda.mem_get_info")
+    def test_not_enough_free_gpu_memory(self, mock_mem_info):
+        # Plenty of total memory, but most of it in use
+        mock_mem_info.return_value = [1024 * 1024 * 1024 * 1, 1024 * 1024 * 1024 * 24]
+
+        self.assertFalse(utils.enough_gpu_memory(minimum_gb=3.0))
+
 
 if __name__ == "__main__":
     unittest.main()
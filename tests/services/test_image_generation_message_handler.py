@@ -1,9 +1,26 @@
 import json
+import os
+import tempfile
 import unittest
 from unittest.mock import AsyncMock, MagicMock, patch
 
+from azure.servicebus.exceptions import ServiceBusError
+from PIL import Image
+
+from cloud_manager.asyncio_service_bus import AsyncioServiceBus
+from cloud_manager.azure_service_bus import AzureServiceBus
+from cloud_manager.local_blob_storage import LocalBlobStorage
+from cloud_manager.memory_blob_storage import InMemoryBlobStorage
+from cloud_manager.memory_service_bus import InMemoryServiceBus
+from cloud_manager.sqlite_service_bus import SqliteServiceBus
+from image_generation import metrics, tracing
+from image_generation.api.utils import zip_images
 from services import config
-from services.image_generation_message_handler import ImageGenerationMessageHandler
+from services.image_generation_message_handler import (
+    ImageGenerationMessageHandler,
+    create_blob_storage,
+    create_service_bus,
+)
 
 
 class AsyncTestImageGenerationMessageHandler(unittest.IsolatedAsyncioTestCase):
@@ -138,6 +155,36 @@ class AsyncTestImageGenerationMessageHandler(unittest.IsolatedAsyncioTestCase):
         )
         self.assertEqual(self.mock_publish_async.call_count, 3)
 
+    async def test_handle_message_records_stage_metrics(self):
+        metrics.REGISTRY.clear()
+        image_generation_handler = ImageGenerationMessageHandler(batch_size=1)
+
+        await image_generation_handler.handle_message_async(self.mock_message)
+
+        for stage in ["generate", "extract", "upload", "publish"]:
+            self.assertEqual(metrics.BATCH_STAGE_SECONDS.count(stage=stage), 2)
+        self.assertEqual(metrics.PENDING_BATCHES.value(), 0)
+        self.assertEqual(metrics.PENDING_UPLOADS.value(), 0)
+
+    async def test_handle_message_traces_stages(self):
+        exporter = tracing.InMemorySpanExporter()
+        tracing.add_exporter(exporter)
+        self.addCleanup(tracing.remove_exporter, exporter)
+        image_generation_handler = ImageGenerationMessageHandler()
+
+        with tracing.start_span("service_bus.receive") as root:
+            await image_generation_handler.handle_message_async(self.mock_message)
+
+        stages = [span for span in exporter.spans if span is not root]
+        self.assertEqual(
+            [span.name for span in stages], ["generate", "extract", "upload", "publish"]
+        )
+        self.assertTrue(all(span.trace_id == root.trace_id for span in stages))
+        self.assertEqual(
+            stages[2].attributes["blob.urls"],
+            ["https://example.com/image_0.png", "https://example.com/image_1.png"],
+        )
+
     async def test_run_generate_on_command(self):
         handler = ImageGenerationMessageHandler()
         handler.handle_message_async = MagicMock()
@@ -353,6 +400,256 @@ class TestImageGenerationMessageHandler(unittest.TestCase):
 
             mock_service_bus_instance.consume_indefinitely.assert_called_once()
 
+    @patch("services.image_generation_message_handler.AzureServiceBus")
+    @patch("services.image_generation_message_handler.AzureBlobStorage")
+    @patch("services.message_handlers.call_image_generation_api")
+    def test_handle_message_with_local_backends(
+        self, mock_call_api, mock_azure_blob_storage, mock_azure_service_bus
+    ):
+        response = MagicMock(status_code=200)
+        response.content = zip_images(
+            [
+                (
+                    f"image_{index}",
+                    Image.new("RGB", (8, 8)),
+                    {"model_path": "m", "style": "general"},
+                )
+                for index in range(2)
+            ]
+        ).read()
+        mock_call_api.return_value = response
+        blob_storage = InMemoryBlobStorage()
+        service_bus = InMemoryServiceBus()
+
+        handler = ImageGenerationMessageHandler(
+            blob_storage=blob_storage, service_bus=service_bus
+        )
+        handler.handle_message({"text_to_style": {"style": "general", "num_images": 2}})
+
+        mock_azure_blob_storage.assert_not_called()
+        mock_azure_service_bus.assert_not_called()
+        self.assertEqual(
+            blob_storage.list_objects(config.AZURE_STORAGE_CONTAINER_NAME),
+            ["image_0.png", "image_1.png"],
+        )
+        published = service_bus.peek_messages(config.AZURE_SERVICE_BUS_TOPIC_NAME)
+        self.assertEqual(
+            [json.loads(message)["url"] for message in published],
+            [
+                f"memory://{config.AZURE_STORAGE_CONTAINER_NAME}/image_0.png",
+                f"memory://{config.AZURE_STORAGE_CONTAINER_NAME}/image_1.png",
+            ],
+        )
+
+    @patch("services.message_handlers.call_image_generation_api")
+    def test_run_manifest_resumes_from_checkpoint(self, mock_call_api):
+        calls = []
+
+        def call_api(host, endpoint, request):
+            calls.append(host)
+            response = MagicMock(status_code=200)
+            response.content = zip_images(
+                [
+                    (
+                        f"image_{len(calls)}_{index}",
+                        Image.new("RGB", (8, 8)),
+                        {"model_path": "m", "style": "general"},
+                    )
+                    for index in range(request["num_images"])
+                ]
+            ).read()
+            return response
+
+        mock_call_api.side_effect = call_api
+        blob_storage = InMemoryBlobStorage()
+        service_bus = InMemoryServiceBus()
+        handler = ImageGenerationMessageHandler(
+            batch_size=2, blob_storage=blob_storage, service_bus=service_bus
+        )
+        topic = config.AZURE_SERVICE_BUS_TOPIC_NAME
+
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = f"{directory}/jobs.jsonl"
+            with open(manifest, "w") as manifest_file:
+                manifest_file.write(
+                    '{"text_to_style": {"style": "general", "num_images": 3}}\n'
+                    '{"text_to_image": {"prompt": {"positive": "a"}, "num_images": 1}}\n'
+                )
+            publish = service_bus.publish
+            publish_errors = [None, RuntimeError("Down"), None]
+
+            def publish_once_down(topic, messages):
+                error = publish_errors.pop(0)
+                if error is not None:
+                    raise error
+                publish(topic, messages)
+
+            with patch.object(service_bus, "publish", side_effect=publish_once_down):
+                summary = handler.run_manifest(
+                    manifest, hosts=["http://api-1", "http://api-2"]
+                )
+
+            self.assertEqual(
+                summary, {"batches": 3, "skipped": 0, "completed": 2, "failed": 1}
+            )
+            self.assertEqual(sorted(set(calls)), ["http://api-1", "http://api-2"])
+            self.assertEqual(len(calls), 3)
+            self.assertEqual(
+                len(blob_storage.list_objects(config.AZURE_STORAGE_CONTAINER_NAME)), 4
+            )
+
+            summary = handler.run_manifest(manifest, hosts=["http://api-1"])
+
+            # The batch that failed to publish is published, not generated again
+            self.assertEqual(
+                summary, {"batches": 3, "skipped": 2, "completed": 1, "failed": 0}
+            )
+            self.assertEqual(len(calls), 3)
+            self.assertEqual(len(service_bus.peek_messages(topic)), 4)
+            self.assertTrue(os.path.exists(f"{manifest}.checkpoint.jsonl"))
+            self.assertEqual(
+                handler.run_manifest(manifest)["skipped"], summary["batches"]
+            )
+            self.assertEqual(len(calls), 3)
+
+    @patch("services.message_handlers.call_image_generation_api")
+    def test_run_manifest_retries_partial_uploads(self, mock_call_api):
+        def call_api(host, endpoint, request):
+            response = MagicMock(status_code=200)
+            response.content = zip_images(
+                [
+                    (
+                        f"image_{index}",
+                        Image.new("RGB", (8, 8)),
+                        {"model_path": "m", "style": "general"},
+                    )
+                    for index in range(request["num_images"])
+                ]
+            ).read()
+            return response
+
+        class DroppingBlobStorage(InMemoryBlobStorage):
+            drop = True
+
+            def push_objects(self, container_name, objects, overwrite=False):
+                if self.drop:
+                    # Like AzureBlobStorage, a failed object is logged and left out
+                    self.drop = False
+                    objects = objects[1:]
+                return super().push_objects(container_name, objects, overwrite)
+
+        mock_call_api.side_effect = call_api
+        service_bus = InMemoryServiceBus()
+        handler = ImageGenerationMessageHandler(
+            batch_size=2, blob_storage=DroppingBlobStorage(), service_bus=service_bus
+        )
+        topic = config.AZURE_SERVICE_BUS_TOPIC_NAME
+
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = f"{directory}/jobs.jsonl"
+            with open(manifest, "w") as manifest_file:
+                manifest_file.write(
+                    '{"text_to_style": {"style": "general", "num_images": 2}}\n'
+                )
+
+            summary = handler.run_manifest(manifest, hosts=["http://api-1"])
+
+            self.assertEqual(
+                summary, {"batches": 1, "skipped": 0, "completed": 0, "failed": 1}
+            )
+            self.assertEqual(service_bus.peek_messages(topic), [])
+
+            summary = handler.run_manifest(manifest, hosts=["http://api-1"])
+
+            self.assertEqual(
+                summary, {"batches": 1, "skipped": 0, "completed": 1, "failed": 0}
+            )
+            self.assertEqual(mock_call_api.call_count, 2)
+            self.assertEqual(len(service_bus.peek_messages(topic)), 2)
+
+    @patch("cloud_manager.azure_service_bus.AutoLockRenewer")
+    @patch("azure.servicebus.aio.ServiceBusClient.from_connection_string")
+    @patch("azure.servicebus.ServiceBusClient.from_connection_string")
+    @patch("services.message_handlers.call_image_generation_api")
+    def test_run_manifest_retries_failed_azure_publishes(
+        self, mock_call_api, mock_from_connection_string, *_
+    ):
+        response = MagicMock(status_code=200)
+        response.content = zip_images(
+            [
+                (
+                    "image_0",
+                    Image.new("RGB", (8, 8)),
+                    {"model_path": "m", "style": "general"},
+                )
+            ]
+        ).read()
+        mock_call_api.return_value = response
+        sender = MagicMock()
+        sender.send_messages.side_effect = [ServiceBusError("Down"), None]
+        sender.create_message_batch.return_value.__len__.return_value = 1
+        mock_from_connection_string.return_value.get_queue_sender.return_value.__enter__.return_value = (
+            sender
+        )
+        handler = ImageGenerationMessageHandler(
+            blob_storage=InMemoryBlobStorage(),
+            service_bus=AzureServiceBus("mock_connection_string"),
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            manifest = f"{directory}/jobs.jsonl"
+            with open(manifest, "w") as manifest_file:
+                manifest_file.write(
+                    '{"text_to_image": {"prompt": {"positive": "a"}, "num_images": 1}}\n'
+                )
+
+            summary = handler.run_manifest(manifest, hosts=["http://api-1"])
+
+            self.assertEqual(
+                summary, {"batches": 1, "skipped": 0, "completed": 0, "failed": 1}
+            )
+            with open(f"{manifest}.checkpoint.jsonl") as checkpoint_file:
+                records = [json.loads(line) for line in checkpoint_file]
+            self.assertFalse(any(record.get("published") for record in records))
+
+            summary = handler.run_manifest(manifest, hosts=["http://api-1"])
+
+            self.assertEqual(
+                summary, {"batches": 1, "skipped": 0, "completed": 1, "failed": 0}
+            )
+            self.assertEqual(mock_call_api.call_count, 1)
+            self.assertEqual(sender.send_messages.call_count, 2)
+
+    def test_run_manifest_with_invalid_concurrency(self):
+        handler = ImageGenerationMessageHandler(
+            blob_storage=InMemoryBlobStorage(), service_bus=InMemoryServiceBus()
+        )
+        with self.assertRaises(ValueError):
+            handler.run_manifest("jobs.jsonl", concurrency=0)
+
+    def test_create_blob_storage(self):
+        with tempfile.TemporaryDirectory() as directory, patch.object(
+            config, "LOCAL_BLOB_STORAGE_DIR", directory
+        ):
+            self.assertIsInstance(create_blob_storage("local"), LocalBlobStorage)
+        self.assertIsInstance(create_blob_storage("memory"), InMemoryBlobStorage)
+        with self.assertRaises(ValueError) as context:
+            create_blob_storage("s3")
+        self.assertIn("not a valid blob storage backend", str(context.exception))
+
+    def test_create_service_bus(self):
+        with tempfile.TemporaryDirectory() as directory, patch.object(
+            config, "LOCAL_SERVICE_BUS_PATH", f"{directory}/service_bus.sqlite3"
+        ):
+            service_bus = create_service_bus("sqlite")
+            self.assertIsInstance(service_bus, SqliteServiceBus)
+            service_bus.close()
+        self.assertIsInstance(create_service_bus("asyncio"), AsyncioServiceBus)
+        self.assertIsInstance(create_service_bus("memory"), InMemoryServiceBus)
+        with self.assertRaises(ValueError) as context:
+            create_service_bus("kafka")
+        self.assertIn("not a valid Service Bus backend", str(context.exception))
+
     def test_init_with_invalid_batch_size(self):
         with self.assertRaises(ValueError) as context:
             ImageGenerationMessageHandler(batch_size=0)
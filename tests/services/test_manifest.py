@@ -0,0 +1,83 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+from services.manifest import ManifestCheckpoint, load_manifest, manifest_digest
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.manifest = Path(self.directory.name) / "jobs.jsonl"
+        self.checkpoint = Path(self.directory.name) / "jobs.checkpoint.jsonl"
+
+    def write_manifest(self, *jobs):
+        self.manifest.write_text("\n".join(json.dumps(job) for job in jobs) + "\n\n")
+
+    def test_load_manifest(self):
+        self.write_manifest(
+            {"text_to_style": {"style": "general", "num_images": 5}},
+            {"text_to_image": {"prompt": {"positive": "a"}, "num_images": 1}},
+        )
+
+        batches = load_manifest(str(self.manifest), batch_size=2)
+
+        self.assertEqual(
+            [batch.batch_id for batch in batches], ["1:0", "1:1", "1:2", "2:0"]
+        )
+        self.assertEqual([batch.num_images for batch in batches], [2, 2, 1, 1])
+        self.assertEqual(
+            batches[2].message_json,
+            {"text_to_style": {"style": "general", "num_images": 1}},
+        )
+
+    def test_load_invalid_manifest(self):
+        for job in [
+            {"text_to_video": {"num_images": 1}},
+            {"text_to_style": {"style": "general"}},
+            {"text_to_style": {"style": "general", "num_images": 0}},
+        ]:
+            with self.subTest(job=job):
+                self.write_manifest(job)
+                with self.assertRaises(ValueError):
+                    load_manifest(str(self.manifest), batch_size=2)
+
+    def test_manifest_digest(self):
+        self.write_manifest({"text_to_style": {"style": "general", "num_images": 5}})
+        digest = manifest_digest(str(self.manifest), 2)
+
+        self.assertEqual(digest, manifest_digest(str(self.manifest), 2))
+        self.assertNotEqual(digest, manifest_digest(str(self.manifest), 3))
+
+    def test_checkpoint_resumes(self):
+        checkpoint = ManifestCheckpoint(str(self.checkpoint), "digest")
+        checkpoint.record_uploaded("1:0", ["message 1"])
+        checkpoint.record_published("1:0")
+        checkpoint.record_uploaded("1:1", ["message 2"])
+        # A record cut short by a crash
+        with open(self.checkpoint, "a") as checkpoint_file:
+            checkpoint_file.write('{"batch": "1:2", "uplo')
+
+        checkpoint = ManifestCheckpoint(str(self.checkpoint), "digest")
+
+        self.assertTrue(checkpoint.is_published("1:0"))
+        self.assertIsNone(checkpoint.uploaded_messages("1:0"))
+        self.assertEqual(checkpoint.uploaded_messages("1:1"), ["message 2"])
+        self.assertFalse(checkpoint.is_published("1:1"))
+        self.assertIsNone(checkpoint.uploaded_messages("1:2"))
+
+        checkpoint.record_published("1:1")
+        checkpoint = ManifestCheckpoint(str(self.checkpoint), "digest")
+        self.assertTrue(checkpoint.is_published("1:1"))
+
+    def test_checkpoint_of_another_manifest(self):
+        ManifestCheckpoint(str(self.checkpoint), "digest")
+
+        with self.assertRaises(ValueError):
+            ManifestCheckpoint(str(self.checkpoint), "other digest")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -38,6 +38,14 @@ class TestTextToStyleMessage(unittest.TestCase):
         mock_api_call.assert_called_once()
         self.assertIsInstance(response, MagicMock)
 
+    @patch("services.message_handlers.call_image_generation_api")
+    def test_process_on_host(self, mock_api_call):
+        message_json = {"text_to_style": {"style": "general", "seed": 1}}
+        TextToStyleMessage(message_json).process("http://other")
+        mock_api_call.assert_called_once_with(
+            "http://other", "/text_to_style", {"style": "general", "seed": 1}
+        )
+
     def test_get_file_name(self):
         message_json = {"text_to_style": {"style": "general", "seed": 1}}
         message = TextToStyleMessage(message_json)